@@ -0,0 +1,86 @@
+#pragma once
+// 轻量指标：无锁计数的延迟直方图，以及统计等待/持有时间的互斥锁（用来发现 State::mu_ 上的锁护航）
+#include <array>
+#include <atomic>
+#include <chrono>
+#include <cstdint>
+#include <mutex>
+#include <vector>
+
+class LatencyHistogram {
+public:
+  // 桶上界（纳秒），与 Python 侧 metrics.LOCK_BUCKETS 一致
+  static constexpr std::array<int64_t,12> kBoundsNs{
+    1'000, 10'000, 50'000, 100'000, 500'000, 1'000'000,
+    5'000'000, 10'000'000, 50'000'000, 100'000'000, 500'000'000, 1'000'000'000};
+
+  struct Snapshot {
+    std::vector<double> bounds;      // 秒
+    std::vector<uint64_t> counts;    // 各桶非累计计数，最后一个是 +Inf
+    double sum = 0;                  // 秒
+  };
+
+  void observe(std::chrono::nanoseconds d){
+    int64_t ns = d.count();
+    size_t i = 0;
+    while (i < kBoundsNs.size() && ns > kBoundsNs[i]) i++;
+    counts_[i].fetch_add(1, std::memory_order_relaxed);
+    sum_ns_.fetch_add(ns, std::memory_order_relaxed);
+  }
+
+  Snapshot snapshot() const {
+    Snapshot s;
+    for (auto b : kBoundsNs) s.bounds.push_back(b / 1e9);
+    for (auto& c : counts_) s.counts.push_back(c.load(std::memory_order_relaxed));
+    s.sum = sum_ns_.load(std::memory_order_relaxed) / 1e9;
+    return s;
+  }
+
+private:
+  std::array<std::atomic<uint64_t>, kBoundsNs.size()+1> counts_{};
+  std::atomic<int64_t> sum_ns_{0};
+};
+
+// 可直接替换 std::mutex（满足 Lockable），每次加锁记录等待时间，解锁记录持有时间
+class InstrumentedMutex {
+public:
+  using Clock = std::chrono::steady_clock;
+
+  void lock(){
+    auto t0 = Clock::now();
+    mu_.lock();
+    acquired_ = Clock::now();
+    wait_.observe(acquired_ - t0);
+  }
+  bool try_lock(){
+    if (!mu_.try_lock()) return false;
+    acquired_ = Clock::now();
+    wait_.observe(Clock::duration::zero());
+    return true;
+  }
+  void unlock(){
+    auto held = Clock::now() - acquired_;
+    mu_.unlock();
+    hold_.observe(held);
+  }
+
+  const LatencyHistogram& waitStats() const { return wait_; }
+  const LatencyHistogram& holdStats() const { return hold_; }
+
+private:
+  std::mutex mu_;
+  Clock::time_point acquired_;   // 只在持锁期间读写
+  LatencyHistogram wait_, hold_;
+};
+
+// RAII 计时：作用域结束时记入直方图
+class ScopedTimer {
+public:
+  explicit ScopedTimer(LatencyHistogram& h) : h_(h), t0_(std::chrono::steady_clock::now()) {}
+  ~ScopedTimer(){ h_.observe(std::chrono::steady_clock::now() - t0_); }
+  ScopedTimer(const ScopedTimer&) = delete;
+  ScopedTimer& operator=(const ScopedTimer&) = delete;
+private:
+  LatencyHistogram& h_;
+  std::chrono::steady_clock::time_point t0_;
+};
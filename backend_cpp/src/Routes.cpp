@@ -1,10 +1,24 @@
 #include <drogon/drogon.h>
 #include <json/json.h>
+#include <cstdlib>
 #include "State.hpp"
 #include "Utility.hpp"
 
 using namespace drogon;
 
+// 注册 GPU 时不指定 heartbeat_ttl 的默认值（秒）
+static int defaultHeartbeatTtl(){
+  static const int ttl = []{ const char* v = std::getenv("GPU_HEARTBEAT_TTL_SEC"); return v && *v ? std::atoi(v) : 30; }();
+  return ttl;
+}
+
+static HttpResponsePtr textResponse(HttpStatusCode code, const std::string& body){
+  auto res = HttpResponse::newHttpResponse();
+  res->setStatusCode(code);
+  res->setBody(body);
+  return res;
+}
+
 void registerRoutes() {
   // GET /stats
   app().registerHandler(
@@ -38,6 +52,70 @@ void registerRoutes() {
     {Get}
   );
 
+  // POST /gpus  注册 GPU：{gpu_name, gpu_memory, performance_score?, compute_capability?, is_shared?, heartbeat_ttl?, nvml_device?}
+  app().registerHandler(
+    "/gpus",
+    [](const HttpRequestPtr& req,
+       std::function<void (const HttpResponsePtr &)> &&cb) {
+      auto body = req->getJsonObject();
+      if (!body || !body->isMember("gpu_name") || (*body)["gpu_memory"].asInt() <= 0) {
+        cb(textResponse(k400BadRequest, "gpu_name and positive gpu_memory required"));
+        return;
+      }
+      auto& b = *body;
+      int ttl = b.isMember("heartbeat_ttl") ? b["heartbeat_ttl"].asInt() : defaultHeartbeatTtl();
+      if (ttl < 1 || ttl > 3600) {
+        cb(textResponse(k400BadRequest, "heartbeat_ttl must be in [1, 3600]"));
+        return;
+      }
+      auto g = State::instance().registerGpu(
+        b["gpu_name"].asString(), b["gpu_memory"].asInt(), b.get("performance_score", 0).asInt(),
+        b.get("compute_capability", "").asString(), b.get("is_shared", true).asBool(), ttl,
+        b.get("nvml_device", "").asString());
+      cb(HttpResponse::newHttpJsonResponse(toJson(g)));
+    },
+    {Post}
+  );
+
+  // DELETE /gpus/{gid}  注销：其上运行中的任务回到 pending
+  app().registerHandler(
+    "/gpus/{gid}",
+    [](const HttpRequestPtr&,
+       std::function<void (const HttpResponsePtr &)> &&cb, std::string gid) {
+      if (!State::instance().deregisterGpu(gid)) { cb(textResponse(k404NotFound, "GPU不存在")); return; }
+      cb(textResponse(k204NoContent, ""));
+    },
+    {Delete}
+  );
+
+  // POST /gpus/heartbeat  一台机器上的多块卡一次上报：{ids: [...]} -> {unknown: [...]}（已注销，需重新注册）
+  app().registerHandler(
+    "/gpus/heartbeat",
+    [](const HttpRequestPtr& req,
+       std::function<void (const HttpResponsePtr &)> &&cb) {
+      auto body = req->getJsonObject();
+      if (!body || !(*body)["ids"].isArray()) { cb(textResponse(k400BadRequest, "ids required")); return; }
+      std::vector<std::string> ids;
+      for (auto& v : (*body)["ids"]) ids.push_back(v.asString());
+      auto ok = State::instance().heartbeats(ids);
+      Json::Value j; j["unknown"] = Json::Value(Json::arrayValue);
+      for (size_t i=0; i<ids.size(); i++) if (!ok[i]) j["unknown"].append(ids[i]);
+      cb(HttpResponse::newHttpJsonResponse(j));
+    },
+    {Post}
+  );
+
+  // POST /gpus/{gid}/heartbeat
+  app().registerHandler(
+    "/gpus/{gid}/heartbeat",
+    [](const HttpRequestPtr&,
+       std::function<void (const HttpResponsePtr &)> &&cb, std::string gid) {
+      if (!State::instance().heartbeats({gid})[0]) { cb(textResponse(k404NotFound, "GPU不存在")); return; }
+      cb(textResponse(k204NoContent, ""));
+    },
+    {Post}
+  );
+
   // GET /requests?q=&status=
   app().registerHandler(
     "/requests",
@@ -3,9 +3,20 @@
 #include <thread>
 #include <random>
 #include <chrono>
+#include <cmath>
+#include <cstdlib>
+#include <cstring>
+
+LatencyHistogram& simTickStats(){ static LatencyHistogram h; return h; }
+LatencyHistogram& simPlacementStats(){ static LatencyHistogram h; return h; }
 
 void startSimulator(){
-  std::thread([]{
+  // 选卡策略：默认 largest_free 选可用显存最多的卡，PLACEMENT_POLICY=ect 选预计最早完成的卡（见 State::pickGpu）
+  const char* pol = std::getenv("PLACEMENT_POLICY");
+  const bool ect = pol && std::strcmp(pol, "ect")==0;
+  const char* co = std::getenv("CO_TENANCY_SLOWDOWN");
+  const double coTenancy = co && *co ? std::atof(co) : 0.15;
+  std::thread([ect, coTenancy]{
     std::mt19937 rng{std::random_device{}()};
     std::uniform_int_distribution<int> memPick(0,3);
     int memOpts[4]={4,8,12,16};
@@ -15,26 +26,23 @@ void startSimulator(){
     const char* priOpts[3]={"low","normal","high"};
 
     while(true){
-      // 1) 生成请求
-      auto r = State::instance().createRequest("自动生成：作业", memOpts[memPick(rng)], estOpts[estPick(rng)], priOpts[prPick(rng)]);
+      {
+        ScopedTimer tick(simTickStats());
+        // 1) 生成请求
+        auto r = State::instance().createRequest("自动生成：作业", memOpts[memPick(rng)], estOpts[estPick(rng)], priOpts[prPick(rng)]);
 
-      // 2) 简单自动调度：找可用显存最多的 GPU
-      auto gpus = State::instance().listGpus("", "all");
-      std::string chosen;
-      int bestFree=-1;
-      for(auto& g: gpus){
-        int f = State::instance().freeMemOf(g.id);
-        if (g.is_shared && f >= r.required_memory && f > bestFree){ bestFree=f; chosen=g.id; }
-      }
-      if (!chosen.empty()){
+        // 2) 自动调度：按策略选卡
+        State::GpuPick pick;
+        {
+          ScopedTimer place(simPlacementStats());
+          pick = State::instance().pickGpu(r.required_memory, ect, coTenancy);
+        }
         ComputeRequest out;
-        State::instance().matchRequest(r.id, chosen, &out);
-        // 3) 随机一段时间后自动完成
-        std::thread([rid=r.id]{
-          std::this_thread::sleep_for(std::chrono::seconds(20 + (std::rand()%25)));
-          ComputeRequest dummy;
-          State::instance().updateRequestStatus(rid, "completed", &dummy);
-        }).detach();
+        if (!pick.id.empty() && State::instance().matchRequest(r.id, pick.id, &out)){
+          // 3) 随机一段时间（按所在卡的快慢缩放）后自动完成（交给 State 的计时服务，不再每个任务开一个线程）
+          auto sec = std::lround((20 + (std::rand()%25)) * pick.slowdown);
+          State::instance().scheduleCompletion(r.id, std::chrono::seconds(sec));
+        }
       }
       std::this_thread::sleep_for(std::chrono::seconds(10));
     }
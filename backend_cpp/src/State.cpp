@@ -1,9 +1,24 @@
 #include "State.hpp"
+#include "Persist.hpp"
+#include "Archive.hpp"
 #include <algorithm>
+#include <cstdio>
+#include <cstdlib>
+#include <functional>
 #include <random>
 
 static std::string uuid4();
+static constexpr size_t kIndexBuildChunk = 500;   // 恢复后补建文本索引每批条数（每批持锁一次，约几毫秒）
+static constexpr size_t kSnapshotChunk = 5000;    // 快照时每批编码的请求数（同上）
+static constexpr size_t kRetentionBatch = 5000;   // 每批归档的请求数
+static constexpr auto kRetentionInterval = std::chrono::seconds(10);
 static bool isZero(const std::chrono::system_clock::time_point& tp){ return tp.time_since_epoch().count()==0; }
+static int64_t toMs(const std::chrono::system_clock::time_point& tp){
+  return std::chrono::duration_cast<std::chrono::milliseconds>(tp.time_since_epoch()).count();
+}
+static int64_t endedAt(const ComputeRequest& r){
+  return (isZero(r.completed_at) ? r.created_at : r.completed_at).time_since_epoch().count();
+}
 
 State& State::instance(){ static State S; return S; }
 
@@ -13,7 +28,8 @@ State::State(){
     auto id = uuid4();
     GpuResource g; g.id=id; g.gpu_name=name; g.gpu_memory=mem; g.performance_score=score;
     g.compute_capability=cc; g.is_shared=true; g.status="online"; g.created_at=now; g.updated_at=now;
-    gpus_[id]=g; gpu_used_mem_[id]=0;
+    gpus_[id]=g; gpu_used_mem_[id]=0; online_gpus_++;
+    gpu_text_.add(id, name);
   };
   addGpu("RTX 4090",24,100,"8.9");
   addGpu("A100 80G",80,120,"8.0");
@@ -21,6 +37,231 @@ State::State(){
   seed();
 }
 
+State::~State(){ closePersistence(); }
+
+bool State::enablePersistence(const std::string& dir, bool fsync){
+  std::lock_guard<InstrumentedMutex> lk(mu_);
+  store_ = std::make_unique<persist::Store>(dir, fsync);
+  persist::Recovered rec;
+  bool recovered = store_->recover(rec);
+  recovered_ = recovered;
+  if (recovered) restoreLocked(rec);
+  else {   // 新目录：第一帧记下完整的初始状态
+    for (auto& kv : gpus_) wal_gpus_.insert(kv.first);
+    for (auto& kv : reqs_) wal_reqs_.insert(kv.first);
+  }
+  store_->open(lsn_);
+  commitLocked();
+  if (recovered){
+    // 恢复出来的运行中任务不知道还剩多久，重新计时
+    auto it = by_status_.find("running");
+    if (it!=by_status_.end())
+      for (auto& id : it->second) completions_.schedule(id, std::chrono::seconds(20 + (std::rand()%25)));
+    // 注册的卡不知道上次心跳是什么时候：按刚收到心跳算，给一个超时的宽限
+    std::lock_guard<std::mutex> b(beat_mu_);
+    auto now = DeadlineTimer::Clock::now();
+    for (auto& kv : gpus_){
+      auto& g = kv.second;
+      if (!g.heartbeat_ttl) continue;
+      beats_[g.id] = Beat{now, std::chrono::seconds(g.heartbeat_ttl), g.status=="offline"};
+      if (g.status!="offline") liveness_.schedule(g.id, std::chrono::seconds(g.heartbeat_ttl));
+    }
+  }
+  if (req_text_.deferred() && !indexer_.joinable()){
+    indexer_ = std::thread([this]{
+      bool more = true;
+      while (more && !stopping_){
+        { std::lock_guard<InstrumentedMutex> g(mu_); more = req_text_.buildStep(kIndexBuildChunk); }
+        std::this_thread::yield();
+      }
+    });
+  }
+  return recovered;
+}
+
+void State::closePersistence(){
+  { std::lock_guard<std::mutex> g(stop_mu_); stopping_ = true; }
+  stop_cv_.notify_all();
+  if (indexer_.joinable()) indexer_.join();
+  if (retention_.joinable()) retention_.join();
+  { std::lock_guard<std::mutex> g(delete_mu_); deletes_closed_ = true; }   // 删除线程做完排队的再退出
+  delete_cv_.notify_all();
+  if (deleter_.joinable()) deleter_.join();
+  std::unique_ptr<persist::Store> store;
+  { std::lock_guard<InstrumentedMutex> lk(mu_); store = std::move(store_); }
+  if (store) store->close();   // 不持锁：后台快照还要分批加锁取数据
+  std::lock_guard<InstrumentedMutex> lk(mu_);
+  archive_.reset();
+}
+
+static bool sameRequest(const ComputeRequest& a, const ComputeRequest& b){
+  return a.id==b.id && a.task_description==b.task_description && a.required_memory==b.required_memory
+      && a.estimated_duration==b.estimated_duration && a.priority==b.priority && a.status==b.status
+      && a.assigned_gpu_id==b.assigned_gpu_id && a.created_at==b.created_at
+      && a.started_at==b.started_at && a.completed_at==b.completed_at;
+}
+
+void State::enableArchive(const std::string& path, size_t historyMax, int64_t maxAgeSec){
+  {
+    std::lock_guard<InstrumentedMutex> lk(mu_);
+    archive_ = std::make_unique<RequestArchive>(path);
+    history_max_ = historyMax;
+    history_max_age_ = std::chrono::seconds(maxAgeSec);
+    if (!recovered_) archive_->clear();   // 内存是新生成的状态，旧归档对不上
+    else {
+      // 重启对账：最后一批可能已写进归档，但移出内存的那一帧日志没来得及落盘；
+      // 取回内存的请求也可能日志已落盘、还没来得及从归档删（见 deleteLoop）。
+      // 内存里的与归档相同则补做移出；内存里的更新（之后又被改过）则删掉归档里的
+      std::vector<ComputeRequest> same; std::vector<std::string> stale;
+      auto ids = archive_->unconfirmedIds(lsn_);
+      for (auto& kv : reqs_) ids.push_back(kv.first);
+      for (auto& kv : archive_->get(ids)){
+        auto it = reqs_.find(kv.first);
+        ComputeRequest c;
+        if (it!=reqs_.end()) c = it->second;
+        else if (!cold_ || !cold_->get(kv.first, c)) continue;
+        if (sameRequest(c, kv.second)) same.push_back(kv.second);
+        else stale.push_back(kv.first);
+      }
+      evictLocked(same);
+      commitLocked();
+      archive_->remove(stale);
+    }
+    archived_ = archive_->counts();
+    if (auto n = archive_->newest()) archive_newest_ = *n;
+    { std::lock_guard<std::mutex> g(delete_mu_); deletes_closed_ = false; }
+    deleter_ = std::thread([this]{ deleteLoop(); });
+  }
+  retention_ = std::thread([this]{
+    std::unique_lock<std::mutex> lk(stop_mu_);
+    while (!stop_cv_.wait_for(lk, kRetentionInterval, [this]{ return stopping_.load(); })){
+      lk.unlock();
+      enforceRetention();
+      lk.lock();
+    }
+  });
+}
+
+// 三步：持锁选出一批；不持锁写归档；再持锁移出内存（选中之后又被改过的不移，删掉其归档）
+size_t State::enforceRetention(){
+  size_t total = 0;
+  std::shared_ptr<persist::ColdRequests> cold;
+  {
+    std::lock_guard<InstrumentedMutex> lk(mu_);
+    if (!archive_) return total;
+    cold = cold_;
+  }
+  if (cold) cold->sortByEnd();   // 快照行按结束时间的排序只做一次，放在锁外
+  while (true){
+    std::vector<ComputeRequest> victims; uint64_t version;
+    {
+      std::lock_guard<InstrumentedMutex> lk(mu_);
+      if (!archive_) return total;
+      victims = retentionVictimsLocked();
+      version = lsn_;
+    }
+    if (victims.empty()) return total;
+    waitDeletes();   // 排在前面的删除可能正是这批里的请求（取回后又结束了）的旧记录
+    archive_->put(victims, version);
+    std::vector<std::string> stale;
+    {
+      std::lock_guard<InstrumentedMutex> lk(mu_);
+      stale = evictLocked(victims);
+      commitLocked();
+    }
+    archive_->remove(stale);
+    total += victims.size() - stale.size();
+    if (victims.size() < kRetentionBatch) return total;
+  }
+}
+
+// 取回的记录已在日志里（或未启用持久化），等这一帧落盘再删归档里的，崩溃也不会两头都丢；
+// 崩溃在落盘与删除之间的，重启时由 enableArchive 的对账删掉
+void State::deleteLoop(){
+  std::unique_lock<std::mutex> lk(delete_mu_);
+  while (true){
+    delete_cv_.wait(lk, [this]{ return !deletes_.empty() || deletes_closed_; });
+    if (deletes_.empty()) return;
+    std::vector<std::string> ids; ids.swap(deletes_);
+    deleting_ = true;
+    lk.unlock();
+    try {
+      if (store_) store_->flush();   // store_ 只在删除线程停掉后才换
+      archive_->remove(ids);
+    } catch (const std::exception& e){
+      std::fprintf(stderr, "[Archive] delete error: %s\n", e.what());
+    }
+    lk.lock();
+    deleting_ = false;
+    delete_cv_.notify_all();
+  }
+}
+
+void State::waitDeletes(){
+  std::unique_lock<std::mutex> lk(delete_mu_);
+  delete_cv_.wait(lk, [this]{ return deletes_.empty() && !deleting_; });
+}
+
+// 按结束先后取超出保留条件（条数或时长）的已结束请求，最多一批（返回副本）。
+// 内存里的按 by_end_、快照里的（都是已结束的）按其结束顺序归并，只看最早的一批
+std::vector<ComputeRequest> State::retentionVictimsLocked(){
+  size_t total = by_end_.size() + (cold_ ? cold_->size() : 0);
+  size_t over = total > history_max_ ? total - history_max_ : 0;
+  auto cutoff = (std::chrono::system_clock::now() - history_max_age_).time_since_epoch().count();
+  std::vector<std::pair<int64_t,size_t>> cold;
+  if (cold_) cold = cold_->oldest(kRetentionBatch);
+  std::vector<ComputeRequest> out;
+  auto h = by_end_.begin(); size_t c = 0;
+  while (out.size() < kRetentionBatch){
+    bool hot = h!=by_end_.end();
+    bool fromCold = c<cold.size() && (!hot || cold[c].first < h->first);
+    if (!hot && !fromCold) break;
+    if (out.size() >= over && (fromCold ? cold[c].first : h->first) >= cutoff) break;
+    if (fromCold) out.push_back(cold_->decode(cold[c++].second));
+    else out.push_back(reqs_.at((h++)->second));
+  }
+  return out;
+}
+
+std::vector<std::string> State::evictLocked(const std::vector<ComputeRequest>& victims){
+  std::vector<std::string> stale;
+  for (auto& v : victims){
+    std::pair<int64_t,std::string> key{toMs(v.created_at), v.id};
+    auto it = reqs_.find(v.id);
+    if (it!=reqs_.end() && sameRequest(it->second, v)){
+      trackEnded(it->second, false);
+      by_status_[v.status].erase(v.id);
+      req_text_.remove(v.id);
+      by_time_.erase(key);
+      reqs_.erase(it);
+      wal_reqs_.erase(v.id);
+    } else if (it!=reqs_.end() || !cold_ || !cold_->take(v.id, nullptr)){   // 快照里的行不会变，还在就是同一条
+      stale.push_back(v.id); continue;
+    }
+    archived_[v.status]++;
+    if (key > archive_newest_) archive_newest_ = key;
+    if (store_) wal_drops_.push_back(v.id);
+  }
+  return stale;
+}
+
+// 写操作碰到还在快照里或已归档的请求：取回内存（恢复全部索引）；归档的本次提交后从归档删除
+ComputeRequest* State::lookupLocked(const std::string& reqId){
+  auto it = reqs_.find(reqId);
+  if (it!=reqs_.end()) return &it->second;
+  ComputeRequest c;
+  if (cold_ && cold_->take(reqId, &c)){ addRequest(c); return &reqs_.at(reqId); }
+  if (!archive_) return nullptr;
+  auto got = archive_->get({reqId});
+  auto g = got.find(reqId);
+  if (g==got.end()) return nullptr;
+  auto& r = g->second;
+  auto& n = archived_[r.status]; if (n) n--;
+  addRequest(r);
+  unarchived_.push_back(reqId);
+  return &reqs_.at(reqId);
+}
+
 void State::seed(){
   auto now = std::chrono::system_clock::now();
   auto gpu_ids = std::vector<std::string>{};
@@ -37,7 +278,7 @@ void State::seed(){
     r.status="running"; r.assigned_gpu_id=gid0;
     r.created_at=now - std::chrono::hours(1);
     r.started_at=now - std::chrono::minutes(55);
-    reqs_[r.id]=r; allocMem(gid0,10);
+    addRequest(r); allocMem(gid0,10);
   }
   // running on gid1
   {
@@ -47,7 +288,7 @@ void State::seed(){
     r.status="running"; r.assigned_gpu_id=gid1;
     r.created_at=now - std::chrono::hours(2);
     r.started_at=now - std::chrono::hours(1) - std::chrono::minutes(20);
-    reqs_[r.id]=r; allocMem(gid1,16);
+    addRequest(r); allocMem(gid1,16);
   }
   // completed on gid2
   {
@@ -58,17 +299,19 @@ void State::seed(){
     r.created_at=now - std::chrono::hours(3);
     r.started_at=now - std::chrono::hours(2) - std::chrono::minutes(50);
     r.completed_at=now - std::chrono::hours(2) - std::chrono::minutes(20);
-    reqs_[r.id]=r; /* 已完成默认释放 */
+    addRequest(r); /* 已完成默认释放 */
   }
 }
 
 std::vector<GpuResource> State::listGpus(const std::string& q, const std::string& status){
-  std::lock_guard<std::mutex> lk(mu_);
-  for (auto& kv : gpus_) recomputeGpuStatus(kv.first);
+  // 状态与已用显存在分配/释放、上下线、注册时就已更新（recomputeGpuStatus），读路径只过滤拷贝
+  std::lock_guard<InstrumentedMutex> lk(mu_);
+  std::unordered_set<std::string> hits;
+  if (!q.empty()) hits = gpu_text_.search(q);
   std::vector<GpuResource> v; v.reserve(gpus_.size());
   for (auto& kv : gpus_){
     auto& g = kv.second;
-    if (!q.empty() && g.gpu_name.find(q)==std::string::npos) continue;
+    if (!q.empty() && !hits.count(g.id)) continue;
     if (!status.empty() && status!="all" && g.status!=status) continue;
     v.push_back(g);
   }
@@ -76,99 +319,553 @@ std::vector<GpuResource> State::listGpus(const std::string& q, const std::string
 }
 
 std::vector<ComputeRequest> State::listRequests(const std::string& q, const std::string& status){
-  std::lock_guard<std::mutex> lk(mu_);
-  std::vector<ComputeRequest> v; v.reserve(reqs_.size());
-  for (auto& kv : reqs_){
-    auto& r = kv.second;
-    if (!q.empty() && r.task_description.find(q)==std::string::npos) continue;
-    if (!status.empty() && status!="all" && r.status!=status) continue;
+  RequestQuery rq; rq.q=q; rq.status=status;
+  return listRequests(rq);
+}
+
+// 内存里的结果与快照里、归档里的按 (created_at, id) 倒序归并；后两者的查询不持锁
+std::vector<ComputeRequest> State::listRequests(const RequestQuery& rq){
+  using Key = std::pair<int64_t,std::string>;
+  auto key = [](const ComputeRequest& r){ return Key{toMs(r.created_at), r.id}; };
+  std::vector<ComputeRequest> v;
+  std::shared_ptr<persist::ColdRequests> cold;
+  bool archived = false;
+  {
+    std::lock_guard<InstrumentedMutex> lk(mu_);
+    v = listResidentLocked(rq);
+    if (cold_ && cold_->size()) cold = cold_;
+    // 归档里不可能有符合条件的记录时不查：未启用/为空、按状态过滤而该状态没有归档、
+    // 时间下限晚于归档里最新的，或内存结果已凑满一页且最后一条比归档里最新的还新
+    if (archive_){
+      bool byStatus = !rq.status.empty() && rq.status!="all";
+      size_t n = 0;
+      if (byStatus){ auto it = archived_.find(rq.status); n = it==archived_.end() ? 0 : it->second; }
+      else for (auto& kv : archived_) n += kv.second;
+      archived = n && !(rq.since_ms && rq.since_ms > archive_newest_.first)
+                 && !(rq.limit && v.size() >= rq.limit && key(v.back()) > archive_newest_);
+    }
+    if (!cold && !archived) return v;
+  }
+  std::vector<ComputeRequest> older;
+  if (cold) older = cold->query(rq);
+  if (archived){
+    auto more = archive_->query(rq, rq.limit);
+    older.insert(older.end(), std::make_move_iterator(more.begin()), std::make_move_iterator(more.end()));
+    // 刚从快照移进归档的两边都有，内容相同
+    std::sort(older.begin(), older.end(), [&](const ComputeRequest& a, const ComputeRequest& b){ return key(a) > key(b); });
+    older.erase(std::unique(older.begin(), older.end(),
+                            [](const ComputeRequest& a, const ComputeRequest& b){ return a.id==b.id; }),
+                older.end());
+  }
+  {
+    // 同时在内存里的以内存为准（查询期间可能刚被取回，或刚被移出、已在 v 里）
+    std::unordered_set<std::string> seen;
+    for (auto& r : v) seen.insert(r.id);
+    std::lock_guard<InstrumentedMutex> lk(mu_);
+    older.erase(std::remove_if(older.begin(), older.end(),
+                               [&](const ComputeRequest& r){ return seen.count(r.id) || reqs_.count(r.id); }),
+                older.end());
+  }
+  if (older.empty()) return v;
+  std::vector<ComputeRequest> out; out.reserve(v.size() + older.size());
+  std::merge(std::make_move_iterator(v.begin()), std::make_move_iterator(v.end()),
+             std::make_move_iterator(older.begin()), std::make_move_iterator(older.end()), std::back_inserter(out),
+             [&](const ComputeRequest& a, const ComputeRequest& b){ return key(a) > key(b); });
+  if (rq.limit && out.size() > rq.limit) out.resize(rq.limit);
+  return out;
+}
+
+std::vector<ComputeRequest> State::listResidentLocked(const RequestQuery& rq){
+  using Key = std::pair<int64_t,std::string>;
+  bool byStatus = !rq.status.empty() && rq.status!="all";
+  size_t limit = rq.limit ? rq.limit : reqs_.size();
+
+  // 时间窗口 [lo, hi)
+  auto lo = rq.since_ms ? by_time_.lower_bound(Key{rq.since_ms, ""}) : by_time_.begin();
+  auto hi = rq.until_ms ? by_time_.lower_bound(Key{rq.until_ms, ""}) : by_time_.end();
+  if (!rq.cursor_id.empty() || rq.cursor_ms){
+    auto c = by_time_.lower_bound(Key{rq.cursor_ms, rq.cursor_id});
+    if (c!=by_time_.end() && (hi==by_time_.end() || *c < *hi)) hi = c;
+  }
+  if (hi!=by_time_.end() && (lo==by_time_.end() || *hi < *lo)) hi = lo;   // 窗口为空（since 不早于 until 或游标）
+  auto inWindow = [&](const Key& k){
+    return (!rq.since_ms || k.first >= rq.since_ms) && (!rq.until_ms || k.first < rq.until_ms)
+        && ((rq.cursor_id.empty() && !rq.cursor_ms) || k < Key{rq.cursor_ms, rq.cursor_id});
+  };
+
+  std::vector<ComputeRequest> v;
+  const std::unordered_set<std::string>* ids = nullptr;
+  std::unordered_set<std::string> hits;
+  if (!rq.q.empty()){ hits = req_text_.search(rq.q); ids = &hits; }
+  else if (byStatus){
+    auto it = by_status_.find(rq.status);
+    static const std::unordered_set<std::string> none;
+    ids = it==by_status_.end() ? &none : &it->second;
+  }
+
+  // 时间窗口是否比命中集合大：数到 ids->size()+1 步就停，不完整遍历窗口，选分支只花 O(命中数)
+  auto windowExceeds = [&](size_t n){
+    if (lo==by_time_.begin() && hi==by_time_.end()) return by_time_.size() > n;
+    size_t k = 0;
+    for (auto it = lo; it != hi && k <= n; ++it) ++k;
+    return k > n;
+  };
+
+  if (ids && windowExceeds(ids->size())){
+    // 命中的请求比时间窗口小：直接对命中集合排序
+    std::vector<Key> keys; keys.reserve(ids->size());
+    for (auto& id : *ids){
+      auto& r = reqs_.at(id);
+      if (byStatus && r.status!=rq.status) continue;
+      Key k{toMs(r.created_at), id};
+      if (inWindow(k)) keys.push_back(std::move(k));
+    }
+    std::sort(keys.begin(), keys.end(), std::greater<Key>());
+    if (keys.size() > limit) keys.resize(limit);
+    v.reserve(keys.size());
+    for (auto& k : keys) v.push_back(reqs_.at(k.second));
+    return v;
+  }
+  // 否则从时间索引倒着走，直到凑够一页
+  for (auto it = hi; it != lo && v.size() < limit; ){
+    --it;
+    if (ids && !ids->count(it->second)) continue;
+    auto& r = reqs_.at(it->second);
+    if (byStatus && r.status!=rq.status) continue;
     v.push_back(r);
   }
-  std::sort(v.begin(), v.end(), [](auto& a, auto& b){ return a.created_at > b.created_at; });
   return v;
 }
 
 PlatformStats State::stats(){
-  std::lock_guard<std::mutex> lk(mu_);
+  std::lock_guard<InstrumentedMutex> lk(mu_);
   PlatformStats s;
   s.total_users = total_users_;
   s.total_gpus = (int)gpus_.size();
-  for (auto& kv : gpus_) if (kv.second.status=="online") s.online_gpus++;
-  for (auto& kv : reqs_) {
-    if (kv.second.status=="pending") s.pending_requests++;
-    if (kv.second.status=="completed") s.completed_requests++;
-  }
+  s.online_gpus = online_gpus_;
+  auto count = [&](const char* st){ auto it=by_status_.find(st); return it==by_status_.end()?0:(int)it->second.size(); };
+  s.pending_requests = count("pending");
+  auto archived = archived_.find("completed");
+  s.completed_requests = count("completed") + (archived==archived_.end() ? 0 : (int)archived->second)
+                       + (cold_ ? (int)cold_->count("completed") : 0);
   return s;
 }
 
 ComputeRequest State::createRequest(const std::string& desc, int mem, int estMin, const std::string& pri){
-  std::lock_guard<std::mutex> lk(mu_);
+  std::lock_guard<InstrumentedMutex> lk(mu_);
+  auto r = createRequestLocked(desc, mem, estMin, pri, std::chrono::system_clock::now());
+  commitLocked();
+  return r;
+}
+
+bool State::matchRequest(const std::string& reqId, const std::string& gpuId, ComputeRequest* out){
+  std::lock_guard<InstrumentedMutex> lk(mu_);
+  bool ok = matchRequestLocked(reqId, gpuId, out);
+  commitLocked();
+  return ok;
+}
+
+bool State::updateRequestStatus(const std::string& reqId, const std::string& st, ComputeRequest* out){
+  std::lock_guard<InstrumentedMutex> lk(mu_);
+  bool ok = updateRequestStatusLocked(reqId, st, out);
+  commitLocked();
+  return ok;
+}
+
+std::vector<std::string> State::createRequests(const std::vector<NewRequest>& items){
+  std::vector<std::string> ids; ids.reserve(items.size());
+  std::lock_guard<InstrumentedMutex> lk(mu_);
+  auto now = std::chrono::system_clock::now();
+  for (auto& it : items)
+    ids.push_back(createRequestLocked(it.task_description, it.required_memory, it.estimated_duration, it.priority, now).id);
+  commitLocked();
+  return ids;
+}
+
+std::vector<bool> State::matchRequests(const std::vector<std::pair<std::string,std::string>>& items){
+  std::vector<bool> ok; ok.reserve(items.size());
+  std::lock_guard<InstrumentedMutex> lk(mu_);
+  for (auto& it : items) ok.push_back(matchRequestLocked(it.first, it.second, nullptr));
+  commitLocked();
+  return ok;
+}
+
+std::vector<bool> State::updateStatuses(const std::vector<std::pair<std::string,std::string>>& items){
+  std::vector<bool> ok; ok.reserve(items.size());
+  std::lock_guard<InstrumentedMutex> lk(mu_);
+  for (auto& it : items) ok.push_back(updateRequestStatusLocked(it.first, it.second, nullptr));
+  commitLocked();
+  return ok;
+}
+
+ComputeRequest State::createRequestLocked(const std::string& desc, int mem, int estMin, const std::string& pri,
+                                          std::chrono::system_clock::time_point now){
   ComputeRequest r;
   r.id=uuid4(); r.task_description=desc; r.required_memory=mem; r.estimated_duration=estMin; r.priority=pri;
-  r.status="pending"; r.created_at=std::chrono::system_clock::now();
-  reqs_[r.id]=r;
+  r.status="pending"; r.created_at=now;
+  addRequest(r);
   return r;
 }
 
-bool State::matchRequest(const std::string& reqId, const std::string& gpuId, ComputeRequest* out){
-  std::lock_guard<std::mutex> lk(mu_);
-  auto itR = reqs_.find(reqId); auto itG = gpus_.find(gpuId);
-  if (itR==reqs_.end() || itG==gpus_.end()) return false;
-  auto& r = itR->second; auto& g = itG->second;
-  if (!g.is_shared) return false;
+bool State::matchRequestLocked(const std::string& reqId, const std::string& gpuId, ComputeRequest* out){
+  auto itG = gpus_.find(gpuId); if (itG==gpus_.end()) return false;
+  auto* pr = lookupLocked(reqId); if (!pr) return false;
+  auto& r = *pr; auto& g = itG->second;
+  if (!g.is_shared || g.status=="offline") return false;
   if (freeMemOf(gpuId) < r.required_memory) return false;
 
   allocMem(gpuId, r.required_memory);
-  r.assigned_gpu_id=gpuId; r.status="running"; r.started_at=std::chrono::system_clock::now();
+  trackRunning(r, false); trackEnded(r, false);
+  r.assigned_gpu_id=gpuId; setStatus(r, "running"); r.started_at=std::chrono::system_clock::now();
+  trackRunning(r, true);
+  if (store_) wal_reqs_.insert(reqId);
   if (out) *out = r;
   return true;
 }
 
-bool State::updateRequestStatus(const std::string& reqId, const std::string& st, ComputeRequest* out){
-  std::lock_guard<std::mutex> lk(mu_);
-  auto it = reqs_.find(reqId); if (it==reqs_.end()) return false;
-  auto& r = it->second;
+bool State::updateRequestStatusLocked(const std::string& reqId, const std::string& st, ComputeRequest* out){
+  auto* pr = lookupLocked(reqId); if (!pr) return false;
+  auto& r = *pr;
   auto now = std::chrono::system_clock::now();
+  trackRunning(r, false); trackEnded(r, false);
 
   if (st=="running"){
-    r.status="running";
+    setStatus(r, "running");
     if (isZero(r.started_at)) r.started_at=now;
     if (!r.assigned_gpu_id.empty() && freeMemOf(r.assigned_gpu_id) >= r.required_memory) {
       allocMem(r.assigned_gpu_id, r.required_memory);
     }
   } else if (st=="completed" || st=="failed"){
-    r.status=st; r.completed_at=now;
+    completions_.cancel(reqId);
+    setStatus(r, st); r.completed_at=now;
     if (!r.assigned_gpu_id.empty()) freeMem(r.assigned_gpu_id, r.required_memory);
   } else if (st=="pending"){
+    completions_.cancel(reqId);
     if (!r.assigned_gpu_id.empty()) freeMem(r.assigned_gpu_id, r.required_memory);
-    r.status="pending"; r.assigned_gpu_id.clear(); r.started_at={}; r.completed_at={};
+    setStatus(r, "pending"); r.assigned_gpu_id.clear(); r.started_at={}; r.completed_at={};
   } else {
-    r.status=st;
+    setStatus(r, st);
   }
+  trackRunning(r, true); trackEnded(r, true);
+  if (store_) wal_reqs_.insert(reqId);
   if (out) *out = r;
   return true;
 }
 
+GpuResource State::registerGpu(const std::string& name, int mem, int score, const std::string& cc, bool shared, int ttlSec,
+                               const std::string& nvmlDevice){
+  std::lock_guard<InstrumentedMutex> lk(mu_);
+  auto now = std::chrono::system_clock::now();
+  GpuResource g; g.id=uuid4(); g.gpu_name=name; g.gpu_memory=mem; g.performance_score=score;
+  g.compute_capability=cc; g.is_shared=shared; g.status="online"; g.heartbeat_ttl=ttlSec; g.nvml_device=nvmlDevice;
+  g.created_at=now; g.updated_at=now;
+  gpus_[g.id]=g; gpu_used_mem_[g.id]=0; online_gpus_++;
+  gpu_text_.add(g.id, name);
+  if (store_) wal_gpus_.insert(g.id);
+  {
+    std::lock_guard<std::mutex> b(beat_mu_);
+    beats_[g.id] = Beat{DeadlineTimer::Clock::now(), std::chrono::seconds(ttlSec)};
+    liveness_.schedule(g.id, std::chrono::seconds(ttlSec));
+  }
+  commitLocked();
+  return g;
+}
+
+bool State::deregisterGpu(const std::string& gpuId){
+  std::lock_guard<InstrumentedMutex> lk(mu_);
+  if (!gpus_.count(gpuId)) return false;
+  {
+    std::lock_guard<std::mutex> b(beat_mu_);
+    beats_.erase(gpuId);
+    liveness_.cancel(gpuId);
+  }
+  takeOfflineLocked(gpuId);
+  gpus_.erase(gpuId); gpu_used_mem_.erase(gpuId); running_on_.erase(gpuId);
+  gpu_text_.remove(gpuId);
+  wal_gpus_.erase(gpuId);
+  if (store_) wal_drops_.push_back(gpuId);
+  commitLocked();
+  return true;
+}
+
+std::vector<bool> State::heartbeats(const std::vector<std::string>& gpuIds){
+  std::vector<bool> ok(gpuIds.size(), false);
+  std::vector<size_t> other;          // 不在 beats_ 里的：内置的卡，或不存在
+  std::vector<std::string> revive;    // 已离线的卡
+  {
+    std::lock_guard<std::mutex> b(beat_mu_);
+    auto now = DeadlineTimer::Clock::now();
+    for (size_t i=0; i<gpuIds.size(); i++){
+      auto it = beats_.find(gpuIds[i]);
+      if (it==beats_.end()){ other.push_back(i); continue; }
+      it->second.last = now; ok[i] = true;
+      if (it->second.offline) revive.push_back(gpuIds[i]);
+    }
+  }
+  if (other.empty() && revive.empty()) return ok;   // 常见情况：不碰 mu_
+  std::lock_guard<InstrumentedMutex> lk(mu_);
+  for (auto i : other) ok[i] = gpus_.count(gpuIds[i]) > 0;
+  for (auto& gid : revive) bringOnlineLocked(gid);
+  commitLocked();
+  return ok;
+}
+
+// 期间有过心跳就按最后一次心跳顺延（不碰 mu_）；否则置 offline
+void State::checkLiveness(const std::string& gpuId){
+  {
+    std::lock_guard<std::mutex> b(beat_mu_);
+    auto it = beats_.find(gpuId);
+    if (it==beats_.end() || it->second.offline) return;
+    auto deadline = it->second.last + it->second.ttl;
+    if (deadline > DeadlineTimer::Clock::now()){
+      liveness_.schedule(gpuId, deadline - DeadlineTimer::Clock::now());
+      return;
+    }
+  }
+  std::lock_guard<InstrumentedMutex> lk(mu_);
+  {
+    std::lock_guard<std::mutex> b(beat_mu_);   // 放开 beat_mu_ 期间可能刚收到心跳或已注销，重新检查
+    auto it = beats_.find(gpuId);
+    if (it==beats_.end() || it->second.offline) return;
+    if (it->second.last + it->second.ttl > DeadlineTimer::Clock::now()){
+      liveness_.schedule(gpuId, it->second.ttl);
+      return;
+    }
+    it->second.offline = true;
+  }
+  takeOfflineLocked(gpuId);
+  commitLocked();
+}
+
+// 置 offline：不再参与调度，其上运行中的任务回到 pending
+void State::takeOfflineLocked(const std::string& gpuId){
+  auto& g = gpus_.at(gpuId);
+  if (g.status=="offline") return;
+  online_gpus_ -= g.status=="online";
+  g.status = "offline"; g.updated_at = std::chrono::system_clock::now();
+  if (store_) wal_gpus_.insert(gpuId);
+  auto it = running_on_.find(gpuId);
+  if (it==running_on_.end()) return;
+  std::vector<std::string> running(it->second.begin(), it->second.end());
+  for (auto& rid : running) updateRequestStatusLocked(rid, "pending", nullptr);
+}
+
+void State::bringOnlineLocked(const std::string& gpuId){
+  auto it = gpus_.find(gpuId);
+  if (it==gpus_.end() || it->second.status!="offline") return;
+  it->second.status = "online"; online_gpus_++;
+  recomputeGpuStatus(gpuId);
+  if (store_) wal_gpus_.insert(gpuId);
+  std::lock_guard<std::mutex> b(beat_mu_);
+  auto bt = beats_.find(gpuId);
+  if (bt==beats_.end()) return;
+  bt->second.offline = false;
+  liveness_.schedule(gpuId, bt->second.ttl);
+}
+
+void State::trackRunning(const ComputeRequest& r, bool on){
+  if (r.status!="running" || r.assigned_gpu_id.empty()) return;
+  if (on) running_on_[r.assigned_gpu_id].insert(r.id);
+  else { auto it = running_on_.find(r.assigned_gpu_id); if (it!=running_on_.end()) it->second.erase(r.id); }
+}
+
+void State::trackEnded(const ComputeRequest& r, bool on){
+  if (r.status!="completed" && r.status!="failed") return;
+  std::pair<int64_t,std::string> key{endedAt(r), r.id};
+  if (on) by_end_.insert(std::move(key)); else by_end_.erase(key);
+}
+
+void State::scheduleCompletion(const std::string& reqId, std::chrono::seconds after){
+  completions_.schedule(reqId, after);
+}
+
+std::vector<std::pair<std::string,int>> State::pendingByPriority(){
+  std::lock_guard<InstrumentedMutex> lk(mu_);
+  std::vector<std::pair<std::string,int>> out{{"high",0},{"normal",0},{"low",0}};
+  auto it = by_status_.find("pending");
+  if (it==by_status_.end()) return out;
+  for (auto& id : it->second){
+    auto& pri = reqs_[id].priority;
+    for (auto& kv : out) if (kv.first==pri){ kv.second++; break; }
+  }
+  return out;
+}
+
+std::vector<std::pair<std::string,size_t>> State::objectCounts(){
+  size_t timers = completions_.pending(), liveness = liveness_.pending();   // 计时器有自己的锁，先取，不与 mu_ 嵌套
+  std::lock_guard<InstrumentedMutex> lk(mu_);
+  size_t archived = 0;
+  for (auto& kv : archived_) archived += kv.second;
+  return {{"requests", reqs_.size()}, {"gpus", gpus_.size()}, {"time_index_entries", by_time_.size()},
+          {"completion_timers", timers}, {"liveness_timers", liveness}, {"archived_requests", archived},
+          {"snapshot_requests", cold_ ? cold_->size() : 0}};
+}
+
+State::GpuUsage State::gpuUsage(){
+  std::lock_guard<InstrumentedMutex> lk(mu_);
+  GpuUsage u;
+  u.ids.reserve(gpus_.size()); u.total.reserve(gpus_.size()); u.used.reserve(gpus_.size()); u.online.reserve(gpus_.size());
+  for (auto& [id, g] : gpus_){
+    auto it = gpu_used_mem_.find(id);
+    u.ids.push_back(id); u.total.push_back(g.gpu_memory);
+    u.used.push_back(it==gpu_used_mem_.end() ? 0 : it->second);
+    u.online.push_back(g.status!="offline");
+    u.devices.push_back(g.nvml_device);
+  }
+  return u;
+}
+
 void State::allocMem(const std::string& gpuId, int mem){
+  if (!gpus_.count(gpuId)) return;   // 已注销
   auto& used = gpu_used_mem_[gpuId];
   used += mem; recomputeGpuStatus(gpuId);
 }
 void State::freeMem(const std::string& gpuId, int mem){
+  if (!gpus_.count(gpuId)) return;
   auto& used = gpu_used_mem_[gpuId];
   used = std::max(0, used - mem); recomputeGpuStatus(gpuId);
 }
+State::GpuPick State::pickGpu(int mem, bool ect, double coTenancy){
+  std::lock_guard<InstrumentedMutex> lk(mu_);
+  GpuPick best; int bestFree = -1;
+  for (auto& [id, g] : gpus_){
+    int f = freeMemOf(id);
+    if (!g.is_shared || f < mem) continue;
+    auto it = running_on_.find(id);
+    size_t peers = it==running_on_.end() ? 0 : it->second.size();
+    double slow = 100.0 / std::max(g.performance_score, 1) * (1.0 + coTenancy * peers);
+    bool better = ect ? (best.id.empty() || slow < best.slowdown || (slow == best.slowdown && f > bestFree))
+                      : f > bestFree;
+    if (better){ best.id = id; best.slowdown = slow; bestFree = f; }
+  }
+  return best;
+}
 int State::freeMemOf(const std::string& gpuId){
-  auto itG = gpus_.find(gpuId); if (itG==gpus_.end()) return 0;
-  int cap = itG->second.gpu_memory;
-  int used = gpu_used_mem_[gpuId];
-  return std::max(0, cap - used);
+  auto itG = gpus_.find(gpuId); if (itG==gpus_.end() || itG->second.status=="offline") return 0;   // 离线的卡不接任务
+  auto itU = gpu_used_mem_.find(gpuId);
+  return std::max(0, itG->second.gpu_memory - (itU==gpu_used_mem_.end() ? 0 : itU->second));
 }
 void State::recomputeGpuStatus(const std::string& gpuId){
   auto& g = gpus_[gpuId];
-  g.status = (gpu_used_mem_[gpuId]>0) ? "busy" : "online";
+  if (g.status=="offline") return;   // 等心跳恢复时再算
+  std::string st = (gpu_used_mem_[gpuId]>0) ? "busy" : "online";
+  if (st!=g.status){
+    online_gpus_ += (st=="online") - (g.status=="online");
+    g.status = st;
+    if (store_) wal_gpus_.insert(gpuId);
+  }
   g.updated_at = std::chrono::system_clock::now();
 }
+void State::addRequest(const ComputeRequest& r){
+  reqs_[r.id]=r;
+  by_status_[r.status].insert(r.id);
+  req_text_.add(r.id, r.task_description);
+  by_time_.emplace(toMs(r.created_at), r.id);
+  trackRunning(r, true);
+  trackEnded(r, true);
+  if (store_) wal_reqs_.insert(r.id);
+}
+void State::setStatus(ComputeRequest& r, const std::string& st){
+  if (st==r.status) return;
+  by_status_[r.status].erase(r.id);
+  by_status_[st].insert(r.id);
+  r.status=st;
+}
+
+// 用恢复出的记录替换全部内存状态并重建各索引（不产生日志）；文本索引登记后由后台线程补建
+void State::restoreLocked(persist::Recovered& rec){
+  lsn_ = rec.lsn;
+  gpus_ = std::move(rec.gpus);
+  reqs_ = std::move(rec.reqs);
+  cold_ = std::move(rec.cold);
+  if (cold_)   // 快照里未结束的请求放回内存（调度、计时、按 GPU 的运行集合都要用）；已结束的留在快照里
+    for (auto& r : cold_->takeUnless({"completed", "failed"})){
+      auto it = reqs_.try_emplace(r.id, std::move(r)).first;
+      rec.order.push_back(&it->second);
+    }
+  gpu_used_mem_.clear(); running_on_.clear(); by_status_.clear(); by_time_.clear(); by_end_.clear();
+  req_text_ = NGramIndex(); gpu_text_ = NGramIndex();
+  online_gpus_ = 0;
+  for (auto& kv : gpus_){
+    gpu_used_mem_[kv.first] = 0;
+    online_gpus_ += kv.second.status=="online";
+    gpu_text_.add(kv.first, kv.second.gpu_name);
+  }
+  // 先按状态计数再预留容量，百万级请求时省掉哈希表反复扩容
+  std::unordered_map<std::string,size_t> counts;
+  for (auto& kv : reqs_) counts[kv.second.status]++;
+  for (auto& kv : counts) by_status_[kv.first].reserve(kv.second);
+  req_text_.reserve(reqs_.size());
+  for (auto& kv : reqs_){
+    auto& r = kv.second;
+    by_status_[r.status].insert(kv.first);
+    req_text_.defer(kv.first, r.task_description);
+    trackEnded(r, true);
+    if (r.status=="running" && !r.assigned_gpu_id.empty()){
+      gpu_used_mem_[r.assigned_gpu_id] += r.required_memory;
+      running_on_[r.assigned_gpu_id].insert(kv.first);
+    }
+  }
+  for (auto* r : rec.order)   // reqs 整体移动过来，节点地址不变
+    by_time_.emplace(toMs(r->created_at), r->id);
+  // 状态与恢复出的已用显存对齐一次（之后只在变更时维护，不动 updated_at）
+  for (auto& [id, g] : gpus_){
+    if (g.status=="offline") continue;
+    std::string st = gpu_used_mem_[id]>0 ? "busy" : "online";
+    if (st!=g.status){ online_gpus_ += (st=="online") - (g.status=="online"); g.status = st; }
+  }
+}
 
+void State::commitLocked(){
+  bool snapshot = false;
+  if (store_ && !(wal_gpus_.empty() && wal_reqs_.empty() && wal_drops_.empty())){
+    std::vector<const GpuResource*> gs; std::vector<const ComputeRequest*> rs;
+    for (auto& id : wal_gpus_) gs.push_back(&gpus_.at(id));
+    for (auto& id : wal_reqs_) rs.push_back(&reqs_.at(id));
+    snapshot = store_->log(++lsn_, gs, rs, wal_drops_);
+    wal_gpus_.clear(); wal_reqs_.clear(); wal_drops_.clear();
+  }
+  if (!unarchived_.empty()){
+    {
+      std::lock_guard<std::mutex> g(delete_mu_);
+      if (!deletes_closed_){
+        deletes_.insert(deletes_.end(), unarchived_.begin(), unarchived_.end());
+        unarchived_.clear();
+      }
+    }
+    if (unarchived_.empty()) delete_cv_.notify_all();
+    else {   // 删除线程已停（正在关闭）：当场删
+      if (store_) store_->flush();
+      archive_->remove(unarchived_);
+      unarchived_.clear();
+    }
+  }
+  if (!snapshot) return;
+  // 该做快照了：这里只编码 GPU；请求由后台线程分批取，用上一批最后的键续上：
+  // 时间索引与上次快照里还没作废的行按 (创建时间, id) 归并，后者按原样拷贝字节
+  std::vector<const GpuResource*> gs;
+  for (auto& kv : gpus_) gs.push_back(&kv.second);
+  auto cursor = std::make_shared<std::pair<int64_t,std::string>>(INT64_MIN, "");
+  auto row = std::make_shared<size_t>(0);   // 快照行里下一条待看的行号（行按键升序，键都大于 cursor）
+  store_->checkpoint(lsn_, persist::Store::snapshotHead(lsn_, gs), [this, cursor, row](persist::Writer& w){
+    std::lock_guard<InstrumentedMutex> lk(mu_);
+    size_t n = 0, last = persist::ColdRequests::npos;   // 本批最后写的是快照行时为其行号
+    auto it = by_time_.upper_bound(*cursor);
+    for (; n<kSnapshotChunk; n++){
+      size_t c = cold_ ? cold_->nextAlive(*row) : persist::ColdRequests::npos;
+      bool hot = it!=by_time_.end();
+      if (c!=persist::ColdRequests::npos && (!hot || cold_->before(c, *it))){
+        cold_->copyRow(c, w);
+        *row = c + 1; last = c;
+      } else if (hot){
+        w.req(reqs_.at(it->second));
+        *cursor = *it++; last = persist::ColdRequests::npos;
+      } else break;
+    }
+    if (last!=persist::ColdRequests::npos) *cursor = cold_->key(last);
+    return n;
+  });
+}
 
 #include <random>
 static std::string uuid4(){
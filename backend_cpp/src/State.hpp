@@ -1,9 +1,19 @@
 #pragma once
+#include <atomic>
+#include <memory>
 #include <string>
 #include <unordered_map>
+#include <unordered_set>
+#include <set>
 #include <vector>
 #include <mutex>
 #include <chrono>
+#include <condition_variable>
+#include <cstdint>
+#include <thread>
+#include "TextIndex.hpp"
+#include "Timer.hpp"
+#include "Metrics.hpp"
 
 struct GpuResource {
   std::string id;
@@ -13,6 +23,8 @@ struct GpuResource {
   std::string compute_capability;
   bool is_shared = true;
   std::string status = "offline"; // online/offline/busy
+  int heartbeat_ttl = 0;           // 心跳超时（秒）；0 为内置的卡，不做存活检测
+  std::string nvml_device;         // 调度器本机的 NVML 设备（UUID 或序号），遥测据此读真实数据；空为不在本机
   std::chrono::system_clock::time_point created_at;
   std::chrono::system_clock::time_point updated_at;
 };
@@ -38,32 +50,166 @@ struct PlatformStats {
   int completed_requests = 0;
 };
 
+// 批量创建的一项
+struct NewRequest {
+  std::string task_description;
+  int required_memory = 0;
+  int estimated_duration = 0;
+  std::string priority = "normal";
+};
+
+// GET /requests 的查询条件；时间均为 epoch 毫秒，0 表示不限
+struct RequestQuery {
+  std::string q;
+  std::string status;
+  size_t limit = 0;          // 0 = 不分页
+  int64_t since_ms = 0;      // created_at >= since
+  int64_t until_ms = 0;      // created_at <  until
+  int64_t cursor_ms = 0;     // 游标：只返回 (created_at, id) 排在它之前（更早）的请求
+  std::string cursor_id;
+};
+
+namespace persist { class Store; struct Recovered; class ColdRequests; }
+class RequestArchive;
+
 class State {
 public:
   static State& instance();
+  ~State();
+
+  // 持久化（WAL + 快照，见 Persist.hpp）：dir 里有数据则用它替换内存中的初始状态，返回是否恢复了。
+  // 须在启动模拟器之前调用；之后每次写操作结束时记一帧日志
+  bool enablePersistence(const std::string& dir, bool fsync = true);
+  void closePersistence();   // 停掉后台线程，等快照和未落盘的日志写完，关闭归档
+
+  // 历史归档（SQLite，见 Archive.hpp）：已结束请求超过 historyMax 条或结束超过 maxAgeSec 秒的，
+  // 由后台线程分批移出内存；GET /requests 仍能查到，completed 计数不变。在 enablePersistence 之后、启动模拟器之前调用
+  void enableArchive(const std::string& path, size_t historyMax, int64_t maxAgeSec);
+  size_t enforceRetention();   // 立即做一轮归档，返回移出的条数
 
   // 查询
   std::vector<GpuResource> listGpus(const std::string& q, const std::string& status);
   std::vector<ComputeRequest> listRequests(const std::string& q, const std::string& status);
+  std::vector<ComputeRequest> listRequests(const RequestQuery& rq); // 按创建时间倒序，可分页
   PlatformStats stats();
 
   // 修改
   ComputeRequest createRequest(const std::string& desc, int mem, int estMin, const std::string& pri);
   bool matchRequest(const std::string& reqId, const std::string& gpuId, ComputeRequest* out);
   bool updateRequestStatus(const std::string& reqId, const std::string& st, ComputeRequest* out);
+  // 批量版本：整批只加一次锁；返回逐项结果（新请求 id / 是否成功）
+  std::vector<std::string> createRequests(const std::vector<NewRequest>& items);
+  std::vector<bool> matchRequests(const std::vector<std::pair<std::string,std::string>>& items);   // (reqId, gpuId)
+  std::vector<bool> updateStatuses(const std::vector<std::pair<std::string,std::string>>& items);  // (reqId, status)
+
+  // GPU 提供方：注册的卡须每隔不超过 ttlSec 秒发一次心跳，否则置 offline、其上运行中的任务回到 pending；
+  // 离线后再收到心跳即恢复。注销时同样把运行中的任务放回 pending
+  GpuResource registerGpu(const std::string& name, int mem, int score, const std::string& cc, bool shared, int ttlSec,
+                          const std::string& nvmlDevice = "");
+  bool deregisterGpu(const std::string& gpuId);
+  // 心跳只在 beat_mu_ 下记时间，不碰 mu_、不写日志；返回每块 GPU 是否存在（不存在的应重新注册）
+  std::vector<bool> heartbeats(const std::vector<std::string>& gpuIds);
 
   // 模拟/采集入口
   void seed();
   void allocMem(const std::string& gpuId, int mem);
   void freeMem(const std::string& gpuId, int mem);
   int  freeMemOf(const std::string& gpuId);
+  // 自动调度选卡（一次持锁）：ect=false 选可用显存最多的共享卡；ect=true 选预计运行最快的，同样快时选可用显存多的。
+  // slowdown 为在该卡上运行相对基准卡（performance_score=100）独占运行的时长倍数：按性能分反比，
+  // 每个同卡运行中的任务再慢 coTenancy（同 backend_py 的 PLACEMENT_POLICY）。放不下时 id 为空
+  struct GpuPick { std::string id; double slowdown = 1.0; };
+  GpuPick pickGpu(int mem, bool ect, double coTenancy);
   void recomputeGpuStatus(const std::string& gpuId);
+  // 到时自动把请求置为 completed；请求被手动改成 completed/failed/pending 时自动撤销
+  void scheduleCompletion(const std::string& reqId, std::chrono::seconds after);
+
+  // 指标：mu_ 的等待/持有时间、按优先级的 pending 数、常驻对象数量
+  const InstrumentedMutex& lockStats() const { return mu_; }
+  std::vector<std::pair<std::string,int>> pendingByPriority();
+  std::vector<std::pair<std::string,size_t>> objectCounts();
+
+  // 遥测采样用：各 GPU 的总显存 / 已用显存（GB）与是否在线，列式，一次持锁
+  struct GpuUsage {
+    std::vector<std::string> ids; std::vector<double> total, used; std::vector<uint8_t> online;
+    std::vector<std::string> devices;   // nvml_device
+  };
+  GpuUsage gpuUsage();
 
 private:
   State();
-  std::mutex mu_;
+  void addRequest(const ComputeRequest& r);
+  // 以下 *Locked 由调用方持有 mu_
+  ComputeRequest createRequestLocked(const std::string& desc, int mem, int estMin, const std::string& pri,
+                                     std::chrono::system_clock::time_point now);
+  bool matchRequestLocked(const std::string& reqId, const std::string& gpuId, ComputeRequest* out);
+  bool updateRequestStatusLocked(const std::string& reqId, const std::string& st, ComputeRequest* out);
+  void setStatus(ComputeRequest& r, const std::string& st); // 所有状态变化都走这里，维护索引
+  void restoreLocked(persist::Recovered& rec);
+  void commitLocked();   // 每个公开写操作结束时调用：把本次变化的记录写成一帧日志
+  std::vector<ComputeRequest> listResidentLocked(const RequestQuery& rq);
+  std::vector<ComputeRequest> retentionVictimsLocked();
+  std::vector<std::string> evictLocked(const std::vector<ComputeRequest>& victims);   // 返回选中后又被改过、没移出的 id
+  ComputeRequest* lookupLocked(const std::string& reqId);   // 内存里没有就从快照或归档取回
+  void trackRunning(const ComputeRequest& r, bool on);   // 维护 running_on_：请求变更前后各调一次
+  void trackEnded(const ComputeRequest& r, bool on);     // 维护 by_end_：同上
+  void deleteLoop();    // 删除线程：按顺序把排队的 id 从归档删掉
+  void waitDeletes();   // 等排队的删除都做完
+  void takeOfflineLocked(const std::string& gpuId);
+  void bringOnlineLocked(const std::string& gpuId);
+  void checkLiveness(const std::string& gpuId);          // 存活检测的截止时间到了（计时线程回调）
+
+  InstrumentedMutex mu_;
   std::unordered_map<std::string,GpuResource> gpus_;
   std::unordered_map<std::string,ComputeRequest> reqs_;
   std::unordered_map<std::string,int> gpu_used_mem_;
+  std::unordered_map<std::string,std::unordered_set<std::string>> running_on_;   // gid -> 其上运行中的请求
+  // 按状态的二级索引与计数：stats() O(1)，按状态过滤只看命中的请求
+  std::unordered_map<std::string,std::unordered_set<std::string>> by_status_;
+  int online_gpus_ = 0;
+  // q 搜索用的 n-gram 倒排索引（大小写不敏感）
+  NGramIndex req_text_;
+  NGramIndex gpu_text_;
+  // 按 (created_at 毫秒, id) 升序的时间索引，分页/时间范围查询 O(log n + 页大小)
+  std::set<std::pair<int64_t,std::string>> by_time_;
+  // 内存里已结束的请求按 (结束时间, id) 升序，归档时从最早结束的取一批
+  std::set<std::pair<int64_t,std::string>> by_end_;
+  // 从快照恢复、还没被碰过的已结束请求：留在 mmap 里，不进上面的各索引（见 persist::ColdRequests）。
+  // 查询与统计把它和内存里的合起来；写操作碰到时取回内存
+  std::shared_ptr<persist::ColdRequests> cold_;
   int total_users_ = 12;
+  // 持久化：store_ 为空表示未启用；wal_* 是本次写操作中变化了的 id
+  std::unique_ptr<persist::Store> store_;
+  uint64_t lsn_ = 0;
+  std::unordered_set<std::string> wal_gpus_, wal_reqs_;
+  bool recovered_ = false;
+  std::thread indexer_;   // 恢复后分批补建 req_text_
+  std::atomic<bool> stopping_{false};
+  // 归档：archive_ 为空表示未启用；archived_ 为各状态的归档条数，archive_newest_ 为归档里最新的时间键；
+  // unarchived_ 是本次写操作从归档取回的 id，日志落盘后从归档删除
+  std::unique_ptr<RequestArchive> archive_;
+  size_t history_max_ = 0;
+  std::chrono::seconds history_max_age_{0};
+  std::unordered_map<std::string,size_t> archived_;
+  std::pair<int64_t,std::string> archive_newest_{INT64_MIN, ""};
+  std::vector<std::string> wal_drops_, unarchived_;
+  std::thread retention_;
+  // 从归档删除不持 mu_：commitLocked 把 unarchived_ 排进 deletes_，删除线程等日志落盘后再删；
+  // deletes_closed_ 时（未启用归档或正在关闭）commitLocked 当场删
+  std::mutex delete_mu_;
+  std::condition_variable delete_cv_;
+  std::vector<std::string> deletes_;
+  bool deleting_ = false, deletes_closed_ = true;
+  std::thread deleter_;
+  std::mutex stop_mu_;
+  std::condition_variable stop_cv_;
+  // 注册 GPU 的存活检测：心跳只更新 beats_ 里的时间；每块卡在 liveness_ 里只挂一个截止时间，
+  // 到期时期间有过心跳就按最后一次心跳顺延，否则置 offline。计时器的工作量只取决于卡数 / 超时，与心跳频率无关。
+  // 锁顺序：mu_ → beat_mu_ → 计时器内部的锁
+  struct Beat { DeadlineTimer::Clock::time_point last; std::chrono::seconds ttl; bool offline = false; };
+  std::mutex beat_mu_;
+  std::unordered_map<std::string,Beat> beats_;
+  // 放在最后：析构时最先停掉计时线程，回调不会碰到已析构的成员
+  DeadlineTimer completions_{[this](const std::string& rid){ updateRequestStatus(rid, "completed", nullptr); }};
+  DeadlineTimer liveness_{[this](const std::string& gid){ checkLiveness(gid); }};
 };
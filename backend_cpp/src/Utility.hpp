@@ -41,6 +41,8 @@ inline Json::Value toJson(const GpuResource &g) {
         j["compute_capability"] = g.compute_capability;
     j["is_shared"]          = g.is_shared;
     j["status"]             = g.status;
+    j["heartbeat_ttl"]      = g.heartbeat_ttl ? Json::Value(g.heartbeat_ttl) : Json::Value();  // 0 → null
+    j["nvml_device"]        = g.nvml_device.empty() ? Json::Value() : Json::Value(g.nvml_device);
 
     const auto created = toIso8601(g.created_at);
     const auto updated = toIso8601(g.updated_at);
@@ -1,7 +1,9 @@
 #include <drogon/drogon.h>
+#include <cstdlib>
 #include <unordered_set>
 #include <string>
 #include "Sim.hpp"
+#include "State.hpp"
 
 void registerRoutes();
 
@@ -67,6 +69,25 @@ int main()
       });
 
   registerRoutes(); // 注册 /stats /gpus /requests ...
+  // 设置 STATE_DIR 则启用 WAL + 快照持久化，重启时从该目录恢复；WAL_FSYNC=0 时不 fsync
+  if (const char* dir = std::getenv("STATE_DIR"); dir && *dir)
+  {
+    const char* fs = std::getenv("WAL_FSYNC");
+    State::instance().enablePersistence(dir, !(fs && std::string(fs) == "0"));
+  }
+  // 已结束请求超过 HISTORY_MAX 条或结束超过 HISTORY_MAX_AGE_SEC 秒的归档到 ARCHIVE_PATH（默认 STATE_DIR/archive.sqlite3）
+  {
+    const char* path = std::getenv("ARCHIVE_PATH");
+    const char* dir = std::getenv("STATE_DIR");
+    std::string archive = (path && *path) ? path : (dir && *dir) ? std::string(dir) + "/archive.sqlite3" : "";
+    if (!archive.empty())
+    {
+      const char* max = std::getenv("HISTORY_MAX");
+      const char* age = std::getenv("HISTORY_MAX_AGE_SEC");
+      State::instance().enableArchive(archive, max ? std::stoul(max) : 100000, age ? std::stoll(age) : 3600);
+    }
+  }
   startSimulator(); // 启动模拟器，可将本行注释掉，则不启动模拟器
   app().addListener("0.0.0.0", 9000).run();
+  State::instance().closePersistence();
 }
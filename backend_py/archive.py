@@ -0,0 +1,133 @@
+# archive.py
+"""
+已结束请求的归档（SQLite）。
+
+调度器内存里只保留活跃请求和最近结束的请求；更早结束（或超出条数上限）的 completed/failed 请求
+分批移到这里，GET /requests 查询时与内存里的结果按 (created_at, id) 归并。
+- 每行存完整记录（orjson 编码，与接口输出一致），另存查询用的列：创建时间（微秒）、状态、大小写折叠后的描述。
+  文本条件用 instr 在折叠后的描述里找子串，和内存里的 n-gram 索引结果一致。
+- version 列是写入这一批时调度器的状态版本，重启时用来和 WAL 对账（见 VirtualScheduler._reconcile_archive）。
+- 一个连接在线程间共享，调用由锁串行化；日志模式 WAL + synchronous=NORMAL。
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+import sqlite3
+import threading
+
+import orjson
+
+from records import RequestRecord
+from persistence import req_from_dict
+from textindex import fold
+
+_EPOCH = datetime(1970, 1, 1)
+_US = timedelta(microseconds=1)
+_IN_CHUNK = 500        # IN (...) 一次带的 id 数
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    id         TEXT PRIMARY KEY,
+    created_us INTEGER NOT NULL,
+    status     TEXT NOT NULL,
+    text       TEXT NOT NULL,
+    version    INTEGER NOT NULL,
+    body       BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS requests_time ON requests (created_us, id);
+CREATE INDEX IF NOT EXISTS requests_version ON requests (version);
+"""
+
+
+def to_us(dt: datetime) -> int:
+    """内部的本地 naive 时间 → 整数微秒，比较与排序都精确"""
+    return (dt - _EPOCH) // _US
+
+def from_us(us: int) -> datetime:
+    return _EPOCH + us * _US
+
+
+class RequestArchive:
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def put(self, reqs: Iterable[RequestRecord], version: int):
+        """写入（或覆盖）一批记录，一个事务"""
+        rows = [(r.id, to_us(r.created_at), r.status, fold(r.task_description), version, orjson.dumps(r))
+                for r in reqs]
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT OR REPLACE INTO requests VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._db.execute("COMMIT")
+
+    def get(self, ids: Iterable[str]) -> dict[str, RequestRecord]:
+        out = {}
+        ids = list(ids)
+        with self._lock:
+            for i in range(0, len(ids), _IN_CHUNK):
+                chunk = ids[i:i + _IN_CHUNK]
+                sql = f"SELECT body FROM requests WHERE id IN ({','.join('?' * len(chunk))})"
+                for (body,) in self._db.execute(sql, chunk):
+                    r = req_from_dict(orjson.loads(body))
+                    out[r.id] = r
+        return out
+
+    def delete(self, ids: Iterable[str]):
+        with self._lock:
+            self._db.executemany("DELETE FROM requests WHERE id = ?", ((rid,) for rid in ids))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM requests")
+
+    def query(self, q: str | None = None, status: str | None = None, since: datetime | None = None,
+              until: datetime | None = None, before: tuple[datetime, str] | None = None,
+              limit: int | None = None) -> list[RequestRecord]:
+        """条件与 VirtualScheduler.list_requests 相同，按 (created_at, id) 倒序"""
+        sql, args = ["SELECT body FROM requests WHERE 1"], []
+        if status:
+            sql.append("AND status = ?"); args.append(status)
+        if q:
+            sql.append("AND instr(text, ?) > 0"); args.append(fold(q))
+        if since:
+            sql.append("AND created_us >= ?"); args.append(to_us(since))
+        if until:
+            sql.append("AND created_us < ?"); args.append(to_us(until))
+        if before:
+            sql.append("AND (created_us, id) < (?, ?)"); args += [to_us(before[0]), before[1]]
+        sql.append("ORDER BY created_us DESC, id DESC")
+        if limit is not None:
+            sql.append("LIMIT ?"); args.append(limit)
+        with self._lock:
+            rows = self._db.execute(" ".join(sql), args).fetchall()
+        return [req_from_dict(orjson.loads(body)) for (body,) in rows]
+
+    def counts(self) -> Counter:
+        """各状态的归档条数"""
+        with self._lock:
+            return Counter(dict(self._db.execute("SELECT status, COUNT(*) FROM requests GROUP BY status")))
+
+    def newest(self) -> Optional[tuple[datetime, str]]:
+        """归档里最新的 (created_at, id)；空归档返回 None"""
+        with self._lock:
+            row = self._db.execute("SELECT created_us, id FROM requests ORDER BY created_us DESC, id DESC LIMIT 1").fetchone()
+        return (from_us(row[0]), row[1]) if row else None
+
+    def unconfirmed_ids(self, version: int) -> list[str]:
+        """
+        可能还没在 WAL 里确认移出内存的记录：最后一批版本早于 version 的，以及版本不早于 version 的。
+        归档一批的删除帧版本总大于写入时的版本，而下一批要等上一批删除发布后才开始，所以更早的批次都已确认。
+        """
+        with self._lock:
+            (last,) = self._db.execute("SELECT MAX(version) FROM requests WHERE version < ?", (version,)).fetchone()
+            rows = self._db.execute("SELECT id FROM requests WHERE version >= ?",
+                                    (version if last is None else last,)).fetchall()
+        return [rid for (rid,) in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,100 @@
+# backfill.py
+"""
+回填调度（backfilling）：队首放不下的请求按运行中任务的预计结束时间（started_at + estimated_duration）预留显存，
+排在后面的请求只有在不推迟预留的前提下才先上，既利用空闲显存，又不让大请求被小请求无限插队。
+- easy：只为第一个放不下的请求预留；
+- conservative：为前 depth 个放不下的请求依次预留，后面的请求不能推迟其中任何一个。
+
+每块 GPU 未来的可用显存是一条阶梯函数（Profile）：当前可用 + 各任务预计结束时释放 − 预留占用，时间为相对现在的秒数。
+估计时长只当上界用：超时仍在运行的任务视为马上结束，对预留最保守。
+"""
+from typing import Callable, Iterable, Optional
+import bisect
+
+MODES = ("none", "easy", "conservative")
+
+
+class Profile:
+    """一块 GPU 未来的可用显存：free 为现在的可用量，(times[i], deltas[i]) 为之后各时刻的增减"""
+    __slots__ = ("free", "times", "deltas")
+
+    def __init__(self, free: int, releases: Iterable[tuple[float, int]] = ()):
+        self.free = free
+        self.times: list[float] = []
+        self.deltas: list[int] = []
+        for t, mem in releases:
+            self._add(t, mem)
+
+    def _add(self, t: float, delta: int):
+        i = bisect.bisect_right(self.times, t)
+        self.times.insert(i, t)
+        self.deltas.insert(i, delta)
+
+    def fits(self, mem: int, start: float, dur: float) -> bool:
+        """[start, start + dur) 内可用显存始终不少于 mem（同一时刻的增减合并后再比较）"""
+        times, deltas = self.times, self.deltas
+        free, end, n = self.free, start + dur, len(times)
+        i = 0
+        while i < n and times[i] <= start:
+            free += deltas[i]; i += 1
+        if free < mem: return False
+        while i < n and times[i] < end:
+            t = times[i]
+            while i < n and times[i] == t:
+                free += deltas[i]; i += 1
+            if free < mem: return False
+        return True
+
+    def earliest(self, mem: int, dur: float) -> Optional[float]:
+        """最早能连续 dur 秒占用 mem 显存的时刻；可用量只在现在或某次释放时变大，只需试这些时刻"""
+        if self.fits(mem, 0.0, dur): return 0.0
+        for t, d in zip(self.times, self.deltas):
+            if d > 0 and t > 0 and self.fits(mem, t, dur): return t
+        return None
+
+    def occupy(self, mem: int, start: float, dur: float):
+        self._add(start, -mem)
+        self._add(start + dur, mem)
+
+
+class Reservations:
+    """一次调度过程中的预留表；各 GPU 的 Profile 用到时才由 build(gid) 按当前状态建立"""
+
+    def __init__(self, build: Callable[[str], Profile]):
+        self._build = build
+        self._profiles: dict[str, Profile] = {}
+        self.reserved: set[str] = set()
+        self.count = 0
+
+    def _profile(self, gid: str) -> Profile:
+        p = self._profiles.get(gid)
+        if p is None:
+            p = self._profiles[gid] = self._build(gid)
+        return p
+
+    def reserve(self, cands: Iterable[tuple[str, float]], mem: int) -> bool:
+        """
+        cands 为 (gid, 在这块卡上的预计时长)：在预计最早完成的卡上预留 [开始, 开始 + 时长)；
+        哪块卡都放不下（需求超过容量）时返回 False
+        """
+        best = None
+        for gid, dur in cands:
+            s = self._profile(gid).earliest(mem, dur)
+            if s is not None and (best is None or s + dur < best[0]):
+                best = (s + dur, s, gid, dur)
+        if best is None: return False
+        _, start, gid, dur = best
+        self._profiles[gid].occupy(mem, start, dur)
+        self.reserved.add(gid)
+        self.count += 1
+        return True
+
+    def allows(self, gid: str, mem: int, dur: float) -> bool:
+        """现在在 gid 上开始运行（显存已确认够用）是否不推迟任何预留"""
+        return gid not in self.reserved or self._profiles[gid].fits(mem, 0.0, dur)
+
+    def commit(self, gid: str, mem: int, dur: float):
+        """现在在 gid 上开始运行了一个任务"""
+        p = self._profiles.get(gid)
+        if p is not None:
+            p.occupy(mem, 0.0, dur)
@@ -0,0 +1,116 @@
+# events.py
+"""变更推送：调度器每次发布新版本时把增量事件广播给所有订阅者（GET /events 的 SSE 流）"""
+from collections import deque
+from typing import Callable, Iterable
+import asyncio
+import threading
+
+from records import dumps
+
+EVENT_BUFFER = 1000        # 每个订阅者最多积压的事件数，超出则丢弃积压并要求客户端重新全量拉取
+HEARTBEAT_SEC = 15         # 空闲时发送注释行保活
+
+
+def sse_frame(event: str, data: str | bytes, version: int | None = None) -> bytes:
+    head = f"id: {version}\n" if version is not None else ""
+    if isinstance(data, str): data = data.encode()
+    return f"{head}event: {event}\ndata: ".encode() + data + b"\n\n"
+
+
+class Subscription:
+    """一个客户端的有界缓冲；生产者可以在任意线程，消费者在事件循环里"""
+
+    def __init__(self, hub: "EventHub", maxsize: int):
+        self._hub = hub
+        self._buf: deque[bytes] = deque()
+        self._maxsize = maxsize
+        self._overflowed = False
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._wake = asyncio.Event()
+
+    def _push(self, frames: list[bytes]):
+        # 由 EventHub 在其锁内调用
+        if self._overflowed:
+            return
+        if len(self._buf) + len(frames) > self._maxsize:
+            self._overflow()   # 慢消费者：丢弃积压，下一次取数据时通知它 resync
+            return
+        self._buf.extend(frames)
+        self._wakeup()
+
+    def _overflow(self):
+        # 由 EventHub 在其锁内调用
+        self._buf.clear()
+        self._overflowed = True
+        self._wakeup()
+
+    def _wakeup(self):
+        if threading.get_ident() == self._loop_thread:
+            self._wake.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def next_frames(self, timeout: float) -> list[bytes] | None:
+        """等待新事件；返回 None 表示缓冲溢出，需要 resync；超时返回空列表"""
+        if not self._buf and not self._overflowed:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        with self._hub._lock:
+            self._wake.clear()
+            if self._overflowed:
+                self._overflowed = False
+                return None
+            frames = list(self._buf)
+            self._buf.clear()
+            return frames
+
+    def close(self):
+        self._hub._unsubscribe(self)
+
+
+class EventHub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs: set[Subscription] = set()
+
+    @property
+    def has_subscribers(self) -> bool:
+        return bool(self._subs)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subs)
+
+    def subscribe(self, maxsize: int = EVENT_BUFFER) -> Subscription:
+        sub = Subscription(self, maxsize)
+        with self._lock:
+            self._subs.add(sub)
+        return sub
+
+    def _unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subs.discard(sub)
+
+    def publish(self, version: int, changes: Iterable[tuple[str, object]],
+                encode: Callable[[object], bytes] = dumps):
+        """每个事件只编码一次，所有订阅者共享同一份字节"""
+        if not self._subs:
+            return
+        self.publish_frames([sse_frame(kind, encode(obj), version) for kind, obj in changes])
+
+    def publish_frames(self, frames: list[bytes]):
+        """广播已编码好的帧（多 worker 模式下转发调度器进程的事件）"""
+        if not frames:
+            return
+        with self._lock:
+            for sub in self._subs:
+                sub._push(frames)
+
+    def reset(self):
+        """上游丢了事件（例如与调度器进程的连接断开过）：让所有订阅者 resync"""
+        with self._lock:
+            for sub in self._subs:
+                sub._overflow()
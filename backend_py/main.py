@@ -1,12 +1,28 @@
 # main.py
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import Optional
-from scheduler_adapter import scheduler
-from models import ComputeRequest
+from contextlib import asynccontextmanager
+import asyncio
+import os
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Optional, Literal, List
+from datetime import datetime
+import orjson
+from scheduler_adapter import scheduler, SCHEDULER_SOCKET, GPU_HEARTBEAT_TTL_SEC
+from events import sse_frame, HEARTBEAT_SEC
+from models import GpuResource, ComputeRequest, Priority, ScheduleResult
+from metrics import REGISTRY, CONTENT_TYPE, PROFILE_MAX_SEC, LatencyMiddleware, sample_stacks
+from telemetry import HISTORY_POINTS_MAX
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI(title="GPU Resource Monitor")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # asyncio 模式下仿真与自动完成都跑在本事件循环上
+    scheduler.start()
+    yield
+    scheduler.close()
+
+app = FastAPI(title="GPU Resource Monitor", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,7 +30,47 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "X-State-Version", "X-Delta"],
 )
+app.add_middleware(LatencyMiddleware)
+
+PROFILE_ENABLED = os.environ.get("PROFILE_ENABLED") == "1"   # /debug/profile 默认关闭
+
+async def _r(result):
+    """多 worker 模式下 scheduler 是 RemoteScheduler，方法返回协程；本地调度器直接返回结果"""
+    return await result if SCHEDULER_SOCKET else result
+
+async def _a(method: str, *args, **kwargs):
+    """可能要读归档的调用：本地调度器用其协程版本（归档读放到线程里），RemoteScheduler 的方法本身就是协程"""
+    return await getattr(scheduler, method if SCHEDULER_SOCKET else method + "_async")(*args, **kwargs)
+
+if SCHEDULER_SOCKET:
+    @app.exception_handler(OSError)
+    async def scheduler_unavailable(request: Request, exc: OSError):
+        # 调度器进程没起来或正在重启；连接会在下次调用时重建
+        return JSONResponse({"detail": "调度器不可用"}, status_code=503)
+
+# ---- 条件 GET：ETag 由对应数据最后变化时的版本号生成，未变化直接 304，不碰数据 ----
+def _etag(kind: str, ver: int) -> str:
+    return f'"{kind}-{ver}"'
+
+def _not_modified(request: Request, etag: str) -> Optional[Response]:
+    inm = request.headers.get("if-none-match")
+    if not inm: return None
+    tags = [t.strip().removeprefix("W/") for t in inm.split(",")]
+    if "*" in tags or etag in tags:
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+def _json(obj, response: Optional[Response] = None) -> Response:
+    """调度器返回的记录用其缓存的 JSON 片段拼接；路由注入的 response 上设置的响应头一并带上"""
+    headers = {k: v for k, v in response.headers.items() if k != "content-length"} if response else None
+    return Response(scheduler.to_json(obj), media_type="application/json", headers=headers)
+
+def _set_version_headers(response: Response, etag: str, version: int):
+    response.headers["ETag"] = etag
+    response.headers["X-State-Version"] = str(version)
+    response.headers["Cache-Control"] = "no-cache"
 
 class MatchBody(BaseModel):
     gpu_id: str
@@ -23,42 +79,207 @@ class CreateReqBody(BaseModel):
     task_description: str
     required_memory: int
     estimated_duration: int
-    priority: Optional[str] = "normal"
+    priority: Optional[Priority] = "normal"
 
 @app.get("/stats")
-def get_stats():
-    return scheduler.stats()
+async def get_stats(request: Request, response: Response):
+    version, _, _, stats_ver = await _r(scheduler.versions())
+    etag = _etag("stats", stats_ver)
+    if (r := _not_modified(request, etag)) is not None: return r
+    _set_version_headers(response, etag, version)
+    return await _r(scheduler.stats())
 
-@app.get("/gpus")
-def get_gpus(q: Optional[str]=None, status: Optional[str]=None):
-    return scheduler.list_gpus(q=q, status=status)
+@app.get("/gpus", response_model=List[GpuResource])
+async def get_gpus(request: Request, response: Response, q: Optional[str]=None,
+                   status: Optional[str]=None, since_version: Optional[int]=None):
+    # since_version：只返回该版本之后变化过的 GPU（客户端按 id 合并）
+    version, gpu_ver, _, _ = await _r(scheduler.versions())
+    etag = _etag("gpus", gpu_ver)
+    if (r := _not_modified(request, etag)) is not None: return r
+    _set_version_headers(response, etag, version)
+    if since_version is not None:
+        if q or status:
+            raise HTTPException(status_code=400, detail="since_version 不能与 q/status 同时使用")
+        items = await _r(scheduler.changed_gpus(since_version))
+        if items is not None:
+            response.headers["X-Delta"] = "partial"
+            return _json(items, response)
+        response.headers["X-Delta"] = "full"   # 其间有 GPU 注销，退回全量
+    return _json(await _r(scheduler.list_gpus(q=q, status=status)), response)
 
-@app.get("/requests")
-def get_requests(q: Optional[str]=None, status: Optional[str]=None):
-    return scheduler.list_requests(q=q, status=status)
+@app.get("/requests", response_model=List[ComputeRequest])
+async def get_requests(request: Request, response: Response, q: Optional[str]=None, status: Optional[str]=None,
+                       limit: Optional[int]=Query(None, ge=1, le=1000), cursor: Optional[str]=None,
+                       since: Optional[datetime]=None, until: Optional[datetime]=None,
+                       since_version: Optional[int]=None):
+    # since/until 是创建时间范围；since_version 是增量同步：只返回该版本之后新建或变化过的请求
+    version, _, req_ver, _ = await _r(scheduler.versions())
+    etag = _etag("requests", req_ver)
+    if (r := _not_modified(request, etag)) is not None: return r
+    _set_version_headers(response, etag, version)
+    if since_version is not None:
+        if q or status or limit or cursor or since or until:
+            raise HTTPException(status_code=400, detail="since_version 不能与其它过滤/分页参数同时使用")
+        items = await _a("changed_requests", since_version)
+        if items is not None:
+            response.headers["X-Delta"] = "partial"
+            return _json(items, response)
+        response.headers["X-Delta"] = "full"   # 变更日志已截掉，退回全量
 
-@app.post("/requests")
-def create_request(body: CreateReqBody) -> ComputeRequest:
-    return scheduler.create_request(
+    # 分页：若还有下一页，游标放在 X-Next-Cursor 响应头里，响应体仍是数组
+    try:
+        items = await _a("list_requests", q=q, status=status, limit=limit, cursor=cursor,
+                         since=since, until=until)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="cursor 无效")
+    if limit and len(items) == limit:
+        response.headers["X-Next-Cursor"] = scheduler.next_cursor(items)
+    return _json(items, response)
+
+@app.post("/requests", response_model=ComputeRequest)
+async def create_request(body: CreateReqBody):
+    return _json(await _r(scheduler.create_request(
         task_description=body.task_description,
         required_memory=body.required_memory,
         estimated_duration=body.estimated_duration,
         priority=body.priority or "normal"
-    )
+    )))
 
-@app.post("/requests/{rid}/match")
-def match_request(rid: str, body: MatchBody):
-    res = scheduler.match_request(rid, body.gpu_id)
-    if not res:
-        raise HTTPException(status_code=400, detail="匹配失败：GPU不可用或请求不存在")
-    return res
+BULK_MAX = 10_000   # 单次批量接口最多的条数
+
+class BulkCreateBody(BaseModel):
+    requests: List[CreateReqBody] = Field(..., max_length=BULK_MAX)
+
+@app.post("/requests/bulk")
+async def create_requests(body: BulkCreateBody):
+    # 整批一次提交给调度器（一次加锁）；只返回新请求的 id，顺序与提交顺序一致
+    ids = await _r(scheduler.create_requests([
+        (r.task_description, r.required_memory, r.estimated_duration, r.priority or "normal")
+        for r in body.requests
+    ]))
+    return {"ids": ids}
 
 class StatusBody(BaseModel):
     status: str  # pending/running/completed/failed
 
-@app.post("/requests/{rid}/status")
-def update_request_status(rid: str, body: StatusBody):
-    res = scheduler.update_request_status(rid, body.status)
+class StatusUpdate(StatusBody):
+    id: str
+
+class BulkStatusBody(BaseModel):
+    updates: List[StatusUpdate] = Field(..., max_length=BULK_MAX)
+
+@app.post("/requests/status/bulk")
+async def update_statuses(body: BulkStatusBody):
+    # ok[i] 表示第 i 项的请求是否存在并已更新
+    ok = await _a("update_statuses", [(u.id, u.status) for u in body.updates])
+    return {"ok": ok, "updated": sum(ok)}
+
+class ScheduleBody(BaseModel):
+    policy: Literal["ffd", "best_fit", "worst_fit"] = "ffd"
+
+@app.post("/requests/schedule")
+async def schedule_requests(body: ScheduleBody = ScheduleBody()) -> ScheduleResult:
+    # 把所有 pending 请求一次性装箱到共享 GPU 上；不带请求体时用默认策略 ffd
+    return await _r(scheduler.schedule_pending(body.policy))
+
+@app.post("/requests/{rid}/match", response_model=ComputeRequest)
+async def match_request(rid: str, body: MatchBody):
+    res = await _a("match_request", rid, body.gpu_id)
+    if not res:
+        raise HTTPException(status_code=400, detail="匹配失败：GPU不可用或请求不存在")
+    return _json(res)
+
+@app.post("/requests/{rid}/status", response_model=ComputeRequest)
+async def update_request_status(rid: str, body: StatusBody):
+    res = await _a("update_request_status", rid, body.status)
     if not res:
         raise HTTPException(status_code=404, detail="请求不存在")
-    return res
+    return _json(res)
+
+# ---- GPU 提供方：注册 / 注销 / 心跳 ----
+class RegisterGpuBody(BaseModel):
+    gpu_name: str
+    gpu_memory: int = Field(..., gt=0)
+    performance_score: int = 0
+    compute_capability: Optional[str] = None
+    is_shared: bool = True
+    heartbeat_ttl: int = Field(GPU_HEARTBEAT_TTL_SEC, ge=1, le=3600)   # 超过这么多秒没有心跳即置 offline
+    nvml_device: Optional[str] = Field(None, max_length=64)   # 卡在调度器本机时：NVML 设备 UUID 或序号
+
+class HeartbeatBody(BaseModel):
+    ids: List[str] = Field(..., max_length=BULK_MAX)
+
+@app.post("/gpus", response_model=GpuResource)
+async def register_gpu(body: RegisterGpuBody):
+    return _json(await _r(scheduler.register_gpu(
+        body.gpu_name, body.gpu_memory, body.performance_score,
+        body.compute_capability, body.is_shared, body.heartbeat_ttl, body.nvml_device
+    )))
+
+@app.delete("/gpus/{gid}", status_code=204)
+async def deregister_gpu(gid: str):
+    # 其上运行中的任务重新排队
+    if not await _r(scheduler.deregister_gpu(gid)):
+        raise HTTPException(status_code=404, detail="GPU不存在")
+    return Response(status_code=204)
+
+@app.post("/gpus/heartbeat")
+async def heartbeats(body: HeartbeatBody):
+    # 一台机器上的多块卡一次上报；unknown 里的 GPU 已注销（或从未注册），需重新注册
+    ok = await _r(scheduler.heartbeats(body.ids))
+    return {"unknown": [gid for gid, k in zip(body.ids, ok) if not k]}
+
+@app.post("/gpus/{gid}/heartbeat", status_code=204)
+async def heartbeat(gid: str):
+    if not await _r(scheduler.heartbeat(gid)):
+        raise HTTPException(status_code=404, detail="GPU不存在")
+    return Response(status_code=204)
+
+@app.get("/gpus/{gid}/history")
+async def gpu_history(gid: str, since: Optional[datetime]=None, until: Optional[datetime]=None,
+                      points: int=Query(120, ge=1, le=HISTORY_POINTS_MAX)):
+    # 显存/利用率在 [since, until) 内按等宽时间桶降采样：t 为桶起点（epoch 毫秒），各序列给出桶内 min/max/avg
+    h = await _r(scheduler.gpu_history(gid, since=since, until=until, points=points))
+    if h is None:
+        raise HTTPException(status_code=404, detail="没有该 GPU 的遥测数据")
+    return Response(orjson.dumps(h, option=orjson.OPT_SERIALIZE_NUMPY), media_type="application/json")
+
+@app.get("/events")
+async def stream_events():
+    """
+    SSE 变更流：request.created / request.updated / gpu.created / gpu.updated / gpu.deleted / stats，事件 id 为状态版本号。
+    连接后先收到 ready；收到 resync 说明本连接积压溢出、有事件被丢弃，客户端应重新全量拉取一次。
+    """
+    sub = scheduler.events.subscribe()
+
+    async def gen():
+        try:
+            v = scheduler.version
+            yield sse_frame("ready", f'{{"version": {v}}}', v)
+            while True:
+                frames = await sub.next_frames(HEARTBEAT_SEC)
+                if frames is None:
+                    v = scheduler.version
+                    yield sse_frame("resync", f'{{"version": {v}}}', v)
+                elif frames:
+                    yield b"".join(frames)
+                else:
+                    yield b": ping\n\n"
+        finally:
+            sub.close()
+
+    return StreamingResponse(gen(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ---- 可观测性 ----
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    body = await scheduler.metrics() if SCHEDULER_SOCKET else REGISTRY.render()
+    return Response(body, media_type=CONTENT_TYPE)
+
+@app.get("/debug/profile", include_in_schema=False)
+async def debug_profile(seconds: float = Query(5, gt=0, le=PROFILE_MAX_SEC)):
+    """采样 seconds 秒内所有线程的栈，返回折叠栈文本（可直接喂给 flamegraph.pl）；需 PROFILE_ENABLED=1"""
+    if not PROFILE_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(await asyncio.to_thread(sample_stacks, seconds), media_type="text/plain")
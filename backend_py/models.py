@@ -15,6 +15,8 @@ class GpuResource(BaseModel):
     compute_capability: Optional[str] = None
     is_shared: bool = True
     status: GpuStatus = "offline"
+    heartbeat_ttl: Optional[int] = None   # 心跳超时（秒）；None 为内置的 GPU，不做存活检测
+    nvml_device: Optional[str] = None     # 调度器所在机器上的 NVML 设备（UUID 或序号），遥测据此读真实数据
     created_at: datetime
     updated_at: datetime
 
@@ -36,3 +38,13 @@ class PlatformStats(BaseModel):
     online_gpus: int = 0
     pending_requests: int = 0
     completed_requests: int = 0
+
+class Placement(BaseModel):
+    request_id: str
+    gpu_id: str
+
+class ScheduleResult(BaseModel):
+    policy: str
+    placements: List[Placement] = []
+    unplaced: int = 0
+    elapsed_ms: float = 0
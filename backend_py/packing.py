@@ -0,0 +1,57 @@
+# packing.py
+"""批量装箱：一次性把一批请求放到一批 GPU 上（纯 NumPy 向量化，无逐卡 Python 循环）"""
+import numpy as np
+
+POLICIES = ("ffd", "best_fit", "worst_fit")
+
+
+def pack(required: np.ndarray, free: np.ndarray, rank: np.ndarray | None = None,
+         policy: str = "ffd") -> np.ndarray:
+    """
+    required: 每个请求需要的显存；free: 每块 GPU 的可用显存；rank: 优先级（越小越先放）
+    返回与 required 等长的数组：分到的 GPU 下标，放不下为 -1。
+
+    请求先按 (优先级, 显存降序) 排好，连续的同优先级同显存请求组成一段，
+    每段内的放置都能一次算完：
+      - ffd：按 GPU 下标依次装满
+      - best_fit：先装可用显存最少且放得下的卡（等价于按可用显存升序依次装满）
+      - worst_fit：每次装当前最空闲的卡（等价于取所有“槽位”中剩余显存最大的前 n 个）
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"unknown policy: {policy}")
+    required = np.asarray(required, dtype=np.int64)
+    free = np.array(free, dtype=np.int64)
+    if rank is None:
+        rank = np.zeros(len(required), dtype=np.int64)
+    out = np.full(len(required), -1, dtype=np.int64)
+    if len(required) == 0 or len(free) == 0:
+        return out
+
+    order = np.lexsort((-required, rank))  # 稳定排序：同键保持原顺序
+    r_sorted, k_sorted = rank[order], required[order]
+    bounds = np.flatnonzero((np.diff(r_sorted) != 0) | (np.diff(k_sorted) != 0)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(order)]))
+
+    gpu_idx = np.arange(len(free))
+    for s, e in zip(starts, ends):
+        m = int(k_sorted[s]); n = e - s
+        if m <= 0:
+            out[order[s:e]] = int(np.argmax(free))
+            continue
+        cap = free // m                      # 每块卡还能放几个
+        if not cap.any():
+            continue
+        # 展开成“槽位”：第 i 块卡的第 j 个槽位放下后剩余 free[i] - (j+1)*m
+        slot_gpu = np.repeat(gpu_idx, cap)
+        slot_k = np.arange(len(slot_gpu)) - np.repeat(np.cumsum(cap) - cap, cap)
+        if policy == "ffd":
+            pick = slot_gpu[:n]
+        elif policy == "best_fit":
+            pick = slot_gpu[np.lexsort((slot_k, slot_gpu, free[slot_gpu]))[:n]]
+        else:
+            left = free[slot_gpu] - slot_k * m
+            pick = slot_gpu[np.lexsort((slot_gpu, -left))[:n]]
+        out[order[s:s + len(pick)]] = pick
+        free -= m * np.bincount(pick, minlength=len(free))
+    return out
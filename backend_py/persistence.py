@@ -0,0 +1,572 @@
+# persistence.py
+"""
+调度器状态持久化：预写日志（WAL）+ 定期快照。
+
+- WAL：每次发布新版本时，把本次变化的 GPU / 请求记录（变化后的完整内容）以及移出内存（归档）的请求 id
+  作为一帧交给后台写线程；
+  写线程把积压的所有帧一次 write + 一次 fsync（组提交），请求处理路径上只有一次入队，不等磁盘。
+  代价是崩溃时可能丢掉最后一组尚未落盘的变更。
+- 快照：每 SNAPSHOT_EVERY 帧做一次。持锁时只切换到新的 WAL 段；写线程从已发布的版本取数据
+  （只追加的时间索引前缀 + 记录，以及 mmap 里仍未变化的列），编码与写文件都不占锁；
+  写完（原子 rename）后删掉被覆盖的旧快照和旧 WAL 段。
+- 恢复：mmap 最新快照，各列直接映射成数组，不逐条构造记录（ColdRequests，用到时才按行构造），
+  再按顺序重放快照之后的 WAL 段；遇到写了一半的尾帧即停止。
+
+目录结构：snap-<版本>.bin、wal-<起始版本>.log，版本号补零到 12 位，按文件名排序即按版本排序。
+"""
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+import itertools
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+import orjson
+
+from records import GpuRecord, RequestRecord
+from textindex import fold
+from metrics import REGISTRY, LOCK_BUCKETS
+
+SNAPSHOT_EVERY = 50_000            # 两次快照之间最多写多少帧 WAL
+SNAP_MAGIC = b"GPUSNAP2"
+FRAME_HEAD = struct.Struct("<II")  # 帧：负载长度、负载 crc32，后接 orjson 负载
+_GPU_TIME_FIELDS = ("created_at", "updated_at")
+_REQ_TIME_FIELDS = ("created_at", "started_at", "completed_at")
+
+WAL_GROUP = REGISTRY.histogram("wal_group_commit_frames", "每次组提交写入的帧数",
+                               buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 1024))
+WAL_WRITE = REGISTRY.histogram("wal_write_seconds", "每次组提交 write + fsync 的耗时", buckets=LOCK_BUCKETS)
+SNAPSHOT_TIME = REGISTRY.histogram("snapshot_write_seconds", "写一次快照的耗时",
+                                   buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30))
+
+
+@dataclass
+class Recovered:
+    version: int
+    gpus: dict[str, GpuRecord]
+    reqs: dict[str, RequestRecord]        # WAL 里出现过的请求（完整记录）
+    by_time: list[tuple[datetime, str]]   # reqs 的 (created_at, id)，升序
+    cold: "ColdRequests"                  # 快照里其余的请求，按列留在 mmap 里
+
+
+def _parse_times(d: dict, names: Iterable[str]) -> dict:
+    for n in names:
+        v = d.get(n)
+        if v is not None:
+            d[n] = datetime.fromisoformat(v)
+    return d
+
+def gpu_from_dict(d: dict) -> GpuRecord:
+    return GpuRecord(**_parse_times(d, _GPU_TIME_FIELDS))
+
+def req_from_dict(d: dict) -> RequestRecord:
+    return RequestRecord(**_parse_times(d, _REQ_TIME_FIELDS))
+
+
+# ----------------- 快照：头部 JSON + 8 字节对齐的列 -----------------
+# 行按 (created_at, id) 升序。id 存成定宽字节串，另存按 id 排序与按结束先后排序的行号；
+# 描述拼成一个 UTF-8 块，同时存每行的字节偏移（按行取）与字符偏移（整块做子串查找时定位行）；
+# 另存一份大小写折叠后的描述块供文本查询（折叠逐字符替换且不改变 UTF-8 长度，两个块共用偏移）。
+_ALIVE = np.iinfo(np.int64).max
+_END_CHUNK = 256                   # 按块筛行时第一块的行数
+
+def _code_column(values: Iterable[Optional[str]], n: int, table: dict) -> np.ndarray:
+    """取值很少的列：字典编码；None 也作为一个取值。table 为已有的 取值 -> 编码，新取值追加在后面"""
+    return np.fromiter((table.setdefault(v, len(table)) for v in values), dtype=np.int32, count=n)
+
+def _time_column(values: Iterable[Optional[datetime]], n: int) -> np.ndarray:
+    return np.array(list(values), dtype="datetime64[us]") if n else np.zeros(0, dtype="datetime64[us]")
+
+def _offsets(lengths: np.ndarray) -> np.ndarray:
+    off = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=off[1:])
+    return off
+
+def write_snapshot(path: Path, version: int, gpus: Iterable[GpuRecord], reqs: list[RequestRecord],
+                   cold: Optional["ColdRequests"] = None):
+    """reqs：内存里的请求；cold：快照里仍未变化的请求（按列直接拷过去，不构造记录）"""
+    base = (cold if cold is not None else ColdRequests.empty()).export()
+    # 编码表以快照里已有的为前缀，原有的编码不用改
+    tables = {name: {v: i for i, v in enumerate(values)} for name, values in base["tables"].items()}
+    n = len(reqs)
+    descs = [r.task_description.encode() for r in reqs]
+    texts = b"".join(fold(r.task_description).encode() for r in reqs)
+    hot = {
+        "id": np.array([r.id.encode() for r in reqs], dtype=np.bytes_) if n else np.zeros(0, dtype="S1"),
+        "required_memory": np.fromiter((r.required_memory for r in reqs), dtype=np.int64, count=n),
+        "estimated_duration": np.fromiter((r.estimated_duration for r in reqs), dtype=np.int64, count=n),
+        "desc_len": np.fromiter(map(len, descs), dtype=np.int64, count=n),
+        "desc_chars": np.fromiter((len(r.task_description) for r in reqs), dtype=np.int64, count=n),
+    }
+    for name in ("priority", "status", "assigned_gpu_id"):
+        hot[name] = _code_column((getattr(r, name) for r in reqs), n, tables[name])
+    for name in _REQ_TIME_FIELDS:
+        hot[name] = _time_column((getattr(r, name) for r in reqs), n)
+
+    cols = {name: np.concatenate((base["columns"][name], col)) for name, col in hot.items()}
+    desc, text = base["desc"] + b"".join(descs), base["text"] + texts
+    created, ids = cols["created_at"], cols["id"]
+    gap = np.diff(created)
+    if not ((gap > 0) | ((gap == 0) & (ids[1:] > ids[:-1]))).all():
+        # 通常快照里剩下的都比内存里的早，已经有序；否则重排，描述块按行切开再拼
+        order = np.lexsort((ids, created))
+        cols = {name: col[order] for name, col in cols.items()}
+        off = _offsets(np.concatenate((base["columns"]["desc_len"], hot["desc_len"]))).tolist()
+        rows = order.tolist()
+        desc = b"".join([desc[off[i]:off[i + 1]] for i in rows])
+        text = b"".join([text[off[i]:off[i + 1]] for i in rows])
+    ended = np.where(np.isnat(cols["completed_at"]), cols["created_at"], cols["completed_at"])
+    cols["desc_off"] = _offsets(cols.pop("desc_len"))
+    cols["desc_chars"] = _offsets(cols.pop("desc_chars"))
+    cols["id_order"] = np.argsort(cols["id"], kind="stable")
+    cols["end_order"] = np.argsort(ended, kind="stable")
+    cols["desc"], cols["text"] = desc, text
+
+    layout, blobs, pos = {}, [], 0
+    for name, col in cols.items():
+        b = col if isinstance(col, bytes) else col.tobytes()
+        dtype = "bytes" if isinstance(col, bytes) else col.dtype.str
+        layout[name] = (dtype, pos, len(b))
+        blobs.append(b)
+        pad = -len(b) % 8
+        if pad: blobs.append(b"\0" * pad)
+        pos += len(b) + pad
+    head = orjson.dumps({"version": version, "n": len(ids), "gpus": list(gpus),
+                         "tables": {name: list(t) for name, t in tables.items()}, "columns": layout})
+    head += b" " * (-(len(SNAP_MAGIC) + 8 + len(head)) % 8)
+
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        f.write(SNAP_MAGIC)
+        f.write(struct.pack("<Q", len(head)))
+        f.write(head)
+        for b in blobs:
+            f.write(b)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def read_snapshot(path: Path) -> Recovered:
+    """只解析头部并把各列映射成数组，请求都留在 ColdRequests 里"""
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mm[:len(SNAP_MAGIC)] != SNAP_MAGIC:
+        raise ValueError(f"not a snapshot: {path}")
+    (head_len,) = struct.unpack_from("<Q", mm, len(SNAP_MAGIC))
+    base = len(SNAP_MAGIC) + 8
+    head = orjson.loads(mm[base:base + head_len])
+    base += head_len
+
+    cols = {}
+    for name, (dtype, off, size) in head["columns"].items():
+        if dtype == "bytes":
+            cols[name] = memoryview(mm)[base + off:base + off + size]
+        else:
+            cols[name] = np.frombuffer(mm, dtype=dtype, count=size // np.dtype(dtype).itemsize, offset=base + off)
+    gpus = {d["id"]: gpu_from_dict(d) for d in head["gpus"]}
+    return Recovered(head["version"], gpus, {}, [], ColdRequests(cols, head["tables"]))
+
+def _make_req(id, desc, mem, est, pri, status, gid, created, started, completed) -> RequestRecord:
+    return RequestRecord(id=id, task_description=desc, required_memory=mem, estimated_duration=est,
+                         priority=pri, status=status, assigned_gpu_id=gid,
+                         created_at=created, started_at=started, completed_at=completed)
+
+
+class ColdRequests:
+    """
+    快照里的请求：恢复时不逐条构造记录，各列留在 mmap 里，用到时才按行构造（每次构造新对象）。
+    调度器把未结束的请求和 WAL 里改过的请求放在内存里，这里只剩已结束、重启后没再改过的；
+    一行被搬进内存或移出（归档）后就不再属于这里。
+    记下每行离开时的版本：无锁读者按自己拿到的快照版本判断可见性，不会在搬动的瞬间漏掉或重复。
+    只有持锁的写者修改，读者不加锁。
+    """
+
+    def __init__(self, cols: dict, tables: dict[str, list]):
+        self._cols = cols
+        self._tables = tables
+        self._ids = cols["id"]
+        self._n = len(self._ids)
+        self._until = np.full(self._n, _ALIVE, dtype=np.int64)   # 行在哪个版本离开；_ALIVE 表示还在
+        self._status_code = {v: i for i, v in enumerate(tables["status"])}
+        counts = np.bincount(cols["status"], minlength=len(tables["status"]))
+        self._counts = Counter({v: int(c) for v, c in zip(tables["status"], counts.tolist()) if c})
+        self._alive = self._n
+        self._end_pos = 0        # end_order 里此前的行都已离开
+        self._text: Optional[str] = None   # 折叠后的全部描述，第一次按文本查询时解码
+
+    @classmethod
+    def empty(cls) -> "ColdRequests":
+        z = np.zeros(0, dtype=np.int64)
+        t = np.zeros(0, dtype="datetime64[us]")
+        cols = {"id": np.zeros(0, dtype="S1"), "desc": memoryview(b""), "text": memoryview(b""),
+                "desc_off": np.zeros(1, dtype=np.int64),
+                "desc_chars": np.zeros(1, dtype=np.int64), "required_memory": z, "estimated_duration": z,
+                "id_order": z, "end_order": z, "created_at": t, "started_at": t, "completed_at": t}
+        for name in ("priority", "status", "assigned_gpu_id"):
+            cols[name] = np.zeros(0, dtype=np.int32)
+        return cls(cols, {"priority": [], "status": [], "assigned_gpu_id": []})
+
+    def __len__(self) -> int:
+        return self._alive
+
+    def count(self, status: str) -> int:
+        return self._counts[status]
+
+    def _row(self, rid: str) -> int:
+        key = rid.encode()
+        if self._n == 0 or len(key) > self._ids.dtype.itemsize: return -1
+        order = self._cols["id_order"]
+        i = int(np.searchsorted(self._ids, key, sorter=order))
+        if i < self._n and self._ids[order[i]] == key:
+            return int(order[i])
+        return -1
+
+    def records(self, rows) -> list[RequestRecord]:
+        rows = np.asarray(rows, dtype=np.int64)
+        c, t = self._cols, self._tables
+        desc, off = c["desc"], c["desc_off"]
+        starts, ends = off[rows].tolist(), off[rows + 1].tolist()
+        return list(map(_make_req,
+                        [b.decode() for b in self._ids[rows].tolist()],
+                        [str(desc[a:b], "utf-8") for a, b in zip(starts, ends)],
+                        c["required_memory"][rows].tolist(), c["estimated_duration"][rows].tolist(),
+                        *([t[name][k] for k in c[name][rows].tolist()] for name in ("priority", "status", "assigned_gpu_id")),
+                        *(c[name][rows].tolist() for name in _REQ_TIME_FIELDS)))
+
+    def get(self, rid: str) -> Optional[RequestRecord]:
+        """按 id 取当前仍在这里的请求"""
+        row = self._row(rid)
+        if row < 0 or self._until[row] != _ALIVE: return None
+        return self.records([row])[0]
+
+    def take(self, rid: str, version: int) -> Optional[RequestRecord]:
+        """调用方持锁：取出一条（从 version 起不再可见），返回它的记录；不在这里返回 None"""
+        row = self._row(rid)
+        if row < 0 or self._until[row] != _ALIVE: return None
+        self._kill(np.array([row]), version)
+        return self.records([row])[0]
+
+    def drop(self, rid: str, version: int) -> bool:
+        """调用方持锁：同 take，但不构造记录；返回是否在这里"""
+        row = self._row(rid)
+        if row < 0 or self._until[row] != _ALIVE: return False
+        self._kill(np.array([row]), version)
+        return True
+
+    def take_unless(self, statuses: Iterable[str], version: int) -> list[RequestRecord]:
+        """调用方持锁：取出状态不在 statuses 里的全部请求，按 (created_at, id) 升序"""
+        keep = [self._status_code[s] for s in statuses if s in self._status_code]
+        rows = np.flatnonzero(~np.isin(self._cols["status"], keep) & (self._until == _ALIVE))
+        recs = self.records(rows)
+        self._kill(rows, version)
+        return recs
+
+    def _kill(self, rows: np.ndarray, version: int):
+        self._until[rows] = version
+        self._alive -= len(rows)
+        for code, c in enumerate(np.bincount(self._cols["status"][rows], minlength=len(self._tables["status"])).tolist()):
+            if c: self._counts[self._tables["status"][code]] -= c
+
+    def by_end(self) -> Iterator[RequestRecord]:
+        """仍在这里的请求，按结束先后（completed_at，没有则 created_at）逐条给出；供保留策略选批"""
+        order, until = self._cols["end_order"], self._until
+        i = self._end_pos
+        while i < self._n:
+            rows = order[i:i + _END_CHUNK]
+            live = rows[until[rows] == _ALIVE]
+            if i == self._end_pos and not len(live):
+                self._end_pos = i = i + len(rows)   # 开头整段都已离开，下次直接跳过
+                continue
+            yield from self.records(live)
+            i += len(rows)
+
+    def query(self, q: str | None, status: str | None, since: datetime | None, until: datetime | None,
+              before: tuple[datetime, str] | None, limit: int | None, version: int) -> list[RequestRecord]:
+        """条件与 VirtualScheduler.list_requests 相同，只看版本 version 时可见的行；按 (created_at, id) 倒序"""
+        if self._n == 0 or limit == 0: return []
+        code = None
+        if status:
+            code = self._status_code.get(status)
+            if code is None: return []
+        created = self._cols["created_at"]
+        lo = int(np.searchsorted(created, np.datetime64(since, "us"))) if since else 0
+        hi = int(np.searchsorted(created, np.datetime64(until, "us"))) if until else self._n
+        if before:
+            t = np.datetime64(before[0], "us")
+            i, j = np.searchsorted(created, t), np.searchsorted(created, t, side="right")
+            hi = min(hi, int(i + np.searchsorted(self._ids[i:j], before[1].encode())))
+        if lo >= hi: return []
+        rows = self._match_text(fold(q), code, lo, hi, limit, version) if q else self._scan(code, lo, hi, limit, version)
+        return self.records(rows)
+
+    def _visible(self, rows: np.ndarray, code: Optional[int], version: int) -> np.ndarray:
+        ok = self._until[rows] > version
+        if code is not None:
+            ok &= self._cols["status"][rows] == code
+        return ok
+
+    def _scan(self, code: Optional[int], lo: int, hi: int, limit: Optional[int], version: int) -> list[int]:
+        """从 hi 往前按块筛，凑够 limit 行即停；块逐次放大"""
+        out, step = [], _END_CHUNK
+        while hi > lo and (limit is None or len(out) < limit):
+            a = max(lo, hi - step)
+            rows = np.arange(a, hi)
+            out += rows[self._visible(rows, code, version)][::-1].tolist()
+            hi, step = a, step * 4
+        return out[:limit]
+
+    def _match_text(self, ql: str, code: Optional[int], lo: int, hi: int, limit: Optional[int], version: int) -> list[int]:
+        """在折叠后的整块描述里从后往前 rfind，按字符偏移定位行；跨行的匹配不算"""
+        text = self._text
+        if text is None:
+            text = self._text = str(self._cols["text"], "utf-8")
+        chars = self._cols["desc_chars"]
+        start, end = int(chars[lo]), int(chars[hi])
+        out = []
+        while limit is None or len(out) < limit:
+            p = text.rfind(ql, start, end)
+            if p < 0: break
+            row = int(np.searchsorted(chars, p, side="right")) - 1
+            if p + len(ql) > chars[row + 1]:
+                end = p + len(ql) - 1   # 跨到下一行了：继续找更靠前的
+                continue
+            if self._visible(np.array([row]), code, version)[0]:
+                out.append(row)
+            end = int(chars[row])
+        return out
+
+    def export(self) -> dict:
+        """写快照用：仍在这里的行的各列与描述块；可在后台线程里调用"""
+        c = self._cols
+        alive = self._until == _ALIVE
+        rows = np.flatnonzero(alive)
+        off, chars = c["desc_off"], c["desc_chars"]
+        cols = {name: c[name][rows] for name in ("id", "required_memory", "estimated_duration",
+                                                  "priority", "status", "assigned_gpu_id", *_REQ_TIME_FIELDS)}
+        cols["desc_len"] = off[rows + 1] - off[rows]
+        cols["desc_chars"] = chars[rows + 1] - chars[rows]
+        blobs = [np.frombuffer(c[name], dtype=np.uint8) for name in ("desc", "text")]
+        if len(rows) < self._n:   # 去掉已离开的行：按字节展开行掩码
+            keep = np.repeat(alive, np.diff(off))
+            blobs = [b[keep] for b in blobs]
+        desc, text = (b.tobytes() for b in blobs)
+        return {"columns": cols, "tables": self._tables, "desc": desc, "text": text}
+
+
+# ----------------- WAL -----------------
+def encode_frame(version: int, gpus: list[GpuRecord], reqs: list[RequestRecord], drops: list[str] = ()) -> bytes:
+    payload = orjson.dumps([version, gpus, reqs, drops] if drops else [version, gpus, reqs])
+    return FRAME_HEAD.pack(len(payload), zlib.crc32(payload)) + payload
+
+def read_frames(path: Path) -> tuple[list, int]:
+    """
+    按顺序读出完整、校验通过的帧；遇到残帧/坏帧即停止（崩溃时正在写的尾部）。
+    返回 (帧列表, 有效部分的字节数)
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    frames, pos = [], 0
+    while pos + FRAME_HEAD.size <= len(data):
+        size, crc = FRAME_HEAD.unpack_from(data, pos)
+        payload = data[pos + FRAME_HEAD.size:pos + FRAME_HEAD.size + size]
+        if len(payload) < size or zlib.crc32(payload) != crc:
+            break
+        frames.append(orjson.loads(payload))
+        pos += FRAME_HEAD.size + size
+    return frames, pos
+
+
+class WalWriter:
+    """后台写线程：append 只入队；线程每轮把积压的帧一次写完、一次 fsync（组提交）"""
+
+    def __init__(self, path: Path, fsync: bool = True):
+        self._fsync = fsync
+        self._cond = threading.Condition()
+        self._queue: list = []          # (version, gpus, reqs, drops) 或 ("rotate", 新文件路径)
+        self._closed = False
+        self._flushed = 0               # 已处理的入队条目数（flush() 等待用）
+        self._enqueued = 0
+        self._file = open(path, "ab")
+        self._thread = threading.Thread(target=self._run, name="wal-writer", daemon=True)
+        self._thread.start()
+
+    def append(self, version: int, gpus: list[GpuRecord], reqs: list[RequestRecord], drops: list[str] = ()):
+        with self._cond:
+            self._queue.append((version, gpus, reqs, drops))
+            self._enqueued += 1
+            self._cond.notify()
+
+    def rotate(self, path: Path):
+        """之后 append 的帧写入新文件；与 append 同一队列，顺序有保证"""
+        with self._cond:
+            self._queue.append(("rotate", path))
+            self._enqueued += 1
+            self._cond.notify()
+
+    def flush(self, timeout: float | None = None):
+        """等到目前为止入队的帧都已落盘"""
+        with self._cond:
+            target = self._enqueued
+            self._cond.wait_for(lambda: self._flushed >= target or not self._thread.is_alive(), timeout)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                batch, self._queue = self._queue, []
+                if not batch and self._closed:
+                    break
+            frames, n = [], 0
+            for item in batch:
+                if item[0] == "rotate":
+                    self._write(frames, n)
+                    frames, n = [], 0
+                    self._file.close()
+                    self._file = open(item[1], "ab")
+                else:
+                    frames.append(encode_frame(*item))
+                    n += 1
+            self._write(frames, n)
+            with self._cond:
+                self._flushed += len(batch)
+                self._cond.notify_all()
+        self._file.close()
+
+    def _write(self, frames: list[bytes], n: int):
+        if not frames: return
+        t0 = time.perf_counter()
+        self._file.write(b"".join(frames))
+        self._file.flush()
+        if self._fsync:
+            os.fsync(self._file.fileno())
+        WAL_WRITE.observe(time.perf_counter() - t0)
+        WAL_GROUP.observe(n)
+
+
+# ----------------- 目录管理 -----------------
+class StateStore:
+    """一个持久化目录：恢复、记日志、做快照"""
+
+    def __init__(self, path: str | os.PathLike, fsync: bool = True, snapshot_every: int = SNAPSHOT_EVERY):
+        self.dir = Path(path)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._fsync = fsync
+        self._snapshot_every = snapshot_every
+        self._frames_since_snap = 0
+        self._wal: WalWriter | None = None
+        self._snap_thread: threading.Thread | None = None
+
+    def _snapshots(self) -> list[tuple[int, Path]]:
+        return sorted((int(p.stem.split("-")[1]), p) for p in self.dir.glob("snap-*.bin"))
+
+    def _segments(self) -> list[tuple[int, Path]]:
+        return sorted((int(p.stem.split("-")[1]), p) for p in self.dir.glob("wal-*.log"))
+
+    def recover(self) -> Optional[Recovered]:
+        """
+        读最新快照并重放其后的 WAL；目录为空返回 None。
+        快照里的请求不构造记录（见 ColdRequests），WAL 里出现的请求从中取出、以日志里的内容为准。
+        """
+        snaps, segs = self._snapshots(), self._segments()
+        if not snaps and not segs:
+            return None
+        state = read_snapshot(snaps[-1][1]) if snaps else Recovered(0, {}, {}, [], ColdRequests.empty())
+        appended = dropped = False
+        for _, path in segs:
+            frames, valid = read_frames(path)
+            if valid < path.stat().st_size:
+                os.truncate(path, valid)   # 截掉残帧，之后若继续追加到这个文件也能读
+            for version, gpus, reqs, *drops in frames:
+                if version <= state.version:
+                    continue   # 快照已包含（旧段删除前崩溃时会留下）
+                state.version = version
+                for d in gpus:
+                    g = gpu_from_dict(d)
+                    state.gpus[g.id] = g
+                for d in reqs:
+                    r = req_from_dict(d)
+                    if r.id not in state.reqs:
+                        state.cold.drop(r.id, 0)
+                        state.by_time.append((r.created_at, r.id))
+                        appended = True
+                    state.reqs[r.id] = r
+                for rid in drops[0] if drops else ():   # 请求与 GPU 的 id 都是 uuid，不会重名
+                    if state.reqs.pop(rid, None) is not None: dropped = True
+                    elif not state.cold.drop(rid, 0): state.gpus.pop(rid, None)
+        if dropped:
+            # 移出后又搬回内存的请求在 by_time 里会有两条相同的键
+            state.by_time = list(dict.fromkeys(k for k in state.by_time if k[1] in state.reqs))
+        if appended:
+            state.by_time.sort()
+        return state
+
+    def open(self, version: int):
+        """从 version 之后开始写新的 WAL 段"""
+        self._wal = WalWriter(self._segment_path(version + 1), self._fsync)
+
+    def log(self, version: int, gpus: list[GpuRecord], reqs: list[RequestRecord], drops: list[str] = ()) -> bool:
+        """记一帧（drops：移出内存的请求 id、注销的 GPU id）；返回是否该做快照了"""
+        self._wal.append(version, gpus, reqs, drops)
+        self._frames_since_snap += 1
+        return self._frames_since_snap >= self._snapshot_every and self._snap_thread is None
+
+    def checkpoint(self, version: int, gpus: tuple[GpuRecord, ...], by_time: list, count: int,
+                   lookup: Callable[[str], Optional[RequestRecord]], cold: ColdRequests):
+        """
+        调用方持锁、版本 version 已发布且已记日志：切换 WAL 段，然后在后台线程里写快照，持锁期间不复制任何容器。
+        by_time 是已发布快照里只追加的时间索引，只用前 count 条；记录用 lookup 现取，
+        取到比 version 新的内容、或已被移出，都由 version 之后的 WAL 帧在恢复时改正。
+        """
+        self._wal.rotate(self._segment_path(version + 1))
+        self._frames_since_snap = 0
+        self._snap_thread = threading.Thread(target=self._write_snapshot,
+                                             args=(version, gpus, by_time, count, lookup, cold),
+                                             name="snapshot-writer", daemon=True)
+        self._snap_thread.start()
+
+    def _write_snapshot(self, version: int, gpus, by_time, count, lookup, cold):
+        t0 = time.perf_counter()
+        try:
+            reqs = [r for _, rid in itertools.islice(by_time, count) if (r := lookup(rid)) is not None]
+            write_snapshot(self._snapshot_path(version), version, gpus, reqs, cold)
+            self._wal.flush()   # 旧段里的帧都写完了再删
+            for v, p in self._snapshots():
+                if v < version: p.unlink(missing_ok=True)
+            for v, p in self._segments():
+                if v <= version: p.unlink(missing_ok=True)
+            SNAPSHOT_TIME.observe(time.perf_counter() - t0)
+        except OSError as e:
+            print("[Persistence] snapshot failed:", e)
+        finally:
+            self._snap_thread = None
+
+    def flush(self):
+        """等到目前为止记下的帧都已落盘"""
+        if self._wal is not None:
+            self._wal.flush()
+
+    def close(self):
+        snap = self._snap_thread
+        if snap is not None:
+            snap.join()
+        if self._wal is not None:
+            self._wal.close()
+
+    def _segment_path(self, start: int) -> Path:
+        return self.dir / f"wal-{start:012d}.log"
+
+    def _snapshot_path(self, version: int) -> Path:
+        return self.dir / f"snap-{version:012d}.bin"
@@ -0,0 +1,113 @@
+# records.py
+"""
+调度器内部使用的紧凑记录：slots + frozen dataclass，字段与 models.py 中的 API 模型一一对应、顺序一致。
+创建/修改都不经过 pydantic 校验（输入在接口层已由 pydantic 模型校验过），
+序列化直接用 orjson 编码成 JSON 字节，输出与对应 pydantic 模型的 model_dump_json() 相同。
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Optional
+import sys
+
+import orjson
+from pydantic import BaseModel
+
+# 状态/优先级只有几个取值：统一指向同一个字符串对象，每条记录只占一个引用
+_INTERNED = {s: sys.intern(s) for s in
+             ("online", "offline", "busy", "pending", "matched", "running", "completed", "failed",
+              "low", "normal", "high")}
+
+def _intern(rec, *names):
+    for n in names:
+        v = getattr(rec, n)
+        object.__setattr__(rec, n, _INTERNED.get(v, v))
+
+
+@dataclass(slots=True, frozen=True, kw_only=True)
+class GpuRecord:
+    id: str
+    gpu_name: str
+    gpu_memory: int
+    performance_score: int
+    compute_capability: Optional[str] = None
+    is_shared: bool = True
+    status: str = "offline"
+    heartbeat_ttl: Optional[int] = None
+    nvml_device: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+    def __post_init__(self):
+        _intern(self, "status")
+
+
+@dataclass(slots=True, frozen=True, kw_only=True)
+class RequestRecord:
+    id: str
+    task_description: str
+    required_memory: int
+    estimated_duration: int
+    priority: str = "normal"
+    status: str = "pending"
+    assigned_gpu_id: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+
+    def __post_init__(self):
+        _intern(self, "status", "priority")
+
+
+def _default(obj):
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    raise TypeError(f"cannot serialize {type(obj).__name__}")
+
+def dumps(obj) -> bytes:
+    """记录 / 记录列表 / pydantic 模型 → JSON 字节"""
+    return orjson.dumps(obj, default=_default)
+
+
+class FragmentCache:
+    """
+    每条记录编码后的 JSON 字节缓存，列表响应直接拼接片段。
+    写操作替换记录时调用 invalidate；记录不可变，取缓存时再按对象身份核对一次，
+    所以无锁读者即使拿到刚被替换的旧记录，也只会得到与该记录一致的字节。
+    keep 可选：未命中时判断这条记录是否值得缓存（例如从归档临时读出的记录不缓存）。
+    """
+
+    def __init__(self, keep: Optional[Callable[[object], bool]] = None):
+        self._frags: dict[str, tuple[object, bytes]] = {}
+        self._keep = keep
+
+    def get(self, rec) -> bytes:
+        e = self._frags.get(rec.id)
+        if e is not None and e[0] is rec:
+            return e[1]
+        b = orjson.dumps(rec)
+        if self._keep is None or self._keep(rec):
+            self._frags[rec.id] = (rec, b)
+        return b
+
+    def __len__(self) -> int:
+        return len(self._frags)
+
+    def invalidate(self, key: str):
+        self._frags.pop(key, None)
+
+    def dumps(self, obj) -> bytes:
+        """与模块级 dumps 相同，但记录（含记录列表）走缓存"""
+        if isinstance(obj, (GpuRecord, RequestRecord)):
+            return self.get(obj)
+        if isinstance(obj, (list, tuple)) and (not obj or isinstance(obj[0], (GpuRecord, RequestRecord))):
+            frags, get, keep = self._frags, self._frags.get, self._keep
+            out = []
+            for rec in obj:
+                e = get(rec.id)
+                if e is None or e[0] is not rec:
+                    e = (rec, orjson.dumps(rec))
+                    if keep is None or keep(rec):
+                        frags[rec.id] = e
+                out.append(e[1])
+            return b"[" + b",".join(out) + b"]"
+        return dumps(obj)
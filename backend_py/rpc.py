@@ -0,0 +1,258 @@
+# rpc.py
+"""
+调度器进程与 API worker 之间的 RPC（Unix socket），多 worker 部署时用：
+一个调度器进程持有唯一的状态，各 worker 把调用转发过去，放置决策始终一致。
+backend_py 与 backend_pycpp/py 各放一份，内容保持一致。
+
+- 帧：4 字节大端长度 + pickle。请求 (call_id, 方法名, args, kwargs)，应答 (call_id, ok, 值或异常)。
+  pickle 只在同一台机器、同一用户的进程之间使用：socket 文件在 bind 时就是 0600（umask），不存在其他用户能连上的窗口。
+- 普通调用最多等 RPC_TIMEOUT_SEC 秒（调度器进程卡住时 worker 返回 503，而不是一直挂着）；推送流不设超时。
+- 一个连接上可以有多个未完成的调用（AsyncClient 按 call_id 对应应答）。serve_async 每帧起一个任务，按到达顺序开始执行，
+  哪个先完成先应答：慢调用（等线程里读归档的）不挡住同一 worker 的心跳、stats 等调用；serve_threads 按到达顺序逐个执行。
+- 方法返回协程时（serve_async）等它完成再应答，期间其他调用照常服务。
+- 方法返回异步迭代器时该连接变成推送流：每产出一项发一帧，直到连接断开（事件转发用）。
+- Encoded：服务端已编码好的 JSON 响应体（复用调度器的片段缓存），worker 原样写回，不再解码/编码。
+"""
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Callable, Optional
+import asyncio
+import inspect
+import itertools
+import os
+import pickle
+import socket
+import socketserver
+import threading
+
+Dispatch = Callable[[str, tuple, dict], Any]
+
+_LEN = 4
+RPC_TIMEOUT_SEC = float(os.environ.get("RPC_TIMEOUT_SEC", "30"))
+
+
+class Encoded:
+    """编码好的记录（或记录列表）；len() 为记录条数，cursor 为分页时最后一条的游标"""
+    __slots__ = ("data", "count", "cursor")
+
+    def __init__(self, data: bytes, count: int = 1, cursor: Optional[str] = None):
+        self.data, self.count, self.cursor = data, count, cursor
+
+    def __len__(self) -> int:
+        return self.count
+
+
+def _frame(msg) -> bytes:
+    body = pickle.dumps(msg, protocol=pickle.HIGHEST_PROTOCOL)
+    return len(body).to_bytes(_LEN, "big") + body
+
+async def _read(reader: asyncio.StreamReader):
+    n = int.from_bytes(await reader.readexactly(_LEN), "big")
+    return pickle.loads(await reader.readexactly(n))
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk: raise ConnectionError("rpc connection closed")
+        buf += chunk
+    return bytes(buf)
+
+def _recv(sock: socket.socket):
+    n = int.from_bytes(_recv_exact(sock, _LEN), "big")
+    return pickle.loads(_recv_exact(sock, n))
+
+def _call(dispatch: Dispatch, method: str, args: tuple, kwargs: dict) -> tuple[bool, Any]:
+    try:
+        return True, dispatch(method, args, kwargs)
+    except Exception as e:
+        return False, e
+
+def _unlink(path: str):
+    try: os.unlink(path)
+    except FileNotFoundError: pass
+
+@contextmanager
+def _private_umask():
+    """bind 期间 umask 077：socket 文件创建出来就只有本用户可读写（默认路径在人人可写的 /tmp 下）"""
+    old = os.umask(0o177)
+    try:
+        yield
+    finally:
+        os.umask(old)
+
+
+# ----------------- 服务端 -----------------
+async def serve_async(path: str, dispatch: Dispatch) -> asyncio.AbstractServer:
+    """在当前事件循环上服务（调度器为 asyncio 模式时用：调用直接在循环里执行，无锁）"""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        send_lock = asyncio.Lock()
+        calls: set[asyncio.Task] = set()     # 未完成的普通调用：对端断开后仍做完（可能已改了状态），只是应答丢掉
+        streams: set[asyncio.Task] = set()   # 推送流：对端断开即取消
+
+        async def send(msg):
+            async with send_lock:   # 一帧写完（含 drain）再写下一帧
+                writer.write(_frame(msg))
+                await writer.drain()
+
+        async def run(call_id, method, args, kwargs):
+            ok, value = _call(dispatch, method, args, kwargs)
+            if ok and inspect.isawaitable(value):
+                try:
+                    value = await value
+                except Exception as e:
+                    ok, value = False, e
+            try:
+                if ok and hasattr(value, "__anext__"):
+                    task = asyncio.current_task()
+                    calls.discard(task); streams.add(task)
+                    try:
+                        async for item in value:
+                            await send((call_id, True, item))
+                    finally:
+                        await value.aclose()
+                    writer.close()   # 流结束，连接随之关闭
+                    return
+                await send((call_id, ok, value))
+            except ConnectionError:
+                pass   # 对端已断开
+
+        try:
+            while True:
+                task = asyncio.get_running_loop().create_task(run(*await _read(reader)))
+                calls.add(task); task.add_done_callback(calls.discard)
+                task.add_done_callback(streams.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            for task in streams: task.cancel()
+            await asyncio.gather(*calls, *streams, return_exceptions=True)
+        except asyncio.CancelledError:
+            for task in calls | streams: task.cancel()   # 服务端关闭
+        finally:
+            writer.close()
+
+    _unlink(path)
+    with _private_umask():
+        server = await asyncio.start_unix_server(handle, path)
+    return server
+
+
+def serve_threads(path: str, dispatch: Dispatch) -> socketserver.ThreadingUnixStreamServer:
+    """每个连接一个线程（调度器自带锁、调用会释放 GIL 时用）；返回的 server 调 serve_forever() 开始服务"""
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            try:
+                while True:
+                    call_id, method, args, kwargs = _recv(self.request)
+                    ok, value = _call(dispatch, method, args, kwargs)
+                    self.request.sendall(_frame((call_id, ok, value)))
+            except ConnectionError:
+                pass
+
+    _unlink(path)
+    with _private_umask():
+        server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    return server
+
+
+# ----------------- 客户端 -----------------
+class AsyncClient:
+    """
+    一个事件循环共用一个连接，调用可并发；连接断开时未完成的调用抛 ConnectionError，下次调用重连；
+    超过 timeout 秒没有应答抛 TimeoutError（迟到的应答按 call_id 丢弃）
+    """
+
+    def __init__(self, path: str, timeout: float = RPC_TIMEOUT_SEC):
+        self._path = path
+        self._timeout = timeout
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pending: dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._connecting = asyncio.Lock()
+
+    async def call(self, method: str, *args, **kwargs):
+        writer = self._writer or await self._connect()
+        call_id = next(self._ids)
+        fut = self._pending[call_id] = asyncio.get_running_loop().create_future()
+        writer.write(_frame((call_id, method, args, kwargs)))
+        try:
+            ok, value = await asyncio.wait_for(fut, self._timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"rpc {method} timed out after {self._timeout}s") from None
+        finally:
+            self._pending.pop(call_id, None)
+        if not ok: raise value
+        return value
+
+    async def stream(self, method: str, *args, **kwargs) -> AsyncIterator:
+        """单独开一个连接接收推送，迭代到连接断开为止"""
+        reader, writer = await asyncio.open_unix_connection(self._path)
+        try:
+            writer.write(_frame((0, method, args, kwargs)))
+            while True:
+                _, ok, value = await _read(reader)
+                if not ok: raise value
+                yield value
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("rpc connection closed") from None
+        finally:
+            writer.close()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _connect(self) -> asyncio.StreamWriter:
+        async with self._connecting:
+            if self._writer is None:
+                reader, self._writer = await asyncio.open_unix_connection(self._path)
+                asyncio.get_running_loop().create_task(self._read_loop(reader, self._writer))
+            return self._writer
+
+    async def _read_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                call_id, ok, value = await _read(reader)
+                fut = self._pending.pop(call_id, None)
+                if fut is not None and not fut.done():
+                    fut.set_result((ok, value))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if self._writer is writer:
+                self._writer = None
+            writer.close()
+            pending, self._pending = self._pending, {}
+            for fut in pending.values():
+                if not fut.done(): fut.set_exception(ConnectionError("rpc connection closed"))
+
+
+class SyncClient:
+    """
+    阻塞调用，每个线程一个连接（同步路由跑在线程池里）；连接断开时抛 ConnectionError，
+    超过 timeout 秒没有应答抛 TimeoutError，两种情况都关掉连接，下次调用重连
+    """
+
+    def __init__(self, path: str, timeout: float = RPC_TIMEOUT_SEC):
+        self._path = path
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def call(self, method: str, *args, **kwargs):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self._timeout)
+            sock.connect(self._path)
+            self._local.sock = sock
+        try:
+            sock.sendall(_frame((0, method, args, kwargs)))
+            _, ok, value = _recv(sock)
+        except OSError:
+            sock.close()
+            self._local.sock = None
+            raise
+        if not ok: raise value
+        return value
@@ -1,53 +1,512 @@
 # scheduler_adapter.py
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
 from datetime import datetime, timedelta
-from threading import Lock, Thread, Timer
+from threading import Lock, Thread
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from dataclasses import replace
+import asyncio
+import os
 import threading
+import bisect
+import heapq
+import itertools
+import queue
 import time
 import uuid
 import random
 
-from models import GpuResource, ComputeRequest, PlatformStats
+import numpy as np
+
+from models import PlatformStats, Placement, ScheduleResult
+from records import GpuRecord, RequestRecord, FragmentCache
+from packing import pack
+from backfill import MODES as BACKFILL_MODES, Profile, Reservations
+from textindex import NGramIndex
+from events import EventHub
+from timers import DeadlineTimer, LoopTimer
+from metrics import REGISTRY, LOCK_BUCKETS
+from persistence import StateStore, Recovered, ColdRequests
+from archive import RequestArchive, to_us
+from telemetry import Telemetry, Targets, make_provider
 
 REQUEST_INTERVAL_SEC = 10          # 每隔 N 秒生成一个新请求
 RUNTIME_SEC_RANGE = (10, 25)       # 运行时长范围（秒）——为了演示快一点
 REQ_MEMORY_CHOICES = [4, 8, 12, 16]  # 新请求可能需要的显存(GB)
 REQ_DURATION_CHOICES = [15, 30, 45, 60, 90]  # 估计时长(分钟)
 REQ_PRIORITY_CHOICES = ["low", "normal", "high"]
+PRIORITY_RANK = {"high": 0, "normal": 1, "low": 2}  # 数值越小越先调度
+# thread：线程 + 锁（可脱离事件循环单独使用）；asyncio：全部跑在事件循环里，由循环串行化修改，无锁
+# virtual：单线程、无锁，时钟与计时器由子类提供（离散事件仿真，见 simulation.py）
+SCHEDULER_MODE = os.environ.get("SCHEDULER_MODE", "asyncio")
+# 持久化目录（WAL + 快照）；不设则状态只在内存里。WAL_FSYNC=0 时只写页缓存不 fsync
+STATE_DIR = os.environ.get("STATE_DIR") or None
+WAL_FSYNC = os.environ.get("WAL_FSYNC", "1") != "0"
+# 多 worker 部署：设置后本进程只是 API worker，调度器在 scheduler_server.py 起的进程里
+SCHEDULER_SOCKET = os.environ.get("SCHEDULER_SOCKET") or None
+DEFAULT_GPUS = [  # (名称, 显存GB, 性能分, 算力)
+    ("RTX 4090", 24, 100, "8.9"),
+    ("A100 80G", 80, 120, "8.0"),
+    ("RTX 3080", 10, 70,  "8.6"),
+]
+# 历史保留：内存里只留活跃请求和最近结束的请求，更早的已结束请求归档到 SQLite（archive.py），查询时合并。
+# 归档文件默认放在 STATE_DIR 下；两者都没设时不归档
+ARCHIVE_PATH = os.environ.get("ARCHIVE_PATH") or (os.path.join(STATE_DIR, "archive.sqlite3") if STATE_DIR else None)
+HISTORY_MAX = int(os.environ.get("HISTORY_MAX", "100000"))                  # 内存中最多保留的已结束请求数
+HISTORY_MAX_AGE_SEC = float(os.environ.get("HISTORY_MAX_AGE_SEC", "3600"))  # 结束超过这么久的请求归档
+RETENTION_INTERVAL_SEC = 10
+RETENTION_BATCH = 5000              # 每批归档条数（一批一个 SQLite 事务，移出内存时持锁一次）
+TERMINAL_STATUSES = ("completed", "failed")
+INDEX_BUILD_CHUNK = 200             # 恢复后后台补建文本索引，每批条数（每批持锁/占用事件循环一次，约几毫秒）
+REQ_LOG_MAX = 100_000   # 增量同步保留的请求变更记录条数；更早的 since 只能全量拉取
+# 经 POST /gpus 注册的 GPU 默认的心跳超时（秒）：超时未收到心跳即置 offline，其上运行中的任务重新排队
+GPU_HEARTBEAT_TTL_SEC = int(os.environ.get("GPU_HEARTBEAT_TTL_SEC", "30"))
+# 自动调度的回填策略（见 backfill.py）：none（默认）放得下就上；easy 为第一个放不下的请求预留；conservative 为前 BACKFILL_DEPTH 个预留
+SCHEDULER_BACKFILL = os.environ.get("SCHEDULER_BACKFILL", "none")
+BACKFILL_DEPTH = 8
+# 抢占（默认关）：high 请求放不下时，把一块卡上代价最小的一组低优先级运行中任务放回 pending 给它腾地方。
+# 防颠簸：运行不满 PREEMPT_MIN_RUN_SEC 的任务、已被抢占 PREEMPT_MAX_PER_REQUEST 次的任务不再被抢占
+SCHEDULER_PREEMPT = os.environ.get("SCHEDULER_PREEMPT", "0") == "1"
+PREEMPT_MIN_RUN_SEC = float(os.environ.get("PREEMPT_MIN_RUN_SEC", "60"))
+PREEMPT_MAX_PER_REQUEST = int(os.environ.get("PREEMPT_MAX_PER_REQUEST", "2"))
+# 优先级老化（默认关）：high 始终排最前；low/normal 按 创建时间 + 档位 × PRIORITY_AGING_SEC 排，等得够久的 low 排到新来的 normal 前面。
+# 0 为严格按优先级
+PRIORITY_AGING_SEC = float(os.environ.get("PRIORITY_AGING_SEC", "0"))
+# 自动调度的选卡策略：largest_free（默认）选可用显存最多的卡；ect 按性能分与同卡任务数估计各卡上的运行时长，选预计最早完成的卡。
+# 运行时长模型：estimated_duration 是在 performance_score = PERF_REF_SCORE 的卡上独占运行的时长，
+# 按分数反比缩放，每多一个同卡运行的任务慢 CO_TENANCY_SLOWDOWN
+PLACEMENT_POLICIES = ("largest_free", "ect")
+PLACEMENT_POLICY = os.environ.get("PLACEMENT_POLICY", "largest_free")
+PERF_REF_SCORE = 100
+CO_TENANCY_SLOWDOWN = float(os.environ.get("CO_TENANCY_SLOWDOWN", "0.15"))
+RUNTIME_BUCKETS = (10, 30, 60, 300, 600, 1800, 3600, 7200, 14400, 28800)
+
+LOCK_WAIT = REGISTRY.histogram("scheduler_lock_wait_seconds", "写操作等待调度器锁的时间（asyncio 模式恒为 0）",
+                               buckets=LOCK_BUCKETS)
+LOCK_HOLD = REGISTRY.histogram("scheduler_lock_hold_seconds", "写操作持有调度器锁的时间（asyncio 模式即阻塞事件循环的时间）",
+                               buckets=LOCK_BUCKETS)
+PLACEMENT = REGISTRY.histogram("scheduler_placement_seconds", "放置决策耗时：dispatch=排队自动调度，batch=批量装箱",
+                               ("kind",), buckets=LOCK_BUCKETS)
+PLACEMENT_RUNTIME = REGISTRY.histogram(
+    "scheduler_placement_expected_runtime_seconds",
+    "自动调度每次放置的预计运行时长：chosen=实际选中的卡，largest_free=同一时刻可用显存最多的卡（对照）",
+    ("choice",), buckets=RUNTIME_BUCKETS)
+SIM_TICK = REGISTRY.histogram("scheduler_sim_tick_seconds", "仿真每一轮（生成请求 + 调度）的耗时", buckets=LOCK_BUCKETS)
+
+class _Snapshot(NamedTuple):
+    """某一版本的只读视图；写操作结束时整体替换，读者拿到引用即可，无需加锁"""
+    version: int
+    gpus: tuple[GpuRecord, ...]
+    stats: PlatformStats
+    by_time: list       # 发布时的 _by_time：只追加，读者只看前 req_count 条；乱序插入、归档移出时整体换新列表
+    req_count: int
+    # 各类数据最后一次变化时的版本号，用作 ETag
+    gpu_version: int
+    req_version: int
+    stats_version: int
 
 class VirtualScheduler:
-    def __init__(self, seed_users: int = 12, enable_simulation: bool = True):
-        self._lock = Lock()
-        self._gpus: dict[str, GpuResource] = {}
-        self._reqs: dict[str, ComputeRequest] = {}
+    """
+    写操作在锁内（asyncio 模式下由事件循环串行化）修改状态，结束时发布新的 _Snapshot。
+    GPU/请求记录发布后不再原地修改：变更时生成新对象替换（copy-on-write），
+    所以读者无锁拿到的记录永远是某个完整版本。
+    内部只存 records.py 的紧凑记录，不经过 pydantic；pydantic 只用于接口层的输入校验。
+    """
+    def __init__(self, seed_users: int = 12, enable_simulation: bool = True, mode: str = "thread",
+                 gpus: List[tuple[str, int, int, str]] = DEFAULT_GPUS, persist_dir: str | None = None,
+                 archive_path: str | None = None, history_max: int = HISTORY_MAX,
+                 history_max_age: float = HISTORY_MAX_AGE_SEC, backfill: str = SCHEDULER_BACKFILL,
+                 preempt: bool = SCHEDULER_PREEMPT, aging_sec: float = PRIORITY_AGING_SEC,
+                 placement: str = PLACEMENT_POLICY):
+        if mode not in ("thread", "asyncio", "virtual"):
+            raise ValueError(f"unknown scheduler mode: {mode}")
+        if backfill not in BACKFILL_MODES:
+            raise ValueError(f"unknown backfill mode: {backfill}")
+        if placement not in PLACEMENT_POLICIES:
+            raise ValueError(f"unknown placement policy: {placement}")
+        self._mode = mode
+        self._backfill = backfill
+        self._placement = placement
+        self._preempt, self._aging = preempt, aging_sec
+        # asyncio 模式下所有调用都在同一个事件循环线程里，锁退化为空上下文
+        self._lock = Lock() if mode == "thread" else nullcontext()
+        self._gpus: dict[str, GpuRecord] = {}
+        self._reqs: dict[str, RequestRecord] = {}
         self._total_users = seed_users
 
         # 额外：每块 GPU 已用显存（GB）
         self._gpu_used_mem: dict[str, int] = {}
+        self._by_gpu: dict[str, dict[str, None]] = {}   # gid -> 其上运行中的请求（离线/注销时重新排队用）
+        # 共享 GPU 按可用显存升序排列的索引：(free, gid)，末尾即可用显存最多的卡
+        self._free_index: list[tuple[int, str]] = []
 
-        # 1) 初始化 GPU
-        now = datetime.now()
-        for name, mem, score, cc in [
-            ("RTX 4090", 24, 100, "8.9"),
-            ("A100 80G", 80, 120, "8.0"),
-            ("RTX 3080", 10, 70,  "8.6"),
-        ]:
-            gid = str(uuid.uuid4())
-            self._gpus[gid] = GpuResource(
-                id=gid, gpu_name=name, gpu_memory=mem, performance_score=score,
-                compute_capability=cc, is_shared=True, status="online",
-                created_at=now, updated_at=now
-            )
-            self._gpu_used_mem[gid] = 0  # 初始未使用
+        # 待调度队列：按 (显存需求, 预计时长) 分类，每类一个 (排队顺序, 入队序号, rid) 小顶堆；同优先级按入队顺序 FIFO。
+        # 调度时按排队顺序归并各堆，选不到卡的一类整堆跳过（见 _dispatch_round）
+        self._pending: dict[tuple[int, float], list[tuple[tuple, int, str]]] = {}
+        self._pending_seq = itertools.count()
+        self._queued: dict[str, int] = {}       # rid -> 当前有效的入队序号（堆中其余条目视为过期）
+        self._queued_mem: Counter = Counter()   # 队列中各显存需求的数量，用于提前结束调度
+        self._queued_pri: Counter = Counter()   # 队列中各优先级的数量（指标用）
+        self._auto_dispatch = enable_simulation
+        self._dispatching = False
+        self._preempted: Counter = Counter()    # rid -> 被抢占次数（结束时删掉）
+        self._preemptions = 0
+
+        # 按状态的二级索引（dict 当有序集合用）与计数，stats()/按状态过滤无需全表扫描
+        self._by_status: dict[str, dict[str, None]] = {}
+        self._online_gpus = 0
+        # q 搜索用的 n-gram 倒排索引
+        self._req_text = NGramIndex()
+        self._gpu_text = NGramIndex()
+        # 按 (created_at, id) 升序的时间索引，分页/时间范围查询用二分定位
+        self._by_time: list[tuple[datetime, str]] = []
+        # 从快照恢复、之后没再改过的已结束请求：按列留在 mmap 里，不在以上各索引中（见 persistence.ColdRequests）
+        self._cold = ColdRequests.empty()
 
-        # 2) 种子请求
-        self._seed_requests()
+        # 版本号与快照：每次有变化的写操作结束时 +1 并发布
+        self._version = 0
+        self._dirty = False
+        self._gpus_dirty = True
+        self._reqs_dirty = True
+        self._snap: _Snapshot | None = None
+        self._stats_key: tuple | None = None    # 上次发布的统计计数，没变就复用旧的 PlatformStats
+        # 增量同步：请求变更日志 (版本, rid) 只追加；GPU 数量少，直接记每块卡的最后变更版本
+        self._req_log: list[tuple[int, str]] = []
+        self._req_log_floor = 0     # 早于此版本的变更已被截掉
+        self._gpu_ver: dict[str, int] = {}
+        self._gpu_removed_ver = 0   # 最后一次注销 GPU 的版本，更早的 since 需全量拉取
+        # 变更推送：一次写操作内的增量按 (实体, id) 合并，发布新版本时一起广播
+        self.events = EventHub()
+        self._changes: dict[tuple[str, str], tuple[str, object]] = {}
+        # 每条记录编码后的 JSON 片段；终态请求不再变化，列表响应大多直接拼接缓存（从归档读出的不缓存）
+        self._json = FragmentCache(keep=self._resident)
+        # 持久化：一次写操作内变化的记录按 id 合并，发布新版本时作为一帧 WAL 交给后台写线程
+        self._store = StateStore(persist_dir, fsync=WAL_FSYNC) if persist_dir else None
+        self._wal_gpus: dict[str, GpuRecord] = {}
+        self._wal_reqs: dict[str, RequestRecord] = {}
+        self._wal_drops: list[str] = []
+        recovered = self._store.recover() if self._store else None
+        # 历史归档：已结束的请求超过保留条件后移到磁盘（见 enforce_retention）
+        self._archive = RequestArchive(archive_path) if archive_path else None
+        self._history_max, self._history_max_age = history_max, history_max_age
+        self._archived: Counter = Counter()     # 归档里的请求数，按状态；统计计数要加上
+        self._archive_newest: tuple[datetime, str] | None = None   # 归档里最新的 (created_at, id)
+        self._unarchived: list[str] = []        # 本次写操作从归档搬回内存的请求，发布后从归档删掉
+        self._evictions = 0                     # 移出内存（写入归档后）的批次数，_lookup 据此判断不持锁预取的归档记录是否可用
+        # 从归档删除的 id 按批排队，由后台线程不持锁删除（见 _delete_loop）
+        self._deletes: queue.Queue[Optional[list[str]]] = queue.Queue()
+        self._deleter: Thread | None = None
 
-        # 3) 启动后台仿真（可关）
+        if recovered is not None:
+            self._restore(recovered)
+        else:
+            # 1) 初始化 GPU（内置的卡没有心跳，不做存活检测）
+            now = self._now()
+            for name, mem, score, cc in gpus:
+                self._add_gpu(GpuRecord(
+                    id=self._new_id(), gpu_name=name, gpu_memory=mem, performance_score=score,
+                    compute_capability=cc, is_shared=True, status="online",
+                    created_at=now, updated_at=now
+                ))
+
+            # 2) 种子请求
+            self._seed_requests()
+        if self._archive is not None:
+            if recovered is None:
+                self._archive.clear()   # 全新的状态，旧归档作废
+            else:
+                self._reconcile_archive(recovered.version)
+            self._archived, self._archive_newest = self._archive.counts(), self._archive.newest()
+            self._deleter = Thread(target=self._delete_loop, name="archive-delete", daemon=True)
+            self._deleter.start()
+        if self._store:
+            self._store.open(self._version)
+        self._publish()
+
+        # 3) 后台仿真（可关）；所有运行中任务的自动完成共用一个计时线程 / 事件循环定时器
+        self._completions = self._make_timer(self._auto_complete, "auto-complete")
+        # 注册 GPU 的存活检测：心跳只记下时间（不加锁、不碰堆）；每块卡在计时器里只挂一个截止时间，
+        # 到期时期间有过心跳就按最后一次心跳顺延，否则置 offline。计时器的工作量只取决于卡数 / 超时，与心跳频率无关
+        self._liveness = self._make_timer(self._check_liveness, "gpu-liveness")
+        self._last_beat: dict[str, float] = {}   # gid -> 最后一次心跳（time.monotonic()）
+        # 恢复出来的卡不知道上次心跳是什么时候：start() 时按刚收到心跳算，给一个超时的宽限
+        self._resume_gpus = [gid for gid, g in self._gpus.items()
+                             if g.heartbeat_ttl is not None and g.status != "offline"]
+        # 恢复出来的运行中任务不知道还剩多久，start() 时重新计时（asyncio 模式要等事件循环起来）
+        self._resume = list(self._by_status.get("running", ())) if recovered is not None and self._auto_dispatch else []
+        self._enable_simulation = enable_simulation
         self._sim_stop = threading.Event()
-        if enable_simulation:
-            self._sim_thread = Thread(target=self._simulate_loop, daemon=True)
-            self._sim_thread.start()
+        self._sim_thread: Thread | None = None
+        self._sim_task: asyncio.Task | None = None
+        self._index_task: asyncio.Task | Thread | None = None
+        self._retention: asyncio.Task | Thread | None = None
+        self._telemetry: Telemetry | None = None   # 显存/利用率采样，start() 时按 TELEMETRY_PROVIDER 创建
+        if mode == "thread":
+            self.start()
+
+    # ----------------- 内部：时钟/计时（离散事件仿真时由子类替换） -----------------
+    def _now(self) -> datetime:
+        return datetime.now()
+
+    def _new_id(self) -> str:
+        return str_uuid()
+
+    def _make_timer(self, callback, name: str):
+        if self._mode == "thread":
+            return DeadlineTimer(callback, name=name)
+        if self._mode == "asyncio":
+            return LoopTimer(callback)
+        raise ValueError("virtual 模式需由子类提供 _make_timer")
+
+    def _runtime(self, req: RequestRecord) -> float:
+        """自动调度的任务运行多久（秒）后完成：随机时长按所在卡的性能分与同卡任务数缩放"""
+        return random.randint(*RUNTIME_SEC_RANGE) * self._slowdown(req.assigned_gpu_id, placed=True)
+
+    # ----------------- 内部：持久化 -----------------
+    def _restore(self, rec: Recovered):
+        """
+        从持久化目录恢复：直接装入记录并重建各索引，不经过 _add_request（不产生日志/事件）。
+        快照里已结束的请求留在 rec.cold 里不动，只把未结束的取出来与 WAL 里的一起放进内存。
+        """
+        # 重启前的增量同步记录没有了（请求和 GPU 都是），更早的 since 需全量拉取
+        self._version = self._req_log_floor = self._gpu_removed_ver = rec.version
+        self._reqs, self._by_time, self._cold = rec.reqs, rec.by_time, rec.cold
+        active = self._cold.take_unless(TERMINAL_STATUSES, 0)
+        if active:
+            self._reqs.update((r.id, r) for r in active)
+            self._by_time = sorted(self._by_time + [(r.created_at, r.id) for r in active])
+        for rid, r in self._reqs.items():
+            self._by_status.setdefault(r.status, {})[rid] = None
+        self._req_text.defer((rid, r.task_description) for rid, r in self._reqs.items())
+        used = Counter()
+        for rid in self._by_status.get("running", ()):
+            r = self._reqs[rid]
+            if r.assigned_gpu_id:
+                used[r.assigned_gpu_id] += r.required_memory
+                self._by_gpu.setdefault(r.assigned_gpu_id, {})[rid] = None
+        for gid, g in rec.gpus.items():
+            self._gpus[gid] = g
+            self._online_gpus += g.status == "online"
+            self._gpu_text.add(gid, g.gpu_name)
+            self._gpu_used_mem[gid] = used[gid]
+            if _schedulable(g):
+                self._free_index.append((self._gpu_free_mem(gid), gid))
+        self._free_index.sort()
+        for _, rid in self._by_time:   # 按创建时间重新入队
+            r = self._reqs[rid]
+            if r.status == "pending": self._enqueue(r)
+        self._dirty = True
+
+    def _log_gpu(self, g: GpuRecord):
+        if self._store is not None: self._wal_gpus[g.id] = g
+
+    def _log_wal(self) -> bool:
+        """_publish 时调用：本次写操作变化的记录作为一帧 WAL；返回是否攒够帧数、该做快照了"""
+        if not (self._wal_gpus or self._wal_reqs or self._wal_drops): return False
+        due = self._store.log(self._version, list(self._wal_gpus.values()), list(self._wal_reqs.values()),
+                              self._wal_drops)
+        self._wal_gpus.clear()
+        self._wal_reqs.clear()
+        self._wal_drops = []
+        return due
+
+    def _checkpoint(self, snap: "_Snapshot"):
+        """新版本发布后调用：快照直接取自已发布的只读视图，不复制任何容器，编码和写盘都在后台线程"""
+        self._store.checkpoint(snap.version, snap.gpus, snap.by_time, snap.req_count, self._reqs.get, self._cold)
+
+    def close(self):
+        """停止仿真，把尚未落盘的 WAL 写完"""
+        self.stop_simulation()
+        if self._telemetry is not None:
+            self._telemetry.stop()
+        if self._store is not None:
+            with self._lock:
+                self._store.close()
+                self._store = None
+        if self._archive is not None:
+            self._deletes.put(None)
+            self._deleter.join()
+            self._archive.close()
+
+    # ----------------- 内部：历史归档 -----------------
+    def _resident(self, rec) -> bool:
+        return self._reqs.get(rec.id) is rec or self._gpus.get(rec.id) is rec
+
+    def _retention_victims(self) -> list[RequestRecord]:
+        """
+        调用方持锁：按结束先后取超出保留条件（条数或时长）的已结束请求，最多一批。
+        _by_status 的各个桶按进入该状态的先后排列，归并即得大致的结束先后；快照里的请求按快照里存的结束顺序参与归并。
+        """
+        buckets = [self._by_status.get(s, {}) for s in TERMINAL_STATUSES]
+        over = sum(map(len, buckets)) + sum(map(self._cold.count, TERMINAL_STATUSES)) - self._history_max
+        cutoff = self._now() - timedelta(seconds=self._history_max_age)
+        victims = []
+        for r in heapq.merge(*(map(self._reqs.__getitem__, b) for b in buckets), self._cold.by_end(), key=_ended_at):
+            if len(victims) >= RETENTION_BATCH or (len(victims) >= over and _ended_at(r) >= cutoff):
+                break
+            victims.append(r)
+        return victims
+
+    def _evict(self, victims: List[RequestRecord]) -> List[str]:
+        """调用方持锁：把已写入归档的请求移出内存；选中之后又被改过的不移，返回它们的 id"""
+        gone, stale, dropped = set(), [], False
+        for rec in victims:
+            rid = rec.id
+            cur = self._reqs.get(rid)
+            if cur is rec:
+                del self._reqs[rid]
+                self._by_status[rec.status].pop(rid, None)
+                self._req_text.remove(rid)
+                self._json.invalidate(rid)
+                gone.add(rid)
+            elif cur is None and self._cold.drop(rid, self._version + 1):
+                pass   # 快照里的请求（还在就没变过），不在内存的各索引里
+            else:
+                stale.append(rid)
+                continue
+            self._archived[rec.status] += 1
+            key = (rec.created_at, rid)
+            if self._archive_newest is None or key > self._archive_newest:
+                self._archive_newest = key
+            if self._store is not None: self._wal_drops.append(rid)
+            dropped = True
+        if gone:
+            self._by_time = [k for k in self._by_time if k[1] not in gone]   # 换新列表，读旧快照的读者不受影响
+        if dropped:
+            self._dirty = self._reqs_dirty = True
+            self._evictions += 1
+        return stale
+
+    def _archive_put(self, victims: List[RequestRecord], version: int):
+        """不持锁：先等排在前面的删除做完（删的可能正是这批里又要归档的请求的旧记录），再写入"""
+        self._deletes.join()
+        self._archive.put(victims, version)
+
+    def _finish_retention(self, victims: List[RequestRecord]):
+        with self._mutate():
+            stale = self._evict(victims)
+        if stale:
+            self._deletes.put(stale)
+
+    def _delete_loop(self):
+        """
+        后台线程：按顺序从归档删除排队的 id。搬回内存的请求要等记着它们的 WAL 帧落盘后再删，
+        崩溃也不会两头都丢；崩溃在落盘与删除之间的，重启时由 _reconcile_archive 删掉。
+        """
+        while True:
+            ids = self._deletes.get()
+            try:
+                if ids is None: return
+                store = self._store
+                if store is not None:
+                    store.flush()
+                self._archive.delete(ids)
+            except Exception as e:
+                print("[Archive] delete error:", e)
+            finally:
+                self._deletes.task_done()
+
+    def enforce_retention(self) -> int:
+        """
+        把超出保留条件的已结束请求归档，返回归档条数。分三步：持锁选出一批 → 不持锁写 SQLite → 持锁移出内存。
+        第二步期间这些请求同时在内存和归档里，查询以内存为准。
+        """
+        if self._archive is None: return 0
+        n = 0
+        while True:
+            with self._lock:
+                victims, version = self._retention_victims(), self._version
+            if not victims: return n
+            self._archive_put(victims, version)
+            self._finish_retention(victims)
+            n += len(victims)
+            if len(victims) < RETENTION_BATCH: return n
+
+    def _retention_loop(self):
+        while not self._sim_stop.wait(RETENTION_INTERVAL_SEC):
+            try:
+                self.enforce_retention()
+            except Exception as e:
+                print("[Retention] error:", e)
+
+    async def _retention_task(self):
+        """asyncio 模式：选批和移出在事件循环上，SQLite 写入放到线程里"""
+        while True:
+            await asyncio.sleep(RETENTION_INTERVAL_SEC)
+            try:
+                while True:
+                    victims, version = self._retention_victims(), self._version
+                    if not victims: break
+                    await asyncio.to_thread(self._archive_put, victims, version)
+                    self._finish_retention(victims)
+                    if len(victims) < RETENTION_BATCH: break
+            except Exception as e:
+                print("[Retention] error:", e)
+
+    def _lookup(self, rid: str, fetched: Optional[tuple[int, dict]] = None) -> Optional[RequestRecord]:
+        """
+        写操作取请求：不在内存里就依次去快照里的冷数据、归档找，找到则搬回内存，之后按普通请求修改。
+        fetched 是写操作前不持锁预取的归档记录（见 _fetch_archived）；预取之后没有新的移出就可直接用，
+        否则（或没有预取）持锁读归档。
+        """
+        req = self._reqs.get(rid)
+        if req is not None: return req
+        req = self._cold.take(rid, self._version + 1)
+        archived = req is None
+        if archived:
+            if self._archive is None: return None
+            if fetched is not None and fetched[0] == self._evictions:
+                req = fetched[1].get(rid)
+            else:
+                req = self._archive.get([rid]).get(rid)
+            if req is None: return None
+        self._reqs[rid] = req
+        self._by_status.setdefault(req.status, {})[rid] = None
+        self._req_text.add(rid, req.task_description)
+        by_time = self._by_time.copy()
+        bisect.insort(by_time, (req.created_at, rid))
+        self._by_time = by_time
+        if archived:
+            self._archived[req.status] -= 1
+            self._unarchived.append(rid)
+        if self._store is not None: self._wal_reqs[rid] = req
+        self._dirty = self._reqs_dirty = True
+        return req
+
+    def _from_archive(self, rids: List[str]) -> dict[str, RequestRecord]:
+        """无锁读者按 id 取到的请求刚好被移出内存时，回归档里取"""
+        return self._archive.get(rids) if self._archive is not None and rids else {}
+
+    def _maybe_archived(self, rids) -> List[str]:
+        """不在内存、也不在快照里的 id：写操作前先不持锁去归档取"""
+        if self._archive is None or not self._archived.total(): return []
+        return [rid for rid in rids if rid not in self._reqs and self._cold.get(rid) is None]
+
+    def _fetch_archived(self, rids: List[str]) -> tuple[int, dict[str, RequestRecord]]:
+        """不持锁：读出 rids 的归档记录，连同读之前的移出批次数（_lookup 判断预取是否可用）"""
+        evictions = self._evictions
+        return evictions, self._from_archive(rids)
+
+    async def _fetch_archived_async(self, rids) -> Optional[tuple[int, dict[str, RequestRecord]]]:
+        rids = self._maybe_archived(rids)
+        return await asyncio.to_thread(self._fetch_archived, rids) if rids else None
+
+    def _reconcile_archive(self, version: int):
+        """
+        重启对账：最后一批归档可能已写进 SQLite，但移出内存的那一帧 WAL 没来得及落盘。
+        这些请求若内存里的与归档里的相同，补做移出；内存里的更新（之后又被改过），删掉归档里的。
+        """
+        same, stale = [], []
+        # 另外，搬回内存后 WAL 已落盘、还没来得及从归档删的（见 _delete_loop），也都在内存里
+        ids = dict.fromkeys(self._archive.unconfirmed_ids(version))
+        ids.update(dict.fromkeys(self._reqs))
+        for rid, rec in self._archive.get(ids).items():
+            mem = self._reqs.get(rid) or self._cold.get(rid)
+            if mem is None: continue
+            if mem == rec: same.append(mem)
+            else: stale.append(rid)
+        self._evict(same)
+        self._archive.delete(stale)
 
     # ----------------- 内部：显存/状态管理 -----------------
     def _gpu_free_mem(self, gpu_id: str) -> int:
@@ -57,137 +516,624 @@ class VirtualScheduler:
 
     def _alloc_mem(self, gpu_id: str, mem: int) -> bool:
         """尝试在 gpu 上分配 mem GB 显存；成功返回 True。"""
-        if gpu_id not in self._gpus: return False
+        g = self._gpus.get(gpu_id)
+        if g is None or g.status == "offline": return False
         free = self._gpu_free_mem(gpu_id)
         if free < mem: return False
-        self._gpu_used_mem[gpu_id] = self._gpu_used_mem.get(gpu_id, 0) + mem
-        self._recompute_gpu_status(gpu_id)
+        self._set_used_mem(gpu_id, self._gpu_used_mem.get(gpu_id, 0) + mem)
         return True
 
     def _free_mem(self, gpu_id: str, mem: int):
         if gpu_id not in self._gpus: return
-        self._gpu_used_mem[gpu_id] = max(0, self._gpu_used_mem.get(gpu_id, 0) - mem)
+        self._set_used_mem(gpu_id, max(0, self._gpu_used_mem.get(gpu_id, 0) - mem))
+        # 有显存释放出来：尽可能多地调度排队中的请求
+        self._dispatch_pending()
+
+    def _set_used_mem(self, gpu_id: str, used: int):
+        """更新已用显存，同时维护可用显存索引"""
+        indexed = _schedulable(self._gpus[gpu_id])
+        if indexed:
+            self._unindex_free(gpu_id)
+        self._gpu_used_mem[gpu_id] = used
+        if indexed:
+            bisect.insort(self._free_index, (self._gpu_free_mem(gpu_id), gpu_id))
         self._recompute_gpu_status(gpu_id)
 
+    def _unindex_free(self, gpu_id: str):
+        old = (self._gpu_free_mem(gpu_id), gpu_id)
+        i = bisect.bisect_left(self._free_index, old)
+        if i < len(self._free_index) and self._free_index[i] == old:
+            del self._free_index[i]
+
+    def _pick_gpu(self, req: RequestRecord, plan: Optional[Reservations] = None) -> Optional[str]:
+        """
+        在放得下（有预留时还要不推迟预留）的卡里选：largest_free 取可用显存最多的；
+        ect 取预计运行时长最短、即预计最早完成的，同样快时取可用显存多的。放不下返回 None。
+        ect 要看遍所有放得下的卡，几十块卡时可以忽略
+        """
+        mem = req.required_memory
+        best, best_dur = None, 0.0
+        for free, gid in reversed(self._free_index):
+            if free < mem: break
+            if plan is None and self._placement == "largest_free": return gid
+            dur = self._expected_on(req, gid)
+            if plan is not None and not plan.allows(gid, mem, dur): continue
+            if self._placement == "largest_free": return gid
+            if best is None or dur < best_dur:
+                best, best_dur = gid, dur
+        return best
+
+    def _slowdown(self, gpu_id: Optional[str], placed: bool = False) -> float:
+        """在 gpu_id 上运行相对基准卡独占运行的时长倍数；placed 表示这个任务已算在该卡的运行中任务里"""
+        g = self._gpus.get(gpu_id)
+        if g is None: return 1.0
+        peers = max(len(self._by_gpu.get(gpu_id, ())) - placed, 0)
+        return PERF_REF_SCORE / max(g.performance_score, 1) * (1.0 + CO_TENANCY_SLOWDOWN * peers)
+
+    def _expected_on(self, req: RequestRecord, gpu_id: str, placed: bool = False) -> float:
+        """req 在 gpu_id 上的预计运行时长（秒）"""
+        return _expected_sec(req) * self._slowdown(gpu_id, placed)
+
     def _recompute_gpu_status(self, gpu_id: str):
-        """根据已用显存是否>0 设置 online/busy（允许 busy 时继续接任务）"""
+        """根据已用显存是否>0 设置 online/busy（允许 busy 时继续接任务）；offline 的卡等心跳恢复时再算"""
         g = self._gpus[gpu_id]
-        g.status = "busy" if self._gpu_used_mem.get(gpu_id, 0) > 0 else "online"
-        g.updated_at = datetime.now()
+        if g.status == "offline": return
+        status = "busy" if self._gpu_used_mem.get(gpu_id, 0) > 0 else "online"
+        if status != g.status:
+            self._online_gpus += (status == "online") - (g.status == "online")
+        self._replace_gpu(replace(g, status=status, updated_at=self._now()))
 
-    # ----------------- 对外：GPU/请求接口 -----------------
-    def list_gpus(self, q: str|None=None, status: str|None=None) -> List[GpuResource]:
-        with self._lock:
-            # 动态刷新 GPU 状态（防止长时间不调用时状态过期）
-            for gid in list(self._gpus.keys()):
-                self._recompute_gpu_status(gid)
-
-            items = list(self._gpus.values())
-            if q:
-                ql = q.lower()
-                items = [g for g in items if ql in g.gpu_name.lower()]
-            if status and status != "all":
-                items = [g for g in items if g.status == status]
-            return items
-
-    def list_requests(self, q: str|None=None, status: str|None=None) -> List[ComputeRequest]:
-        with self._lock:
-            items = list(self._reqs.values())
-            if q:
-                ql = q.lower()
-                items = [r for r in items if ql in r.task_description.lower()]
-            if status and status != "all":
-                items = [r for r in items if r.status == status]
-            # 可按时间排序，最新在前：
-            items.sort(key=lambda r: r.created_at, reverse=True)
-            return items
-
-    def create_request(self, task_description: str, required_memory: int, estimated_duration: int, priority: str="normal") -> ComputeRequest:
+    def _replace_gpu(self, g: GpuRecord, kind: str = "gpu.updated"):
+        """所有 GPU 变更都走这里：替换记录，记 WAL、版本与事件"""
+        self._gpus[g.id] = g
+        self._json.invalidate(g.id)
+        self._log_gpu(g)
+        self._dirty = self._gpus_dirty = True
+        self._gpu_ver[g.id] = self._version + 1
+        self._emit("gpu", kind, g)
+
+    def _add_gpu(self, g: GpuRecord):
+        self._online_gpus += g.status == "online"
+        self._gpu_text.add(g.id, g.gpu_name)
+        self._gpu_used_mem[g.id] = 0
+        if _schedulable(g):
+            bisect.insort(self._free_index, (g.gpu_memory, g.id))
+        self._replace_gpu(g, "gpu.created")
+
+    def _take_offline(self, gpu_id: str):
+        """置 offline：不再参与调度，其上运行中的任务重新排队"""
+        g = self._gpus[gpu_id]
+        if g.status == "offline": return
+        if _schedulable(g):
+            self._unindex_free(gpu_id)
+        self._online_gpus -= g.status == "online"
+        self._replace_gpu(replace(g, status="offline", updated_at=self._now()))
+        for rid in list(self._by_gpu.get(gpu_id, ())):
+            self._set_status(rid, "pending")
+        self._dispatch_pending()
+
+    def _bring_online(self, gpu_id: str):
+        """离线的卡又收到心跳：重新参与调度，恢复存活检测"""
+        g = replace(self._gpus[gpu_id], status="online")
+        self._gpus[gpu_id] = g
+        self._online_gpus += 1
+        if _schedulable(g):
+            bisect.insort(self._free_index, (self._gpu_free_mem(gpu_id), gpu_id))
+        self._recompute_gpu_status(gpu_id)
+        self._liveness.schedule(gpu_id, g.heartbeat_ttl)
+        self._dispatch_pending()
+
+    def _check_liveness(self, gpu_id: str):
+        """存活检测的截止时间到了：期间有过心跳就按最后一次心跳顺延，否则置 offline"""
+        g = self._gpus.get(gpu_id)
+        if g is None or g.heartbeat_ttl is None: return
+        left = self._last_beat.get(gpu_id, 0.0) + g.heartbeat_ttl - time.monotonic()
+        if left > 0:
+            self._liveness.schedule(gpu_id, left)   # 常见情况：不加锁、不发布新版本
+            return
+        with self._mutate():
+            g = self._gpus.get(gpu_id)
+            if g is None or g.status == "offline": return
+            if self._last_beat.get(gpu_id, 0.0) + g.heartbeat_ttl > time.monotonic():
+                self._liveness.schedule(gpu_id, g.heartbeat_ttl)   # 检查之后刚收到心跳
+                return
+            self._take_offline(gpu_id)
+
+    def _track_running(self, req: RequestRecord, on: bool):
+        """维护 _by_gpu：调用方在请求变更前后各调一次"""
+        if req.status != "running" or not req.assigned_gpu_id: return
+        if on:
+            self._by_gpu.setdefault(req.assigned_gpu_id, {})[req.id] = None
+        elif (running := self._by_gpu.get(req.assigned_gpu_id)) is not None:
+            running.pop(req.id, None)
+
+    def _add_request(self, req: RequestRecord):
+        self._reqs[req.id] = req
+        self._req_text.add(req.id, req.task_description)
+        key = (req.created_at, req.id)
+        if not self._by_time or self._by_time[-1] < key:
+            self._by_time.append(key)  # 常见情况：新请求时间最大，直接追加
+        else:
+            by_time = self._by_time.copy()   # 乱序插入换新列表：已发布的前缀不能动（无锁读者、写快照的线程在读）
+            bisect.insort(by_time, key)
+            self._by_time = by_time
+        self._by_status.setdefault(req.status, {})[req.id] = None
+        self._track_running(req, True)
+        self._log_req(req)
+        self._emit("request", "request.created", req)
+
+    def _update_req(self, req: RequestRecord, **changes) -> RequestRecord:
+        """所有请求变更都走这里：生成新版本替换旧记录，顺带维护状态索引；返回新记录"""
+        new = replace(req, **changes)
+        if new.status != req.status:
+            bucket = self._by_status.get(req.status)
+            if bucket is not None:
+                bucket.pop(req.id, None)
+            self._by_status.setdefault(new.status, {})[req.id] = None
+        if (new.status, new.assigned_gpu_id) != (req.status, req.assigned_gpu_id):
+            self._track_running(req, False)
+            self._track_running(new, True)
+        self._reqs[req.id] = new
+        self._json.invalidate(req.id)
+        self._log_req(new)
+        self._emit("request", "request.updated", new)
+        return new
+
+    def _log_req(self, req: RequestRecord):
+        self._dirty = self._reqs_dirty = True
+        if self._store is not None: self._wal_reqs[req.id] = req
+        self._req_log.append((self._version + 1, req.id))   # 本次写操作发布后的版本
+        if len(self._req_log) > REQ_LOG_MAX:
+            half = len(self._req_log) // 2
+            self._req_log_floor = self._req_log[half - 1][0]
+            self._req_log = self._req_log[half:]        # 换新列表，正在读旧列表的读者不受影响
+
+    def _emit(self, entity: str, kind: str, obj):
+        if not self.events.has_subscribers: return
+        prev = self._changes.get((entity, obj.id))
+        if prev is not None and prev[0].endswith(".created"):
+            kind = prev[0]  # 同一次写操作里先创建后修改：仍算创建，带最新内容
+        self._changes[(entity, obj.id)] = (kind, obj)
+
+    @contextmanager
+    def _mutate(self):
+        """写操作：持锁修改，结束时若有变化则发布新快照；顺带统计锁等待/持有时间"""
+        t0 = time.perf_counter()
         with self._lock:
-            rid = str_uuid(); now = datetime.now()
-            req = ComputeRequest(
-                id=rid, task_description=task_description, required_memory=required_memory,
-                estimated_duration=estimated_duration, priority=priority, status="pending",
-                created_at=now
+            t1 = time.perf_counter()
+            try:
+                yield
+            finally:
+                if self._dirty:
+                    self._publish()
+                t2 = time.perf_counter()
+        LOCK_WAIT.observe(t1 - t0)
+        LOCK_HOLD.observe(t2 - t1)
+
+    def _publish(self):
+        self._version += 1
+        checkpoint = self._store is not None and self._log_wal()
+        if self._unarchived:
+            self._deletes.put(self._unarchived)   # 本帧落盘后由后台线程从归档删
+            self._unarchived = []
+        prev = self._snap
+        gpus = tuple(self._gpus.values()) if self._gpus_dirty else prev.gpus
+        key = (self._total_users, len(self._gpus), self._online_gpus, len(self._by_status.get("pending", ())),
+               len(self._by_status.get("completed", ())) + self._cold.count("completed") + self._archived["completed"])
+        stats_changed = prev is None or key != self._stats_key
+        if stats_changed:
+            self._stats_key = key
+            stats = PlatformStats(
+                total_users=key[0], total_gpus=key[1], online_gpus=key[2],
+                pending_requests=key[3], completed_requests=key[4],
             )
-            self._reqs[rid] = req
-            return req
+        else:
+            stats = prev.stats
+        if self._changes or self.events.has_subscribers:
+            changes = list(self._changes.values())
+            if stats_changed:
+                changes.append(("stats", stats))
+            self._changes.clear()
+            self.events.publish(self._version, changes, self._json.dumps)
+        self._snap = _Snapshot(
+            self._version, gpus, stats, self._by_time, len(self._by_time),
+            gpu_version=self._version if self._gpus_dirty or prev is None else prev.gpu_version,
+            req_version=self._version if self._reqs_dirty or prev is None else prev.req_version,
+            stats_version=self._version if stats_changed else prev.stats_version,
+        )
+        self._dirty = self._gpus_dirty = self._reqs_dirty = False
+        if checkpoint:
+            self._checkpoint(self._snap)
+
+    # ----------------- 对外：GPU/请求接口 -----------------
+    # 读接口都不加锁：基于当前快照（GPU 状态在每次显存变化时已经刷新，读时无需再算）
+    def list_gpus(self, q: str|None=None, status: str|None=None) -> List[GpuRecord]:
+        items = self._snap.gpus
+        if q:
+            hits = self._gpu_text.search(q)
+            items = [g for g in items if g.id in hits]
+        if status and status != "all":
+            items = [g for g in items if g.status == status]
+        return list(items)
+
+    def list_requests(self, q: str|None=None, status: str|None=None, limit: int|None=None,
+                      cursor: str|None=None, since: datetime|None=None,
+                      until: datetime|None=None) -> List[RequestRecord]:
+        """
+        按创建时间倒序（最新在前）返回请求。
+        limit/cursor 分页：cursor 取上一页最后一条的 encode_cursor()，只返回比它更早的请求；
+        since/until 限定创建时间范围 [since, until)。
+        快照里的（冷）请求和已归档的请求同样参与查询：内存里的结果与它们的查询结果按时间归并。
+        """
+        out, fetch = self._list_requests(q, status, limit, cursor, since, until)
+        return fetch() if fetch else out
+
+    async def list_requests_async(self, q: str|None=None, status: str|None=None, limit: int|None=None,
+                                  cursor: str|None=None, since: datetime|None=None,
+                                  until: datetime|None=None) -> List[RequestRecord]:
+        """同 list_requests；要查归档时放到线程里，不阻塞事件循环"""
+        out, fetch = self._list_requests(q, status, limit, cursor, since, until)
+        return await asyncio.to_thread(fetch) if fetch else out
+
+    def _list_requests(self, q, status, limit, cursor, since, until):
+        """内存与冷数据的结果，以及归档可能补进这一页时做归档查询、归并的函数（否则为 None）"""
+        before = _decode_cursor(cursor) if cursor else None
+        since, until = _naive(since), _naive(until)
+        # 无锁读：索引的拷贝（set(...)/切片）都是单次 C 层操作；_by_time 只追加，只看快照时刻的前缀
+        snap = self._snap
+        total, by_time = snap.req_count, snap.by_time
+        reqs = self._reqs
+        ids = None
+        if status and status != "all":
+            ids = set(self._by_status.get(status, ()))
+        if q:
+            hits = self._req_text.search(q)
+            ids = hits if ids is None else hits & ids
 
-    def match_request(self, request_id: str, gpu_id: str) -> Optional[ComputeRequest]:
+        lo = bisect.bisect_left(by_time, (since,), 0, total) if since else 0
+        hi = bisect.bisect_left(by_time, (until,), 0, total) if until else total
+        if before:
+            hi = min(hi, bisect.bisect_left(by_time, before, 0, total))
+        n = max(0, hi - lo)
+        if limit is not None:
+            n = min(n, limit)
+
+        if ids is None:
+            keys = by_time[hi - n:hi] if n else []
+            keys.reverse()
+        elif len(ids) < hi - lo:
+            # 过滤后的结果少于时间窗口：直接对命中的请求排序（刚被移出内存的跳过，归档查询会补上）
+            keys = sorted(((r.created_at, rid) for rid in ids if (r := reqs.get(rid)) is not None), reverse=True)
+            keys = [k for k in keys if (not since or k[0] >= since) and (not until or k[0] < until)
+                    and (not before or k < before) and k <= by_time[total - 1]][:n]
+        else:
+            # 从时间索引倒着走，直到凑够一页
+            keys = []
+            for i in range(hi - 1, lo - 1, -1):
+                if len(keys) >= n: break
+                if by_time[i][1] in ids:
+                    keys.append(by_time[i])
+        out = [r for _, rid in keys if (r := reqs.get(rid)) is not None]
+        evicted = len(out) < len(keys)   # 读的过程中被移出内存的：已先写入归档，归档查询会补上
+        if self._cold:
+            # 按本快照的版本判断可见：刚从冷数据搬进内存的，旧快照的时间索引里没有，这里仍能查到
+            cold = self._cold.query(q, status if status != "all" else None, since, until, before, limit, snap.version)
+            if cold:
+                seen = {r.id for r in out}
+                merged = heapq.merge(out, [r for r in cold if r.id not in seen], key=_time_key, reverse=True)
+                out = list(itertools.islice(merged, limit))
+        newest = self._archive_newest
+        if not evicted and (newest is None or (status and status != "all" and not self._archived.get(status))
+                            or (since and newest[0] < since) or (limit is not None and len(out) >= limit
+                                                                 and (out[-1].created_at, out[-1].id) > newest)):
+            return out, None   # 归档里不会有排得进这一页的请求
+
+        def fetch() -> List[RequestRecord]:
+            older = self._archive.query(q, status if status != "all" else None, since, until, before, limit)
+            seen = {r.id for r in out}
+            older = [r for r in older if r.id not in reqs and r.id not in seen]   # 同时在内存里的以内存为准
+            merged = heapq.merge(out, older, key=_time_key, reverse=True)
+            return list(itertools.islice(merged, limit))
+        return out, fetch
+
+    def create_request(self, task_description: str, required_memory: int, estimated_duration: int, priority: str="normal") -> RequestRecord:
+        with self._mutate():
+            return self._create(task_description, required_memory, estimated_duration, priority, self._now())
+
+    def match_request(self, request_id: str, gpu_id: str) -> Optional[RequestRecord]:
         """前端手动匹配：允许匹配到 online/busy 的共享 GPU，只要显存足够"""
-        with self._lock:
-            req = self._reqs.get(request_id); gpu = self._gpus.get(gpu_id)
-            if not req or not gpu: return None
-            if not gpu.is_shared: return None
-            # busy 也允许，只要显存足够
-            if self._gpu_free_mem(gpu_id) < req.required_memory:
-                return None
-
-            # 分配显存并置为 running（也可先置 matched，再由前端点“开始执行”）
-            if not self._alloc_mem(gpu_id, req.required_memory):
-                return None
-
-            now = datetime.now()
-            req.assigned_gpu_id = gpu_id
-            req.status = "matched"
-            req.started_at = now
-            # 这里可以按你的业务需求：立刻进入 running
-            req.status = "running"
+        fetched = self._fetch_archived(self._maybe_archived([request_id]))
+        with self._mutate():
+            return self._match(request_id, gpu_id, fetched)
+
+    def update_request_status(self, request_id: str, status: str) -> Optional[RequestRecord]:
+        fetched = self._fetch_archived(self._maybe_archived([request_id]))
+        with self._mutate():
+            return self._set_status(request_id, status, fetched)
+
+    # 批量版本：整批在一次写操作里完成（一次加锁、一次发布新版本），返回紧凑的逐项结果
+    def create_requests(self, items: List[tuple[str, int, int, str]]) -> List[str]:
+        """items: [(task_description, required_memory, estimated_duration, priority), ...]；返回新请求 id"""
+        with self._mutate():
+            now = self._now()
+            return [self._create(desc, mem, est, pri, now).id for desc, mem, est, pri in items]
+
+    def match_requests(self, items: List[tuple[str, str]]) -> List[bool]:
+        """items: [(request_id, gpu_id), ...]；返回每项是否匹配成功"""
+        fetched = self._fetch_archived(self._maybe_archived(rid for rid, _ in items))
+        with self._mutate():
+            return [self._match(rid, gid, fetched) is not None for rid, gid in items]
+
+    def update_statuses(self, items: List[tuple[str, str]]) -> List[bool]:
+        """items: [(request_id, status), ...]；返回每项请求是否存在"""
+        fetched = self._fetch_archived(self._maybe_archived(rid for rid, _ in items))
+        with self._mutate():
+            return [self._set_status(rid, st, fetched) is not None for rid, st in items]
+
+    # 协程版本（main.py 与 scheduler_server.py 用）：碰到已归档的请求时，归档读放到线程里，不阻塞事件循环
+    async def match_request_async(self, request_id: str, gpu_id: str) -> Optional[RequestRecord]:
+        fetched = await self._fetch_archived_async([request_id])
+        with self._mutate():
+            return self._match(request_id, gpu_id, fetched)
+
+    async def update_request_status_async(self, request_id: str, status: str) -> Optional[RequestRecord]:
+        fetched = await self._fetch_archived_async([request_id])
+        with self._mutate():
+            return self._set_status(request_id, status, fetched)
+
+    async def match_requests_async(self, items: List[tuple[str, str]]) -> List[bool]:
+        fetched = await self._fetch_archived_async(rid for rid, _ in items)
+        with self._mutate():
+            return [self._match(rid, gid, fetched) is not None for rid, gid in items]
+
+    async def update_statuses_async(self, items: List[tuple[str, str]]) -> List[bool]:
+        fetched = await self._fetch_archived_async(rid for rid, _ in items)
+        with self._mutate():
+            return [self._set_status(rid, st, fetched) is not None for rid, st in items]
+
+    # ----------------- 对外：GPU 注册 / 注销 / 心跳 -----------------
+    def register_gpu(self, gpu_name: str, gpu_memory: int, performance_score: int,
+                     compute_capability: str | None = None, is_shared: bool = True,
+                     heartbeat_ttl: int = GPU_HEARTBEAT_TTL_SEC, nvml_device: str | None = None) -> GpuRecord:
+        """
+        新卡上线：立即参与调度；此后须每隔不超过 heartbeat_ttl 秒调用一次 heartbeat。
+        nvml_device 为本机 NVML 设备（UUID 或序号），遥测据此读真实显存/利用率
+        """
+        with self._mutate():
+            now = self._now()
+            g = GpuRecord(
+                id=self._new_id(), gpu_name=gpu_name, gpu_memory=gpu_memory, performance_score=performance_score,
+                compute_capability=compute_capability, is_shared=is_shared, status="online",
+                heartbeat_ttl=heartbeat_ttl, nvml_device=nvml_device or None, created_at=now, updated_at=now
+            )
+            self._add_gpu(g)
+            self._last_beat[g.id] = time.monotonic()
+            self._liveness.schedule(g.id, heartbeat_ttl)
+            self._dispatch_pending()
+            return self._gpus[g.id]
+
+    def deregister_gpu(self, gpu_id: str) -> bool:
+        """注销：其上运行中的任务重新排队，记录删除；GPU 不存在返回 False"""
+        with self._mutate():
+            if gpu_id not in self._gpus: return False
+            self._liveness.cancel(gpu_id)
+            self._last_beat.pop(gpu_id, None)
+            self._take_offline(gpu_id)
+            g = self._gpus.pop(gpu_id)
+            del self._gpu_used_mem[gpu_id]
+            self._by_gpu.pop(gpu_id, None)
+            self._gpu_ver.pop(gpu_id, None)
+            self._gpu_text.remove(gpu_id)
+            self._json.invalidate(gpu_id)
+            self._wal_gpus.pop(gpu_id, None)
+            if self._store is not None: self._wal_drops.append(gpu_id)
+            self._gpu_removed_ver = self._version + 1
+            self._dirty = self._gpus_dirty = True
+            self._emit("gpu", "gpu.deleted", g)
+            return True
+
+    def heartbeat(self, gpu_id: str) -> bool:
+        """GPU 是否存在"""
+        return self.heartbeats([gpu_id])[0]
+
+    def heartbeats(self, gpu_ids: List[str]) -> List[bool]:
+        """
+        心跳只记下时间：不加锁、不发布新版本，开销与卡数无关。
+        已离线的卡收到心跳时才进写操作，恢复 online。返回每块 GPU 是否存在（不存在的应重新注册）
+        """
+        now = time.monotonic()
+        ok, revive = [], []
+        for gid in gpu_ids:
+            g = self._gpus.get(gid)
+            ok.append(g is not None)
+            if g is None or g.heartbeat_ttl is None: continue
+            self._last_beat[gid] = now
+            if g.status == "offline": revive.append(gid)
+        if revive:
+            with self._mutate():
+                for gid in revive:
+                    g = self._gpus.get(gid)
+                    if g is not None and g.status == "offline": self._bring_online(gid)
+        return ok
+
+    def _create(self, task_description: str, required_memory: int, estimated_duration: int,
+                priority: str, now: datetime) -> RequestRecord:
+        req = RequestRecord(
+            id=self._new_id(), task_description=task_description, required_memory=required_memory,
+            estimated_duration=estimated_duration, priority=priority, status="pending",
+            created_at=now
+        )
+        self._add_request(req)
+        self._enqueue(req)
+        return req
+
+    def _match(self, request_id: str, gpu_id: str, fetched: Optional[tuple[int, dict]] = None) -> Optional[RequestRecord]:
+        gpu = self._gpus.get(gpu_id)
+        req = self._lookup(request_id, fetched) if gpu else None
+        if not req or not gpu: return None
+        if not _schedulable(gpu): return None
+        # busy 也允许，只要显存足够
+        if self._gpu_free_mem(gpu_id) < req.required_memory:
+            return None
+
+        # 分配显存并置为 running（也可先置 matched，再由前端点“开始执行”）
+        if not self._alloc_mem(gpu_id, req.required_memory):
+            return None
+
+        self._dequeue(req)
+        # 这里可以按你的业务需求：先置 matched，或立刻进入 running
+        return self._update_req(req, assigned_gpu_id=gpu_id, started_at=self._now(), status="running")
+
+    def _set_status(self, request_id: str, status: str, fetched: Optional[tuple[int, dict]] = None) -> Optional[RequestRecord]:
+        req = self._lookup(request_id, fetched)
+        if not req: return None
+        now = self._now()
+
+        self._dequeue(req)
+
+        if status == "running":
+            req = self._update_req(req, status="running", started_at=req.started_at or now)
+            # 若运行时没有显存（例如手动切 running），尝试分配
+            if req.assigned_gpu_id:
+                if self._gpu_free_mem(req.assigned_gpu_id) >= req.required_memory:
+                    self._alloc_mem(req.assigned_gpu_id, req.required_memory)
+                # 否则保持当前（也可直接返回 None 表示失败）
             return req
 
-    def update_request_status(self, request_id: str, status: str) -> Optional[ComputeRequest]:
-        with self._lock:
-            req = self._reqs.get(request_id)
-            if not req: return None
-            now = datetime.now()
-
-            if status == "running":
-                req.status = "running"
-                if not req.started_at:
-                    req.started_at = now
-                # 若运行时没有显存（例如手动切 running），尝试分配
-                if req.assigned_gpu_id:
-                    if self._gpu_free_mem(req.assigned_gpu_id) >= req.required_memory:
-                        self._alloc_mem(req.assigned_gpu_id, req.required_memory)
-                    # 否则保持当前（也可直接返回 None 表示失败）
-                return req
-
-            if status in ("completed", "failed"):
-                req.status = status
-                req.completed_at = now
-                # 释放显存
-                if req.assigned_gpu_id:
-                    self._free_mem(req.assigned_gpu_id, req.required_memory)
-                return req
-
-            if status == "pending":
-                # 取消匹配：释放显存、清除绑定
-                if req.assigned_gpu_id:
-                    self._free_mem(req.assigned_gpu_id, req.required_memory)
-                req.status = "pending"
-                req.assigned_gpu_id = None
-                req.started_at = None
-                req.completed_at = None
-                return req
-
-            # 其他状态（matched等）按需扩展
-            req.status = status
+        if status in ("completed", "failed"):
+            self._completions.cancel(req.id)
+            self._preempted.pop(req.id, None)
+            req = self._update_req(req, status=status, completed_at=now)
+            # 释放显存
+            if req.assigned_gpu_id:
+                self._free_mem(req.assigned_gpu_id, req.required_memory)
             return req
 
-    def stats(self) -> PlatformStats:
-        with self._lock:
-            gpus = list(self._gpus.values()); reqs = list(self._reqs.values())
-            return PlatformStats(
-                total_users=self._total_users,
-                total_gpus=len(gpus),
-                online_gpus=sum(1 for g in gpus if g.status == "online"),
-                pending_requests=sum(1 for r in reqs if r.status == "pending"),
-                completed_requests=sum(1 for r in reqs if r.status == "completed"),
+        if status == "pending":
+            # 取消匹配：释放显存、清除绑定，撤销自动完成
+            self._completions.cancel(req.id)
+            if req.assigned_gpu_id:
+                self._free_mem(req.assigned_gpu_id, req.required_memory)
+            req = self._update_req(req, status="pending", assigned_gpu_id=None,
+                                   started_at=None, completed_at=None)
+            self._enqueue(req)
+            return req
+
+        # 其他状态（matched等）按需扩展
+        return self._update_req(req, status=status)
+
+    def schedule_pending(self, policy: str = "ffd") -> ScheduleResult:
+        """批量调度：把所有排队中的请求一次性装箱到共享 GPU 上"""
+        with self._mutate():
+            t0 = time.perf_counter()
+            rids = sorted(self._queued, key=self._queued.__getitem__)  # 按入队顺序
+            gids = [gid for gid, g in self._gpus.items() if _schedulable(g)]
+            reqs = [self._reqs[rid] for rid in rids]
+            required = np.fromiter((r.required_memory for r in reqs), dtype=np.int64, count=len(reqs))
+            rank = np.fromiter((PRIORITY_RANK.get(r.priority, 1) for r in reqs), dtype=np.int64, count=len(reqs))
+            free = np.fromiter((self._gpu_free_mem(gid) for gid in gids), dtype=np.int64, count=len(gids))
+            assign = pack(required, free, rank, policy)
+
+            placed = []
+            for i in np.flatnonzero(assign >= 0):
+                req, gid = reqs[i], gids[assign[i]]
+                if self._place(req, gid):
+                    placed.append(Placement(request_id=req.id, gpu_id=gid))
+            elapsed = time.perf_counter() - t0
+            PLACEMENT.observe(elapsed, "batch")
+            return ScheduleResult(
+                policy=policy, placements=placed, unplaced=len(reqs) - len(placed),
+                elapsed_ms=elapsed * 1000,
             )
 
+    def queue_depth(self) -> dict[str, int]:
+        """排队中的请求数，按优先级"""
+        return {p: self._queued_pri.get(p, 0) for p in PRIORITY_RANK}
+
+    def object_counts(self) -> dict[str, int]:
+        """常驻对象数量（指标用）"""
+        return {
+            "requests": len(self._reqs), "snapshot_requests": len(self._cold), "gpus": len(self._gpus),
+            "queue_heap_entries": sum(map(len, self._pending.values())), "completion_timers": self._completions.pending(),
+            "liveness_timers": self._liveness.pending(),
+            "req_log_entries": len(self._req_log), "json_fragments": len(self._json),
+            "event_subscribers": self.events.subscriber_count,
+            "archived_requests": sum(self._archived.values()),
+            "telemetry_series": self._telemetry.store.series_count() if self._telemetry else 0,
+            "preempted_requests": len(self._preempted),
+        }
+
+    def to_json(self, obj) -> bytes:
+        """记录 / 记录列表 → JSON 字节，复用每条记录缓存的片段"""
+        return self._json.dumps(obj)
+
+    def next_cursor(self, items: List[RequestRecord]) -> str:
+        """一页请求之后的分页游标"""
+        return encode_cursor(items[-1])
+
+    def stats(self) -> PlatformStats:
+        return self._snap.stats
+
+    @property
+    def version(self) -> int:
+        """当前已发布的状态版本号，每次有变化的写操作 +1"""
+        return self._snap.version
+
+    def versions(self) -> tuple[int, int, int, int]:
+        """(整体, GPU, 请求, 统计) 各自最后变化的版本号，一次取自同一个快照"""
+        snap = self._snap
+        return snap.version, snap.gpu_version, snap.req_version, snap.stats_version
+
+    def changed_gpus(self, since: int) -> Optional[List[GpuRecord]]:
+        """版本 since 之后有变化的 GPU；其间有 GPU 注销时返回 None，需全量拉取"""
+        if self._gpu_removed_ver > since:
+            return None
+        return [g for g in self._snap.gpus if self._gpu_ver.get(g.id, 0) > since]
+
+    def changed_requests(self, since: int) -> Optional[List[RequestRecord]]:
+        """版本 since 之后有变化（含新建）的请求；since 太旧、变更日志已截掉时返回 None，需全量拉取"""
+        out = self._changed_requests(since)
+        if out is None: return None
+        return _fill(out, self._from_archive([rid for rid, r in out.items() if r is None]))
+
+    async def changed_requests_async(self, since: int) -> Optional[List[RequestRecord]]:
+        """同 changed_requests；有已移出内存的请求时，归档读放到线程里"""
+        out = self._changed_requests(since)
+        if out is None: return None
+        missing = [rid for rid, r in out.items() if r is None]
+        return _fill(out, await asyncio.to_thread(self._from_archive, missing) if missing else {})
+
+    def _changed_requests(self, since: int) -> Optional[dict[str, Optional[RequestRecord]]]:
+        """id -> 内存里的请求（已移出内存的为 None）"""
+        snap, log = self._snap, self._req_log
+        if since < self._req_log_floor:
+            return None
+        i = bisect.bisect_right(log, (since, "\uffff"))
+        rids = dict.fromkeys(rid for v, rid in log[i:] if v <= snap.version)
+        return {rid: self._reqs.get(rid) for rid in rids}
+
+    # ----------------- 对外：遥测 -----------------
+    def _telemetry_targets(self) -> Targets:
+        """采样线程调用：无锁读当前快照与已用显存记账"""
+        gpus, used = self._snap.gpus, self._gpu_used_mem
+        n = len(gpus)
+        return Targets([g.id for g in gpus], np.fromiter((g.gpu_memory for g in gpus), np.float64, n),
+                       np.fromiter((used.get(g.id, 0) for g in gpus), np.float64, n),
+                       np.fromiter((g.status != "offline" for g in gpus), bool, n), [g.nvml_device for g in gpus])
+
+    def gpu_history(self, gpu_id: str, since: datetime|None=None, until: datetime|None=None,
+                    points: int=120) -> Optional[dict]:
+        """
+        GPU 显存/利用率在 [since, until) 内按时间桶降采样的 min/max/avg 序列（见 telemetry.downsample）；
+        遥测未开启或没有这块卡的数据时返回 None
+        """
+        if self._telemetry is None: return None
+        return self._telemetry.history(gpu_id, since=since and since.timestamp(), until=until and until.timestamp(),
+                                       points=points)
+
     # ----------------- 内部：初始化请求种子数据 -----------------
     def _seed_requests(self):
-        now = datetime.now()
+        now = self._now()
         gpu_ids = list(self._gpus.keys())
         gpu_for_matched = gpu_ids[0] if len(gpu_ids) > 0 else None
         gpu_for_running = gpu_ids[1] if len(gpu_ids) > 1 else gpu_for_matched
@@ -196,66 +1142,66 @@ class VirtualScheduler:
         # 1) pending（2条）
         '''
         rid = str_uuid()
-        self._reqs[rid] = ComputeRequest(
+        self._add_request(RequestRecord(
             id=rid, task_description="训练文本分类模型（小规模）",
             required_memory=8, estimated_duration=45, priority="normal",
             status="pending", created_at=now - timedelta(minutes=30)
-        )
+        ))
         rid = str_uuid()
-        self._reqs[rid] = ComputeRequest(
+        self._add_request(RequestRecord(
             id=rid, task_description="图像超分实验（2x）",
             required_memory=12, estimated_duration=60, priority="low",
             status="pending", created_at=now - timedelta(minutes=10)
-        )
+        ))
         '''
 
         # 2) matched->running
         if gpu_for_matched:
             rid = str_uuid()
-            self._reqs[rid] = ComputeRequest(
+            self._add_request(RequestRecord(
                 id=rid, task_description="大语料数据清洗与统计",
                 required_memory=10, estimated_duration=90, priority="normal",
                 status="running", assigned_gpu_id=gpu_for_matched,
                 created_at=now - timedelta(hours=1), started_at=now - timedelta(minutes=55)
-            )
+            ))
             # 分配显存
             self._alloc_mem(gpu_for_matched, 10)
 
         # 3) running
         if gpu_for_running:
             rid = str_uuid()
-            self._reqs[rid] = ComputeRequest(
+            self._add_request(RequestRecord(
                 id=rid, task_description="Stable Diffusion 批量渲染",
                 required_memory=16, estimated_duration=120, priority="high",
                 status="running", assigned_gpu_id=gpu_for_running,
                 created_at=now - timedelta(hours=2), started_at=now - timedelta(hours=1, minutes=20)
-            )
+            ))
             self._alloc_mem(gpu_for_running, 16)
 
         # 4) completed（释放显存）
         if gpu_for_completed:
             rid = str_uuid()
-            self._reqs[rid] = ComputeRequest(
+            self._add_request(RequestRecord(
                 id=rid, task_description="小规模推理服务压测",
                 required_memory=8, estimated_duration=30, priority="normal",
                 status="completed", assigned_gpu_id=gpu_for_completed,
                 created_at=now - timedelta(hours=3),
                 started_at=now - timedelta(hours=2, minutes=50),
                 completed_at=now - timedelta(hours=2, minutes=20)
-            )
+            ))
             # 确保已释放
             self._free_mem(gpu_for_completed, 0)  # no-op, 只是触发状态刷新
 
         # 5) failed（已释放）
         rid = str_uuid()
-        self._reqs[rid] = ComputeRequest(
+        self._add_request(RequestRecord(
             id=rid, task_description="视频分割模型训练（测试）",
             required_memory=12, estimated_duration=40, priority="normal",
             status="completed", assigned_gpu_id=gpu_for_completed,
             created_at=now - timedelta(hours=4),
             started_at=now - timedelta(hours=3, minutes=50),
             completed_at=now - timedelta(hours=3, minutes=40)
-        )
+        ))
 
     # ----------------- 内部：自动调度/完成 -----------------
     def _simulate_loop(self):
@@ -268,7 +1214,17 @@ class VirtualScheduler:
                 print("[Simulator] error:", e)
             self._sim_stop.wait(REQUEST_INTERVAL_SEC)
 
+    async def _simulate_task(self):
+        """asyncio 模式下的仿真：事件循环上的一个任务，逻辑同 _simulate_loop"""
+        while True:
+            try:
+                self._auto_spawn_and_schedule()
+            except Exception as e:
+                print("[Simulator] error:", e)
+            await asyncio.sleep(REQUEST_INTERVAL_SEC)
+
     def _auto_spawn_and_schedule(self):
+        t0 = time.perf_counter()
         # 1) 生成一个随机请求
         desc = random.choice([
             "自动生成：微型训练任务",
@@ -280,47 +1236,296 @@ class VirtualScheduler:
         est = random.choice(REQ_DURATION_CHOICES)
         pri = random.choice(REQ_PRIORITY_CHOICES)
 
-        req = self.create_request(desc, mem, est, pri)
+        self.create_request(desc, mem, est, pri)
 
-        # 2) 尝试自动匹配到某个 GPU（按可用显存从大到小）
-        with self._lock:
-            # 计算每个 GPU 的可用显存
-            candidates = sorted(
-                [(gid, self._gpu_free_mem(gid)) for gid in self._gpus if self._gpus[gid].is_shared],
-                key=lambda x: x[1],
-                reverse=True
-            )
-            chosen = None
-            for gid, free in candidates:
-                if free >= mem:
-                    chosen = gid
-                    break
-
-            if chosen is None:
-                # 没 GPU 可用：保持 pending
-                return
+        # 2) 按优先级调度排队中的请求（含之前没放下的）
+        with self._mutate():
+            self._dispatch_pending()
+        SIM_TICK.observe(time.perf_counter() - t0)
 
-            # 分配并置 running
-            if not self._alloc_mem(chosen, mem):
-                return
-            now = datetime.now()
-            req.assigned_gpu_id = chosen
-            req.status = "running"
-            req.started_at = now
+    def _enqueue(self, req: RequestRecord):
+        self._dequeue(req)
+        seq = next(self._pending_seq)
+        self._queued[req.id] = seq
+        self._queued_mem[req.required_memory] += 1
+        self._queued_pri[req.priority] += 1
+        heap = self._pending.setdefault((req.required_memory, _expected_sec(req)), [])
+        heapq.heappush(heap, (self._queue_key(req), seq, req.id))
+        # 过期条目太多时重建堆，避免无限增长
+        if len(heap) > 2 * self._queued_mem[req.required_memory] + 64:
+            heap[:] = [it for it in heap if self._queued.get(it[2]) == it[1]]
+            heapq.heapify(heap)
+
+    def _queue_key(self, req: RequestRecord) -> tuple:
+        """
+        排队顺序：不老化时按优先级档位；老化时 high 仍单独在前（不让老化的任务挡住交互请求），
+        其余按 创建时间（秒）+ 档位 × aging。被抢占回来的任务按原创建时间排，不会排到队尾
+        """
+        rank = PRIORITY_RANK.get(req.priority, 1)
+        if not self._aging or rank == 0: return (rank,)
+        return (1, to_us(req.created_at) / 1e6 + rank * self._aging)
+
+    def _dequeue(self, req: RequestRecord):
+        """出队：只删登记，堆里的条目在弹出时按序号惰性丢弃"""
+        if self._queued.pop(req.id, None) is None: return
+        self._queued_mem[req.required_memory] -= 1
+        if not self._queued_mem[req.required_memory]:
+            del self._queued_mem[req.required_memory]
+        self._queued_pri[req.priority] -= 1
+
+    def _dispatch_pending(self):
+        """
+        调用方需持有锁：按 高/中/低 优先级（老化后的顺序）、同级先来先服务，把放得下的请求都调度出去。
+        开启回填时，第一个放不下的请求（conservative 为前 BACKFILL_DEPTH 个）按预计结束时间预留显存，
+        之后的请求只在不推迟预留时才先上；不回填时放得下就上，大请求可能一直被小请求插队。
+        开启抢占时，放不下的 high 请求先尝试抢占（见 _preempt_for）。
+        """
+        if not self._auto_dispatch or not self._queued or self._dispatching: return
+        self._dispatching = True   # 抢占时释放显存会再次触发调度：不重入，由这一轮接着处理
+        try:
+            self._dispatch_round()
+        finally:
+            self._dispatching = False
+
+    def _dispatch_round(self):
+        t0 = time.perf_counter()
+        skipped = []
+        plan: Reservations | None = None   # 出现第一个放不下的请求后才建
+        depth = BACKFILL_DEPTH if self._backfill == "conservative" else 1
+        hopeless = None   # 抢占失败过的最小显存需求：更大的 high 请求不必再试
+        # 本轮选不到卡的 显存需求 -> 最短的预计时长：可用显存只减不增、预留只增不减，
+        # 显存不小于、时长不短于它的请求同样选不到（抢占腾出显存后清空）
+        rejected: dict[int, float] = {}
+        fronts = self._fronts()
+        while fronts:
+            item, cls = fronts[0]
+            mem, est = cls
+            if not (self._preempt and item[0][0] == 0 and (hopeless is None or mem < hopeless)):
+                free_max = self._free_index[-1][0] if self._free_index else -1
+                # 最空闲的卡都放不下队列里最小的请求，后面不用再看了（排在最前的是可以抢占的 high 请求时除外）
+                if free_max < min(self._queued_mem, default=mem): break
+                # 这一类请求选不到卡、预留也已做完（或不回填）：整堆本轮都不用再看（抢占腾出显存后 fronts 会重建）。
+                # 否则回填预留挡住队首后，每次释放显存都要把整个队列弹出、放回一遍
+                if (self._backfill == "none" or (plan is not None and plan.count >= depth)) and \
+                        (free_max < mem or any(m <= mem and d <= est for m, d in rejected.items())):
+                    heapq.heappop(fronts)
+                    continue
+            heap = self._pending[cls]
+            heapq.heappop(heap)
+            if heap: heapq.heapreplace(fronts, (heap[0], cls))
+            else: heapq.heappop(fronts)
+            rid = item[2]
+            if self._queued.get(rid) != item[1]:
+                continue  # 过期条目：已被手动匹配/改状态/重新入队
+            req = self._reqs[rid]
+            gid = self._pick_gpu(req, plan)
+            if gid is None: rejected[mem] = min(est, rejected.get(mem, est))
+            if gid is None and self._preempt and req.priority == "high" and \
+                    (hopeless is None or req.required_memory < hopeless):
+                gid = self._preempt_for(req)
+                if gid is None: hopeless = req.required_memory
+                else: rejected = {}
+                fronts = self._fronts()   # 被抢占的任务重新入队了，可用显存也变了
+            if gid is None:
+                if self._backfill != "none" and (plan is None or plan.count < depth):
+                    plan = plan or Reservations(self._release_profile)
+                    plan.reserve([(g.id, self._expected_on(req, g.id)) for g in self._gpus.values()
+                                  if _schedulable(g) and g.gpu_memory >= req.required_memory],
+                                 req.required_memory)
+                skipped.append((item, cls))
+                continue
+            # 与可用显存最多的卡对比预计运行时长，衡量选卡策略的收益
+            chosen, largest = self._expected_on(req, gid), self._expected_on(req, self._free_index[-1][1])
+            if not self._place(req, gid):
+                skipped.append((item, cls))   # 仍在 _queued 里，条目放回堆
+                continue
+            PLACEMENT_RUNTIME.observe(chosen, "chosen")
+            PLACEMENT_RUNTIME.observe(largest, "largest_free")
+            if plan is not None:
+                plan.commit(gid, req.required_memory, self._expected_on(req, gid, placed=True))
+        for item, cls in skipped:
+            heapq.heappush(self._pending[cls], item)
+        PLACEMENT.observe(time.perf_counter() - t0, "dispatch")
 
-            # 3) 设置完成计时器
-            duration = random.randint(*RUNTIME_SEC_RANGE)
-            Timer(duration, self._auto_complete, args=[req.id]).start()
+    def _fronts(self) -> list:
+        """各类请求的堆顶 (条目, 类别) 组成的小顶堆：依次弹出即按排队顺序遍历整个队列"""
+        fronts = [(heap[0], cls) for cls, heap in self._pending.items() if heap]
+        heapq.heapify(fronts)
+        return fronts
+
+    def _preempt_for(self, req: RequestRecord) -> Optional[str]:
+        """
+        调用方持锁：在一块卡上挑代价最小的一组优先级更低的运行中任务，按 update_request_status 的 pending 路径放回队列，
+        腾出显存后返回这块卡；找不到返回 None。代价先比任务数，再比已运行时长之和（白做的工作）。
+        每块卡试两种贪心顺序：显存从大到小（任务数最少）、已运行时长从短到长（损失最少），取代价小的。
+        """
+        now = self._now()
+        rank = PRIORITY_RANK.get(req.priority, 1)
+        best = None
+        for gid, g in self._gpus.items():
+            need = req.required_memory - self._gpu_free_mem(gid)
+            if not _schedulable(g) or g.gpu_memory < req.required_memory or need <= 0:
+                continue   # 放得下却没选中的卡是回填预留挡住的，不靠抢占绕过
+            cands = []
+            for rid in self._by_gpu.get(gid, ()):
+                r = self._reqs[rid]
+                ran = (now - r.started_at).total_seconds() if r.started_at else 0.0
+                if PRIORITY_RANK.get(r.priority, 1) > rank and ran >= PREEMPT_MIN_RUN_SEC \
+                        and self._preempted[rid] < PREEMPT_MAX_PER_REQUEST:
+                    cands.append((r, ran))
+            for key in (_by_memory_desc, _by_elapsed):
+                victims = _cover(sorted(cands, key=key), need)
+                if victims is None: break   # 全部候选加起来都不够
+                cost = (len(victims), sum(ran for _, ran in victims))
+                if best is None or cost < best[0]:
+                    best = (cost, gid, victims)
+        if best is None: return None
+        _, gid, victims = best
+        for r, _ in victims:
+            self._preempted[r.id] += 1
+            self._preemptions += 1
+            self._set_status(r.id, "pending")
+        return gid
+
+    def _release_profile(self, gpu_id: str) -> Profile:
+        """该卡未来的可用显存：运行中的任务在 started_at + 在该卡上的预计时长 释放（已超时的视为马上释放）"""
+        now = self._now()
+        slow = self._slowdown(gpu_id, placed=True)
+        releases = []
+        for rid in self._by_gpu.get(gpu_id, ()):
+            r = self._reqs[rid]
+            left = (r.started_at - now).total_seconds() + _expected_sec(r) * slow if r.started_at else 0.0
+            releases.append((max(left, 0.0), r.required_memory))
+        return Profile(self._gpu_free_mem(gpu_id), releases)
+
+    def _place(self, req: RequestRecord, gpu_id: str) -> bool:
+        """
+        出队、分配显存并置 running；仿真模式下设置完成计时器。
+        显存分配失败（卡已离线/注销或显存不够）时请求留在队列里，返回 False
+        """
+        if not self._alloc_mem(gpu_id, req.required_memory):
+            return False
+        self._dequeue(req)
+        req = self._update_req(req, assigned_gpu_id=gpu_id, status="running", started_at=self._now())
+        if self._auto_dispatch:
+            self._completions.schedule(req.id, self._runtime(req))
+        return True
 
     def _auto_complete(self, request_id: str):
         # 到时自动完成并释放显存
         self.update_request_status(request_id, "completed")
 
     # ----------------- 控制模拟 -----------------
+    def start(self):
+        """启动仿真（可重复调用）。asyncio 模式需在事件循环里调用，例如 FastAPI 的 lifespan"""
+        for rid in self._resume:
+            self._completions.schedule(rid, self._runtime(self._reqs[rid]))
+        self._resume = []
+        for gid in self._resume_gpus:
+            self._last_beat[gid] = time.monotonic()
+            self._liveness.schedule(gid, self._gpus[gid].heartbeat_ttl)
+        self._resume_gpus = []
+        if self._req_text.deferred and self._index_task is None:
+            # 从快照恢复的请求还没建文本索引：分批补建，期间 q 查询对未建部分逐条比对
+            if self._mode == "asyncio":
+                self._index_task = asyncio.get_running_loop().create_task(self._build_index_task())
+            else:
+                self._index_task = Thread(target=self._build_index_loop, name="text-index", daemon=True)
+                self._index_task.start()
+        if self._archive is not None and self._retention is None:
+            if self._mode == "asyncio":
+                self._retention = asyncio.get_running_loop().create_task(self._retention_task())
+            else:
+                self._retention = Thread(target=self._retention_loop, name="retention", daemon=True)
+                self._retention.start()
+        if self._telemetry is None and (provider := make_provider()) is not None:
+            self._telemetry = Telemetry(self._telemetry_targets, provider)
+            self._telemetry.start()
+        if not self._enable_simulation: return
+        if self._mode == "thread":
+            if self._sim_thread is None:
+                self._sim_thread = Thread(target=self._simulate_loop, daemon=True)
+                self._sim_thread.start()
+        elif self._sim_task is None:
+            self._sim_task = asyncio.get_running_loop().create_task(self._simulate_task())
+
+    def _build_index_loop(self):
+        more = True
+        while more:
+            with self._lock:
+                more = self._req_text.build_step(INDEX_BUILD_CHUNK)
+            time.sleep(0)
+
+    async def _build_index_task(self):
+        while self._req_text.build_step(INDEX_BUILD_CHUNK):
+            await asyncio.sleep(0)
+
     def stop_simulation(self):
         self._sim_stop.set()
+        if self._sim_task is not None:
+            self._sim_task.cancel()
+        if isinstance(self._index_task, asyncio.Task):
+            self._index_task.cancel()
+        if isinstance(self._retention, asyncio.Task):
+            self._retention.cancel()
 
 def str_uuid() -> str:
     return str(uuid.uuid4())
 
-scheduler = VirtualScheduler(enable_simulation=True)
+def encode_cursor(req: RequestRecord) -> str:
+    """分页游标：创建时间 + id，翻页时只返回排在它之后（更早）的请求"""
+    return f"{req.created_at.isoformat()}|{req.id}"
+
+def _decode_cursor(cursor: str) -> tuple[datetime, str]:
+    ts, _, rid = cursor.partition("|")
+    return _naive(datetime.fromisoformat(ts)), rid
+
+def _time_key(r: RequestRecord) -> tuple[datetime, str]:
+    return r.created_at, r.id
+
+def _fill(out: dict[str, Optional[RequestRecord]], archived: dict[str, RequestRecord]) -> List[RequestRecord]:
+    """内存里没有的用归档里取到的补上，两边都没有的丢掉"""
+    return [r if r is not None else archived[rid] for rid, r in out.items() if r is not None or rid in archived]
+
+def _schedulable(g: GpuRecord) -> bool:
+    """共享且在线的卡才参与调度 / 手动匹配"""
+    return g.is_shared and g.status != "offline"
+
+def _cover(cands: list[tuple[RequestRecord, float]], need: int) -> Optional[list[tuple[RequestRecord, float]]]:
+    """按顺序取候选直到腾出的显存够 need；不够返回 None"""
+    out, freed = [], 0
+    for c in cands:
+        if freed >= need: break
+        out.append(c)
+        freed += c[0].required_memory
+    return out if freed >= need else None
+
+def _by_memory_desc(c: tuple[RequestRecord, float]):
+    return -c[0].required_memory
+
+def _by_elapsed(c: tuple[RequestRecord, float]):
+    return c[1]
+
+def _expected_sec(r: RequestRecord) -> float:
+    """预计运行时长（秒）：estimated_duration 以分钟计，至少按 1 分钟算"""
+    return max(r.estimated_duration, 1) * 60.0
+
+def _ended_at(r: RequestRecord) -> datetime:
+    return r.completed_at or r.created_at
+
+def _naive(dt: datetime|None) -> datetime|None:
+    """内部时间都是本地 naive 时间；带时区的查询参数先换算过来"""
+    if dt is None or dt.tzinfo is None: return dt
+    return dt.astimezone().replace(tzinfo=None)
+
+if SCHEDULER_SOCKET:
+    from scheduler_remote import RemoteScheduler
+    scheduler = RemoteScheduler(SCHEDULER_SOCKET)
+else:
+    scheduler = VirtualScheduler(enable_simulation=True, mode=SCHEDULER_MODE, persist_dir=STATE_DIR,
+                                 archive_path=ARCHIVE_PATH)
+
+    REGISTRY.gauge("scheduler_queue_depth", "排队中的请求数", lambda: [((p,), n) for p, n in scheduler.queue_depth().items()],
+                   ("priority",))
+    REGISTRY.gauge("scheduler_objects", "常驻对象数量", lambda: [((k,), n) for k, n in scheduler.object_counts().items()],
+                   ("kind",))
@@ -0,0 +1,120 @@
+# scheduler_remote.py
+"""
+API worker 一侧的调度器代理（设置 SCHEDULER_SOCKET 时 scheduler_adapter.scheduler 就是它）。
+接口与 main.py 用到的 VirtualScheduler 方法相同，但都是协程，转发给 scheduler_server.py 起的调度器进程；
+记录类结果是调度器进程编码好的 JSON（rpc.Encoded），to_json 原样返回。
+事件：启动后保持一条转发连接，把调度器进程的事件帧广播给本 worker 的 SSE 订阅者；断线重连后让订阅者 resync。
+"""
+from typing import List, Optional
+import asyncio
+
+from events import EventHub
+from metrics import REGISTRY, HTTP_LATENCY
+from models import PlatformStats, ScheduleResult
+from records import dumps
+from rpc import AsyncClient, Encoded
+
+RECONNECT_SEC = 1.0
+
+
+class RemoteScheduler:
+    def __init__(self, path: str):
+        self._rpc = AsyncClient(path)
+        self.events = EventHub()
+        self.version = 0   # 转发连接上最近收到的版本号；只会偏旧，客户端据此做增量同步仍然正确
+        self._relay: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._relay is None:
+            self._relay = asyncio.get_running_loop().create_task(self._relay_task())
+
+    def close(self):
+        if self._relay is not None:
+            self._relay.cancel()
+            self._relay = None
+        self._rpc.close()
+
+    async def _relay_task(self):
+        while True:
+            try:
+                async for version, frames in self._rpc.stream("events"):
+                    self.version = version
+                    if frames is None: self.events.reset()
+                    else: self.events.publish_frames(frames)
+            except OSError:   # 调度器进程没起来或重启了
+                pass
+            self.events.reset()
+            await asyncio.sleep(RECONNECT_SEC)
+
+    # ----------------- 查询 -----------------
+    async def versions(self) -> tuple[int, int, int, int]:
+        return await self._rpc.call("versions")
+
+    async def stats(self) -> PlatformStats:
+        return await self._rpc.call("stats")
+
+    async def list_gpus(self, q: str|None=None, status: str|None=None) -> Encoded:
+        return await self._rpc.call("list_gpus", q=q, status=status)
+
+    async def changed_gpus(self, since: int) -> Optional[Encoded]:
+        return await self._rpc.call("changed_gpus", since)
+
+    async def list_requests(self, **kwargs) -> Encoded:
+        return await self._rpc.call("list_requests", **kwargs)
+
+    async def changed_requests(self, since: int) -> Optional[Encoded]:
+        return await self._rpc.call("changed_requests", since)
+
+    async def queue_depth(self) -> dict[str, int]:
+        return await self._rpc.call("queue_depth")
+
+    async def object_counts(self) -> dict[str, int]:
+        return await self._rpc.call("object_counts")
+
+    # ----------------- 修改 -----------------
+    async def create_request(self, **kwargs) -> Encoded:
+        return await self._rpc.call("create_request", **kwargs)
+
+    async def match_request(self, request_id: str, gpu_id: str) -> Optional[Encoded]:
+        return await self._rpc.call("match_request", request_id, gpu_id)
+
+    async def update_request_status(self, request_id: str, status: str) -> Optional[Encoded]:
+        return await self._rpc.call("update_request_status", request_id, status)
+
+    async def create_requests(self, items: List[tuple[str, int, int, str]]) -> List[str]:
+        return await self._rpc.call("create_requests", items)
+
+    async def match_requests(self, items: List[tuple[str, str]]) -> List[bool]:
+        return await self._rpc.call("match_requests", items)
+
+    async def update_statuses(self, items: List[tuple[str, str]]) -> List[bool]:
+        return await self._rpc.call("update_statuses", items)
+
+    async def schedule_pending(self, policy: str = "ffd") -> ScheduleResult:
+        return await self._rpc.call("schedule_pending", policy)
+
+    async def register_gpu(self, *args) -> Encoded:
+        return await self._rpc.call("register_gpu", *args)
+
+    async def deregister_gpu(self, gpu_id: str) -> bool:
+        return await self._rpc.call("deregister_gpu", gpu_id)
+
+    async def heartbeat(self, gpu_id: str) -> bool:
+        return await self._rpc.call("heartbeat", gpu_id)
+
+    async def heartbeats(self, gpu_ids: List[str]) -> List[bool]:
+        return await self._rpc.call("heartbeats", gpu_ids)
+
+    async def gpu_history(self, gpu_id: str, **kwargs) -> Optional[dict]:
+        return await self._rpc.call("gpu_history", gpu_id, **kwargs)
+
+    # ----------------- 输出 -----------------
+    def to_json(self, obj) -> bytes:
+        return obj.data if isinstance(obj, Encoded) else dumps(obj)
+
+    def next_cursor(self, items: Encoded) -> str:
+        return items.cursor
+
+    async def metrics(self) -> bytes:
+        """本 worker 的路由延迟 + 调度器进程的锁/放置/仿真指标"""
+        return REGISTRY.render(keep=lambda name: name == HTTP_LATENCY.name, collectors=False) + await self._rpc.call("metrics")
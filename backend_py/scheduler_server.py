@@ -0,0 +1,85 @@
+# scheduler_server.py
+"""
+多 worker 部署时的调度器进程：持有唯一的 VirtualScheduler，经 Unix socket（rpc.py）为各 API worker 服务。
+仿真、自动完成、WAL、归档都只在这个进程里跑；worker 只做 HTTP 解析与响应。
+
+    python scheduler_server.py --socket /tmp/gpu-sched.sock
+    SCHEDULER_SOCKET=/tmp/gpu-sched.sock uvicorn main:app --workers 4 --port 9000
+"""
+import argparse
+import asyncio
+import os
+import signal
+
+# 本进程就是调度器：去掉 SCHEDULER_SOCKET 再导入 scheduler_adapter，否则它会建一个连向自己的代理
+DEFAULT_SOCKET = os.environ.pop("SCHEDULER_SOCKET", None) or "/tmp/gpu-sched.sock"
+
+from scheduler_adapter import scheduler, encode_cursor
+from events import HEARTBEAT_SEC
+from metrics import REGISTRY, HTTP_LATENCY
+from rpc import Encoded, serve_async
+
+# 返回记录（或记录列表）的方法：在这里用调度器的片段缓存编码成 JSON，worker 原样写回
+RECORD_METHODS = {"list_gpus", "changed_gpus", "list_requests", "changed_requests",
+                  "create_request", "match_request", "update_request_status", "register_gpu"}
+PLAIN_METHODS = {"versions", "stats", "create_requests", "match_requests", "update_statuses",
+                 "schedule_pending", "queue_depth", "object_counts", "deregister_gpu", "heartbeat", "heartbeats",
+                 "gpu_history"}
+# 可能要读归档的方法：调用其协程版本，归档读放到线程里，不阻塞本进程的事件循环
+ASYNC_METHODS = {"list_requests", "changed_requests", "match_request", "update_request_status",
+                 "match_requests", "update_statuses"}
+RELAY_BUFFER = 10_000   # 转发给每个 worker 的事件最多积压多少帧
+
+
+def dispatch(method: str, args: tuple, kwargs: dict):
+    if method in ASYNC_METHODS:
+        return _await(method, getattr(scheduler, method + "_async")(*args, **kwargs))
+    if method in RECORD_METHODS:
+        return _encode(method, getattr(scheduler, method)(*args, **kwargs))
+    if method in PLAIN_METHODS:
+        return getattr(scheduler, method)(*args, **kwargs)
+    if method == "metrics":
+        return REGISTRY.render(keep=lambda name: name != HTTP_LATENCY.name)
+    if method == "events":
+        return _relay()
+    raise AttributeError(f"unknown scheduler method: {method}")
+
+def _encode(method: str, res):
+    if method not in RECORD_METHODS or res is None: return res
+    if not isinstance(res, list): return Encoded(scheduler.to_json(res))
+    cursor = encode_cursor(res[-1]) if method == "list_requests" and res else None
+    return Encoded(scheduler.to_json(res), len(res), cursor)
+
+async def _await(method: str, coro):
+    return _encode(method, await coro)
+
+async def _relay():
+    """事件推送：(当前版本, 帧列表)；帧列表为 None 表示积压溢出，空列表兼作保活（连接断开时写失败即退出）"""
+    sub = scheduler.events.subscribe(RELAY_BUFFER)
+    try:
+        yield scheduler.version, []
+        while True:
+            frames = await sub.next_frames(HEARTBEAT_SEC)
+            yield scheduler.version, frames
+    finally:
+        sub.close()
+
+
+async def serve(path: str):
+    scheduler.start()
+    server = await serve_async(path, dispatch)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    print(f"scheduler listening on {path}", flush=True)
+    await stop.wait()
+    server.close()
+    scheduler.close()
+    os.unlink(path)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket 路径（worker 的 SCHEDULER_SOCKET）")
+    asyncio.run(serve(ap.parse_args().socket))
@@ -0,0 +1,245 @@
+# simulation.py
+"""
+离散事件仿真：虚拟时钟 + 事件堆驱动与线上相同的调度逻辑（VirtualScheduler），没有任何 sleep。
+到达过程可以是带种子的泊松过程，也可以回放 CSV 轨迹；跑完输出利用率、排队等待分位数和 makespan，
+用来在上线前比较调度改动。
+
+    python simulation.py --jobs 100000 --rate 0.005 --seed 1
+    python simulation.py --trace jobs.csv
+    python simulation.py --backfill none         # 对比回填策略：none / easy / conservative
+    python simulation.py --preempt --aging 1800  # 开启抢占，优先级老化 30 分钟一档
+    python simulation.py --compare-placement     # 同一批任务分别用 largest_free / ect 选卡，对比 makespan 与周转时间
+"""
+from datetime import datetime, timedelta
+from typing import Callable, Hashable, Iterable, Iterator, List, NamedTuple
+import argparse
+import csv
+import heapq
+import itertools
+import json
+import random
+import time
+
+import numpy as np
+
+from records import RequestRecord
+from scheduler_adapter import VirtualScheduler, DEFAULT_GPUS, REQ_MEMORY_CHOICES, REQ_DURATION_CHOICES, \
+    REQ_PRIORITY_CHOICES, SCHEDULER_BACKFILL, SCHEDULER_PREEMPT, PRIORITY_AGING_SEC, PLACEMENT_POLICIES, \
+    PLACEMENT_POLICY
+from backfill import MODES as BACKFILL_MODES
+
+
+class Job(NamedTuple):
+    arrival: float              # 到达时刻（秒，相对仿真开始）
+    required_memory: int
+    runtime: float              # 实际运行时长（秒）：在基准卡（performance_score = PERF_REF_SCORE）上独占运行
+    estimated_duration: int = 0  # 提交时给出的估计时长（分钟），同 API 字段
+    priority: str = "normal"
+
+
+def poisson_arrivals(n: int, rate: float, seed: int = 0) -> Iterator[Job]:
+    """n 个任务，到达间隔服从均值 1/rate 秒的指数分布；显存/估计时长/优先级的取值同在线仿真，
+    实际运行时长为估计时长的 30%~100%"""
+    rng = random.Random(seed)
+    t = 0.0
+    for _ in range(n):
+        t += rng.expovariate(rate)
+        est = rng.choice(REQ_DURATION_CHOICES)
+        yield Job(t, rng.choice(REQ_MEMORY_CHOICES), est * 60 * rng.uniform(0.3, 1.0), est,
+                  rng.choice(REQ_PRIORITY_CHOICES))
+
+
+def load_trace(path: str) -> Iterator[Job]:
+    """CSV 轨迹：表头含 arrival, required_memory, runtime，可选 estimated_duration, priority；按 arrival 升序"""
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            runtime = float(row["runtime"])
+            yield Job(float(row["arrival"]), int(row["required_memory"]), runtime,
+                      int(row.get("estimated_duration") or -(-runtime // 60)), row.get("priority") or "normal")
+
+
+class EventLoop:
+    """虚拟时钟：事件按 (时刻, 序号) 出堆，时钟直接跳到下一个事件"""
+
+    def __init__(self, epoch: datetime = datetime(2025, 1, 1)):
+        self.now = 0.0
+        self.epoch = epoch
+        self._heap: list[tuple[float, int, Callable, tuple]] = []
+        self._seq = itertools.count()
+        self.events = 0
+
+    def at(self, t: float, fn: Callable, *args):
+        heapq.heappush(self._heap, (t, next(self._seq), fn, args))
+
+    def run(self):
+        heap = self._heap
+        while heap:
+            t, _, fn, args = heapq.heappop(heap)
+            self.now = t
+            self.events += 1
+            fn(*args)
+
+
+class VirtualTimer:
+    """与 timers.DeadlineTimer 接口相同，截止时间放进 EventLoop 的事件堆；被取消/覆盖的事件出堆时按序号丢弃"""
+
+    def __init__(self, loop: EventLoop, callback: Callable[[Hashable], None]):
+        self._loop = loop
+        self._callback = callback
+        self._live: dict[Hashable, int] = {}
+        self._seq = itertools.count()
+
+    def schedule(self, key: Hashable, delay: float):
+        seq = self._live[key] = next(self._seq)
+        self._loop.at(self._loop.now + delay, self._fire, key, seq)
+
+    def cancel(self, key: Hashable):
+        self._live.pop(key, None)
+
+    def pending(self) -> int:
+        return len(self._live)
+
+    def stop(self):
+        self._live.clear()
+
+    def _fire(self, key: Hashable, seq: int):
+        if self._live.get(key) != seq: return
+        del self._live[key]
+        self._callback(key)
+
+
+class SimScheduler(VirtualScheduler):
+    """时钟、计时器、运行时长换成仿真提供的；其余（排队、选卡、显存记账、状态流转）都是线上那一套"""
+
+    def __init__(self, loop: EventLoop, gpus: List[tuple[str, int, int, str]] = DEFAULT_GPUS,
+                 backfill: str = SCHEDULER_BACKFILL, preempt: bool = SCHEDULER_PREEMPT,
+                 aging_sec: float = PRIORITY_AGING_SEC, placement: str = PLACEMENT_POLICY):
+        self._loop = loop
+        self._runtimes: dict[str, float] = {}   # 被抢占的任务重新运行时从头算
+        self._ids = itertools.count(1)
+        super().__init__(seed_users=0, enable_simulation=True, mode="virtual", gpus=gpus, backfill=backfill,
+                         preempt=preempt, aging_sec=aging_sec, placement=placement)
+
+    def _now(self) -> datetime:
+        return self._loop.epoch + timedelta(seconds=self._loop.now)
+
+    def _new_id(self) -> str:
+        return f"sim-{next(self._ids):08d}"   # 确定的 id：同一种子多次回放结果完全一致
+
+    def _make_timer(self, callback, name: str):
+        return VirtualTimer(self._loop, callback)
+
+    def _runtime(self, req: RequestRecord) -> float:
+        # 同线上的运行时长模型：按所在卡的性能分与开始时的同卡任务数缩放
+        return self._runtimes[req.id] * self._slowdown(req.assigned_gpu_id, placed=True)
+
+    def _seed_requests(self):
+        pass
+
+    def submit(self, job: Job):
+        """任务到达：入队并立即尝试调度（同在线仿真的 _auto_spawn_and_schedule）"""
+        with self._mutate():
+            req = self._create("", job.required_memory, job.estimated_duration, job.priority, self._now())
+            self._runtimes[req.id] = job.runtime
+            self._dispatch_pending()
+
+
+def simulate(jobs: Iterable[Job], gpus: List[tuple[str, int, int, str]] = DEFAULT_GPUS,
+             backfill: str = SCHEDULER_BACKFILL, preempt: bool = SCHEDULER_PREEMPT,
+             aging_sec: float = PRIORITY_AGING_SEC, placement: str = PLACEMENT_POLICY) -> dict:
+    """回放 jobs 直到所有事件处理完，返回统计结果（时间单位：秒）"""
+    loop = EventLoop()
+    sched = SimScheduler(loop, gpus, backfill, preempt, aging_sec, placement)
+    arrivals = iter(jobs)
+
+    def arrive(job: Job):
+        sched.submit(job)
+        nxt = next(arrivals, None)
+        if nxt is not None:
+            loop.at(nxt.arrival, arrive, nxt)
+
+    t0 = time.perf_counter()
+    first = next(arrivals, None)
+    if first is not None:
+        loop.at(first.arrival, arrive, first)
+    loop.run()
+    wall = time.perf_counter() - t0
+
+    # 等待时间 = 开始运行 - 到达；从未运行的（比任何一块卡都大）单独计数
+    epoch = loop.epoch
+    reqs = [r for r in sched._reqs.values() if r.started_at is not None]
+    waits = np.fromiter(((r.started_at - r.created_at).total_seconds() for r in reqs), dtype=np.float64,
+                        count=len(reqs))
+    arrived = min((r.created_at for r in sched._reqs.values()), default=epoch)
+    finished = max((r.completed_at for r in reqs if r.completed_at), default=arrived)
+    makespan = (finished - arrived).total_seconds()
+    busy = sum(r.required_memory * (r.completed_at - r.started_at).total_seconds() for r in reqs if r.completed_at)
+    # 周转时间 = 完成 - 到达（含排队和在较慢/较挤的卡上多花的时间）
+    turnaround = np.fromiter(((r.completed_at - r.created_at).total_seconds() for r in reqs if r.completed_at),
+                             dtype=np.float64)
+    capacity = sum(mem for _, mem, _, _ in gpus)
+    pct = np.percentile(waits, [50, 90, 99]) if len(waits) else np.zeros(3)
+    # 按显存需求分组的平均等待：大请求是否被小请求插队饿死
+    mems = np.fromiter((r.required_memory for r in reqs), dtype=np.int64, count=len(reqs))
+    by_mem = {int(m): round(float(waits[mems == m].mean()), 3) for m in np.unique(mems)}
+    # 按优先级的等待分位数：high 的启动延迟是否可预期、low 是否被饿死
+    pris = np.array([r.priority for r in reqs])
+    by_pri = {p: {"p50": round(float(np.percentile(waits[pris == p], 50)), 3),
+                  "p99": round(float(np.percentile(waits[pris == p], 99)), 3),
+                  "max": round(float(waits[pris == p].max()), 3)}
+              for p in REQ_PRIORITY_CHOICES if (pris == p).any()}
+    return {
+        "placement": placement,
+        "backfill": backfill,
+        "preempt": preempt,
+        "aging_sec": aging_sec,
+        "preemptions": sched._preemptions,
+        "jobs": len(sched._reqs),
+        "completed": len(reqs),
+        "never_started": len(sched._reqs) - len(reqs),
+        "makespan_sec": round(makespan, 3),
+        "mem_utilization": round(busy / (capacity * makespan), 4) if makespan else 0.0,
+        "wait_mean_sec": round(float(waits.mean()), 3) if len(waits) else 0.0,
+        "wait_p50_sec": round(float(pct[0]), 3),
+        "wait_p90_sec": round(float(pct[1]), 3),
+        "wait_p99_sec": round(float(pct[2]), 3),
+        "wait_max_sec": round(float(waits.max()), 3) if len(waits) else 0.0,
+        "turnaround_mean_sec": round(float(turnaround.mean()), 3) if len(turnaround) else 0.0,
+        "turnaround_p99_sec": round(float(np.percentile(turnaround, 99)), 3) if len(turnaround) else 0.0,
+        "wait_mean_by_memory_sec": by_mem,
+        "wait_by_priority_sec": by_pri,
+        "events": loop.events,
+        "wall_sec": round(wall, 3),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="离散事件仿真：回放任务到达过程，评估调度效果")
+    ap.add_argument("--jobs", type=int, default=100_000, help="泊松到达的任务数")
+    ap.add_argument("--rate", type=float, default=0.005, help="平均每秒到达的任务数")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--trace", help="CSV 轨迹文件；给出时忽略 --jobs/--rate/--seed")
+    ap.add_argument("--backfill", choices=BACKFILL_MODES, default=SCHEDULER_BACKFILL, help="回填策略")
+    ap.add_argument("--preempt", action=argparse.BooleanOptionalAction, default=SCHEDULER_PREEMPT,
+                    help="high 请求放不下时抢占低优先级任务")
+    ap.add_argument("--aging", type=float, default=PRIORITY_AGING_SEC, help="优先级老化：等待多少秒提升一档，0 为不老化")
+    ap.add_argument("--placement", choices=PLACEMENT_POLICIES, default=PLACEMENT_POLICY, help="选卡策略")
+    ap.add_argument("--compare-placement", action="store_true",
+                    help="同一批任务依次用各选卡策略回放，输出各自结果及 ect 相对 largest_free 的变化")
+    args = ap.parse_args()
+    jobs = load_trace(args.trace) if args.trace else poisson_arrivals(args.jobs, args.rate, args.seed)
+    kw = dict(backfill=args.backfill, preempt=args.preempt, aging_sec=args.aging)
+    if not args.compare_placement:
+        print(json.dumps(simulate(jobs, placement=args.placement, **kw), ensure_ascii=False, indent=2))
+        return
+    jobs = list(jobs)
+    out = {p: simulate(jobs, placement=p, **kw) for p in PLACEMENT_POLICIES}
+    base, new = out["largest_free"], out["ect"]
+    out["ect_vs_largest_free"] = {k: round(new[k] / base[k] - 1, 4) if base[k] else 0.0
+                                  for k in ("makespan_sec", "turnaround_mean_sec", "turnaround_p99_sec",
+                                            "wait_mean_sec")}
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
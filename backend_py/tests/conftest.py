@@ -0,0 +1,6 @@
+# conftest.py
+"""测试直接导入 backend_py 下的模块（与 uvicorn main:app 相同的平铺导入方式）"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
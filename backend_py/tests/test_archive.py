@@ -0,0 +1,172 @@
+# test_archive.py
+from collections import Counter
+
+import pytest
+
+from scheduler_adapter import VirtualScheduler, encode_cursor, TERMINAL_STATUSES
+
+
+def make(path, history_max: int = 10 ** 9) -> VirtualScheduler:
+    """持久化 + 归档到 path；asyncio 模式不调 start()，没有后台归档，归档只由测试触发"""
+    return VirtualScheduler(enable_simulation=False, mode="asyncio", persist_dir=str(path),
+                            archive_path=str(path / "archive.sqlite3"), history_max=history_max)
+
+
+def fill(s: VirtualScheduler, batches: int = 6, n: int = 25) -> list[str]:
+    """分几批创建（创建时间各不相同），每批大部分结束，少数留在 pending/running；返回全部 id"""
+    ids = []
+    for b in range(batches):
+        new = s.create_requests([(f"batch {b} job {i}", 1, 5, "normal") for i in range(n)])
+        s.update_statuses([(rid, "failed" if i % 7 == 0 else "completed") for i, rid in enumerate(new[:n - 3])])
+        s.update_request_status(new[-1], "running")
+        ids += new
+    return ids
+
+
+def retain(s: VirtualScheduler, keep: int) -> int:
+    s._history_max = keep
+    n = s.enforce_retention()
+    s._deletes.join()
+    return n
+
+
+def key(r):
+    return (r.created_at, r.id)
+
+
+def check_all(s: VirtualScheduler, want: dict):
+    """每个请求恰好出现一次、内容与 want 相同；统计计数与 want 一致"""
+    got = s.list_requests()
+    assert Counter(r.id for r in got) == Counter(list(want))
+    assert {r.id: r for r in got} == want
+    assert s.stats().completed_requests == sum(r.status == "completed" for r in want.values())
+    assert all(key(a) > key(b) for a, b in zip(got, got[1:]))
+
+
+def snapshot_of(s: VirtualScheduler) -> dict:
+    return {r.id: r for r in s.list_requests()}
+
+
+# ----------------- 重启对账 -----------------
+def crash_after_put(s: VirtualScheduler, keep: int) -> list:
+    """归档一批写进了 SQLite，移出内存的那一帧 WAL 还没写就崩溃：只做 enforce_retention 的前两步"""
+    s._history_max = keep
+    victims, version = s._retention_victims(), s._version
+    assert victims
+    s._archive_put(victims, version)
+    return victims
+
+
+def test_crash_between_archive_put_and_drop_frame(tmp_path):
+    s = make(tmp_path)
+    fill(s)
+    assert retain(s, 100) > 0                  # 第一批正常归档，已确认
+    victims = crash_after_put(s, 60)
+    want = snapshot_of(s)
+    s.close()
+
+    s2 = make(tmp_path, history_max=60)
+    try:
+        check_all(s2, want)
+        # 与归档里相同的补做了移出，不在内存里，也不会留在两边
+        assert not any(r.id in s2._reqs for r in victims)
+        assert sum(s2._archived.values()) == s2._archive.counts().total()
+        assert s2._archive.get(r.id for r in victims).keys() == {r.id for r in victims}
+    finally:
+        s2.close()
+    s3 = make(tmp_path, history_max=60)   # 对账的结果本身也落盘了
+    try:
+        check_all(s3, want)
+    finally:
+        s3.close()
+
+
+def test_crash_after_put_with_request_changed_since(tmp_path):
+    s = make(tmp_path)
+    fill(s)
+    victims = crash_after_put(s, 60)
+    changed = victims[0].id
+    s.update_request_status(changed, "pending")   # 归档写入之后又改过：以内存（WAL）为准
+    want = snapshot_of(s)
+    s.close()
+
+    s2 = make(tmp_path, history_max=60)
+    try:
+        check_all(s2, want)
+        assert s2._reqs[changed].status == "pending"
+        assert changed not in s2._archive.get([changed])
+    finally:
+        s2.close()
+
+
+def test_crash_before_unarchived_request_is_deleted(tmp_path):
+    # 从归档搬回内存、WAL 已落盘，但还没从归档删掉就崩溃
+    s = make(tmp_path)
+    ids = fill(s)
+    assert retain(s, 50) > 0
+    archived = next(rid for rid in ids if rid not in s._reqs and s._cold.get(rid) is None)
+    s._deletes.put = lambda ids: None         # 删除线程收不到这次删除
+    s.update_request_status(archived, "pending")
+    assert archived in s._archive.get([archived])
+    want = snapshot_of(s)
+    del s._deletes.put                        # close() 要靠它通知删除线程退出
+    s.close()
+
+    s2 = make(tmp_path)
+    try:
+        check_all(s2, want)
+        assert s2._reqs[archived].status == "pending"
+        assert archived not in s2._archive.get([archived])
+    finally:
+        s2.close()
+
+
+# ----------------- 分页：内存 + 快照冷数据 + 归档 -----------------
+@pytest.fixture
+def split_store(tmp_path):
+    s = make(tmp_path)
+    ids = fill(s)
+    s._store._snapshot_every = 1
+    s.create_request("pad", 1, 1)              # 这一帧之后写快照，包含前面的全部请求
+    s.close()
+    s = make(tmp_path)                         # 快照里已结束的请求留在 mmap 里
+    assert len(s._cold) > 0
+    assert retain(s, 80) > 0                   # 最早结束的一部分进归档
+    ids += fill(s, batches=2)                  # 之后的请求只在内存里
+    assert len(s._cold) > 0 and sum(s._archived.values()) > 0
+    assert any(s._by_status.get(st) for st in TERMINAL_STATUSES)
+    yield s, ids
+    s.close()
+
+
+def pages(s: VirtualScheduler, limit: int, total: int, **kw) -> list:
+    """按游标翻到底；翻出的条数超过 total 说明游标没往前走"""
+    out, cursor = [], None
+    while True:
+        page = s.list_requests(limit=limit, cursor=cursor, **kw)
+        assert len(page) <= limit
+        if not page: return out
+        out += page
+        assert len(out) <= total
+        cursor = s.next_cursor(page)
+
+
+@pytest.mark.parametrize("limit", [1, 7, 50])
+@pytest.mark.parametrize("status", [None, "completed", "failed"])
+def test_cursor_pages_are_gap_free_and_ordered(split_store, limit, status):
+    s, ids = split_store
+    full = s.list_requests(status=status)
+    assert len({r.id for r in full}) == len(full)
+    if status is None:
+        assert {r.id for r in full} >= set(ids)
+    got = pages(s, limit, len(full), status=status)
+    assert [r.id for r in got] == [r.id for r in full]
+    assert all(key(a) > key(b) for a, b in zip(got, got[1:]))
+
+
+def test_cursor_from_archived_request(split_store):
+    s, _ = split_store
+    full = s.list_requests()
+    i = next(i for i, r in enumerate(full) if s._archive.get([r.id]))
+    rest = s.list_requests(cursor=encode_cursor(full[i]))
+    assert [r.id for r in rest] == [r.id for r in full[i + 1:]]
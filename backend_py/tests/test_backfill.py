@@ -0,0 +1,113 @@
+# test_backfill.py
+import pytest
+
+from backfill import Profile, Reservations
+from scheduler_adapter import PERF_REF_SCORE, CO_TENANCY_SLOWDOWN
+from simulation import EventLoop, Job, SimScheduler
+
+ONE_GPU = [("G", 16, PERF_REF_SCORE, "8.0")]
+
+
+# ----------------- Profile -----------------
+def test_profile_fits_and_earliest():
+    p = Profile(4, [(10.0, 8), (20.0, 4)])   # 现在 4，10 秒后 12，20 秒后 16
+    assert p.fits(4, 0.0, 100.0)
+    assert not p.fits(8, 0.0, 5.0)
+    assert p.fits(12, 10.0, 50.0)
+    assert not p.fits(16, 10.0, 50.0)
+    assert p.earliest(4, 1.0) == 0.0
+    assert p.earliest(12, 5.0) == 10.0
+    assert p.earliest(16, 5.0) == 20.0
+    assert p.earliest(20, 5.0) is None
+
+
+def test_profile_occupy_and_same_time_deltas():
+    p = Profile(8, [(10.0, 8)])
+    p.occupy(16, 10.0, 30.0)                 # 10 秒时 +8 与 -16 同时发生，合并后再比较
+    assert p.fits(8, 0.0, 10.0)
+    assert not p.fits(8, 0.0, 11.0)
+    assert p.fits(16, 40.0, 5.0)
+    assert p.earliest(16, 5.0) == 40.0
+
+
+# ----------------- Reservations -----------------
+def test_reserve_picks_earliest_completion():
+    profiles = {"fast": Profile(0, [(30.0, 16)]), "slow": Profile(16)}
+    plan = Reservations(lambda gid: profiles[gid])
+    # slow 现在就有空但要跑 100 秒；fast 30 秒后空出来，跑 50 秒，80 秒时先完成
+    assert plan.reserve([("slow", 100.0), ("fast", 50.0)], 16)
+    assert plan.reserved == {"fast"} and plan.count == 1
+    assert not profiles["fast"].fits(1, 30.0, 1.0)
+    # 没预留的卡不受限制；预留的卡上只有预留开始前结束的才行
+    assert plan.allows("slow", 16, 1000.0)
+    assert plan.allows("fast", 0, 30.0)
+    assert not plan.allows("fast", 1, 31.0)
+
+
+def test_reserve_fails_when_no_gpu_can_ever_hold_it():
+    plan = Reservations(lambda gid: Profile(8, [(10.0, 8)]))
+    assert not plan.reserve([("a", 10.0)], 24)
+    assert plan.count == 0 and not plan.reserved
+
+
+def test_commit_occupies_reserved_profile():
+    profiles = {"g": Profile(8, [(100.0, 8)])}
+    plan = Reservations(lambda gid: profiles[gid])
+    plan.reserve([("g", 50.0)], 16)          # [100, 150)
+    assert plan.allows("g", 8, 90.0)
+    plan.commit("g", 8, 90.0)
+    assert not plan.allows("g", 1, 1.0)      # 现在的 8 已经占满
+
+
+# ----------------- 调度（EASY / none） -----------------
+def run(backfill: str, jobs: list[Job], probe_at: float):
+    """回放 jobs，在 probe_at 时刻记下各请求的状态；返回 (调度器, 当时的状态)"""
+    loop = EventLoop()
+    s = SimScheduler(loop, ONE_GPU, backfill=backfill, preempt=False, placement="ect")
+    for job in jobs:
+        loop.at(job.arrival, s.submit, job)
+    seen = {}
+    loop.at(probe_at, lambda: seen.update({r.id: r.status for r in s.list_requests()}))
+    loop.run()
+    return s, seen
+
+
+def ids(n: int) -> list[str]:
+    """前 n 个请求的 id（仿真 id 按创建顺序编号，GPU 先占用了前几个）"""
+    return [f"sim-{i:08d}" for i in range(len(ONE_GPU) + 1, len(ONE_GPU) + n + 1)]
+
+
+JOBS = [
+    Job(0.0, 8, 3600.0, 60),    # A：跑满 1 小时
+    Job(1.0, 16, 1800.0, 30),   # B：要整块卡，等 A 结束，预留 [3600, ...)
+    Job(2.0, 4, 1800.0, 30),    # C：预计在预留开始前结束，可以先上
+    Job(3.0, 4, 5400.0, 90),    # D：会跨过预留开始时刻，不能先上
+]
+
+
+def test_easy_backfills_only_jobs_that_end_before_the_reservation():
+    s, seen = run("easy", JOBS, 10.0)
+    a, b, c, d = ids(4)
+    assert seen == {a: "running", b: "pending", c: "running", d: "pending"}
+    reqs = {r.id: r for r in s.list_requests()}
+    # B 在 A 结束时立刻开始，D 排在 B 之后
+    assert reqs[b].started_at == reqs[a].completed_at
+    assert reqs[d].started_at >= reqs[b].completed_at
+    # C 与 A 同卡运行，按同卡任务数放慢
+    assert (reqs[c].completed_at - reqs[c].started_at).total_seconds() == pytest.approx(1800 * (1 + CO_TENANCY_SLOWDOWN))
+
+
+def test_without_backfill_small_jobs_jump_ahead():
+    s, seen = run("none", JOBS, 10.0)
+    a, b, c, d = ids(4)
+    assert seen == {a: "running", b: "pending", c: "running", d: "running"}
+    reqs = {r.id: r for r in s.list_requests()}
+    assert reqs[b].started_at >= reqs[d].completed_at
+
+
+def test_overdue_jobs_count_as_releasing_now():
+    # A 估计 1 分钟、实际跑 1 小时：超时后按马上结束算，B 的预留从现在开始，C 不能先上
+    jobs = [Job(0.0, 8, 3600.0, 1), Job(100.0, 16, 600.0, 10), Job(101.0, 4, 60.0, 1)]
+    _, seen = run("easy", jobs, 200.0)
+    a, b, c = ids(3)
+    assert seen == {a: "running", b: "pending", c: "pending"}
@@ -0,0 +1,90 @@
+# test_packing.py
+import random
+
+import numpy as np
+import pytest
+
+from packing import pack, POLICIES
+
+
+def greedy(required, free, rank, policy):
+    """逐个请求放置的参照实现：按 (优先级, 显存降序) 依次挑卡"""
+    free = list(free)
+    out = [-1] * len(required)
+    for i in sorted(range(len(required)), key=lambda i: (rank[i], -required[i])):
+        fits = [g for g in range(len(free)) if free[g] >= required[i]]
+        if not fits: continue
+        if policy == "ffd": g = fits[0]
+        elif policy == "best_fit": g = min(fits, key=lambda g: (free[g], g))
+        else: g = min(fits, key=lambda g: (-free[g], g))
+        out[i] = g
+        free[g] -= required[i]
+    return out
+
+
+def test_ffd_fills_gpus_in_order():
+    # 降序：10 放第 0 块（剩 2），8、6 放第 1 块（剩 2），4 哪块都放不下
+    assert pack([4, 10, 6, 8], [12, 16]).tolist() == [-1, 0, 1, 1]
+
+
+def test_best_fit_prefers_tightest_gpu():
+    assert pack([8, 8], [24, 10, 16], policy="best_fit").tolist() == [1, 2]
+
+
+def test_worst_fit_spreads_over_most_free():
+    # 24 → 16 后与第 2 块并列最空闲，取下标小的；之后第 2 块最空闲
+    assert pack([8, 8, 8], [24, 10, 16], policy="worst_fit").tolist() == [0, 0, 2]
+
+
+def test_rank_goes_first_and_unplaced_is_minus_one():
+    # 同样 10G，rank 0 的先放；只有一块 12G 的卡，rank 1 的放不下
+    assert pack([10, 10], [12], rank=np.array([1, 0])).tolist() == [-1, 0]
+    assert pack([30], [24, 16]).tolist() == [-1]
+
+
+def test_empty_inputs():
+    assert pack([], [24]).tolist() == []
+    assert pack([4, 8], []).tolist() == [-1, -1]
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        pack([4], [8], policy="random")
+
+
+@pytest.mark.parametrize("policy", POLICIES)
+def test_matches_one_by_one_greedy(policy):
+    rnd = random.Random(policy)
+    for _ in range(300):
+        required = [rnd.choice([1, 2, 4, 8, 12, 16, 24]) for _ in range(rnd.randint(1, 40))]
+        free = [rnd.randint(0, 48) for _ in range(rnd.randint(1, 6))]
+        rank = [rnd.randint(0, 2) for _ in required]
+        got = pack(np.array(required), np.array(free), np.array(rank), policy)
+        assert got.tolist() == greedy(required, free, rank, policy), (required, free, rank)
+        # 每块卡分到的显存不超过其可用显存
+        used = np.bincount(got[got >= 0], weights=np.array(required)[got >= 0], minlength=len(free))
+        assert (used <= np.array(free)).all()
+
+
+@pytest.mark.parametrize("policy", POLICIES)
+def test_schedule_pending_places_queue(policy):
+    from scheduler_adapter import VirtualScheduler, PRIORITY_RANK
+    s = VirtualScheduler(enable_simulation=False, mode="asyncio")
+    try:
+        for mem, pri in [(12, "low"), (4, "normal"), (16, "high"), (8, "normal"), (200, "high")]:
+            s.create_request("batch", mem, 30, pri)
+        gids = [g.id for g in s.list_gpus() if g.is_shared and g.status != "offline"]
+        free = [s._gpu_free_mem(gid) for gid in gids]
+        reqs = {r.id: r for r in s.list_requests(status="pending")}
+        queued = [reqs[rid] for rid in sorted(s._queued, key=s._queued.__getitem__)]   # 入队顺序，同 schedule_pending
+        res = s.schedule_pending(policy)
+        want = greedy([r.required_memory for r in queued], free,
+                      [PRIORITY_RANK[r.priority] for r in queued], policy)
+        assert {p.request_id: p.gpu_id for p in res.placements} == \
+               {r.id: gids[g] for r, g in zip(queued, want) if g >= 0}
+        assert res.unplaced == want.count(-1) >= 1   # 200G 的放不下
+        running = {r.id: r for r in s.list_requests(status="running")}
+        for p in res.placements:
+            assert running[p.request_id].assigned_gpu_id == p.gpu_id
+    finally:
+        s.close()
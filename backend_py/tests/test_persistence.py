@@ -0,0 +1,186 @@
+# test_persistence.py
+import pytest
+
+from persistence import FRAME_HEAD, StateStore, read_frames
+from scheduler_adapter import VirtualScheduler, TERMINAL_STATUSES
+
+ACTIVE_STATUSES = ("pending", "matched", "running")
+
+
+def make(path) -> VirtualScheduler:
+    """持久化到 path 的调度器；不跑仿真，状态只由测试里的调用改变"""
+    return VirtualScheduler(enable_simulation=False, mode="thread", persist_dir=str(path))
+
+
+def dump(s: VirtualScheduler) -> tuple:
+    """对外可见的状态：全部请求（含快照里的冷数据）、GPU、统计"""
+    return ({r.id: r for r in s.list_requests()}, {g.id: g for g in s.list_gpus()}, s.stats())
+
+
+def by_status(s: VirtualScheduler) -> dict[str, set[str]]:
+    return {st: set(ids) for st, ids in s._by_status.items() if ids}
+
+
+def mutate(s: VirtualScheduler, n: int = 20) -> list[str]:
+    """各种写操作都走一遍：批量创建、匹配、开始运行、结束、注册/注销 GPU；返回新请求 id"""
+    ids = s.create_requests([(f"job {i}", 1 + i % 4, 10, ("high", "normal", "low")[i % 3]) for i in range(n)])
+    gid = next(g.id for g in s.list_gpus() if g.gpu_memory >= 8)
+    assert s.match_request(ids[0], gid) is not None
+    assert s.match_request(ids[1], gid) is not None
+    s.update_request_status(ids[1], "running")
+    assert all(s.update_statuses([(rid, "completed") for rid in ids[2:n // 2]]))
+    s.update_request_status(ids[n // 2], "failed")
+    g = s.register_gpu("T4", 16, 60, "7.5", heartbeat_ttl=3600)
+    gone = s.register_gpu("P100", 16, 50, "6.0", heartbeat_ttl=3600)
+    assert s.deregister_gpu(gone.id)
+    s.update_request_status(ids[-1], "running")
+    assert s.match_request(ids[-2], g.id) is not None
+    return ids
+
+
+def restart(s: VirtualScheduler, path) -> VirtualScheduler:
+    s.close()
+    return make(path)
+
+
+# ----------------- 重启 -----------------
+def test_restart_restores_requests_gpus_stats_and_indexes(tmp_path):
+    s = make(tmp_path)
+    mutate(s)
+    before, statuses, queued = dump(s), by_status(s), list(s._queued)
+    s2 = restart(s, tmp_path)
+    try:
+        assert dump(s2) == before
+        assert by_status(s2) == statuses
+        assert set(s2._queued) == set(queued)
+        assert s2.version >= s.version   # 版本不回退：重启前拿到的 since 仍然有效
+    finally:
+        s2.close()
+
+
+def test_restart_again_after_more_writes(tmp_path):
+    s = make(tmp_path)
+    ids = mutate(s)
+    s = restart(s, tmp_path)
+    s.update_request_status(ids[2], "pending")   # 恢复后再改：写到新的 WAL 段
+    s.create_request("after restart", 2, 5)
+    before, statuses = dump(s), by_status(s)
+    s2 = restart(s, tmp_path)
+    try:
+        assert dump(s2) == before and by_status(s2) == statuses
+    finally:
+        s2.close()
+
+
+# ----------------- 残帧 -----------------
+def _tear(path, how: str):
+    data = bytearray(path.read_bytes())
+    frames, _ = read_frames(path)
+    if how == "truncate":
+        del data[-3:]                       # 最后一帧只写了一半
+    else:
+        *_, last = _frame_offsets(data)
+        data[last + FRAME_HEAD.size] ^= 0xFF   # 负载坏了，crc 对不上
+    path.write_bytes(bytes(data))
+    assert len(read_frames(path)[0]) == len(frames) - 1
+
+
+def _frame_offsets(data: bytes):
+    pos = 0
+    while pos < len(data):
+        yield pos
+        pos += FRAME_HEAD.size + FRAME_HEAD.unpack_from(data, pos)[0]
+
+
+@pytest.mark.parametrize("how", ["truncate", "corrupt"])
+def test_torn_last_frame_is_dropped(tmp_path, how):
+    s = make(tmp_path)
+    mutate(s)
+    before, statuses, version = dump(s), by_status(s), s.version
+    last = s.create_request("lost in the crash", 1, 1)   # 恰好一帧
+    s.close()
+    (seg,) = sorted(tmp_path.glob("wal-*.log"))
+    _tear(seg, how)
+
+    s2 = make(tmp_path)
+    try:
+        assert dump(s2) == before and by_status(s2) == statuses
+        assert s2.version >= version
+        assert seg.stat().st_size == read_frames(seg)[1]   # 残帧已截掉
+        rid = s2.create_request("after recovery", 1, 1).id
+    finally:
+        s2.close()
+    s3 = make(tmp_path)
+    try:
+        reqs = dump(s3)[0]
+        assert rid in reqs and last.id not in reqs
+    finally:
+        s3.close()
+
+
+# ----------------- 快照 + WAL 尾部 -----------------
+def test_snapshot_then_wal_tail(tmp_path):
+    s = make(tmp_path)
+    s._store._snapshot_every = 5          # 第 5 帧后在后台写快照
+    ids = mutate(s, 40)
+    for _ in range(5):
+        s.create_request("pad", 1, 1)
+    s._store._snap_thread and s._store._snap_thread.join()
+    snaps = sorted(tmp_path.glob("snap-*.bin"))
+    assert snaps
+    snap_version = int(snaps[-1].stem.split("-")[1])
+    # 快照之后的写操作：新请求、把快照里已结束的请求改回 pending、结束一个运行中的
+    s._store._snapshot_every = 10 ** 9
+    s.update_request_status(ids[3], "pending")
+    s.update_request_status(ids[1], "completed")
+    tail = s.create_request("tail", 3, 3).id
+    assert s.version > snap_version
+    before = dump(s)
+    active = {st: set(s._by_status.get(st, ())) for st in ACTIVE_STATUSES}
+    s2 = restart(s, tmp_path)
+    try:
+        # 旧快照、被快照覆盖的 WAL 段都删了；快照之后的段还在
+        assert len(list(tmp_path.glob("snap-*.bin"))) == 1
+        assert all(int(p.stem.split("-")[1]) > snap_version for p in tmp_path.glob("wal-*.log"))
+        assert dump(s2) == before
+        assert s2._reqs[ids[3]].status == "pending" and tail in s2._reqs
+        assert {st: set(s2._by_status.get(st, ())) for st in ACTIVE_STATUSES} == active
+        # 快照里已结束、之后没改过的请求留在 mmap 里，不进内存和索引
+        assert len(s2._cold) > 0
+        reqs = before[0]
+        for st in TERMINAL_STATUSES:
+            want = {rid for rid, r in reqs.items() if r.status == st}
+            hot = set(s2._by_status.get(st, ()))
+            cold = {rid for rid in want if s2._cold.get(rid) is not None}
+            assert hot | cold == want and not hot & cold
+        assert ids[3] not in s2._by_status.get("completed", {}) and s2._cold.get(ids[3]) is None
+    finally:
+        s2.close()
+
+
+def test_segment_covered_by_snapshot_is_skipped(tmp_path):
+    # 旧段删除前崩溃：段里的帧快照都已包含，按版本跳过，不会把请求改回旧的内容
+    s = make(tmp_path)
+    s._store._snapshot_every = 10 ** 9
+    ids = mutate(s)
+    (seg,) = sorted(tmp_path.glob("wal-*.log"))
+    s.close()
+    stale = seg.read_bytes()
+    s = make(tmp_path)
+    s._store._snapshot_every = 1
+    s.update_request_status(ids[2], "pending")   # 快照在这一帧之后
+    s._store._snap_thread and s._store._snap_thread.join()
+    before = dump(s)
+    s.close()
+    assert not seg.exists()
+    seg.write_bytes(stale)
+    s2 = make(tmp_path)
+    try:
+        assert dump(s2) == before
+        assert s2._reqs[ids[2]].status == "pending"
+    finally:
+        s2.close()
+
+
+def test_empty_dir_recovers_nothing(tmp_path):
+    assert StateStore(tmp_path / "new").recover() is None
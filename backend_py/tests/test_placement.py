@@ -0,0 +1,91 @@
+# test_placement.py
+from datetime import datetime
+
+import pytest
+
+from backfill import Profile, Reservations
+from records import RequestRecord
+from scheduler_adapter import PERF_REF_SCORE, CO_TENANCY_SLOWDOWN
+from simulation import EventLoop, Job, SimScheduler
+
+
+def sched(gpus: list[tuple[str, int, int, str]], placement: str = "ect", jobs: list[Job] = ()):
+    """建调度器，在仿真开始时按顺序提交 jobs（不推进时钟，任务都还在运行）；返回 (调度器, GPU 名称 -> id)"""
+    s = SimScheduler(EventLoop(), gpus, backfill="none", preempt=False, placement=placement)
+    for job in jobs:
+        s.submit(job)
+    return s, {g.gpu_name: g.id for g in s._gpus.values()}
+
+
+def probe(mem: int, est: int = 10) -> RequestRecord:
+    """只用来选卡、不入队的请求"""
+    return RequestRecord(id="probe", task_description="", required_memory=mem, estimated_duration=est,
+                         created_at=datetime(2025, 1, 1))
+
+
+FAST_SMALL = [("fast", 16, 2 * PERF_REF_SCORE, "8.0"), ("slow", 24, PERF_REF_SCORE, "8.0")]
+
+
+# ----------------- 预计运行时长 -----------------
+def test_slowdown_scales_with_score_and_co_tenancy():
+    s, g = sched(FAST_SMALL, jobs=[Job(0.0, 4, 3600.0, 60)])
+    assert s._slowdown(g["slow"]) == pytest.approx(1.0)
+    # fast 上已有一个任务：性能分翻倍，同卡一个任务再慢 CO_TENANCY_SLOWDOWN
+    assert s._slowdown(g["fast"]) == pytest.approx(0.5 * (1 + CO_TENANCY_SLOWDOWN))
+    assert s._slowdown(g["fast"], placed=True) == pytest.approx(0.5)
+    assert s._expected_on(probe(4, 10), g["slow"]) == pytest.approx(600.0)
+
+
+# ----------------- ect / largest_free -----------------
+def test_ect_picks_fastest_gpu():
+    s, g = sched(FAST_SMALL)
+    assert s._pick_gpu(probe(8)) == g["fast"]
+
+
+def test_largest_free_ignores_speed():
+    s, g = sched(FAST_SMALL, placement="largest_free")
+    assert s._pick_gpu(probe(8)) == g["slow"]
+
+
+def test_ect_only_considers_gpus_that_fit():
+    s, g = sched(FAST_SMALL)
+    assert s._pick_gpu(probe(20)) == g["slow"]
+    assert s._pick_gpu(probe(32)) is None
+
+
+def test_ect_spreads_when_co_tenancy_outweighs_speed():
+    # 性能分高 10%，但多一个同卡任务要慢 CO_TENANCY_SLOWDOWN，第二个任务放到空卡上
+    gpus = [("a", 16, 110, "8.0"), ("b", 16, 100, "8.0")]
+    s, g = sched(gpus, jobs=[Job(0.0, 4, 3600.0, 60), Job(0.0, 4, 3600.0, 60)])
+    first, second = sorted(s.list_requests(), key=lambda r: r.id)
+    assert first.assigned_gpu_id == g["a"] and second.assigned_gpu_id == g["b"]
+
+
+def test_ect_tie_goes_to_more_free_memory():
+    gpus = [("small", 16, PERF_REF_SCORE, "8.0"), ("big", 24, PERF_REF_SCORE, "8.0")]
+    s, g = sched(gpus)
+    assert s._pick_gpu(probe(8)) == g["big"]
+
+
+def test_runtime_follows_chosen_gpu():
+    s, g = sched(FAST_SMALL, jobs=[Job(0.0, 8, 1200.0, 20)])
+    s._loop.run()
+    (r,) = s.list_requests()
+    assert r.assigned_gpu_id == g["fast"]
+    assert (r.completed_at - r.started_at).total_seconds() == pytest.approx(600.0)
+
+
+# ----------------- 回填预留 -----------------
+@pytest.mark.parametrize("placement", ["ect", "largest_free"])
+def test_plan_skips_gpus_whose_reservation_would_be_delayed(placement):
+    s, g = sched(FAST_SMALL, placement=placement)
+    caps = {g["fast"]: 16, g["slow"]: 24}
+    profiles = {gid: Profile(cap) for gid, cap in caps.items()}
+    plan = Reservations(lambda gid: profiles[gid])
+    assert plan.reserve([(g["fast"], 60.0), (g["slow"], 60.0)], 16)
+    (reserved,) = plan.reserved
+    other = g["slow"] if reserved == g["fast"] else g["fast"]
+    assert s._pick_gpu(probe(8), plan) == other
+    # 两块卡都预留了就放不下
+    assert plan.reserve([(other, 60.0)], caps[other])
+    assert s._pick_gpu(probe(8), plan) is None
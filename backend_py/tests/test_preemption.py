@@ -0,0 +1,130 @@
+# test_preemption.py
+from scheduler_adapter import PERF_REF_SCORE, PREEMPT_MIN_RUN_SEC, PREEMPT_MAX_PER_REQUEST
+from simulation import EventLoop, Job, SimScheduler
+
+ONE_GPU = [("G", 16, PERF_REF_SCORE, "8.0")]
+
+
+def run(jobs: list[Job], probe_at: float, preempt: bool = True, aging_sec: float = 0):
+    """回放 jobs，在 probe_at 时刻记下各请求的状态；返回 (调度器, 当时的状态)"""
+    loop = EventLoop()
+    s = SimScheduler(loop, ONE_GPU, backfill="none", preempt=preempt, aging_sec=aging_sec, placement="ect")
+    for job in jobs:
+        loop.at(job.arrival, s.submit, job)
+    seen = {}
+    loop.at(probe_at, lambda: seen.update({r.id: r.status for r in s.list_requests()}))
+    loop.run()
+    return s, seen
+
+
+def ids(n: int) -> list[str]:
+    """前 n 个请求的 id（仿真 id 按创建顺序编号，GPU 先占用了前几个）"""
+    return [f"sim-{i:08d}" for i in range(len(ONE_GPU) + 1, len(ONE_GPU) + n + 1)]
+
+
+def started(s: SimScheduler) -> list[str]:
+    """按最后一次开始运行的时刻排序的请求 id"""
+    return [r.id for r in sorted(s.list_requests(), key=lambda r: r.started_at)]
+
+
+# ----------------- 防抖：最短运行时长 / 次数上限 -----------------
+def test_no_preemption_before_min_run_time():
+    t = PREEMPT_MIN_RUN_SEC / 2
+    jobs = [
+        Job(0.0, 16, 3600.0, 60, "low"),
+        Job(t, 16, 600.0, 10, "high"),                      # low 才跑了一半的最短时长，不抢
+        Job(PREEMPT_MIN_RUN_SEC + 1, 1, 60.0, 1, "low"),     # 到达时触发一轮调度，这时可以抢了
+    ]
+    s, seen = run(jobs, t + 1)
+    low, high, _ = ids(3)
+    assert seen[low] == "running" and seen[high] == "pending"
+    reqs = {r.id: r for r in s.list_requests()}
+    assert (reqs[high].started_at - s._loop.epoch).total_seconds() == PREEMPT_MIN_RUN_SEC + 1
+    assert s._preemptions == 1
+
+
+def test_request_preempted_at_most_max_times():
+    # 每个 high 跑 600 秒，结束后 low 重新开始，100 秒后下一个 high 到达
+    jobs = [Job(0.0, 16, 36000.0, 600, "low")]
+    jobs += [Job(100.0 + 700.0 * i, 16, 600.0, 10, "high") for i in range(PREEMPT_MAX_PER_REQUEST + 1)]
+    last = jobs[-1].arrival
+    s, seen = run(jobs, last + 1)
+    low, *highs = ids(len(jobs))
+    assert seen[low] == "running" and seen[highs[-1]] == "pending"
+    assert all(seen[h] == "completed" for h in highs[:-1])
+    assert s._preemptions == PREEMPT_MAX_PER_REQUEST
+
+
+# ----------------- 选哪些任务让路 -----------------
+def test_fewest_victims_win_over_less_lost_work():
+    jobs = [
+        Job(0.0, 8, 36000.0, 600, "low"),       # C：已跑 300 秒，一个就够
+        Job(200.0, 4, 36000.0, 600, "low"),     # A、B：各跑 100 秒，合计损失更少，但要两个
+        Job(200.0, 4, 36000.0, 600, "low"),
+        Job(300.0, 8, 600.0, 10, "high"),
+    ]
+    _, seen = run(jobs, 301.0)
+    c, a, b, high = ids(4)
+    assert seen == {c: "pending", a: "running", b: "running", high: "running"}
+
+
+def test_same_count_prefers_least_elapsed():
+    jobs = [
+        Job(0.0, 8, 36000.0, 600, "low"),
+        Job(100.0, 8, 36000.0, 600, "low"),     # 跑得短，白做的工作少
+        Job(300.0, 8, 600.0, 10, "high"),
+    ]
+    _, seen = run(jobs, 301.0)
+    old, young, high = ids(3)
+    assert seen == {old: "running", young: "pending", high: "running"}
+
+
+def test_only_lower_priority_is_preempted():
+    jobs = [Job(0.0, 16, 3600.0, 60, "high"), Job(100.0, 16, 600.0, 10, "high")]
+    s, seen = run(jobs, 101.0)
+    first, second = ids(2)
+    assert seen == {first: "running", second: "pending"}
+    assert s._preemptions == 0
+
+
+def test_preempted_request_keeps_its_place():
+    # 被抢占的 normal 按原创建时间排队，排在后到的 normal 之前
+    jobs = [
+        Job(0.0, 16, 3600.0, 60, "normal"),
+        Job(100.0, 16, 600.0, 10, "high"),
+        Job(200.0, 16, 600.0, 10, "normal"),
+    ]
+    s, _ = run(jobs, 201.0)
+    first, high, later = ids(3)
+    assert started(s) == [high, first, later]
+
+
+# ----------------- 老化 -----------------
+AGING_JOBS = [
+    Job(0.0, 16, 10000.0, 170, "normal"),   # 占住整块卡
+    Job(1.0, 16, 60.0, 1, "low"),           # 老化后：1 + 2 × 1800
+    Job(2000.0, 16, 60.0, 1, "normal"),     # 老化后：2000 + 1800，排在 low 之后
+    Job(5000.0, 16, 60.0, 1, "high"),       # high 始终在最前
+]
+
+
+def test_aging_lets_old_low_requests_overtake():
+    s, _ = run(AGING_JOBS, 1.0, preempt=False, aging_sec=1800)
+    blocker, low, normal, high = ids(4)
+    assert started(s) == [blocker, high, low, normal]
+
+
+def test_without_aging_priority_order_is_strict():
+    s, _ = run(AGING_JOBS, 1.0, preempt=False, aging_sec=0)
+    blocker, low, normal, high = ids(4)
+    assert started(s) == [blocker, high, normal, low]
+
+
+def test_queue_key():
+    s, _ = run(AGING_JOBS, 1.0, preempt=False, aging_sec=1800)
+    reqs = {r.id: r for r in s.list_requests()}
+    _, low, normal, high = ids(4)
+    assert s._queue_key(reqs[high]) == (0,)
+    assert s._queue_key(reqs[low]) < s._queue_key(reqs[normal])
+    s._aging = 0
+    assert [s._queue_key(reqs[r]) for r in (high, normal, low)] == [(0,), (1,), (2,)]
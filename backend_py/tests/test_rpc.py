@@ -0,0 +1,89 @@
+# test_rpc.py
+import asyncio
+
+import pytest
+
+from rpc import AsyncClient, serve_async
+
+
+async def with_server(path: str, dispatch, body):
+    server = await serve_async(path, dispatch)
+    client = AsyncClient(path, timeout=5)
+    try:
+        return await body(client)
+    finally:
+        client.close()
+        server.close()
+
+
+def test_blocked_call_does_not_delay_others(tmp_path):
+    async def main():
+        release = asyncio.Event()
+        seen = []
+
+        async def slow():
+            await release.wait()
+            return "slow"
+
+        def dispatch(method, args, kwargs):
+            seen.append(method)
+            return slow() if method == "slow" else (method, args)
+
+        async def body(client: AsyncClient):
+            blocked = asyncio.ensure_future(client.call("slow"))
+            # 同一个连接上的后续调用照常应答，不等 slow
+            assert await asyncio.wait_for(client.call("stats"), 1) == ("stats", ())
+            assert await asyncio.wait_for(client.call("heartbeat", "g1"), 1) == ("heartbeat", ("g1",))
+            assert not blocked.done()
+            release.set()
+            assert await asyncio.wait_for(blocked, 1) == "slow"
+            assert seen == ["slow", "stats", "heartbeat"]   # 按到达顺序开始执行
+
+        await with_server(str(tmp_path / "rpc.sock"), dispatch, body)
+
+    asyncio.run(main())
+
+
+def test_errors_and_concurrent_replies_match_call_ids(tmp_path):
+    async def main():
+        async def echo(x, delay):
+            await asyncio.sleep(delay)
+            if x < 0: raise ValueError(x)
+            return x
+
+        def dispatch(method, args, kwargs):
+            return echo(*args)
+
+        async def body(client: AsyncClient):
+            # 应答按完成先后乱序发回，按 call_id 对上各自的调用
+            xs = list(range(20))
+            got = await asyncio.gather(*(client.call("echo", x, (20 - x) / 1000) for x in xs))
+            assert got == xs
+            with pytest.raises(ValueError):
+                await client.call("echo", -1, 0)
+            assert await client.call("echo", 7, 0) == 7
+
+        await with_server(str(tmp_path / "rpc.sock"), dispatch, body)
+
+    asyncio.run(main())
+
+
+def test_stream_pushes_until_done(tmp_path):
+    async def main():
+        async def items():
+            for i in range(3):
+                yield i
+
+        def dispatch(method, args, kwargs):
+            return items()
+
+        async def body(client: AsyncClient):
+            got = []
+            with pytest.raises(ConnectionError):
+                async for item in client.stream("events"):
+                    got.append(item)
+            assert got == [0, 1, 2]
+
+        await with_server(str(tmp_path / "rpc.sock"), dispatch, body)
+
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+# test_textindex.py
+import random
+
+from textindex import NGramIndex, fold
+
+TEXTS = {
+    "a": "大语料数据清洗与统计",
+    "b": "BERT 微调 on GLUE",
+    "c": "Ölçüm ΣΙΓΜΑ-Модель",
+    "d": "自动生成：批量推理任务",
+    "e": "bert",
+}
+
+
+def brute(texts: dict[str, str], q: str) -> set[str]:
+    return {k for k, t in texts.items() if fold(q) in fold(t)}
+
+
+def build(texts: dict[str, str]) -> NGramIndex:
+    idx = NGramIndex()
+    for k, t in texts.items():
+        idx.add(k, t)
+    return idx
+
+
+def test_fold_covers_latin1_greek_cyrillic_only():
+    assert fold("ABC Ölçüm ΣΙΓΜΑ МОДЕЛЬ Ёж") == "abc ölçüm σιγμα модель ёж"
+    assert fold("×") == "×"          # U+00D7 不是字母
+    assert fold("大写") == "大写"
+
+
+def test_search_short_and_long_queries():
+    idx = build(TEXTS)
+    assert idx.search("bert") == {"b", "e"}
+    assert idx.search("BeRt 微") == {"b"}
+    assert idx.search("数据清洗") == {"a"}
+    assert idx.search("推") == {"d"}
+    assert idx.search("σιγμα-мод") == {"c"}
+    assert idx.search("ölçüm") == {"c"}
+    assert idx.search("不存在的描述") == set()
+    assert idx.search("") == set(TEXTS)
+
+
+def test_matches_substring_scan():
+    rnd = random.Random(4)
+    alphabet = "abAB训练推理Σσ Жж"
+    texts = {str(i): "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 12))) for i in range(300)}
+    idx = build(texts)
+    for _ in range(500):
+        q = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 6)))
+        assert idx.search(q) == brute(texts, q), q
+
+
+def test_remove_and_readd():
+    idx = build(TEXTS)
+    idx.remove("b")
+    assert idx.search("bert") == {"e"}
+    assert "b" not in idx.search("")
+    idx.add("e", "GPT 推理")    # 同一个 key 重新登记，旧文本的片段要去掉
+    assert idx.search("bert") == set()
+    assert idx.search("gpt 推") == {"e"}
+    idx.remove("missing")       # 不存在的 key 忽略
+    assert idx._postings and all(idx._postings.values())   # 空的倒排表会被删掉
+
+
+def test_deferred_entries_are_searchable_before_build():
+    idx = NGramIndex()
+    idx.add("a", TEXTS["a"])
+    idx.defer((k, t) for k, t in TEXTS.items() if k != "a")
+    assert idx.deferred == 4
+    assert idx.search("bert") == {"b", "e"}
+    idx.remove("e")             # 还没建索引的也能删
+    assert idx.search("bert") == {"b"}
+    assert idx.build_step(2) is True
+    assert idx.build_step(10) is False
+    assert idx.deferred == 0
+    assert idx.search("bert") == {"b"}
+    assert idx.search("") == {"a", "b", "c", "d"}
+
+
+def test_long_query_skips_keys_removed_mid_search():
+    # 无锁读者取出候选后 key 被 remove：倒排表里还有，原文已经没了
+    idx = build(TEXTS)
+    del idx._texts["b"]
+    assert idx.search("bert 微调") == set()
+    assert idx.search("ber") == {"b", "e"}    # 不超过 N 个字符时直接取倒排表
@@ -0,0 +1,92 @@
+# textindex.py
+"""子串检索用的 n-gram 倒排索引（与 C++ 的 TextIndex.hpp 行为保持一致）"""
+from typing import Iterable
+
+# 大小写折叠只处理 ASCII / Latin-1 / 希腊 / 西里尔字母，C++ 侧用同一张表，保证两个后端结果一致
+_FOLD = {c: c + 0x20 for c in range(0x41, 0x5B)}
+_FOLD.update({c: c + 0x20 for c in range(0xC0, 0xDF) if c != 0xD7})
+_FOLD.update({c: c + 0x20 for c in range(0x391, 0x3AA) if c != 0x3A2})
+_FOLD.update({c: c + 0x50 for c in range(0x400, 0x410)})
+_FOLD.update({c: c + 0x20 for c in range(0x410, 0x430)})
+
+
+def fold(text: str) -> str:
+    return text.translate(_FOLD)
+
+
+class NGramIndex:
+    """
+    按字符（不是字节）切 1~N 元片段建倒排表，中文描述同样适用。
+    查询不超过 N 个字符时直接取对应倒排表；更长的查询取各 N 元片段倒排表的交集，再逐条确认子串。
+    大批量装入（例如从快照恢复）用 defer 先登记，再由调用方分批 build_step 建索引；
+    尚未建索引的条目在查询时逐条比对，结果始终完整。
+    """
+    N = 3
+
+    def __init__(self):
+        self._postings: dict[str, set[str]] = {}
+        self._texts: dict[str, str] = {}
+        self._deferred: dict[str, str] = {}    # 已登记、尚未建索引的 key -> 原文
+
+    def defer(self, items: Iterable[tuple[str, str]]):
+        self._deferred.update(items)
+
+    @property
+    def deferred(self) -> int:
+        return len(self._deferred)
+
+    def build_step(self, n: int) -> bool:
+        """把最多 n 条登记的条目建进索引；返回是否还有剩余"""
+        d = self._deferred
+        for _ in range(min(n, len(d))):
+            key, text = d.popitem()
+            self._index(key, text)
+        return bool(d)
+
+    def add(self, key: str, text: str):
+        self._deferred.pop(key, None)
+        self._index(key, text)
+
+    def _index(self, key: str, text: str):
+        if key in self._texts:
+            self.remove(key)
+        t = fold(text)
+        self._texts[key] = t
+        for g in self._grams(t):
+            self._postings.setdefault(g, set()).add(key)
+
+    def remove(self, key: str):
+        if self._deferred.pop(key, None) is not None: return
+        t = self._texts.pop(key, None)
+        if t is None: return
+        for g in self._grams(t):
+            bucket = self._postings.get(g)
+            if bucket is None: continue
+            bucket.discard(key)
+            if not bucket:
+                del self._postings[g]
+
+    def search(self, q: str) -> set[str]:
+        ql = fold(q)
+        out = self._search(ql)
+        if self._deferred:
+            out.update(k for k, t in list(self._deferred.items()) if ql in fold(t))
+        return out
+
+    def _search(self, ql: str) -> set[str]:
+        if not ql:
+            return set(self._texts)
+        if len(ql) <= self.N:
+            return set(self._postings.get(ql, ()))
+        grams = sorted({ql[i:i + self.N] for i in range(len(ql) - self.N + 1)},
+                       key=lambda g: len(self._postings.get(g, ())))
+        cands = set(self._postings.get(grams[0], ()))
+        for g in grams[1:]:
+            if not cands: break
+            cands &= self._postings.get(g, set())
+        # thread 模式下读者不持锁：候选取出后 key 可能已被 remove（驱逐/归档/注销），跳过
+        texts = self._texts
+        return {k for k in cands if ql in texts.get(k, "")}
+
+    def _grams(self, t: str) -> set[str]:
+        return {t[i:i + n] for n in range(1, self.N + 1) for i in range(len(t) - n + 1)}
@@ -0,0 +1,106 @@
+# timers.py
+"""到期回调服务：一个线程（或事件循环）+ 最小堆管理所有任务的截止时间，取代“每个任务一个 Timer 线程”"""
+from typing import Callable, Hashable
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+
+class DeadlineTimer:
+    """
+    schedule(key, delay) 在 delay 秒后回调 callback(key)；同一个 key 重新 schedule 会覆盖旧的截止时间，
+    cancel(key) 取消。被取消/覆盖的堆条目不立即删除，弹出时按序号惰性丢弃。
+    无论挂了多少个截止时间，始终只有一个后台线程。
+    """
+
+    def __init__(self, callback: Callable[[Hashable], None], name: str = "deadline-timer"):
+        self._callback = callback
+        self._name = name
+        self._cond = threading.Condition()
+        self._heap: list[tuple[float, int, Hashable]] = []
+        self._live: dict[Hashable, int] = {}   # key -> 当前有效的序号
+        self._seq = itertools.count()
+        self._thread: threading.Thread | None = None
+        self._stopped = False
+
+    def schedule(self, key: Hashable, delay: float):
+        with self._cond:
+            seq = next(self._seq)
+            self._live[key] = seq
+            heapq.heappush(self._heap, (time.monotonic() + delay, seq, key))
+            if len(self._heap) > 2 * len(self._live) + 64:
+                self._heap = [it for it in self._heap if self._live.get(it[2]) == it[1]]
+                heapq.heapify(self._heap)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+            elif self._heap[0][1] == seq:
+                self._cond.notify()  # 新的截止时间最早，唤醒线程重新计算等待时长
+
+    def cancel(self, key: Hashable):
+        with self._cond:
+            self._live.pop(key, None)
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._live)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    while self._heap and self._live.get(self._heap[0][2]) != self._heap[0][1]:
+                        heapq.heappop(self._heap)
+                    if self._heap and self._heap[0][0] <= time.monotonic():
+                        break
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                if self._stopped:
+                    return
+                _, _, key = heapq.heappop(self._heap)
+                del self._live[key]
+            try:
+                self._callback(key)
+            except Exception as e:
+                print(f"[{self._name}] error:", e)
+
+
+class LoopTimer:
+    """
+    与 DeadlineTimer 接口相同，但跑在 asyncio 事件循环上（loop.call_later），不占用任何线程。
+    只能在事件循环线程里调用；回调同样在事件循环里执行。
+    """
+
+    def __init__(self, callback: Callable[[Hashable], None]):
+        self._callback = callback
+        self._handles: dict[Hashable, asyncio.TimerHandle] = {}
+
+    def schedule(self, key: Hashable, delay: float):
+        self.cancel(key)
+        self._handles[key] = asyncio.get_running_loop().call_later(delay, self._fire, key)
+
+    def cancel(self, key: Hashable):
+        h = self._handles.pop(key, None)
+        if h is not None:
+            h.cancel()
+
+    def pending(self) -> int:
+        return len(self._handles)
+
+    def stop(self):
+        for h in self._handles.values():
+            h.cancel()
+        self._handles.clear()
+
+    def _fire(self, key: Hashable):
+        self._handles.pop(key, None)
+        try:
+            self._callback(key)
+        except Exception as e:
+            print("[loop-timer] error:", e)
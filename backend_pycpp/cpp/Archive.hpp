@@ -0,0 +1,195 @@
+#pragma once
+// 已结束请求的归档（SQLite），与 Python 后端 archive.py 思路相同。
+// State 内存里只保留活跃请求和最近结束的请求；更早结束（或超出条数上限）的 completed/failed 请求分批移到这里，
+// listRequests 时与内存里的结果按 (created_at 毫秒, id) 归并。
+// - 每行存完整记录（Persist.hpp 的二进制编码），另存查询用的列：创建时间（毫秒）、状态、大小写折叠后的描述；
+//   文本条件用 instr 在折叠后的描述里找子串，和内存里的 n-gram 索引结果一致。
+// - version 列是写入这一批时的 WAL 帧序号，重启时用来和 WAL 对账（见 State::enableArchive）。
+#include <mutex>
+#include <optional>
+#include <stdexcept>
+#include <string>
+#include <unordered_map>
+#include <utility>
+#include <vector>
+#include <sqlite3.h>
+#include "Persist.hpp"
+#include "TextIndex.hpp"
+
+inline std::string toUtf8(const std::u32string& s){
+  std::string out; out.reserve(s.size());
+  for (char32_t c : s){
+    if (c < 0x80) out += (char)c;
+    else if (c < 0x800){ out += (char)(0xC0 | (c >> 6)); out += (char)(0x80 | (c & 0x3F)); }
+    else if (c < 0x10000){ out += (char)(0xE0 | (c >> 12)); out += (char)(0x80 | ((c >> 6) & 0x3F)); out += (char)(0x80 | (c & 0x3F)); }
+    else { out += (char)(0xF0 | (c >> 18)); out += (char)(0x80 | ((c >> 12) & 0x3F));
+           out += (char)(0x80 | ((c >> 6) & 0x3F)); out += (char)(0x80 | (c & 0x3F)); }
+  }
+  return out;
+}
+
+class RequestArchive {
+public:
+  explicit RequestArchive(const std::string& path){
+    if (sqlite3_open(path.c_str(), &db_) != SQLITE_OK){
+      std::string err = db_ ? sqlite3_errmsg(db_) : "out of memory";
+      sqlite3_close(db_);
+      throw std::runtime_error("cannot open archive " + path + ": " + err);
+    }
+    exec("PRAGMA journal_mode=WAL");
+    exec("PRAGMA synchronous=NORMAL");
+    exec("CREATE TABLE IF NOT EXISTS requests ("
+         " id TEXT PRIMARY KEY, created_ms INTEGER NOT NULL, status TEXT NOT NULL,"
+         " text TEXT NOT NULL, version INTEGER NOT NULL, body BLOB NOT NULL) WITHOUT ROWID");
+    exec("CREATE INDEX IF NOT EXISTS requests_time ON requests (created_ms, id)");
+    exec("CREATE INDEX IF NOT EXISTS requests_version ON requests (version)");
+  }
+  ~RequestArchive(){ sqlite3_close(db_); }
+  RequestArchive(const RequestArchive&) = delete;
+  RequestArchive& operator=(const RequestArchive&) = delete;
+
+  // 写入（或覆盖）一批记录，一个事务
+  void put(const std::vector<ComputeRequest>& reqs, uint64_t version){
+    std::lock_guard<std::mutex> lk(mu_);
+    exec("BEGIN");
+    Stmt st(db_, "INSERT OR REPLACE INTO requests VALUES (?, ?, ?, ?, ?, ?)");
+    for (auto& r : reqs){
+      persist::Writer w; w.req(r);
+      auto text = toUtf8(foldUtf8(r.task_description));
+      st.text(1, r.id); st.int64(2, toMs(r.created_at)); st.text(3, r.status); st.text(4, text);
+      st.int64(5, (int64_t)version); st.blob(6, w.buf);
+      st.step(); st.reset();
+    }
+    exec("COMMIT");
+  }
+
+  std::unordered_map<std::string,ComputeRequest> get(const std::vector<std::string>& ids){
+    std::unordered_map<std::string,ComputeRequest> out;
+    std::lock_guard<std::mutex> lk(mu_);
+    Stmt st(db_, "SELECT body FROM requests WHERE id = ?");
+    for (auto& id : ids){
+      st.text(1, id);
+      if (st.step()){ auto r = st.request(0); out.emplace(r.id, std::move(r)); }
+      st.reset();
+    }
+    return out;
+  }
+
+  void remove(const std::vector<std::string>& ids){
+    std::lock_guard<std::mutex> lk(mu_);
+    Stmt st(db_, "DELETE FROM requests WHERE id = ?");
+    for (auto& id : ids){ st.text(1, id); st.step(); st.reset(); }
+  }
+
+  void clear(){ std::lock_guard<std::mutex> lk(mu_); exec("DELETE FROM requests"); }
+
+  // 条件与 State::listRequests 相同，按 (created_at, id) 倒序；limit 为 0 表示不限
+  std::vector<ComputeRequest> query(const RequestQuery& rq, size_t limit){
+    std::string sql = "SELECT body FROM requests WHERE 1";
+    bool byStatus = !rq.status.empty() && rq.status!="all";
+    bool cursor = !rq.cursor_id.empty() || rq.cursor_ms;
+    if (byStatus) sql += " AND status = ?";
+    if (!rq.q.empty()) sql += " AND instr(text, ?) > 0";
+    if (rq.since_ms) sql += " AND created_ms >= ?";
+    if (rq.until_ms) sql += " AND created_ms < ?";
+    if (cursor) sql += " AND (created_ms, id) < (?, ?)";
+    sql += " ORDER BY created_ms DESC, id DESC";
+    if (limit) sql += " LIMIT ?";
+
+    std::lock_guard<std::mutex> lk(mu_);
+    Stmt st(db_, sql.c_str());
+    int i = 1;
+    if (byStatus) st.text(i++, rq.status);
+    if (!rq.q.empty()) st.text(i++, toUtf8(foldUtf8(rq.q)));
+    if (rq.since_ms) st.int64(i++, rq.since_ms);
+    if (rq.until_ms) st.int64(i++, rq.until_ms);
+    if (cursor){ st.int64(i++, rq.cursor_ms); st.text(i++, rq.cursor_id); }
+    if (limit) st.int64(i++, (int64_t)limit);
+    std::vector<ComputeRequest> out;
+    while (st.step()) out.push_back(st.request(0));
+    return out;
+  }
+
+  // 各状态的归档条数
+  std::unordered_map<std::string,size_t> counts(){
+    std::unordered_map<std::string,size_t> out;
+    std::lock_guard<std::mutex> lk(mu_);
+    Stmt st(db_, "SELECT status, COUNT(*) FROM requests GROUP BY status");
+    while (st.step()) out[st.str(0)] = (size_t)st.col64(1);
+    return out;
+  }
+
+  // 归档里最新的 (created_at 毫秒, id)
+  std::optional<std::pair<int64_t,std::string>> newest(){
+    std::lock_guard<std::mutex> lk(mu_);
+    Stmt st(db_, "SELECT created_ms, id FROM requests ORDER BY created_ms DESC, id DESC LIMIT 1");
+    if (!st.step()) return std::nullopt;
+    return std::make_pair(st.col64(0), st.str(1));
+  }
+
+  // 可能还没在 WAL 里确认移出内存的记录：最后一批序号早于 version 的，以及序号不早于 version 的。
+  // 一批的删除帧序号总大于写入时的序号，下一批要等上一批移出之后才开始，所以更早的批次都已确认
+  std::vector<std::string> unconfirmedIds(uint64_t version){
+    std::lock_guard<std::mutex> lk(mu_);
+    int64_t from = (int64_t)version;
+    {
+      Stmt st(db_, "SELECT MAX(version) FROM requests WHERE version < ?");
+      st.int64(1, (int64_t)version);
+      if (st.step() && !st.isNull(0)) from = st.col64(0);
+    }
+    Stmt st(db_, "SELECT id FROM requests WHERE version >= ?");
+    st.int64(1, from);
+    std::vector<std::string> out;
+    while (st.step()) out.push_back(st.str(0));
+    return out;
+  }
+
+private:
+  static int64_t toMs(std::chrono::system_clock::time_point tp){
+    return std::chrono::duration_cast<std::chrono::milliseconds>(tp.time_since_epoch()).count();
+  }
+
+  // 预编译语句的薄封装
+  class Stmt {
+  public:
+    Stmt(sqlite3* db, const char* sql){
+      if (sqlite3_prepare_v2(db, sql, -1, &st_, nullptr) != SQLITE_OK)
+        throw std::runtime_error(std::string("archive: ") + sqlite3_errmsg(db));
+    }
+    ~Stmt(){ sqlite3_finalize(st_); }
+    Stmt(const Stmt&) = delete;
+    Stmt& operator=(const Stmt&) = delete;
+    void text(int i, const std::string& s){ sqlite3_bind_text(st_, i, s.data(), (int)s.size(), SQLITE_TRANSIENT); }
+    void blob(int i, const std::string& s){ sqlite3_bind_blob(st_, i, s.data(), (int)s.size(), SQLITE_TRANSIENT); }
+    void int64(int i, int64_t v){ sqlite3_bind_int64(st_, i, v); }
+    bool step(){ return sqlite3_step(st_) == SQLITE_ROW; }
+    void reset(){ sqlite3_reset(st_); sqlite3_clear_bindings(st_); }
+    bool isNull(int c){ return sqlite3_column_type(st_, c) == SQLITE_NULL; }
+    int64_t col64(int c){ return sqlite3_column_int64(st_, c); }
+    std::string str(int c){
+      auto p = reinterpret_cast<const char*>(sqlite3_column_text(st_, c));
+      return p ? std::string(p, (size_t)sqlite3_column_bytes(st_, c)) : std::string();
+    }
+    ComputeRequest request(int c){
+      ComputeRequest r;
+      auto p = static_cast<const char*>(sqlite3_column_blob(st_, c));
+      persist::Reader rd(p, (size_t)sqlite3_column_bytes(st_, c));
+      rd.req(r);
+      return r;
+    }
+  private:
+    sqlite3_stmt* st_ = nullptr;
+  };
+
+  void exec(const char* sql){
+    char* err = nullptr;
+    if (sqlite3_exec(db_, sql, nullptr, nullptr, &err) != SQLITE_OK){
+      std::string msg = err ? err : "unknown error";
+      sqlite3_free(err);
+      throw std::runtime_error("archive: " + msg);
+    }
+  }
+
+  sqlite3* db_ = nullptr;
+  std::mutex mu_;   // 一个连接在线程间共享，调用串行化
+};
@@ -0,0 +1,121 @@
+#pragma once
+// 批量导出：把一批请求转成列式缓冲区 / 直接编码成 JSON，全程不需要 GIL，也不产生逐行的 Python 对象
+#include <chrono>
+#include <cstdint>
+#include <cstdio>
+#include <ctime>
+#include <string>
+#include <unordered_map>
+#include <vector>
+#include "State.hpp"
+
+inline int64_t tpToMs(std::chrono::system_clock::time_point tp){
+  if (tp.time_since_epoch().count()==0) return 0;   // 0 = null
+  return std::chrono::duration_cast<std::chrono::milliseconds>(tp.time_since_epoch()).count();
+}
+
+// 变长字符串列：所有字符串首尾相接放在 data 里，第 i 个是 data[offsets[i], offsets[i+1])
+struct StringColumn {
+  std::vector<uint8_t> data;
+  std::vector<int64_t> offsets{0};
+  void push(const std::string& s){
+    data.insert(data.end(), s.begin(), s.end());
+    offsets.push_back((int64_t)data.size());
+  }
+};
+
+// 取值很少的字符串列（status/priority）：字典编码，codes[i] 是 names 的下标
+struct CodeColumn {
+  std::vector<uint8_t> codes;
+  std::vector<std::string> names;
+  std::unordered_map<std::string,uint8_t> lookup;
+  void push(const std::string& s){
+    auto it = lookup.find(s);
+    if (it==lookup.end()){
+      it = lookup.emplace(s, (uint8_t)names.size()).first;
+      names.push_back(s);
+    }
+    codes.push_back(it->second);
+  }
+};
+
+struct RequestColumns {
+  size_t n = 0;
+  StringColumn id, task_description, assigned_gpu_id;
+  std::vector<int32_t> required_memory, estimated_duration;
+  CodeColumn priority, status;
+  std::vector<int64_t> created_at, started_at, completed_at;   // epoch 毫秒，0 = null
+};
+
+inline RequestColumns toColumns(const std::vector<ComputeRequest>& v){
+  RequestColumns c; c.n = v.size();
+  c.required_memory.reserve(v.size()); c.estimated_duration.reserve(v.size());
+  c.created_at.reserve(v.size()); c.started_at.reserve(v.size()); c.completed_at.reserve(v.size());
+  for (auto& r : v){
+    c.id.push(r.id); c.task_description.push(r.task_description); c.assigned_gpu_id.push(r.assigned_gpu_id);
+    c.required_memory.push_back(r.required_memory); c.estimated_duration.push_back(r.estimated_duration);
+    c.priority.push(r.priority); c.status.push(r.status);
+    c.created_at.push_back(tpToMs(r.created_at));
+    c.started_at.push_back(tpToMs(r.started_at));
+    c.completed_at.push_back(tpToMs(r.completed_at));
+  }
+  return c;
+}
+
+// ---- JSON 编码：输出与 Python 侧 pydantic 模型序列化结果一致 ----
+inline void jsonStr(std::string& out, const std::string& s){
+  out.push_back('"');
+  for (unsigned char ch : s){
+    switch (ch){
+      case '"':  out += "\\\""; break;
+      case '\\': out += "\\\\"; break;
+      case '\n': out += "\\n"; break;
+      case '\r': out += "\\r"; break;
+      case '\t': out += "\\t"; break;
+      case '\b': out += "\\b"; break;
+      case '\f': out += "\\f"; break;
+      default:
+        if (ch < 0x20){ char buf[8]; std::snprintf(buf, sizeof(buf), "\\u%04x", ch); out += buf; }
+        else out.push_back((char)ch);   // 非 ASCII 原样输出 UTF-8
+    }
+  }
+  out.push_back('"');
+}
+
+// UTC ISO8601，毫秒为 0 时不带小数部分：2025-01-02T03:04:05.123000Z
+inline void jsonTime(std::string& out, int64_t ms){
+  if (!ms){ out += "null"; return; }
+  std::time_t t = (std::time_t)(ms / 1000);
+  int frac = (int)(ms % 1000);
+  if (frac < 0){ frac += 1000; t -= 1; }
+  std::tm tm{};
+  gmtime_r(&t, &tm);
+  char buf[40];
+  size_t n = std::strftime(buf, sizeof(buf), "\"%Y-%m-%dT%H:%M:%S", &tm);
+  if (frac) n += std::snprintf(buf+n, sizeof(buf)-n, ".%03d000", frac);
+  out.append(buf, n);
+  out += "Z\"";
+}
+
+inline std::string requestsJson(const std::vector<ComputeRequest>& v){
+  std::string out;
+  out.reserve(v.size() * 360 + 2);
+  out.push_back('[');
+  for (size_t i=0; i<v.size(); i++){
+    auto& r = v[i];
+    if (i) out.push_back(',');
+    out += "{\"id\":"; jsonStr(out, r.id);
+    out += ",\"task_description\":"; jsonStr(out, r.task_description);
+    out += ",\"required_memory\":"; out += std::to_string(r.required_memory);
+    out += ",\"estimated_duration\":"; out += std::to_string(r.estimated_duration);
+    out += ",\"priority\":"; jsonStr(out, r.priority);
+    out += ",\"status\":"; jsonStr(out, r.status);
+    out += ",\"assigned_gpu_id\":"; jsonStr(out, r.assigned_gpu_id);
+    out += ",\"created_at\":"; jsonTime(out, tpToMs(r.created_at));
+    out += ",\"started_at\":"; jsonTime(out, tpToMs(r.started_at));
+    out += ",\"completed_at\":"; jsonTime(out, tpToMs(r.completed_at));
+    out.push_back('}');
+  }
+  out.push_back(']');
+  return out;
+}
@@ -0,0 +1,562 @@
+#pragma once
+// 状态持久化：预写日志（WAL）+ 定期快照，与 Python 后端的 persistence.py 思路相同，文件格式各自独立。
+// - WAL：每次写操作结束时把变化的 GPU / 请求（完整内容）编码成一帧交给后台线程；
+//   后台线程把积压的帧一次 write + 一次 fsync（组提交），调用方不等磁盘。崩溃时可能丢最后一组未落盘的帧。
+// - 快照：每 kSnapshotEvery 帧做一次模糊快照。持锁时只切换 WAL 段、编码 GPU；后台线程分批取请求
+//   （每批由调用方短暂持锁编码）边取边写文件。分批期间发生的修改同时记在新 WAL 段里，恢复时重放覆盖，结果一致。
+// - 恢复：mmap 最新快照，GPU 逐条解码；请求不解码，只扫一遍记下每行的位置和几个定长字段（ColdRequests），
+//   用到时才解码。再按顺序重放其后的 WAL 段；遇到写了一半的尾帧即停止并截掉。
+// 目录结构：snap-<序号>.bin、wal-<起始序号>.log，序号补零到 12 位。
+#include <algorithm>
+#include <array>
+#include <atomic>
+#include <chrono>
+#include <condition_variable>
+#include <cstdint>
+#include <cstdio>
+#include <cstring>
+#include <deque>
+#include <filesystem>
+#include <functional>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <string_view>
+#include <thread>
+#include <unordered_map>
+#include <unordered_set>
+#include <vector>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#include "State.hpp"
+
+namespace persist {
+
+inline uint32_t crc32(const char* data, size_t n){
+  static const auto table = []{
+    std::array<uint32_t,256> t{};
+    for (uint32_t i=0; i<256; i++){
+      uint32_t c = i;
+      for (int k=0; k<8; k++) c = (c & 1) ? 0xEDB88320u ^ (c >> 1) : c >> 1;
+      t[i] = c;
+    }
+    return t;
+  }();
+  uint32_t c = 0xFFFFFFFFu;
+  for (size_t i=0; i<n; i++) c = table[(c ^ (unsigned char)data[i]) & 0xFF] ^ (c >> 8);
+  return c ^ 0xFFFFFFFFu;
+}
+
+// ---- 小端二进制编码 ----
+class Writer {
+public:
+  std::string buf;
+  template <class T> void pod(T v){ buf.append(reinterpret_cast<const char*>(&v), sizeof(v)); }
+  void str(const std::string& s){ pod<uint32_t>((uint32_t)s.size()); buf += s; }
+  void time(std::chrono::system_clock::time_point tp){ pod<int64_t>(tp.time_since_epoch().count()); }
+  void gpu(const GpuResource& g){
+    str(g.id); str(g.gpu_name); pod<int32_t>(g.gpu_memory); pod<int32_t>(g.performance_score);
+    str(g.compute_capability); pod<uint8_t>(g.is_shared); str(g.status); time(g.created_at); time(g.updated_at);
+    pod<int32_t>(g.heartbeat_ttl); str(g.nvml_device);
+  }
+  void req(const ComputeRequest& r){
+    str(r.id); str(r.task_description); pod<int32_t>(r.required_memory); pod<int32_t>(r.estimated_duration);
+    str(r.priority); str(r.status); str(r.assigned_gpu_id);
+    time(r.created_at); time(r.started_at); time(r.completed_at);
+  }
+};
+
+class Reader {
+public:
+  Reader(const char* p, size_t n) : p_(p), end_(p + n) {}
+  bool ok() const { return ok_; }
+  size_t left() const { return (size_t)(end_ - p_); }
+  template <class T> T pod(){
+    T v{};
+    if (left() < sizeof(T)){ ok_ = false; p_ = end_; return v; }
+    std::memcpy(&v, p_, sizeof(T)); p_ += sizeof(T);
+    return v;
+  }
+  const char* pos() const { return p_; }
+  void skip(size_t n){ p_ += std::min(n, left()); }
+  std::string_view view(){
+    auto n = pod<uint32_t>();
+    if (left() < n){ ok_ = false; p_ = end_; return {}; }
+    std::string_view v(p_, n); p_ += n;
+    return v;
+  }
+  void str(std::string& s){ s = view(); }
+  void time(std::chrono::system_clock::time_point& tp){
+    tp = std::chrono::system_clock::time_point(std::chrono::system_clock::duration(pod<int64_t>()));
+  }
+  void gpu(GpuResource& g){
+    str(g.id); str(g.gpu_name); g.gpu_memory = pod<int32_t>(); g.performance_score = pod<int32_t>();
+    str(g.compute_capability); g.is_shared = pod<uint8_t>() != 0; str(g.status); time(g.created_at); time(g.updated_at);
+    g.heartbeat_ttl = pod<int32_t>(); str(g.nvml_device);
+  }
+  void req(ComputeRequest& r){
+    str(r.id); str(r.task_description); r.required_memory = pod<int32_t>(); r.estimated_duration = pod<int32_t>();
+    str(r.priority); str(r.status); str(r.assigned_gpu_id);
+    time(r.created_at); time(r.started_at); time(r.completed_at);
+  }
+private:
+  const char* p_;
+  const char* end_;
+  bool ok_ = true;
+};
+
+// 只读 mmap 整个文件
+class MappedFile {
+public:
+  explicit MappedFile(const std::string& path){
+    int fd = ::open(path.c_str(), O_RDONLY);
+    if (fd < 0) return;
+    struct stat st{};
+    if (::fstat(fd, &st)==0 && st.st_size > 0){
+      void* p = ::mmap(nullptr, (size_t)st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+      if (p != MAP_FAILED){ data_ = static_cast<const char*>(p); size_ = (size_t)st.st_size; }
+    }
+    ::close(fd);
+  }
+  ~MappedFile(){ if (data_) ::munmap(const_cast<char*>(data_), size_); }
+  MappedFile(const MappedFile&) = delete;
+  MappedFile& operator=(const MappedFile&) = delete;
+  const char* data() const { return data_; }
+  size_t size() const { return size_; }
+private:
+  const char* data_ = nullptr;
+  size_t size_ = 0;
+};
+
+inline void writeAll(int fd, const std::string& s){
+  size_t off = 0;
+  while (off < s.size()){
+    auto n = ::write(fd, s.data() + off, s.size() - off);
+    if (n <= 0) return;
+    off += (size_t)n;
+  }
+}
+
+// 后台写线程：append 只入队；线程每轮把积压的帧一次写完、一次 fsync（组提交）
+class WalWriter {
+public:
+  WalWriter(const std::string& path, bool fsync) : fsync_(fsync) {
+    fd_ = ::open(path.c_str(), O_WRONLY | O_CREAT | O_APPEND, 0644);
+    th_ = std::thread([this]{ run(); });
+  }
+  ~WalWriter(){
+    { std::lock_guard<std::mutex> lk(mu_); closed_ = true; }
+    cv_.notify_all();
+    if (th_.joinable()) th_.join();
+    if (fd_ >= 0) ::close(fd_);
+  }
+  WalWriter(const WalWriter&) = delete;
+  WalWriter& operator=(const WalWriter&) = delete;
+
+  void append(std::string frame){ push({std::move(frame), false}); }
+  // 之后 append 的帧写入新文件；与 append 同一队列，顺序有保证
+  void rotate(const std::string& path){ push({path, true}); }
+  // 等到目前为止入队的都已落盘
+  void flush(){
+    std::unique_lock<std::mutex> lk(mu_);
+    auto target = enqueued_;
+    cv_.wait(lk, [&]{ return done_ >= target; });
+  }
+
+private:
+  struct Item { std::string data; bool rotate; };
+
+  void push(Item it){
+    { std::lock_guard<std::mutex> lk(mu_); q_.push_back(std::move(it)); enqueued_++; }
+    cv_.notify_all();
+  }
+
+  void run(){
+    std::unique_lock<std::mutex> lk(mu_);
+    while (true){
+      cv_.wait(lk, [&]{ return !q_.empty() || closed_; });
+      if (q_.empty() && closed_) return;
+      std::deque<Item> batch; batch.swap(q_);
+      lk.unlock();
+      std::string buf;
+      for (auto& it : batch){
+        if (!it.rotate){ buf += it.data; continue; }
+        write(buf); buf.clear();
+        if (fd_ >= 0) ::close(fd_);
+        fd_ = ::open(it.data.c_str(), O_WRONLY | O_CREAT | O_APPEND, 0644);
+      }
+      write(buf);
+      lk.lock();
+      done_ += batch.size();
+      cv_.notify_all();
+    }
+  }
+
+  void write(const std::string& buf){
+    if (buf.empty() || fd_ < 0) return;
+    writeAll(fd_, buf);
+    if (fsync_) ::fdatasync(fd_);
+  }
+
+  bool fsync_;
+  int fd_ = -1;
+  std::mutex mu_;
+  std::condition_variable cv_;
+  std::deque<Item> q_;
+  uint64_t enqueued_ = 0, done_ = 0;
+  bool closed_ = false;
+  std::thread th_;
+};
+
+// 快照里的请求：留在 mmap 里不解码，恢复时只顺序扫一遍，记下每行的位置、创建/结束时间和状态，
+// 再建一张 id → 行号的开放寻址表。行按 (创建时间毫秒, id) 升序（快照按时间索引写出）。
+// 某行被取回内存（写操作碰到）或移出（归档、WAL 里有更新）后即作废，不会复活；行的内容不变，
+// 所以 query 可以不持锁扫描（作废标记是原子量）。其余方法由调用方持锁（State::mu_），恢复时为单线程
+class ColdRequests {
+public:
+  static constexpr size_t npos = SIZE_MAX;
+
+  ColdRequests(std::shared_ptr<MappedFile> file, Reader& r, uint64_t n) : file_(std::move(file)) {
+    rows_.reserve(n);
+    for (uint64_t i=0; i<n && r.ok(); i++){
+      auto start = r.pos();
+      r.view(); r.view(); r.skip(8);   // id、描述、显存与预计时长
+      r.view(); auto st = r.view(); r.view();
+      auto created = r.pod<int64_t>(); r.skip(8); auto completed = r.pod<int64_t>();
+      if (!r.ok()) break;
+      Row row;
+      row.off = (uint64_t)(start - file_->data()); row.len = (uint32_t)(r.pos() - start);
+      row.created_ms = std::chrono::duration_cast<std::chrono::milliseconds>(
+                         std::chrono::system_clock::duration(created)).count();
+      row.ended = completed ? completed : created;
+      row.status = code(st);
+      rows_.push_back(row);
+    }
+    alive_.reset(new std::atomic<bool>[rows_.size()]);
+    for (size_t i=0; i<rows_.size(); i++) alive_[i].store(true, std::memory_order_relaxed);
+    alive_n_ = rows_.size();
+    counts_.assign(statuses_.size(), 0);
+    for (auto& row : rows_) counts_[row.status]++;
+    size_t cap = 16; while (cap < rows_.size() * 2) cap <<= 1;
+    slots_.assign(cap, UINT32_MAX);
+    for (uint32_t i=0; i<rows_.size(); i++){
+      size_t h = std::hash<std::string_view>{}(idOf(i)) & (cap - 1);
+      while (slots_[h]!=UINT32_MAX) h = (h + 1) & (cap - 1);
+      slots_[h] = i;
+    }
+  }
+
+  size_t size() const { return alive_n_; }
+  size_t count(const std::string& status) const { int c = codeOf(status); return c<0 ? 0 : counts_[c]; }
+
+  bool get(const std::string& id, ComputeRequest& out) const {
+    auto i = find(id); if (i==npos) return false;
+    out = decode(i);
+    return true;
+  }
+  // 取出完整记录（out 可为空）并作废该行；没有或已作废返回 false
+  bool take(const std::string& id, ComputeRequest* out){
+    auto i = find(id); if (i==npos) return false;
+    if (out) *out = decode(i);
+    kill(i);
+    return true;
+  }
+  // 取出状态不在 keep 里的全部记录
+  std::vector<ComputeRequest> takeUnless(std::initializer_list<const char*> keep){
+    std::vector<bool> take(statuses_.size(), true);
+    for (auto* st : keep){ int c = codeOf(st); if (c>=0) take[c] = false; }
+    std::vector<ComputeRequest> out;
+    for (size_t i=0; i<rows_.size(); i++)
+      if (take[rows_[i].status] && alive(i)){ out.push_back(decode(i)); kill(i); }
+    return out;
+  }
+
+  // 行号按结束时间（没有则按创建时间）排序，只做一次；只读不变的行，可不持锁调用
+  void sortByEnd(){
+    std::call_once(sorted_, [this]{
+      end_order_.resize(rows_.size());
+      for (uint32_t i=0; i<rows_.size(); i++) end_order_[i] = i;
+      std::stable_sort(end_order_.begin(), end_order_.end(),
+                       [&](uint32_t a, uint32_t b){ return rows_[a].ended < rows_[b].ended; });
+    });
+  }
+  // 按结束时间（没有则按创建时间）升序取最多 n 个未作废的行：(结束时间, 行号)；还没排序则先排
+  std::vector<std::pair<int64_t,size_t>> oldest(size_t n){
+    sortByEnd();
+    while (end_pos_ < end_order_.size() && !alive(end_order_[end_pos_])) end_pos_++;   // 作废的不会复活
+    std::vector<std::pair<int64_t,size_t>> out;
+    for (size_t k=end_pos_; k<end_order_.size() && out.size()<n; k++)
+      if (alive(end_order_[k])) out.emplace_back(rows_[end_order_[k]].ended, end_order_[k]);
+    return out;
+  }
+  ComputeRequest decode(size_t i) const {
+    Reader r(file_->data() + rows_[i].off, rows_[i].len);
+    ComputeRequest q; r.req(q);
+    return q;
+  }
+
+  // 条件同 State::listRequests：按 (created_at, id) 倒序，最多 rq.limit 条；只读不变的行内容，可不持锁调用
+  std::vector<ComputeRequest> query(const RequestQuery& rq) const {
+    std::vector<ComputeRequest> out;
+    bool byStatus = !rq.status.empty() && rq.status!="all";
+    int st = byStatus ? codeOf(rq.status) : -1;
+    if (byStatus && st<0) return out;
+    size_t lo = rq.since_ms ? lowerBound(rq.since_ms, {}) : 0;
+    size_t hi = rq.until_ms ? lowerBound(rq.until_ms, {}) : rows_.size();
+    if (!rq.cursor_id.empty() || rq.cursor_ms) hi = std::min(hi, lowerBound(rq.cursor_ms, rq.cursor_id));
+    auto q = foldUtf8(rq.q);
+    for (size_t i=hi; i>lo && (!rq.limit || out.size()<rq.limit); ){
+      --i;
+      if (!alive(i) || (byStatus && rows_[i].status!=st)) continue;
+      if (!q.empty() && foldUtf8(descOf(i)).find(q)==std::u32string::npos) continue;
+      out.push_back(decode(i));
+    }
+    return out;
+  }
+
+  // 快照用：从行号 pos 起第一个未作废的行，没有返回 npos
+  size_t nextAlive(size_t pos) const {
+    while (pos < rows_.size() && !alive(pos)) pos++;
+    return pos < rows_.size() ? pos : npos;
+  }
+  // 行 i 的键是否小于 (ms, id)
+  bool before(size_t i, const std::pair<int64_t,std::string>& key) const {
+    return rows_[i].created_ms!=key.first ? rows_[i].created_ms < key.first : idOf(i) < key.second;
+  }
+  std::pair<int64_t,std::string> key(size_t i) const { return {rows_[i].created_ms, std::string(idOf(i))}; }
+  // 原样追加行 i 的编码（与 Writer::req 相同）
+  void copyRow(size_t i, Writer& w) const { w.buf.append(file_->data() + rows_[i].off, rows_[i].len); }
+
+private:
+  struct Row { uint64_t off; uint32_t len; uint8_t status; int64_t created_ms; int64_t ended; };
+
+  bool alive(size_t i) const { return alive_[i].load(std::memory_order_relaxed); }
+  void kill(size_t i){
+    alive_[i].store(false, std::memory_order_relaxed);
+    alive_n_--; counts_[rows_[i].status]--;
+  }
+  std::string_view idOf(size_t i) const { Reader r(file_->data() + rows_[i].off, rows_[i].len); return r.view(); }
+  std::string_view descOf(size_t i) const {
+    Reader r(file_->data() + rows_[i].off, rows_[i].len); r.view();
+    return r.view();
+  }
+  // 未作废的行号，没有返回 npos
+  size_t find(std::string_view id) const {
+    size_t mask = slots_.size() - 1;
+    for (size_t h = std::hash<std::string_view>{}(id) & mask; slots_[h]!=UINT32_MAX; h = (h + 1) & mask)
+      if (idOf(slots_[h])==id) return alive(slots_[h]) ? slots_[h] : npos;
+    return npos;
+  }
+  // 第一个键不小于 (ms, id) 的行号
+  size_t lowerBound(int64_t ms, const std::string& id) const {
+    size_t lo = 0, hi = rows_.size();
+    std::pair<int64_t,std::string> k{ms, id};
+    while (lo < hi){ size_t mid = (lo + hi) / 2; if (before(mid, k)) lo = mid + 1; else hi = mid; }
+    return lo;
+  }
+  uint8_t code(std::string_view st){
+    for (size_t c=0; c<statuses_.size(); c++) if (statuses_[c]==st) return (uint8_t)c;
+    statuses_.emplace_back(st);
+    return (uint8_t)(statuses_.size() - 1);
+  }
+  int codeOf(const std::string& st) const {
+    for (size_t c=0; c<statuses_.size(); c++) if (statuses_[c]==st) return (int)c;
+    return -1;
+  }
+
+  std::shared_ptr<MappedFile> file_;
+  std::vector<Row> rows_;
+  std::unique_ptr<std::atomic<bool>[]> alive_;
+  size_t alive_n_ = 0;
+  std::vector<std::string> statuses_;
+  std::vector<size_t> counts_;        // 各状态未作废的行数
+  std::vector<uint32_t> slots_;       // id 哈希表，线性探测
+  std::vector<uint32_t> end_order_;   // 按结束时间排好的行号（sortByEnd 时建）
+  std::once_flag sorted_;
+  size_t end_pos_ = 0;                // end_order_ 里此前全已作废
+};
+
+struct Recovered {
+  uint64_t lsn = 0;   // 已恢复到的帧序号
+  std::unordered_map<std::string,GpuResource> gpus;
+  std::shared_ptr<ColdRequests> cold;   // 快照里的请求；WAL 里有更新或移出的已作废
+  std::unordered_map<std::string,ComputeRequest> reqs;   // WAL 里出现过的请求
+  std::vector<const ComputeRequest*> order;   // 指向 reqs 里的元素（节点地址不随扩容变化），按在 WAL 里首次出现的顺序
+  std::unordered_set<std::string> dropped;    // 重放中被移出内存（归档）的 id，重放完再删，order 里的指针才不会悬空
+};
+
+// 一个持久化目录：恢复、记日志、做快照。调用方（State）持锁调用
+class Store {
+public:
+  static constexpr uint64_t kSnapshotEvery = 50000;   // 两次快照之间最多写多少帧
+  static constexpr char kMagic[8] = {'C','X','X','S','N','A','P','3'};   // 2：GPU 记录加了 heartbeat_ttl；3：nvml_device
+
+  Store(std::string dir, bool fsync) : dir_(std::move(dir)), fsync_(fsync) {
+    std::filesystem::create_directories(dir_);
+  }
+  ~Store(){
+    if (snap_.joinable()) snap_.join();
+  }
+
+  // 读最新快照并重放其后的 WAL；目录为空返回 false
+  bool recover(Recovered& out){
+    auto snaps = list("snap-", ".bin"), segs = list("wal-", ".log");
+    if (snaps.empty() && segs.empty()) return false;
+    if (!snaps.empty()) readSnapshot(snaps.back().second, out);
+    for (auto& seg : segs) replay(seg.second, out);
+    if (!out.dropped.empty()){
+      out.order.erase(std::remove_if(out.order.begin(), out.order.end(),
+                                     [&](const ComputeRequest* r){ return out.dropped.count(r->id) > 0; }),
+                      out.order.end());
+      for (auto& id : out.dropped) out.reqs.erase(id);
+      out.dropped.clear();
+    }
+    return true;
+  }
+
+  // 从 lsn 之后开始写新的 WAL 段
+  void open(uint64_t lsn){ wal_ = std::make_unique<WalWriter>(segmentPath(lsn + 1), fsync_); }
+
+  // 一帧：序号 + 变化的 GPU / 请求 [+ 移出内存的请求 id、注销的 GPU id]；返回是否该做快照了
+  template <class Gpus, class Reqs>
+  bool log(uint64_t lsn, const Gpus& gpus, const Reqs& reqs, const std::vector<std::string>& drops = {}){
+    Writer w;
+    w.pod<uint64_t>(lsn);
+    w.pod<uint32_t>((uint32_t)gpus.size()); for (auto* g : gpus) w.gpu(*g);
+    w.pod<uint32_t>((uint32_t)reqs.size()); for (auto* r : reqs) w.req(*r);
+    if (!drops.empty()){ w.pod<uint32_t>((uint32_t)drops.size()); for (auto& id : drops) w.str(id); }
+    Writer f;
+    f.pod<uint32_t>((uint32_t)w.buf.size()); f.pod<uint32_t>(crc32(w.buf.data(), w.buf.size()));
+    f.buf += w.buf;
+    wal_->append(std::move(f.buf));
+    return ++since_snap_ >= kSnapshotEvery && !snapping_;
+  }
+
+  // 后台线程反复调用：把下一批请求（按创建时间升序）编码进 Writer，返回条数，0 表示取完
+  using ChunkFn = std::function<size_t(Writer&)>;
+
+  // 调用方持锁：切换 WAL 段；head 为 snapshotHead 的结果，请求由后台线程经 next 分批取出写文件
+  void checkpoint(uint64_t lsn, std::string head, ChunkFn next){
+    wal_->rotate(segmentPath(lsn + 1));
+    since_snap_ = 0;
+    snapping_ = true;
+    if (snap_.joinable()) snap_.join();
+    snap_ = std::thread([this, lsn, head = std::move(head), next = std::move(next)]{
+      writeSnapshot(lsn, head, next);
+      snapping_ = false;
+    });
+  }
+
+  // 快照头：魔数 + 序号 + 全部 GPU + 请求条数（占位，写完请求后回填）
+  static std::string snapshotHead(uint64_t lsn, const std::vector<const GpuResource*>& gpus){
+    Writer w;
+    w.buf.append(kMagic, sizeof(kMagic));
+    w.pod<uint64_t>(lsn);
+    w.pod<uint32_t>((uint32_t)gpus.size()); for (auto* g : gpus) w.gpu(*g);
+    w.pod<uint64_t>(0);
+    return std::move(w.buf);
+  }
+
+  // 等已提交的帧都写完（含 fsync）
+  void flush(){ if (wal_) wal_->flush(); }
+
+  void close(){
+    if (snap_.joinable()) snap_.join();
+    wal_.reset();
+  }
+
+private:
+  std::vector<std::pair<uint64_t,std::string>> list(const std::string& prefix, const std::string& ext) const {
+    std::vector<std::pair<uint64_t,std::string>> out;
+    for (auto& e : std::filesystem::directory_iterator(dir_)){
+      auto name = e.path().filename().string();
+      if (name.rfind(prefix, 0)!=0 || e.path().extension()!=ext) continue;
+      out.emplace_back(std::stoull(name.substr(prefix.size())), e.path().string());
+    }
+    std::sort(out.begin(), out.end());
+    return out;
+  }
+
+  std::string segmentPath(uint64_t start) const { return dir_ + "/" + numbered("wal-", start, ".log"); }
+  std::string snapshotPath(uint64_t lsn) const { return dir_ + "/" + numbered("snap-", lsn, ".bin"); }
+  static std::string numbered(const char* prefix, uint64_t n, const char* ext){
+    char buf[64]; std::snprintf(buf, sizeof(buf), "%s%012llu%s", prefix, (unsigned long long)n, ext);
+    return buf;
+  }
+
+  static void readSnapshot(const std::string& path, Recovered& out){
+    auto f = std::make_shared<MappedFile>(path);
+    if (!f->data() || f->size() < sizeof(kMagic) || std::memcmp(f->data(), kMagic, sizeof(kMagic))!=0) return;
+    Reader r(f->data() + sizeof(kMagic), f->size() - sizeof(kMagic));
+    out.lsn = r.pod<uint64_t>();
+    auto ng = r.pod<uint32_t>();
+    for (uint32_t i=0; i<ng && r.ok(); i++){ GpuResource g; r.gpu(g); out.gpus[g.id] = std::move(g); }
+    auto nr = r.pod<uint64_t>();
+    out.cold = std::make_shared<ColdRequests>(f, r, nr);   // 请求留在 mmap 里，用到时才解码
+  }
+
+  static void replay(const std::string& path, Recovered& out){
+    off_t valid = 0;
+    {
+      MappedFile f(path);
+      Reader r(f.data(), f.size());
+      while (r.left() >= 8){
+        auto n = r.pod<uint32_t>(); auto crc = r.pod<uint32_t>();
+        if (r.left() < n || crc32(r.pos(), n)!=crc) break;
+        Reader fr(r.pos(), n);
+        r.skip(n);
+        valid += 8 + n;
+        auto lsn = fr.pod<uint64_t>();
+        if (lsn <= out.lsn) continue;   // 快照已包含（旧段删除前崩溃时会留下）
+        out.lsn = lsn;
+        auto ng = fr.pod<uint32_t>();
+        for (uint32_t i=0; i<ng; i++){ GpuResource g; fr.gpu(g); out.gpus[g.id] = std::move(g); }
+        auto nr = fr.pod<uint32_t>();
+        for (uint32_t i=0; i<nr; i++){
+          ComputeRequest q; fr.req(q);
+          if (out.cold) out.cold->take(q.id, nullptr);   // 以 WAL 里的为准
+          out.dropped.erase(q.id);
+          auto [it, fresh] = out.reqs.try_emplace(q.id);
+          it->second = std::move(q);
+          if (fresh) out.order.push_back(&it->second);
+        }
+        if (fr.left() >= 4){
+          auto nd = fr.pod<uint32_t>();
+          for (uint32_t i=0; i<nd; i++){   // 请求与 GPU 的 id 都是 uuid，不会重名
+            std::string id; fr.str(id);
+            if (out.reqs.count(id)) out.dropped.insert(id);
+            else if (!out.cold || !out.cold->take(id, nullptr)) out.gpus.erase(id);
+          }
+        }
+      }
+    }
+    if (valid < (off_t)std::filesystem::file_size(path)) ::truncate(path.c_str(), valid);   // 截掉残帧
+  }
+
+  void writeSnapshot(uint64_t lsn, const std::string& head, const ChunkFn& next){
+    auto path = snapshotPath(lsn), tmp = path + ".tmp";
+    int fd = ::open(tmp.c_str(), O_WRONLY | O_CREAT | O_TRUNC, 0644);
+    if (fd < 0) return;
+    writeAll(fd, head);
+    uint64_t total = 0;
+    Writer w;
+    for (size_t n; (n = next(w)) > 0; w.buf.clear()){ total += n; writeAll(fd, w.buf); }
+    ::pwrite(fd, &total, sizeof(total), (off_t)(head.size() - sizeof(total)));
+    ::fsync(fd); ::close(fd);
+    std::filesystem::rename(tmp, path);
+    wal_->flush();   // 旧段里的帧都写完了再删
+    for (auto& s : list("snap-", ".bin")) if (s.first < lsn) std::filesystem::remove(s.second);
+    for (auto& s : list("wal-", ".log")) if (s.first <= lsn) std::filesystem::remove(s.second);
+  }
+
+  std::string dir_;
+  bool fsync_;
+  std::unique_ptr<WalWriter> wal_;
+  uint64_t since_snap_ = 0;
+  std::atomic<bool> snapping_{false};
+  std::thread snap_;
+};
+
+} // namespace persist
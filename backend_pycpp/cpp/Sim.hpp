@@ -1,2 +1,5 @@
 #pragma once
+#include "Metrics.hpp"
 void startSimulator(); // 后台线程
+LatencyHistogram& simTickStats();       // 仿真每一轮（生成请求 + 选卡 + 匹配）的耗时
+LatencyHistogram& simPlacementStats();  // 自动选卡决策的耗时
@@ -0,0 +1,134 @@
+#pragma once
+// 子串检索用的 n-gram 倒排索引（与 Python 侧 textindex.py 行为保持一致）
+#include <algorithm>
+#include <string>
+#include <string_view>
+#include <unordered_map>
+#include <unordered_set>
+#include <vector>
+
+// UTF-8 解码为码点，并做大小写折叠：只处理 ASCII / Latin-1 / 希腊 / 西里尔字母
+inline std::u32string foldUtf8(std::string_view s){
+  std::u32string out; out.reserve(s.size());
+  for (size_t i=0; i<s.size();){
+    unsigned char c = (unsigned char)s[i];
+    char32_t cp; int len;
+    if (c<0x80){ cp=c; len=1; }
+    else if ((c>>5)==0x6){ cp=c&0x1F; len=2; }
+    else if ((c>>4)==0xE){ cp=c&0x0F; len=3; }
+    else if ((c>>3)==0x1E){ cp=c&0x07; len=4; }
+    else { cp=0xFFFD; len=1; }
+    if (i+len > s.size()){ cp=0xFFFD; len=(int)(s.size()-i); }
+    else for (int k=1;k<len;k++) cp = (cp<<6) | ((unsigned char)s[i+k] & 0x3F);
+    i += len;
+
+    if (cp>=0x41 && cp<=0x5A) cp += 0x20;
+    else if (cp>=0xC0 && cp<=0xDE && cp!=0xD7) cp += 0x20;
+    else if (cp>=0x391 && cp<=0x3A9 && cp!=0x3A2) cp += 0x20;
+    else if (cp>=0x400 && cp<=0x40F) cp += 0x50;
+    else if (cp>=0x410 && cp<=0x42F) cp += 0x20;
+    out.push_back(cp);
+  }
+  return out;
+}
+
+// 按字符切 1~N 元片段建倒排表；查询不超过 N 个字符直接取倒排表，更长的取交集后再逐条确认子串
+// 大批量装入（从快照恢复）用 defer 先登记，再分批 buildStep 建索引；尚未建索引的条目查询时逐条比对
+class NGramIndex {
+public:
+  static constexpr size_t N = 3;
+
+  void reserve(size_t n){ deferred_.reserve(n); }
+  void defer(const std::string& key, const std::string& text){ deferred_[key] = text; }
+  size_t deferred() const { return deferred_.size(); }
+
+  // 把最多 n 条登记的条目建进索引；返回是否还有剩余
+  bool buildStep(size_t n){
+    for (; n && !deferred_.empty(); n--){
+      auto it = deferred_.begin();
+      index(it->first, it->second);
+      deferred_.erase(it);
+    }
+    return !deferred_.empty();
+  }
+
+  void add(const std::string& key, const std::string& text){
+    deferred_.erase(key);
+    index(key, text);
+  }
+
+  void remove(const std::string& key){
+    if (deferred_.erase(key)) return;
+    auto it = texts_.find(key); if (it==texts_.end()) return;
+    for (auto& g : grams(it->second)){
+      auto p = postings_.find(g); if (p==postings_.end()) continue;
+      p->second.erase(key);
+      if (p->second.empty()) postings_.erase(p);
+    }
+    texts_.erase(it);
+  }
+
+  // 返回命中的 key；空查询返回全部
+  std::unordered_set<std::string> search(const std::string& q) const {
+    auto ql = foldUtf8(q);
+    auto out = searchIndexed(ql);
+    for (auto& kv : deferred_)
+      if (foldUtf8(kv.second).find(ql)!=std::u32string::npos) out.insert(kv.first);
+    return out;
+  }
+
+private:
+  void index(const std::string& key, const std::string& text){
+    removeIndexed(key);
+    auto t = foldUtf8(text);
+    for (auto& g : grams(t)) postings_[g].insert(key);
+    texts_[key] = std::move(t);
+  }
+
+  void removeIndexed(const std::string& key){
+    auto it = texts_.find(key); if (it==texts_.end()) return;
+    for (auto& g : grams(it->second)){
+      auto p = postings_.find(g); if (p==postings_.end()) continue;
+      p->second.erase(key);
+      if (p->second.empty()) postings_.erase(p);
+    }
+    texts_.erase(it);
+  }
+
+  std::unordered_set<std::string> searchIndexed(const std::u32string& ql) const {
+    std::unordered_set<std::string> out;
+    if (ql.empty()){
+      for (auto& kv : texts_) out.insert(kv.first);
+      return out;
+    }
+    if (ql.size() <= N){
+      auto p = postings_.find(ql);
+      if (p!=postings_.end()) out = p->second;
+      return out;
+    }
+    std::vector<const std::unordered_set<std::string>*> lists;
+    for (size_t i=0; i+N<=ql.size(); i++){
+      auto p = postings_.find(ql.substr(i, N));
+      if (p==postings_.end()) return out;
+      lists.push_back(&p->second);
+    }
+    std::sort(lists.begin(), lists.end(), [](auto a, auto b){ return a->size() < b->size(); });
+    for (auto& k : *lists[0]){
+      bool all = true;
+      for (size_t j=1; j<lists.size() && all; j++) all = lists[j]->count(k) > 0;
+      if (all && texts_.at(k).find(ql)!=std::u32string::npos) out.insert(k);
+    }
+    return out;
+  }
+
+  static std::unordered_set<std::u32string> grams(const std::u32string& t){
+    std::unordered_set<std::u32string> gs;
+    for (size_t n=1; n<=N; n++)
+      for (size_t i=0; i+n<=t.size(); i++) gs.insert(t.substr(i, n));
+    return gs;
+  }
+
+  std::unordered_map<std::u32string, std::unordered_set<std::string>> postings_;
+  std::unordered_map<std::string, std::u32string> texts_;
+  std::unordered_map<std::string, std::string> deferred_;   // 已登记、尚未建索引的 key -> 原文
+};
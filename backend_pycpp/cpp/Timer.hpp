@@ -0,0 +1,80 @@
+#pragma once
+// 到期回调服务：一个线程 + 最小堆管理所有任务的截止时间，取代“每个任务 detach 一个线程去 sleep”
+#include <chrono>
+#include <condition_variable>
+#include <functional>
+#include <mutex>
+#include <queue>
+#include <string>
+#include <thread>
+#include <tuple>
+#include <unordered_map>
+#include <vector>
+
+class DeadlineTimer {
+public:
+  using Clock = std::chrono::steady_clock;
+  using Callback = std::function<void(const std::string&)>;
+
+  explicit DeadlineTimer(Callback cb) : cb_(std::move(cb)) {}
+  ~DeadlineTimer(){
+    { std::lock_guard<std::mutex> lk(mu_); stopped_ = true; }
+    cv_.notify_all();
+    if (th_.joinable()) th_.join();
+  }
+  DeadlineTimer(const DeadlineTimer&) = delete;
+  DeadlineTimer& operator=(const DeadlineTimer&) = delete;
+
+  // delay 后回调 cb(key)；同一个 key 再次 schedule 会覆盖旧的截止时间
+  void schedule(const std::string& key, Clock::duration delay){
+    std::lock_guard<std::mutex> lk(mu_);
+    auto seq = ++seq_;
+    live_[key] = seq;
+    heap_.emplace(Clock::now() + delay, seq, key);
+    if (!th_.joinable()) th_ = std::thread([this]{ run(); });
+    cv_.notify_one();
+  }
+
+  // 取消：只删登记，堆里的条目弹出时按序号惰性丢弃
+  void cancel(const std::string& key){
+    std::lock_guard<std::mutex> lk(mu_);
+    live_.erase(key);
+  }
+
+  size_t pending(){
+    std::lock_guard<std::mutex> lk(mu_);
+    return live_.size();
+  }
+
+private:
+  using Entry = std::tuple<Clock::time_point, uint64_t, std::string>;
+
+  bool stale(const Entry& e) const {
+    auto it = live_.find(std::get<2>(e));
+    return it==live_.end() || it->second!=std::get<1>(e);
+  }
+
+  void run(){
+    std::unique_lock<std::mutex> lk(mu_);
+    while (!stopped_){
+      while (!heap_.empty() && stale(heap_.top())) heap_.pop();
+      if (heap_.empty()){ cv_.wait(lk); continue; }
+      auto deadline = std::get<0>(heap_.top());
+      if (Clock::now() < deadline){ cv_.wait_until(lk, deadline); continue; }
+      auto key = std::get<2>(heap_.top());
+      heap_.pop(); live_.erase(key);
+      lk.unlock();
+      cb_(key);          // 回调时不持有本锁，回调里可以再 schedule/cancel
+      lk.lock();
+    }
+  }
+
+  Callback cb_;
+  std::mutex mu_;
+  std::condition_variable cv_;
+  std::priority_queue<Entry, std::vector<Entry>, std::greater<Entry>> heap_;
+  std::unordered_map<std::string, uint64_t> live_;
+  uint64_t seq_ = 0;
+  bool stopped_ = false;
+  std::thread th_;
+};
@@ -1,8 +1,10 @@
 // cxxsched_module.cpp
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
+#include <pybind11/numpy.h>
 #include "State.hpp"
 #include "Sim.hpp"
+#include "Export.hpp"
 #include <chrono>
 #include <string>
 #include <vector>
@@ -16,6 +18,8 @@ static py::dict to_py(const GpuResource& g){
     d["id"]=g.id; d["gpu_name"]=g.gpu_name; d["gpu_memory"]=g.gpu_memory;
     d["performance_score"]=g.performance_score; d["compute_capability"]=g.compute_capability;
     d["is_shared"]=g.is_shared; d["status"]=g.status;
+    d["heartbeat_ttl"]=g.heartbeat_ttl ? py::object(py::int_(g.heartbeat_ttl)) : py::object(py::none());
+    d["nvml_device"]=g.nvml_device.empty() ? py::object(py::none()) : py::object(py::str(g.nvml_device));
     d["created_at"]=std::chrono::duration_cast<std::chrono::milliseconds>(g.created_at.time_since_epoch()).count();
     d["updated_at"]=std::chrono::duration_cast<std::chrono::milliseconds>(g.updated_at.time_since_epoch()).count();
     return d;
@@ -42,6 +46,34 @@ static py::dict to_py(const PlatformStats& s){
     return d;
 }
 
+// 列式导出：把 vector 的所有权交给 numpy 数组（capsule 负责释放），不拷贝数据
+template <class T>
+static py::array_t<T> to_array(std::vector<T>&& v){
+    auto* p = new std::vector<T>(std::move(v));
+    py::capsule owner(p, [](void* q){ delete static_cast<std::vector<T>*>(q); });
+    return py::array_t<T>({(py::ssize_t)p->size()}, {(py::ssize_t)sizeof(T)}, p->data(), owner);
+}
+static py::tuple to_py(StringColumn&& c){
+    return py::make_tuple(to_array(std::move(c.data)), to_array(std::move(c.offsets)));
+}
+static py::tuple to_py(CodeColumn&& c){
+    return py::make_tuple(to_array(std::move(c.codes)), py::cast(c.names));
+}
+
+// 直方图快照 -> (桶上界秒数列表, 各桶非累计计数含 +Inf, 总和秒)
+static py::tuple to_py(const LatencyHistogram::Snapshot& h){
+    return py::make_tuple(h.bounds, h.counts, h.sum);
+}
+
+static RequestQuery make_query(const std::string& q, const std::string& status, size_t limit,
+                               int64_t cursor_ms, const std::string& cursor_id,
+                               int64_t since_ms, int64_t until_ms){
+    RequestQuery rq;
+    rq.q=q; rq.status=status; rq.limit=limit;
+    rq.cursor_ms=cursor_ms; rq.cursor_id=cursor_id; rq.since_ms=since_ms; rq.until_ms=until_ms;
+    return rq;
+}
+
 PYBIND11_MODULE(cxxsched, m /*, py::mod_gil_not_used() 可选 */) {
     m.doc() = "C++ scheduler bindings";
 
@@ -51,6 +83,25 @@ PYBIND11_MODULE(cxxsched, m /*, py::mod_gil_not_used() 可选 */) {
         startSimulator(); // 已经是detach线程，不会阻塞
     });
 
+    // 持久化：须在 start_simulator 之前调用；返回是否从目录里恢复了状态
+    m.def("enable_persistence", [](const std::string& dir, bool fsync){
+        py::gil_scoped_release release;
+        return State::instance().enablePersistence(dir, fsync);
+    }, py::arg("dir"), py::arg("fsync")=true);
+    m.def("close_persistence", [](){
+        py::gil_scoped_release release;
+        State::instance().closePersistence();
+    });
+    // 历史归档：在 enable_persistence 之后、start_simulator 之前调用
+    m.def("enable_archive", [](const std::string& path, size_t history_max, int64_t max_age_sec){
+        py::gil_scoped_release release;
+        State::instance().enableArchive(path, history_max, max_age_sec);
+    }, py::arg("path"), py::arg("history_max"), py::arg("max_age_sec"));
+    m.def("enforce_retention", [](){
+        py::gil_scoped_release release;
+        return State::instance().enforceRetention();
+    });
+
     // 统计
     m.def("stats", [](){
         PlatformStats s;
@@ -75,16 +126,63 @@ PYBIND11_MODULE(cxxsched, m /*, py::mod_gil_not_used() 可选 */) {
         return out;
     }, py::arg("q")="", py::arg("status")="");
 
-    m.def("list_requests", [](const std::string& q, const std::string& status){
+    m.def("list_requests", [](const std::string& q, const std::string& status, size_t limit,
+                              int64_t cursor_ms, const std::string& cursor_id,
+                              int64_t since_ms, int64_t until_ms){
+        auto rq = make_query(q, status, limit, cursor_ms, cursor_id, since_ms, until_ms);
         std::vector<ComputeRequest> v;
         {
             py::gil_scoped_release release;
-            v = State::instance().listRequests(q, status);
+            v = State::instance().listRequests(rq);
         }
         py::list out;
         for (auto& r: v) out.append(to_py(r));
         return out;
-    }, py::arg("q")="", py::arg("status")="");
+    }, py::arg("q")="", py::arg("status")="", py::arg("limit")=0,
+       py::arg("cursor_ms")=0, py::arg("cursor_id")="", py::arg("since_ms")=0, py::arg("until_ms")=0);
+
+    // 列式导出：数值/时间列是 numpy 数组，字符串列是 (uint8 数据, int64 偏移) ，status/priority 是 (uint8 编码, 取值表)
+    m.def("export_requests", [](const std::string& q, const std::string& status, size_t limit,
+                                int64_t cursor_ms, const std::string& cursor_id,
+                                int64_t since_ms, int64_t until_ms){
+        auto rq = make_query(q, status, limit, cursor_ms, cursor_id, since_ms, until_ms);
+        RequestColumns c;
+        {
+            py::gil_scoped_release release;
+            c = toColumns(State::instance().listRequests(rq));
+        }
+        py::dict d;
+        d["n"]=c.n;
+        d["id"]=to_py(std::move(c.id));
+        d["task_description"]=to_py(std::move(c.task_description));
+        d["required_memory"]=to_array(std::move(c.required_memory));
+        d["estimated_duration"]=to_array(std::move(c.estimated_duration));
+        d["priority"]=to_py(std::move(c.priority));
+        d["status"]=to_py(std::move(c.status));
+        d["assigned_gpu_id"]=to_py(std::move(c.assigned_gpu_id));
+        d["created_at"]=to_array(std::move(c.created_at));
+        d["started_at"]=to_array(std::move(c.started_at));
+        d["completed_at"]=to_array(std::move(c.completed_at));
+        return d;
+    }, py::arg("q")="", py::arg("status")="", py::arg("limit")=0,
+       py::arg("cursor_ms")=0, py::arg("cursor_id")="", py::arg("since_ms")=0, py::arg("until_ms")=0);
+
+    // 直接编码好的 JSON 响应体：返回 (bytes, 条数, 最后一条的分页游标 "毫秒|id")
+    m.def("list_requests_json", [](const std::string& q, const std::string& status, size_t limit,
+                                   int64_t cursor_ms, const std::string& cursor_id,
+                                   int64_t since_ms, int64_t until_ms){
+        auto rq = make_query(q, status, limit, cursor_ms, cursor_id, since_ms, until_ms);
+        std::string body, last; size_t n = 0;
+        {
+            py::gil_scoped_release release;
+            auto v = State::instance().listRequests(rq);
+            body = requestsJson(v);
+            n = v.size();
+            if (n) last = std::to_string(tpToMs(v.back().created_at)) + "|" + v.back().id;
+        }
+        return py::make_tuple(py::bytes(body), n, last);
+    }, py::arg("q")="", py::arg("status")="", py::arg("limit")=0,
+       py::arg("cursor_ms")=0, py::arg("cursor_id")="", py::arg("since_ms")=0, py::arg("until_ms")=0);
 
 
     // 创建 / 匹配 / 状态更新
@@ -108,6 +206,27 @@ PYBIND11_MODULE(cxxsched, m /*, py::mod_gil_not_used() 可选 */) {
         return to_py(out);   // 已持有 GIL
     });
 
+    // 批量：整批只加一次 State 锁、只释放一次 GIL；结果是紧凑的逐项列表
+    // items: [(task_description, required_memory, estimated_duration, priority), ...] -> [新请求 id, ...]
+    m.def("create_requests", [](const std::vector<std::tuple<std::string,int,int,std::string>>& items){
+        std::vector<NewRequest> v; v.reserve(items.size());
+        for (auto& [desc, mem, est, pri] : items) v.push_back(NewRequest{desc, mem, est, pri});
+        py::gil_scoped_release release;
+        return State::instance().createRequests(v);
+    });
+
+    // items: [(request_id, gpu_id), ...] -> [是否成功, ...]
+    m.def("match_requests", [](const std::vector<std::pair<std::string,std::string>>& items){
+        py::gil_scoped_release release;
+        return State::instance().matchRequests(items);
+    });
+
+    // items: [(request_id, status), ...] -> [是否成功（请求存在）, ...]
+    m.def("update_statuses", [](const std::vector<std::pair<std::string,std::string>>& items){
+        py::gil_scoped_release release;
+        return State::instance().updateStatuses(items);
+    });
+
     m.def("update_request_status", [](const std::string& rid, const std::string& st) -> std::optional<py::dict> {
         ComputeRequest out; bool ok = false;
         {
@@ -118,4 +237,54 @@ PYBIND11_MODULE(cxxsched, m /*, py::mod_gil_not_used() 可选 */) {
         return to_py(out);
     });
 
+    // GPU 注册 / 注销 / 心跳
+    m.def("register_gpu", [](const std::string& name, int mem, int score, const std::string& cc, bool shared, int ttl,
+                             const std::string& nvml_device){
+        GpuResource g;
+        {
+            py::gil_scoped_release release;
+            g = State::instance().registerGpu(name, mem, score, cc, shared, ttl, nvml_device);
+        }
+        return to_py(g);
+    }, py::arg("name"), py::arg("mem"), py::arg("score"), py::arg("cc"), py::arg("shared"), py::arg("ttl"),
+       py::arg("nvml_device")="");
+    m.def("deregister_gpu", [](const std::string& gid){
+        py::gil_scoped_release release;
+        return State::instance().deregisterGpu(gid);
+    });
+    // ids -> [GPU 是否存在, ...]
+    m.def("heartbeats", [](const std::vector<std::string>& ids){
+        py::gil_scoped_release release;
+        return State::instance().heartbeats(ids);
+    });
+
+    // 指标
+    m.def("lock_stats", [](){
+        auto& mu = State::instance().lockStats();
+        auto wait = mu.waitStats().snapshot(), hold = mu.holdStats().snapshot();
+        return py::make_tuple(to_py(wait), to_py(hold));
+    });
+    m.def("sim_stats", [](){
+        auto tick = simTickStats().snapshot(), place = simPlacementStats().snapshot();
+        return py::make_tuple(to_py(tick), to_py(place));
+    });
+    m.def("pending_by_priority", [](){
+        py::gil_scoped_release release;
+        return State::instance().pendingByPriority();
+    });
+    m.def("object_counts", [](){
+        py::gil_scoped_release release;
+        return State::instance().objectCounts();
+    });
+
+    // 遥测：(ids, 总显存 float64, 已用显存 float64, 在线 uint8)
+    m.def("gpu_usage", [](){
+        State::GpuUsage u;
+        {
+            py::gil_scoped_release release;
+            u = State::instance().gpuUsage();
+        }
+        return py::make_tuple(py::cast(u.ids), to_array(std::move(u.total)), to_array(std::move(u.used)),
+                              to_array(std::move(u.online)), py::cast(u.devices));
+    });
 }
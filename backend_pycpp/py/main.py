@@ -1,12 +1,24 @@
 # main.py
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import Optional
-from scheduler_cxx_adapter import scheduler
-from models import ComputeRequest
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+from typing import Optional, List
+from datetime import datetime
+import os
+from contextlib import asynccontextmanager
+import orjson
+from scheduler_cxx_adapter import scheduler, SCHEDULER_SOCKET, GPU_HEARTBEAT_TTL_SEC
+from models import ComputeRequest, GpuResource
+from metrics import REGISTRY, CONTENT_TYPE, PROFILE_MAX_SEC, LatencyMiddleware, sample_stacks
+from telemetry import HISTORY_POINTS_MAX
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI(title="GPU Resource Monitor")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    scheduler.close()
+
+app = FastAPI(title="GPU Resource Monitor", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,7 +26,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(LatencyMiddleware)
+
+PROFILE_ENABLED = os.environ.get("PROFILE_ENABLED") == "1"   # /debug/profile 默认关闭
+
+if SCHEDULER_SOCKET:
+    @app.exception_handler(OSError)
+    async def scheduler_unavailable(request: Request, exc: OSError):
+        # 调度器进程没起来或正在重启；连接会在下次调用时重建
+        return JSONResponse({"detail": "调度器不可用"}, status_code=503)
 
 class MatchBody(BaseModel):
     gpu_id: str
@@ -33,9 +55,19 @@ def get_stats():
 def get_gpus(q: Optional[str]=None, status: Optional[str]=None):
     return scheduler.list_gpus(q=q, status=status)
 
-@app.get("/requests")
-def get_requests(q: Optional[str]=None, status: Optional[str]=None):
-    return scheduler.list_requests(q=q, status=status)
+@app.get("/requests", response_model=List[ComputeRequest])
+def get_requests(q: Optional[str]=None, status: Optional[str]=None,
+                 limit: Optional[int]=Query(None, ge=1, le=1000), cursor: Optional[str]=None,
+                 since: Optional[datetime]=None, until: Optional[datetime]=None):
+    # 分页：若还有下一页，游标放在 X-Next-Cursor 响应头里，响应体仍是数组
+    # 响应体由 C++ 直接编码，不经过逐行的 dict / pydantic 模型
+    try:
+        body, n, last = scheduler.list_requests_json(q=q, status=status, limit=limit, cursor=cursor,
+                                                     since=since, until=until)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="cursor 无效")
+    headers = {"X-Next-Cursor": last} if limit and n == limit else None
+    return Response(body, media_type="application/json", headers=headers)
 
 @app.post("/requests")
 def create_request(body: CreateReqBody) -> ComputeRequest:
@@ -46,6 +78,35 @@ def create_request(body: CreateReqBody) -> ComputeRequest:
         priority=body.priority or "normal"
     )
 
+BULK_MAX = 10_000   # 单次批量接口最多的条数
+
+class BulkCreateBody(BaseModel):
+    requests: List[CreateReqBody] = Field(..., max_length=BULK_MAX)
+
+@app.post("/requests/bulk")
+def create_requests(body: BulkCreateBody):
+    # 整批一次提交给调度器（一次加锁）；只返回新请求的 id，顺序与提交顺序一致
+    ids = scheduler.create_requests([
+        (r.task_description, r.required_memory, r.estimated_duration, r.priority or "normal")
+        for r in body.requests
+    ])
+    return {"ids": ids}
+
+class StatusBody(BaseModel):
+    status: str  # pending/running/completed/failed
+
+class StatusUpdate(StatusBody):
+    id: str
+
+class BulkStatusBody(BaseModel):
+    updates: List[StatusUpdate] = Field(..., max_length=BULK_MAX)
+
+@app.post("/requests/status/bulk")
+def update_statuses(body: BulkStatusBody):
+    # ok[i] 表示第 i 项的请求是否存在并已更新
+    ok = scheduler.update_statuses([(u.id, u.status) for u in body.updates])
+    return {"ok": ok, "updated": sum(ok)}
+
 @app.post("/requests/{rid}/match")
 def match_request(rid: str, body: MatchBody):
     res = scheduler.match_request(rid, body.gpu_id)
@@ -53,12 +114,69 @@ def match_request(rid: str, body: MatchBody):
         raise HTTPException(status_code=400, detail="匹配失败：GPU不可用或请求不存在")
     return res
 
-class StatusBody(BaseModel):
-    status: str  # pending/running/completed/failed
-
 @app.post("/requests/{rid}/status")
 def update_request_status(rid: str, body: StatusBody):
     res = scheduler.update_request_status(rid, body.status)
     if not res:
         raise HTTPException(status_code=404, detail="请求不存在")
     return res
+
+# ---- GPU 提供方：注册 / 注销 / 心跳 ----
+class RegisterGpuBody(BaseModel):
+    gpu_name: str
+    gpu_memory: int = Field(..., gt=0)
+    performance_score: int = 0
+    compute_capability: Optional[str] = None
+    is_shared: bool = True
+    heartbeat_ttl: int = Field(GPU_HEARTBEAT_TTL_SEC, ge=1, le=3600)   # 超过这么多秒没有心跳即置 offline
+    nvml_device: Optional[str] = Field(None, max_length=64)   # 卡在调度器本机时：NVML 设备 UUID 或序号
+
+class HeartbeatBody(BaseModel):
+    ids: List[str] = Field(..., max_length=BULK_MAX)
+
+@app.post("/gpus")
+def register_gpu(body: RegisterGpuBody) -> GpuResource:
+    return scheduler.register_gpu(body.gpu_name, body.gpu_memory, body.performance_score,
+                                  body.compute_capability, body.is_shared, body.heartbeat_ttl, body.nvml_device)
+
+@app.delete("/gpus/{gid}", status_code=204)
+def deregister_gpu(gid: str):
+    # 其上运行中的任务回到 pending
+    if not scheduler.deregister_gpu(gid):
+        raise HTTPException(status_code=404, detail="GPU不存在")
+    return Response(status_code=204)
+
+@app.post("/gpus/heartbeat")
+def heartbeats(body: HeartbeatBody):
+    # 一台机器上的多块卡一次上报；unknown 里的 GPU 已注销（或从未注册），需重新注册
+    ok = scheduler.heartbeats(body.ids)
+    return {"unknown": [gid for gid, k in zip(body.ids, ok) if not k]}
+
+@app.post("/gpus/{gid}/heartbeat", status_code=204)
+def heartbeat(gid: str):
+    if not scheduler.heartbeat(gid):
+        raise HTTPException(status_code=404, detail="GPU不存在")
+    return Response(status_code=204)
+
+@app.get("/gpus/{gid}/history")
+def gpu_history(gid: str, since: Optional[datetime]=None, until: Optional[datetime]=None,
+                points: int=Query(120, ge=1, le=HISTORY_POINTS_MAX)):
+    # 显存/利用率在 [since, until) 内按等宽时间桶降采样：t 为桶起点（epoch 毫秒），各序列给出桶内 min/max/avg
+    h = scheduler.gpu_history(gid, since=since, until=until, points=points)
+    if h is None:
+        raise HTTPException(status_code=404, detail="没有该 GPU 的遥测数据")
+    return Response(orjson.dumps(h, option=orjson.OPT_SERIALIZE_NUMPY), media_type="application/json")
+
+# ---- 可观测性 ----
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    body = scheduler.metrics() if SCHEDULER_SOCKET else REGISTRY.render()
+    return Response(body, media_type=CONTENT_TYPE)
+
+@app.get("/debug/profile", include_in_schema=False)
+def debug_profile(seconds: float = Query(5, gt=0, le=PROFILE_MAX_SEC)):
+    """采样 seconds 秒内所有线程的栈，返回折叠栈文本（可直接喂给 flamegraph.pl）；需 PROFILE_ENABLED=1。
+    只能看到 Python 帧，C++ 内部耗时请看 cxx_* 直方图或用 perf"""
+    if not PROFILE_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(sample_stacks(seconds), media_type="text/plain")
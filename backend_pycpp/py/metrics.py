@@ -0,0 +1,187 @@
+# metrics.py
+"""
+Prometheus 指标（文本格式 0.0.4，不依赖 prometheus_client）与按需采样的栈剖析。
+backend_py 与 backend_pycpp/py 各放一份，内容保持一致。
+"""
+from bisect import bisect_left
+from collections import Counter
+from typing import Callable, Iterable, Sequence
+import sys
+import threading
+import time
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+LOCK_BUCKETS = (1e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1, 0.5, 1)
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra: parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"): return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Histogram:
+    """带标签的直方图；observe 线程安全"""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help = name, help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, list] = {}   # 标签值 -> [各桶计数..., +Inf 计数, 总和]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[i] += 1
+            s[-1] += value
+
+    def time(self, *labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = [(k, list(v)) for k, v in self._series.items()]
+        for labels, s in series:
+            yield from render_histogram(self.name, self.labelnames, labels, self.buckets, s[:-1], s[-1])
+
+
+def render_histogram(name: str, labelnames: Sequence[str], labels: Sequence[str], buckets: Sequence[float],
+                     counts: Sequence[int], total: float) -> Iterable[str]:
+    """counts 为各桶（含最后的 +Inf）的非累计计数"""
+    acc = 0
+    for le, c in zip(list(buckets) + [float("inf")], counts):
+        acc += c
+        le_label = 'le="%s"' % _fmt_value(float(le))
+        yield f"{name}_bucket{_fmt_labels(labelnames, labels, le_label)} {acc}"
+    yield f"{name}_sum{_fmt_labels(labelnames, labels)} {_fmt_value(float(total))}"
+    yield f"{name}_count{_fmt_labels(labelnames, labels)} {acc}"
+
+
+class _Timer:
+    __slots__ = ("_h", "_labels", "_t0")
+
+    def __init__(self, h: Histogram, labels: tuple):
+        self._h, self._labels = h, labels
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._h.observe(time.perf_counter() - self._t0, *self._labels)
+
+
+class Gauge:
+    """抓取时才求值：fn 返回一个数，或 [(标签值元组, 数值), ...]"""
+
+    def __init__(self, name: str, help: str, fn: Callable, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.fn = name, help, fn
+        self.labelnames = tuple(labelnames)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        v = self.fn()
+        if not self.labelnames:
+            yield f"{self.name} {_fmt_value(v)}"
+            return
+        for labels, x in v:
+            yield f"{self.name}{_fmt_labels(self.labelnames, labels)} {_fmt_value(x)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+        self._collectors: list[Callable[[], Iterable[str]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kw) -> Histogram:
+        return self.register(Histogram(*args, **kw))
+
+    def gauge(self, *args, **kw) -> Gauge:
+        return self.register(Gauge(*args, **kw))
+
+    def collector(self, fn: Callable[[], Iterable[str]]):
+        """直接产出文本行的采集函数（例如 C++ 扩展导出的统计）"""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self, keep: Callable[[str], bool] | None = None, collectors: bool = True) -> bytes:
+        """keep 按指标名筛选（多 worker 模式下 worker 与调度器进程各出一部分）"""
+        lines = []
+        for m in self._metrics:
+            if keep is None or keep(m.name):
+                lines.extend(m.render())
+        for fn in self._collectors if collectors else ():
+            lines.extend(fn())
+        return ("\n".join(lines) + "\n").encode()
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "请求到响应头发出的耗时", ("method", "route", "status"))
+
+
+class LatencyMiddleware:
+    """纯 ASGI 中间件：按路由模板（如 /requests/{rid}/match）统计延迟，不用 BaseHTTPMiddleware 以免额外开销"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                HTTP_LATENCY.observe(time.perf_counter() - t0, scope["method"],
+                                     getattr(route, "path", "unmatched"), str(message["status"]))
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+# ---- 按需采样剖析：定时抓所有线程的栈，按折叠栈（flamegraph 格式）计数 ----
+PROFILE_MAX_SEC = 60
+
+def sample_stacks(seconds: float, interval: float = 0.005, top: int = 50) -> str:
+    """
+    在调用线程里采样 seconds 秒（应放到单独线程执行），返回 "帧;帧;帧 次数" 每行一个，按次数降序。
+    采样线程自身不计入。
+    """
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    counts: Counter = Counter()
+    deadline = time.monotonic() + min(seconds, PROFILE_MAX_SEC)
+    while time.monotonic() < deadline:
+        for tid, frame in sys._current_frames().items():
+            if tid == me: continue
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                frame = frame.f_back
+            parts.append(names.get(tid, str(tid)))
+            counts[";".join(reversed(parts))] += 1
+        time.sleep(interval)
+    return "".join(f"{k} {n}\n" for k, n in counts.most_common(top))
@@ -1,33 +1,85 @@
 # scheduler_cxx_adapter.py
 import cxxsched
+import os
 from datetime import datetime, timezone
 from typing import Optional, List
 from models import GpuResource, ComputeRequest, PlatformStats
+from metrics import REGISTRY, render_histogram
+from telemetry import Telemetry, Targets, make_provider
+
+# 持久化目录（WAL + 快照，C++ 侧实现）；不设则状态只在内存里。WAL_FSYNC=0 时只写页缓存不 fsync
+STATE_DIR = os.environ.get("STATE_DIR") or None
+WAL_FSYNC = os.environ.get("WAL_FSYNC", "1") != "0"
+# 历史归档（SQLite）：已结束请求超过 HISTORY_MAX 条或结束超过 HISTORY_MAX_AGE_SEC 秒的移出内存
+ARCHIVE_PATH = os.environ.get("ARCHIVE_PATH") or (os.path.join(STATE_DIR, "archive.sqlite3") if STATE_DIR else None)
+HISTORY_MAX = int(os.environ.get("HISTORY_MAX", "100000"))
+HISTORY_MAX_AGE_SEC = int(os.environ.get("HISTORY_MAX_AGE_SEC", "3600"))
+# 多 worker 部署：设置后本进程只是 API worker，State 在 scheduler_server.py 起的进程里
+SCHEDULER_SOCKET = os.environ.get("SCHEDULER_SOCKET") or None
+# 经 POST /gpus 注册的 GPU 默认的心跳超时（秒）
+GPU_HEARTBEAT_TTL_SEC = int(os.environ.get("GPU_HEARTBEAT_TTL_SEC", "30"))
 
 def _ms_to_dt(ms: int | None):
     if not ms: return None
     return datetime.fromtimestamp(ms/1000, tz=timezone.utc)
 
+def _dt_to_ms(dt: datetime | None) -> int:
+    if dt is None: return 0
+    if dt.tzinfo is None: dt = dt.astimezone()
+    return round(dt.timestamp() * 1000)
+
+def encode_cursor(req: ComputeRequest) -> str:
+    """分页游标：创建时间(毫秒) + id，翻页时只返回排在它之后（更早）的请求"""
+    return f"{_dt_to_ms(req.created_at)}|{req.id}"
+
+def _decode_cursor(cursor: str) -> tuple[int, str]:
+    ms, _, rid = cursor.partition("|")
+    return int(ms), rid
+
+def _query_args(q, status, limit, cursor, since, until) -> tuple:
+    cursor_ms, cursor_id = _decode_cursor(cursor) if cursor else (0, "")
+    return q or "", status or "", limit or 0, cursor_ms, cursor_id, _dt_to_ms(since), _dt_to_ms(until)
+
+def _gpu(d: dict) -> GpuResource:
+    d["created_at"] = _ms_to_dt(d["created_at"])
+    d["updated_at"] = _ms_to_dt(d["updated_at"])
+    return GpuResource(**d)
+
+def _usage_targets() -> Targets:
+    """遥测采样线程调用：C++ 侧一次持锁取出各卡的显存记账"""
+    ids, total, used, online, devices = cxxsched.gpu_usage()
+    return Targets(ids, total, used, online.view(bool), devices)
+
+def column_str(col: tuple, i: int) -> str:
+    """取 export_requests 字符串列的第 i 个值"""
+    data, offsets = col
+    return bytes(data[offsets[i]:offsets[i + 1]]).decode()
+
 class scheduler:
-    def __init__(self, enable_simulation: bool = True):
+    def __init__(self, enable_simulation: bool = True, persist_dir: str | None = None,
+                 archive_path: str | None = None):
+        if persist_dir:
+            cxxsched.enable_persistence(persist_dir, WAL_FSYNC)
+        if archive_path:
+            cxxsched.enable_archive(archive_path, HISTORY_MAX, HISTORY_MAX_AGE_SEC)
         if enable_simulation:
             cxxsched.start_simulator()
+        # 显存/利用率采样（TELEMETRY_PROVIDER=off 关闭）
+        provider = make_provider()
+        self._telemetry = Telemetry(_usage_targets, provider) if provider else None
+        if self._telemetry: self._telemetry.start()
 
     def stats(self) -> PlatformStats:
         d = cxxsched.stats()
         return PlatformStats(**d)  # 字段名对齐
 
     def list_gpus(self, q: Optional[str]=None, status: Optional[str]=None) -> List[GpuResource]:
-        arr = cxxsched.list_gpus(q or "", status or "")
-        out = []
-        for d in arr:
-            d["created_at"]  = _ms_to_dt(d["created_at"])
-            d["updated_at"]  = _ms_to_dt(d["updated_at"])
-            out.append(GpuResource(**d))
-        return out
+        return [_gpu(d) for d in cxxsched.list_gpus(q or "", status or "")]
 
-    def list_requests(self, q: Optional[str]=None, status: Optional[str]=None) -> List[ComputeRequest]:
-        arr = cxxsched.list_requests(q or "", status or "")
+    def list_requests(self, q: Optional[str]=None, status: Optional[str]=None, limit: Optional[int]=None,
+                      cursor: Optional[str]=None, since: Optional[datetime]=None,
+                      until: Optional[datetime]=None) -> List[ComputeRequest]:
+        arr = cxxsched.list_requests(*_query_args(q, status, limit, cursor, since, until))
         out = []
         for d in arr:
             d["created_at"]  = _ms_to_dt(d["created_at"])
@@ -36,6 +88,25 @@ class scheduler:
             out.append(ComputeRequest(**d))
         return out
 
+    def list_requests_json(self, q: Optional[str]=None, status: Optional[str]=None, limit: Optional[int]=None,
+                           cursor: Optional[str]=None, since: Optional[datetime]=None,
+                           until: Optional[datetime]=None) -> tuple[bytes, int, str]:
+        """
+        快速路径：C++ 里直接编码好的 JSON 响应体，不产生逐行的 Python 对象。
+        返回 (body, 条数, 最后一条的 encode_cursor)；参数同 list_requests。
+        """
+        return cxxsched.list_requests_json(*_query_args(q, status, limit, cursor, since, until))
+
+    def export_requests(self, q: Optional[str]=None, status: Optional[str]=None, limit: Optional[int]=None,
+                        cursor: Optional[str]=None, since: Optional[datetime]=None,
+                        until: Optional[datetime]=None) -> dict:
+        """
+        列式导出（零拷贝 numpy 数组）：required_memory/estimated_duration 为 int32，
+        created_at/started_at/completed_at 为 epoch 毫秒 int64（0 表示空）；
+        字符串列为 (uint8 数据, int64 偏移)，status/priority 为 (uint8 编码, 取值表)。
+        """
+        return cxxsched.export_requests(*_query_args(q, status, limit, cursor, since, until))
+
     def create_request(self, task_description: str, required_memory: int,
                        estimated_duration: int, priority: str="normal") -> ComputeRequest:
         d = cxxsched.create_request(task_description, required_memory, estimated_duration, priority)
@@ -55,5 +126,81 @@ class scheduler:
             r[k]=_ms_to_dt(r[k])
         return ComputeRequest(**r)
 
+    # GPU 注册 / 注销 / 心跳
+    def register_gpu(self, gpu_name: str, gpu_memory: int, performance_score: int,
+                     compute_capability: Optional[str] = None, is_shared: bool = True,
+                     heartbeat_ttl: int = GPU_HEARTBEAT_TTL_SEC, nvml_device: Optional[str] = None) -> GpuResource:
+        return _gpu(cxxsched.register_gpu(gpu_name, gpu_memory, performance_score, compute_capability or "",
+                                          is_shared, heartbeat_ttl, nvml_device or ""))
+
+    def deregister_gpu(self, gpu_id: str) -> bool:
+        return cxxsched.deregister_gpu(gpu_id)
+
+    def gpu_history(self, gpu_id: str, since: Optional[datetime]=None, until: Optional[datetime]=None,
+                    points: int=120) -> Optional[dict]:
+        """[since, until) 内按时间桶降采样的显存/利用率 min/max/avg 序列；遥测未开启或没有这块卡的数据时返回 None"""
+        if self._telemetry is None: return None
+        return self._telemetry.history(gpu_id, since=since and since.timestamp(), until=until and until.timestamp(),
+                                       points=points)
+
+    def heartbeat(self, gpu_id: str) -> bool:
+        return cxxsched.heartbeats([gpu_id])[0]
+
+    def heartbeats(self, gpu_ids: List[str]) -> List[bool]:
+        """心跳只记时间，不碰 State 的主锁；返回每块 GPU 是否存在"""
+        return cxxsched.heartbeats(gpu_ids)
+
+    # 批量：整批只加一次 State 锁，返回紧凑的逐项结果
+    def create_requests(self, items: List[tuple[str, int, int, str]]) -> List[str]:
+        """items: [(task_description, required_memory, estimated_duration, priority), ...]；返回新请求 id"""
+        return cxxsched.create_requests(items)
+
+    def match_requests(self, items: List[tuple[str, str]]) -> List[bool]:
+        """items: [(request_id, gpu_id), ...]；返回每项是否匹配成功"""
+        return cxxsched.match_requests(items)
+
+    def update_statuses(self, items: List[tuple[str, str]]) -> List[bool]:
+        """items: [(request_id, status), ...]；返回每项请求是否存在"""
+        return cxxsched.update_statuses(items)
+
+    def close(self):
+        """停掉遥测采样，把尚未落盘的 WAL 和进行中的快照写完"""
+        if self._telemetry: self._telemetry.stop()
+        cxxsched.close_persistence()
+
+    # 指标
+    def queue_depth(self) -> dict[str, int]:
+        """pending 请求数，按优先级"""
+        return dict(cxxsched.pending_by_priority())
+
+    def object_counts(self) -> dict[str, int]:
+        counts = dict(cxxsched.object_counts())
+        counts["telemetry_series"] = self._telemetry.store.series_count() if self._telemetry else 0
+        return counts
+
+_CXX_HISTOGRAMS = (
+    ("cxx_state_lock_wait_seconds", "等待 State::mu_ 的时间"),
+    ("cxx_state_lock_hold_seconds", "持有 State::mu_ 的时间"),
+    ("cxx_sim_tick_seconds", "仿真每一轮（生成请求 + 选卡 + 匹配）的耗时"),
+    ("cxx_sim_placement_seconds", "仿真自动选卡决策的耗时"),
+)
+
+def _cxx_histograms():
+    """C++ 侧原子计数的直方图，抓取时取快照"""
+    for (name, help), (bounds, counts, total) in zip(_CXX_HISTOGRAMS, cxxsched.lock_stats() + cxxsched.sim_stats()):
+        yield f"# HELP {name} {help}"
+        yield f"# TYPE {name} histogram"
+        yield from render_histogram(name, (), (), bounds, counts, total)
+
 # 供 main.py 导入
-scheduler = scheduler(enable_simulation=True)
+if SCHEDULER_SOCKET:
+    from scheduler_remote import RemoteScheduler
+    scheduler = RemoteScheduler(SCHEDULER_SOCKET)
+else:
+    scheduler = scheduler(enable_simulation=True, persist_dir=STATE_DIR, archive_path=ARCHIVE_PATH)
+
+    REGISTRY.gauge("scheduler_queue_depth", "pending 请求数", lambda: [((p,), n) for p, n in scheduler.queue_depth().items()],
+                   ("priority",))
+    REGISTRY.gauge("scheduler_objects", "常驻对象数量", lambda: [((k,), n) for k, n in scheduler.object_counts().items()],
+                   ("kind",))
+    REGISTRY.collector(_cxx_histograms)
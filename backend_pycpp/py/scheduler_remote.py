@@ -0,0 +1,89 @@
+# scheduler_remote.py
+"""
+API worker 一侧的调度器代理（设置 SCHEDULER_SOCKET 时 scheduler_cxx_adapter.scheduler 就是它）。
+接口与 scheduler_cxx_adapter.scheduler 相同，阻塞调用转发给 scheduler_server.py 起的调度器进程；
+路由跑在线程池里，每个线程一个连接。
+"""
+from datetime import datetime
+from typing import List, Optional
+
+from metrics import REGISTRY, HTTP_LATENCY
+from models import GpuResource, ComputeRequest, PlatformStats
+from rpc import SyncClient
+
+
+class RemoteScheduler:
+    def __init__(self, path: str):
+        self._rpc = SyncClient(path)
+
+    def stats(self) -> PlatformStats:
+        return self._rpc.call("stats")
+
+    def list_gpus(self, q: Optional[str]=None, status: Optional[str]=None) -> List[GpuResource]:
+        return self._rpc.call("list_gpus", q=q, status=status)
+
+    def list_requests(self, q: Optional[str]=None, status: Optional[str]=None, limit: Optional[int]=None,
+                      cursor: Optional[str]=None, since: Optional[datetime]=None,
+                      until: Optional[datetime]=None) -> List[ComputeRequest]:
+        return self._rpc.call("list_requests", q=q, status=status, limit=limit, cursor=cursor,
+                              since=since, until=until)
+
+    def list_requests_json(self, q: Optional[str]=None, status: Optional[str]=None, limit: Optional[int]=None,
+                           cursor: Optional[str]=None, since: Optional[datetime]=None,
+                           until: Optional[datetime]=None) -> tuple[bytes, int, str]:
+        return self._rpc.call("list_requests_json", q=q, status=status, limit=limit, cursor=cursor,
+                              since=since, until=until)
+
+    def export_requests(self, q: Optional[str]=None, status: Optional[str]=None, limit: Optional[int]=None,
+                        cursor: Optional[str]=None, since: Optional[datetime]=None,
+                        until: Optional[datetime]=None) -> dict:
+        """跨进程时数组是拷贝，不再零拷贝"""
+        return self._rpc.call("export_requests", q=q, status=status, limit=limit, cursor=cursor,
+                              since=since, until=until)
+
+    def create_request(self, task_description: str, required_memory: int,
+                       estimated_duration: int, priority: str="normal") -> ComputeRequest:
+        return self._rpc.call("create_request", task_description, required_memory, estimated_duration, priority)
+
+    def match_request(self, request_id: str, gpu_id: str) -> Optional[ComputeRequest]:
+        return self._rpc.call("match_request", request_id, gpu_id)
+
+    def update_request_status(self, request_id: str, status: str) -> Optional[ComputeRequest]:
+        return self._rpc.call("update_request_status", request_id, status)
+
+    def create_requests(self, items: List[tuple[str, int, int, str]]) -> List[str]:
+        return self._rpc.call("create_requests", items)
+
+    def match_requests(self, items: List[tuple[str, str]]) -> List[bool]:
+        return self._rpc.call("match_requests", items)
+
+    def update_statuses(self, items: List[tuple[str, str]]) -> List[bool]:
+        return self._rpc.call("update_statuses", items)
+
+    def register_gpu(self, *args) -> GpuResource:
+        return self._rpc.call("register_gpu", *args)
+
+    def deregister_gpu(self, gpu_id: str) -> bool:
+        return self._rpc.call("deregister_gpu", gpu_id)
+
+    def heartbeat(self, gpu_id: str) -> bool:
+        return self._rpc.call("heartbeat", gpu_id)
+
+    def heartbeats(self, gpu_ids: List[str]) -> List[bool]:
+        return self._rpc.call("heartbeats", gpu_ids)
+
+    def gpu_history(self, gpu_id: str, **kwargs) -> Optional[dict]:
+        return self._rpc.call("gpu_history", gpu_id, **kwargs)
+
+    def close(self):
+        """持久化由调度器进程负责，worker 退出时无事可做"""
+
+    def queue_depth(self) -> dict[str, int]:
+        return self._rpc.call("queue_depth")
+
+    def object_counts(self) -> dict[str, int]:
+        return self._rpc.call("object_counts")
+
+    def metrics(self) -> bytes:
+        """本 worker 的路由延迟 + 调度器进程的锁/仿真指标"""
+        return REGISTRY.render(keep=lambda name: name == HTTP_LATENCY.name, collectors=False) + self._rpc.call("metrics")
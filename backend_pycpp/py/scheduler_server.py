@@ -0,0 +1,52 @@
+# scheduler_server.py
+"""
+多 worker 部署时的调度器进程：持有唯一的 C++ State（cxxsched），经 Unix socket（rpc.py）为各 API worker 服务。
+每个连接一个线程：State 自带锁，C++ 调用期间释放 GIL。仿真、WAL、归档都只在这个进程里跑。
+
+    python scheduler_server.py --socket /tmp/gpu-sched-cxx.sock
+    SCHEDULER_SOCKET=/tmp/gpu-sched-cxx.sock uvicorn main:app --workers 4 --port 9001
+"""
+import argparse
+import os
+import signal
+import threading
+
+# 本进程就是调度器：去掉 SCHEDULER_SOCKET 再导入 scheduler_cxx_adapter，否则它会建一个连向自己的代理
+DEFAULT_SOCKET = os.environ.pop("SCHEDULER_SOCKET", None) or "/tmp/gpu-sched-cxx.sock"
+
+from scheduler_cxx_adapter import scheduler
+from metrics import REGISTRY, HTTP_LATENCY
+from rpc import serve_threads
+
+METHODS = {"stats", "list_gpus", "list_requests", "list_requests_json", "export_requests",
+           "create_request", "match_request", "update_request_status",
+           "create_requests", "match_requests", "update_statuses", "queue_depth", "object_counts",
+           "register_gpu", "deregister_gpu", "heartbeat", "heartbeats", "gpu_history"}
+
+
+def dispatch(method: str, args: tuple, kwargs: dict):
+    if method in METHODS:
+        return getattr(scheduler, method)(*args, **kwargs)
+    if method == "metrics":
+        return REGISTRY.render(keep=lambda name: name != HTTP_LATENCY.name)
+    raise AttributeError(f"unknown scheduler method: {method}")
+
+
+def serve(path: str):
+    server = serve_threads(path, dispatch)
+    threading.Thread(target=server.serve_forever, name="rpc", daemon=True).start()
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    print(f"scheduler listening on {path}", flush=True)
+    stop.wait()
+    server.shutdown()
+    server.server_close()
+    scheduler.close()
+    os.unlink(path)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket 路径（worker 的 SCHEDULER_SOCKET）")
+    serve(ap.parse_args().socket)
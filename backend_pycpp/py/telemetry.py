@@ -0,0 +1,334 @@
+# telemetry.py
+"""
+GPU 遥测：按固定间隔采样每块 GPU 的显存占用与利用率，存进定长环形缓冲，供 GET /gpus/{id}/history 查询。
+backend_py 与 backend_pycpp/py 各放一份，内容保持一致。
+
+- 数据来源（Provider）可替换：NvmlProvider 读本机显卡（需要 pynvml），只采样注册时给了 nvml_device（UUID 或本机序号）
+  的卡，其余的卡交给 FakeProvider；FakeProvider 按调度器记账的已用显存生成确定性的曲线
+  （同一 seed、同一 GPU、同一时刻结果相同），用于没有 GPU 的机器、演示卡和不在本机的卡。
+- 所有 GPU 在同一拍采样，共用一条时间轴：存储是 (容量, 槽位) 的 float32 矩阵，每拍写一行（一次向量化赋值）。
+  槽位按 GPU 分配，卡被注销后槽位回收复用；内存上限 = 容量 × 槽位数 × 8 字节，与运行时长无关。
+- 采样在一个后台线程里，每拍的工作量只与卡数有关；查询时在锁内拷出该卡的一列，降采样在锁外做。
+"""
+from typing import Callable, NamedTuple, Optional
+import abc
+import math
+import os
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from metrics import REGISTRY, LOCK_BUCKETS
+
+TELEMETRY_PROVIDER = os.environ.get("TELEMETRY_PROVIDER", "auto")               # auto | nvml | fake | off
+TELEMETRY_INTERVAL_SEC = float(os.environ.get("TELEMETRY_INTERVAL_SEC", "1"))   # 采样间隔
+TELEMETRY_CAPACITY = int(os.environ.get("TELEMETRY_CAPACITY", "3600"))          # 每块卡保留的样本数
+HISTORY_POINTS_MAX = 2000       # 一次查询最多返回的点数
+DEFAULT_WINDOW_SEC = 3600       # 不给 since 时的查询窗口
+ERROR_LOG_INTERVAL_SEC = 60     # 采样持续出错时，每隔这么久才打印一次
+
+SAMPLE = REGISTRY.histogram("telemetry_sample_seconds", "遥测每一拍（读数 + 写入环形缓冲）的耗时", buckets=LOCK_BUCKETS)
+
+
+class Targets(NamedTuple):
+    """
+    一拍要采样的 GPU：id 与同序的 numpy 数组（总显存/调度器记账的已用显存，GB；是否在线），
+    devices 为同序的本机 NVML 设备（UUID 或序号字符串，没有为 None/空串）
+    """
+    ids: list
+    total: np.ndarray
+    used: np.ndarray
+    online: np.ndarray
+    devices: list
+
+
+# ----------------- 数据来源 -----------------
+class Provider(abc.ABC):
+    """sample 返回与 targets.ids 同序的 (已用显存 GB, 利用率 %) 两个 float32 数组；NaN 表示这一拍没有数据"""
+    name = "none"
+
+    @abc.abstractmethod
+    def sample(self, targets: Targets, now: float) -> tuple[np.ndarray, np.ndarray]:
+        ...
+
+    def source(self, device: Optional[str]) -> str:
+        """映射到 device 的卡的读数来自哪里（history 的 provider 字段）"""
+        return self.name
+
+    def close(self):
+        pass
+
+
+class FakeProvider(Provider):
+    """
+    确定性的模拟读数：利用率围绕已用显存占比波动（每块卡相位不同），显存在记账值上下小幅抖动；
+    空闲卡保持低位，离线的卡没有数据。
+    """
+    name = "fake"
+    PERIOD_SEC = 60.0
+
+    def __init__(self, seed: int = 0):
+        self._seed = seed
+        self._phase: dict[str, float] = {}
+
+    def _phases(self, ids: list) -> np.ndarray:
+        ph = self._phase
+        if len(ph) > 4 * len(ids) + 64:   # 注销的卡不再出现，顺手清掉
+            keep = set(ids)
+            self._phase = ph = {k: v for k, v in ph.items() if k in keep}
+        out = np.empty(len(ids))
+        for i, gid in enumerate(ids):
+            p = ph.get(gid)
+            if p is None:
+                p = ph[gid] = zlib.crc32(f"{self._seed}:{gid}".encode()) / 2**32 * 2 * math.pi
+            out[i] = p
+        return out
+
+    def sample(self, targets: Targets, now: float) -> tuple[np.ndarray, np.ndarray]:
+        phase = self._phases(targets.ids)
+        wave = np.sin(2 * math.pi * now / self.PERIOD_SEC + phase)
+        ripple = np.sin(2 * math.pi * now / 7.0 + 3 * phase)
+        total = np.maximum(targets.total, 1)
+        share = targets.used / total
+        busy = targets.used > 0
+        util = np.where(busy, 55 + 40 * share + 8 * wave + 3 * ripple, 2 + wave + ripple)
+        mem = np.where(busy, targets.used * (0.92 + 0.05 * wave), 0.25 + 0.05 * ripple)
+        util = np.clip(util, 0, 100).astype(np.float32)
+        mem = np.clip(mem, 0, total).astype(np.float32)
+        util[~targets.online] = np.nan
+        mem[~targets.online] = np.nan
+        return mem, util
+
+
+class NvmlProvider(Provider):
+    """
+    读本机显卡（pynvml）。GPU 注册时的 nvml_device 指明对应本机哪块设备（UUID 如 GPU-xxxx，或序号如 "0"）；
+    没给、或本机没有这块设备的卡（演示卡、其他机器上的卡）由 fallback 生成读数，fallback 为 None 时没有数据
+    """
+    name = "nvml"
+
+    def __init__(self, fallback: Optional[Provider] = None):
+        import pynvml   # 可选依赖：没装时由 make_provider 退回 FakeProvider
+        pynvml.nvmlInit()
+        self._nvml = pynvml
+        self._fallback = fallback
+        self._devices: dict[str, object] = {}
+        for i in range(pynvml.nvmlDeviceGetCount()):
+            h = pynvml.nvmlDeviceGetHandleByIndex(i)
+            uuid = pynvml.nvmlDeviceGetUUID(h)
+            self._devices[str(i)] = self._devices[uuid.decode() if isinstance(uuid, bytes) else uuid] = h
+
+    def sample(self, targets: Targets, now: float) -> tuple[np.ndarray, np.ndarray]:
+        n = len(targets.ids)
+        if self._fallback is not None:
+            mem, util = self._fallback.sample(targets, now)
+        else:
+            mem, util = np.full(n, np.nan, np.float32), np.full(n, np.nan, np.float32)
+        for i, dev in enumerate(targets.devices):
+            h = self._devices.get(dev) if dev else None
+            if h is None: continue
+            mem[i] = util[i] = np.nan
+            try:
+                mem[i] = self._nvml.nvmlDeviceGetMemoryInfo(h).used / 2**30
+                util[i] = self._nvml.nvmlDeviceGetUtilizationRates(h).gpu
+            except self._nvml.NVMLError:
+                pass   # 这一拍读不到（设备掉线/复位中），留 NaN
+        return mem, util
+
+    def source(self, device: Optional[str]) -> str:
+        if device and device in self._devices: return self.name
+        return self._fallback.source(device) if self._fallback is not None else "none"
+
+    def close(self):
+        if self._fallback is not None: self._fallback.close()
+        self._nvml.nvmlShutdown()
+
+
+def make_provider(kind: str = TELEMETRY_PROVIDER) -> Optional[Provider]:
+    """
+    auto：有 pynvml 且能初始化就用 NVML（没映射到本机设备的卡用模拟读数），否则全部用模拟读数；
+    nvml：只采样映射到本机设备的卡，NVML 不可用时报错；off 返回 None
+    """
+    if kind == "off": return None
+    if kind == "fake": return FakeProvider()
+    if kind not in ("auto", "nvml"):
+        raise ValueError(f"unknown TELEMETRY_PROVIDER: {kind}")
+    if kind == "nvml": return NvmlProvider()
+    try:
+        return NvmlProvider(fallback=FakeProvider())
+    except Exception as e:
+        print("[Telemetry] NVML unavailable, using fake readings:", e)
+        return FakeProvider()
+
+
+# ----------------- 存储 -----------------
+class SeriesStore:
+    """所有 GPU 共用一条时间轴的环形缓冲；append 由采样线程调用，history 可在任意线程调用"""
+
+    def __init__(self, capacity: int = TELEMETRY_CAPACITY):
+        self._cap = capacity
+        self._t = np.zeros(capacity)                        # 采样时刻（epoch 秒）
+        self._mem = np.full((capacity, 0), np.nan, np.float32)
+        self._util = np.full((capacity, 0), np.nan, np.float32)
+        self._slot: dict[str, int] = {}                     # gid -> 列
+        self._free: list[int] = []
+        self._n = 0                                         # 写过的总拍数
+        self._lock = threading.Lock()
+
+    def _grow(self, need: int):
+        width = max(need, 2 * self._mem.shape[1], 8)
+        pad = np.full((self._cap, width - self._mem.shape[1]), np.nan, np.float32)
+        self._free.extend(range(width - 1, self._mem.shape[1] - 1, -1))
+        self._mem = np.hstack((self._mem, pad))
+        self._util = np.hstack((self._util, pad))
+
+    def _columns(self, ids: list) -> np.ndarray:
+        """调用方持锁：各 GPU 的列号，新卡分配槽位，不再出现的卡回收槽位"""
+        slot = self._slot
+        if len(slot) != len(ids) or any(gid not in slot for gid in ids):
+            keep = set(ids)
+            for gid in [g for g in slot if g not in keep]:
+                col = slot.pop(gid)
+                self._mem[:, col] = self._util[:, col] = np.nan
+                self._free.append(col)
+            new = [gid for gid in ids if gid not in slot]
+            if len(new) > len(self._free):
+                self._grow(len(slot) + len(new))
+            for gid in new:
+                slot[gid] = self._free.pop()
+        return np.fromiter((slot[gid] for gid in ids), np.intp, len(ids))
+
+    def append(self, now: float, ids: list, mem: np.ndarray, util: np.ndarray):
+        with self._lock:
+            cols = self._columns(ids)
+            row = self._n % self._cap
+            self._t[row] = now
+            self._mem[row] = self._util[row] = np.nan
+            self._mem[row, cols] = mem
+            self._util[row, cols] = util
+            self._n += 1
+
+    def series(self, gid: str) -> Optional[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """该卡按时间升序的 (时刻, 显存, 利用率) 拷贝；没有这块卡返回 None"""
+        with self._lock:
+            col = self._slot.get(gid)
+            if col is None: return None
+            n, cap = min(self._n, self._cap), self._cap
+            start = (self._n - n) % cap
+            order = np.arange(start, start + n) % cap
+            return self._t[order], self._mem[order, col], self._util[order, col]
+
+    def series_count(self) -> int:
+        return len(self._slot)
+
+    def nbytes(self) -> int:
+        return self._t.nbytes + self._mem.nbytes + self._util.nbytes
+
+
+def _reduce(x: np.ndarray, starts: np.ndarray) -> dict:
+    """按段求 min/max/avg，忽略 NaN；一段全是 NaN 时三者都是 NaN（JSON 里为 null）"""
+    valid = ~np.isnan(x)
+    cnt = np.add.reduceat(valid.astype(np.int32), starts)
+    total = np.add.reduceat(np.where(valid, x, 0).astype(np.float64), starts)
+    lo = np.minimum.reduceat(np.where(valid, x, np.inf), starts)
+    hi = np.maximum.reduceat(np.where(valid, x, -np.inf), starts)
+    empty = cnt == 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg = (total / cnt).astype(np.float32)
+    lo[empty] = hi[empty] = avg[empty] = np.nan
+    return {"min": lo, "max": hi, "avg": avg}
+
+
+def downsample(t: np.ndarray, mem: np.ndarray, util: np.ndarray, since: float, until: float,
+               points: int, step: float) -> dict:
+    """把 [since, until) 内的样本按等宽时间桶聚合成至多 points 个点；没有样本的桶不输出"""
+    lo, hi = np.searchsorted(t, since), np.searchsorted(t, until)
+    t, mem, util = t[lo:hi], mem[lo:hi], util[lo:hi]
+    width = max((until - since) / points, step)
+    if len(t) == 0:
+        empty = np.zeros(0, np.float32)
+        agg = {"min": empty, "max": empty, "avg": empty}
+        return {"step_sec": width, "t": np.zeros(0, np.int64), "mem_used_gb": agg, "util_pct": agg}
+    bucket = ((t - since) // width).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    return {
+        "step_sec": width,
+        "t": np.round((since + bucket[starts] * width) * 1000).astype(np.int64),   # 桶起点，epoch 毫秒
+        "mem_used_gb": _reduce(mem, starts),
+        "util_pct": _reduce(util, starts),
+    }
+
+
+# ----------------- 采样 -----------------
+class Telemetry:
+    """targets 每拍调用一次，返回当前要采样的 GPU；不能阻塞太久（调度器里是无锁读快照）"""
+
+    def __init__(self, targets: Callable[[], Targets], provider: Provider,
+                 interval: float = TELEMETRY_INTERVAL_SEC, capacity: int = TELEMETRY_CAPACITY):
+        self._targets, self._provider = targets, provider
+        self._interval = interval
+        self.store = SeriesStore(capacity)
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._errors, self._logged_at = 0, -math.inf   # 上次打印之后又失败了几拍
+        self._device_of: dict = {}                      # 最近一拍各卡的 nvml_device
+
+    @property
+    def provider(self) -> str:
+        return self._provider.name
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="telemetry", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self._provider.close()
+
+    def sample_once(self, now: float | None = None):
+        now = time.time() if now is None else now
+        with SAMPLE.time():
+            tg = self._targets()
+            mem, util = self._provider.sample(tg, now)
+            self._device_of = dict(zip(tg.ids, tg.devices))
+            self.store.append(now, tg.ids, mem, util)
+
+    def _loop(self):
+        # 按固定节拍对齐，不因每拍的耗时漂移；落后超过一拍就跳过，不补采
+        deadline = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.sample_once()
+            except Exception as e:
+                self._log_error(e)   # 一拍失败不影响后面的采样
+            deadline += self._interval
+            wait = deadline - time.monotonic()
+            if wait < 0:
+                deadline, wait = time.monotonic(), 0
+            self._stop.wait(wait)
+
+    def _log_error(self, e: Exception):
+        """持续出错时（例如 NVML 驱动掉了）每 ERROR_LOG_INTERVAL_SEC 秒打印一次，附上期间失败的拍数"""
+        self._errors += 1
+        now = time.monotonic()
+        if now - self._logged_at < ERROR_LOG_INTERVAL_SEC: return
+        more = f" ({self._errors} failed samples)" if self._errors > 1 else ""
+        print("[Telemetry] error:", f"{e}{more}")
+        self._errors, self._logged_at = 0, now
+
+    def history(self, gpu_id: str, since: float | None = None, until: float | None = None,
+                points: int = 120) -> Optional[dict]:
+        """[since, until)（epoch 秒）内的降采样序列；没有这块卡的数据返回 None"""
+        s = self.store.series(gpu_id)
+        if s is None: return None
+        until = time.time() if until is None else until
+        since = until - DEFAULT_WINDOW_SEC if since is None else since
+        out = downsample(*s, since, max(until, since), max(1, min(points, HISTORY_POINTS_MAX)), self._interval)
+        out["gpu_id"], out["provider"] = gpu_id, self._provider.source(self._device_of.get(gpu_id))
+        return out
@@ -0,0 +1,6 @@
+# conftest.py
+"""测试直接导入 backend_pycpp/py 下的模块；cxxsched 需先用 cpp/CMakeLists.txt 编译好放在该目录，否则相关测试跳过"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,40 @@
+# test_listing.py
+import time
+
+import pytest
+
+c = pytest.importorskip("cxxsched")
+
+
+def best_ms(fn, repeat: int = 20) -> float:
+    """多次调用取最快的一次（毫秒），减少抖动"""
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best * 1e3
+
+
+def grow(ids: list[str], n: int):
+    while len(ids) < n:
+        ids += c.create_requests([("job", 1, 1, "low")] * 10000)
+
+
+def test_status_listing_does_not_grow_with_total_requests():
+    # 只有 5 个 failed：按状态过滤的分页应只花 O(命中数)，与总请求数无关
+    ids: list[str] = []
+    grow(ids, 20000)
+    failed = ids[:5]
+    assert all(c.update_statuses([(rid, "failed") for rid in failed]))
+    query = lambda: c.list_requests(status="failed", limit=50)
+    got = [r["id"] for r in query()]
+    assert set(failed) <= set(got) and all(r["status"] == "failed" for r in query())
+    small = best_ms(query)
+    windowed = best_ms(lambda: c.list_requests(status="failed", limit=50, since_ms=1))
+
+    grow(ids, 200000)
+    assert [r["id"] for r in query()] == got
+    # 总数涨了 10 倍：改之前耗时跟着涨 10 倍，这里留足抖动余量
+    assert best_ms(query) < 3 * small + 2.0
+    assert best_ms(lambda: c.list_requests(status="failed", limit=50, since_ms=1)) < 3 * windowed + 2.0
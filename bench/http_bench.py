@@ -0,0 +1,275 @@
+# http_bench.py
+"""
+HTTP 压测：对 backend_py 或 backend_pycpp 按给定比例混合调用各接口，控制并发，
+预先灌入 10^3~10^6 条历史请求，输出吞吐与 p50/p99/p999 延迟（JSON，便于跨提交对比）。
+
+    # 进程内（httpx ASGITransport，不走网络）
+    python bench/http_bench.py --backend py --history 100000 --concurrency 32 --duration 10
+    # 本机起 uvicorn，走真实 HTTP
+    python bench/http_bench.py --backend pycpp --server --port 9100 --out pycpp.json
+    # 与之前的结果对比
+    python bench/http_bench.py --backend py --baseline py.json
+"""
+from pathlib import Path
+from typing import Optional
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIRS = {"py": ROOT / "backend_py", "pycpp": ROOT / "backend_pycpp" / "py"}
+DEFAULT_MIX = "gpus=25,requests=25,stats=25,create=10,match=8,status=7"
+OPS = ("gpus", "requests", "requests_all", "stats", "create", "match", "status")
+BULK_CHUNK = 10_000
+TERMINAL_RATIO = 0.9   # 历史请求中已完成/失败的比例，其余保持 pending 供 match 使用
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        op, _, w = part.partition("=")
+        op = op.strip()
+        if op not in OPS:
+            raise SystemExit(f"unknown op in --mix: {op}（可选 {', '.join(OPS)}）")
+        mix[op] = float(w or 1)
+    return mix
+
+
+def percentile(sorted_ms: list[float], p: float) -> float:
+    if not sorted_ms: return 0.0
+    i = min(len(sorted_ms) - 1, max(0, round(p / 100 * len(sorted_ms) + 0.5) - 1))
+    return sorted_ms[i]
+
+
+def summarize(lat_ms: list[float], errors: int, non2xx: int, elapsed: float) -> dict:
+    lat = sorted(lat_ms)
+    return {
+        "count": len(lat),
+        "errors": errors,          # 异常 / 5xx
+        "non_2xx": non2xx,         # 4xx（例如显存不足导致 match 失败），属于正常业务结果
+        "rps": round(len(lat) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(lat) / len(lat), 3) if lat else 0.0,
+        "p50_ms": round(percentile(lat, 50), 3),
+        "p99_ms": round(percentile(lat, 99), 3),
+        "p999_ms": round(percentile(lat, 99.9), 3),
+        "max_ms": round(lat[-1], 3) if lat else 0.0,
+    }
+
+
+class Workload:
+    """压测期间共享的 id 池：match 从 pending 池里取，status 从已匹配池里取"""
+
+    def __init__(self, client: httpx.AsyncClient, rng: random.Random):
+        self.client = client
+        self.rng = rng
+        self.gpu_ids: list[str] = []
+        self.pending: list[str] = []
+        self.running: list[str] = []
+
+    async def populate(self, history: int):
+        """通过批量接口灌入历史请求，大部分置为终态"""
+        for start in range(0, history, BULK_CHUNK):
+            n = min(BULK_CHUNK, history - start)
+            body = {"requests": [
+                {"task_description": f"历史任务 #{start + i} batch-{self.rng.randrange(1000)}",
+                 "required_memory": self.rng.choice((4, 8, 12, 16)),
+                 "estimated_duration": self.rng.choice((15, 30, 45, 60, 90)),
+                 "priority": self.rng.choice(("low", "normal", "high"))}
+                for i in range(n)
+            ]}
+            r = await self.client.post("/requests/bulk", json=body, timeout=None)
+            r.raise_for_status()
+            ids = r.json()["ids"]
+            cut = int(len(ids) * TERMINAL_RATIO)
+            updates = [{"id": rid, "status": self.rng.choice(("completed", "completed", "failed"))}
+                       for rid in ids[:cut]]
+            if updates:
+                (await self.client.post("/requests/status/bulk", json={"updates": updates}, timeout=None)).raise_for_status()
+            self.pending.extend(ids[cut:])
+        r = await self.client.get("/gpus")
+        r.raise_for_status()
+        self.gpu_ids = [g["id"] for g in r.json()]
+
+    async def call(self, op: str) -> httpx.Response:
+        c, rng = self.client, self.rng
+        if op == "gpus":
+            return await c.get("/gpus")
+        if op == "requests":
+            return await c.get("/requests", params={"limit": 100})
+        if op == "requests_all":
+            return await c.get("/requests")
+        if op == "stats":
+            return await c.get("/stats")
+        if op == "create":
+            r = await c.post("/requests", json={"task_description": "压测任务", "estimated_duration": 30,
+                                                "required_memory": rng.choice((4, 8, 12, 16)),
+                                                "priority": rng.choice(("low", "normal", "high"))})
+            if r.status_code == 200: self.pending.append(r.json()["id"])
+            return r
+        if op == "match":
+            rid = self._take(self.pending)
+            if rid is None: return await c.get("/stats")   # 池空时退化为只读调用
+            r = await c.post(f"/requests/{rid}/match", json={"gpu_id": rng.choice(self.gpu_ids)})
+            (self.running if r.status_code == 200 else self.pending).append(rid)
+            return r
+        if op == "status":
+            rid = self._take(self.running)
+            if rid is None: return await c.get("/stats")
+            return await c.post(f"/requests/{rid}/status", json={"status": rng.choice(("completed", "failed"))})
+        raise ValueError(op)
+
+    def _take(self, pool: list[str]) -> Optional[str]:
+        if not pool: return None
+        i = self.rng.randrange(len(pool))
+        pool[i], pool[-1] = pool[-1], pool[i]
+        return pool.pop()
+
+
+async def drive(w: Workload, mix: dict[str, float], concurrency: int, duration: float, warmup: float) -> dict:
+    ops, weights = list(mix), list(mix.values())
+    lat: dict[str, list[float]] = {op: [] for op in ops}
+    errors = dict.fromkeys(ops, 0)
+    non2xx = dict.fromkeys(ops, 0)
+    t_start = time.perf_counter()
+    t_measure = t_start + warmup
+    t_end = t_measure + duration
+
+    async def worker():
+        while True:
+            op = w.rng.choices(ops, weights)[0]
+            t0 = time.perf_counter()
+            if t0 >= t_end: return
+            try:
+                r = await w.call(op)
+                code = r.status_code
+            except Exception:
+                code = 599
+            t1 = time.perf_counter()
+            if t0 < t_measure: continue
+            lat[op].append((t1 - t0) * 1000)
+            if code >= 500: errors[op] += 1
+            elif code >= 300: non2xx[op] += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    all_lat = [x for v in lat.values() for x in v]
+    return {
+        "total": summarize(all_lat, sum(errors.values()), sum(non2xx.values()), duration),
+        "ops": {op: summarize(lat[op], errors[op], non2xx[op], duration) for op in ops},
+    }
+
+
+def start_server(backend: str, port: int) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIRS[backend],
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/stats", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        if proc.poll() is not None:
+            raise SystemExit(f"uvicorn exited with {proc.returncode}")
+        time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("uvicorn did not become ready in 30s")
+
+
+def load_app(backend: str):
+    """进程内加载某个后端的 FastAPI app（两个后端的模块名相同，一个进程只能加载一个）"""
+    path = str(BACKEND_DIRS[backend])
+    sys.path.insert(0, path)
+    os.chdir(path)
+    import main
+    return main.app
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(result: dict, baseline: dict):
+    """打印与基线的对比：吞吐与 p99 的变化比例"""
+    print(f"{'op':<14}{'rps':>12}{'base':>12}{'Δ':>8}{'p99_ms':>12}{'base':>12}{'Δ':>8}", file=sys.stderr)
+    rows = [("total", result["total"], baseline.get("total", {}))]
+    rows += [(op, v, baseline.get("ops", {}).get(op, {})) for op, v in result["ops"].items()]
+    for op, cur, base in rows:
+        def delta(k):
+            return f"{(cur[k] / base[k] - 1) * 100:+.0f}%" if base.get(k) else "-"
+        print(f"{op:<14}{cur['rps']:>12}{base.get('rps', '-'):>12}{delta('rps'):>8}"
+              f"{cur['p99_ms']:>12}{base.get('p99_ms', '-'):>12}{delta('p99_ms'):>8}", file=sys.stderr)
+
+
+async def run(args) -> dict:
+    mix = parse_mix(args.mix)
+    proc = None
+    if args.server:
+        proc = start_server(args.backend, args.port)
+        client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}",
+                                   limits=httpx.Limits(max_connections=args.concurrency), timeout=60)
+    else:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=load_app(args.backend)),
+                                   base_url="http://bench", timeout=60)
+    try:
+        w = Workload(client, random.Random(args.seed))
+        t0 = time.perf_counter()
+        await w.populate(args.history)
+        populate_sec = time.perf_counter() - t0
+        res = await drive(w, mix, args.concurrency, args.duration, args.warmup)
+    finally:
+        await client.aclose()
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    res["meta"] = {
+        "backend": args.backend, "transport": "http" if args.server else "asgi", "commit": git_commit(),
+        "history": args.history, "concurrency": args.concurrency, "duration_sec": args.duration,
+        "warmup_sec": args.warmup, "mix": mix, "seed": args.seed, "populate_sec": round(populate_sec, 3),
+        "python": platform.python_version(), "machine": platform.machine(), "time": int(time.time()),
+    }
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser(description="GPU 调度后端 HTTP 压测")
+    ap.add_argument("--backend", choices=tuple(BACKEND_DIRS), default="py")
+    ap.add_argument("--server", action="store_true", help="在本机起 uvicorn 走真实 HTTP；默认进程内 ASGI")
+    ap.add_argument("--port", type=int, default=9100)
+    ap.add_argument("--history", type=int, default=1000, help="预先灌入的历史请求数（10^3~10^6）")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--duration", type=float, default=10, help="计时阶段秒数")
+    ap.add_argument("--warmup", type=float, default=2, help="预热秒数（不计入结果）")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help=f"接口比例，如 {DEFAULT_MIX}；可选 {', '.join(OPS)}")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="结果另存为 JSON 文件")
+    ap.add_argument("--baseline", help="之前的结果 JSON，打印对比")
+    args = ap.parse_args()
+    # 进程内模式会切换工作目录到后端目录，先把路径定下来
+    out = Path(args.out).resolve() if args.out else None
+    baseline = Path(args.baseline).resolve() if args.baseline else None
+
+    res = asyncio.run(run(args))
+    text = json.dumps(res, ensure_ascii=False, indent=2)
+    print(text)
+    if out:
+        out.write_text(text + "\n", encoding="utf-8")
+    if baseline:
+        compare(res, json.loads(baseline.read_text(encoding="utf-8")))
+
+
+if __name__ == "__main__":
+    main()